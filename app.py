@@ -2,13 +2,22 @@ from flask import Flask
 import os
 from dotenv import load_dotenv
 
-# استيراد Blueprint للويب هوك (تأكد أن المسار صحيح في مشروعك)
-from routes.webhook import webhook_bp
-
 # تحميل متغيرات البيئة من .env (مطلوب للتطوير المحلي/الإنتاج)
+# لازم قبل import الـ routes: الموديولات بتقرا إعداداتها (os.getenv) وقت الـ import
 load_dotenv()
 
+# استيراد Blueprint للويب هوك (تأكد أن المسار صحيح في مشروعك)
+from routes.webhook import webhook_bp, start_message_workers, WEBHOOK_PROCESSING_MODE  # noqa: E402
+from routes.metrics import metrics_bp  # noqa: E402
+from routes.health import health_bp  # noqa: E402
+from routes.export import export_bp  # noqa: E402
+from routes.chat import chat_bp  # noqa: E402
+
 def create_app():
+    # لوج JSON عن طريق طابور و thread في الخلفية (utils/logging_setup.py)؛ لازم قبل أي استخدام لـ app.logger
+    from utils.logging_setup import configure_logging
+    configure_logging()
+
     app = Flask(__name__)
 
     # إعدادات التطبيق الإضافية (ضع أي إعدادات إضافية هنا)
@@ -16,13 +25,51 @@ def create_app():
 
     # تسجيل Blueprint الخاص بالويب هوك
     app.register_blueprint(webhook_bp)
+    # /metrics بصيغة Prometheus
+    app.register_blueprint(metrics_bp)
+    # /healthz (liveness) و /readyz (readiness بعد الـ warm-up)
+    app.register_blueprint(health_bp)
+    # /export/<table>.ndjson للـ analytics (محتاج EXPORT_TOKEN)
+    app.register_blueprint(export_bp)
+    # الويب شات: / (templates/index.html) و POST /chat بالرد stream (SSE)
+    app.register_blueprint(chat_bp)
     # إذا أردت استخدام url_prefix:
     # app.register_blueprint(webhook_bp, url_prefix='/api')
 
-    # إعداد لوجينج افتراضي لو لم يكن معرف في ملفات أخرى (مفيد في Render/logs)
-    import logging
-    if not app.logger.handlers:
-        logging.basicConfig(level=logging.INFO)
+    # الـ handler الافتراضي بتاع Flask كان هيكتب كل سطر مرتين (مرة منه ومرة من الـ root)
+    from flask.logging import default_handler
+    app.logger.removeHandler(default_handler)
+
+    # schema migrations وقت التشغيل (لو مش بتتشغل كخطوة في الـ deploy: python -m utils.migrations)
+    from utils.migrations import DB_AUTO_MIGRATE
+    if DB_AUTO_MIGRATE:
+        from utils.migrations import upgrade
+        upgrade()
+
+    # SIGHUP بيعيد تحميل ملفات config_data (replies/FAQ/prompt/reference) من غير restart
+    from utils.config_store import config_store
+    config_store.install_sighup_handler()
+
+    # إعادة إرسال رسايل واتساب اللي فشلت بخطأ مؤقت (429/5xx/timeout)
+    from utils.send_meta import WHATSAPP_OUTBOX_ENABLED
+    if WHATSAPP_OUTBOX_ENABLED:
+        from utils.outbox import start_outbox_dispatcher
+        start_outbox_dispatcher()
+
+    # أرشفة تاريخ المحادثات الأقدم من HISTORY_RETENTION_DAYS في الخلفية (utils/retention.py)
+    from utils.retention import HISTORY_RETENTION_DAYS
+    if HISTORY_RETENTION_DAYS > 0:
+        from utils.retention import start_retention_job
+        start_retention_job()
+
+    # تحميل الـ config والـ clients وفتح connections للـ DB في الخلفية قبل ما الـ traffic يوصل (/readyz)
+    from utils.warmup import WARMUP_ON_START, warmup
+    if WARMUP_ON_START:
+        warmup.start()
+
+    # في وضع الطابور الـ webhook بيرد فوراً والـ workers دي هي اللي بتعالج الرسايل
+    if WEBHOOK_PROCESSING_MODE == 'queue':
+        start_message_workers()
 
     return app
 
@@ -0,0 +1,155 @@
+# asgi.py
+# تشغيل الـ webhook في وضع asyncio تحت أي ASGI server، مثلاً:
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000
+# الـ /webhook و POST /chat (SSE) بيتعالجوا async (AsyncOpenAI + httpx + SQLAlchemy async engine)، فكل
+# stream مفتوح للويب شات task مش thread، وباقي المسارات بتروح لتطبيق Flask زي ما هي. app.py لسه شغال لوحده مع gunicorn زي الأول.
+import json
+import uuid
+import asyncio
+import logging
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app
+from routes.webhook import ahandle_webhook_post, verify_subscription
+from routes.chat import (
+    CHAT_SESSION_COOKIE, SSE_HEADERS, chat_streams, parse_chat_request, session_cookie, aiter_sse, busy_response,
+)
+from utils.logging_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+_flask_asgi = WsgiToAsgi(flask_app)
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _respond(send, status: int, body, content_type: str = "application/json"):
+    if isinstance(body, (dict, list)):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    else:
+        data = str(body if body is not None else "").encode("utf-8")
+        content_type = "text/html; charset=utf-8"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(data)).encode())],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            from utils.send_meta import close_async_http_clients
+            await close_async_http_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _session_from_headers(headers):
+    """X-Chat-Session (API clients) وإلا الـ cookie بتاعة المتصفح، زي routes/chat.py."""
+    if headers.get(b"x-chat-session"):
+        return headers[b"x-chat-session"].decode("latin-1")
+    cookie = SimpleCookie()
+    try:
+        cookie.load(headers.get(b"cookie", b"").decode("latin-1"))
+    except Exception:
+        pass
+    morsel = cookie.get(CHAT_SESSION_COOKIE)
+    return morsel.value if morsel else None
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _chat(scope, receive, send):
+    """POST /chat: نفس routes/chat.py بس الـ SSE بيتكتب من async generator."""
+    raw = await _read_body(receive)
+    try:
+        data = json.loads(raw) if raw else None
+    except ValueError:
+        data = None
+    headers = dict(scope.get("headers") or ())
+    user_id, message, session_id, error = parse_chat_request(data, _session_from_headers(headers))
+    if error:
+        return await _respond(send, error[1], error[0])
+    if not chat_streams.acquire():
+        body, status = busy_response()
+        return await _respond(send, status, body)
+
+    async def stream():
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"set-cookie", session_cookie(session_id).encode("latin-1"))]
+                       + [(k.lower().encode(), v.encode()) for k, v in SSE_HEADERS.items()],
+        })
+        async for chunk in aiter_sse(user_id, message):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex[:16]
+    try:
+        with log_context(request_id=request_id):
+            streamer = asyncio.ensure_future(stream())
+        # لو العميل قفل الصفحة الـ stream بيتلغي (والجزء اللي اتبعت من الرد بيتسجل)
+        watcher = asyncio.ensure_future(_wait_disconnect(receive))
+        await asyncio.wait({streamer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        watcher.cancel()
+        if not streamer.done():
+            streamer.cancel()
+        try:
+            await streamer
+        except asyncio.CancelledError:
+            logger.info(f"Web chat client for {user_id} disconnected mid-stream.")
+        except Exception as e:
+            logger.error(f"Unhandled error in web chat stream: {e}", exc_info=True)
+    finally:
+        chat_streams.release()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/chat":
+        return await _chat(scope, receive, send)
+    if scope["type"] != "http" or scope["path"].rstrip("/") != "/webhook":
+        return await _flask_asgi(scope, receive, send)
+
+    if scope["method"] == "GET":
+        args = dict(parse_qsl(scope.get("query_string", b"").decode("utf-8")))
+        body, status = verify_subscription(args)
+        return await _respond(send, status, body)
+    if scope["method"] != "POST":
+        return await _respond(send, 405, "Method Not Allowed")
+
+    raw = await _read_body(receive)
+    try:
+        data = json.loads(raw) if raw else None
+    except ValueError:
+        # نفس سلوك Flask مع JSON بايظ
+        return await _respond(send, 400, "Bad Request")
+    try:
+        headers = dict(scope.get("headers") or ())
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or None
+        body, status = await ahandle_webhook_post(data, request_id=request_id)
+    except Exception as e:
+        logger.error(f"Unhandled error in async webhook: {e}", exc_info=True)
+        body, status = {"status": "error", "message": str(e)}, 500
+    await _respond(send, status, body)
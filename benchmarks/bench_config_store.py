@@ -0,0 +1,69 @@
+# benchmarks/bench_config_store.py
+# زمن get_reply_from_json: النسخة القديمة (قراءة replies.json و json.loads مع كل رد) مقابل الـ config store.
+#
+#   python -m benchmarks.bench_config_store [--iterations 20000]
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.config_store import ConfigStore  # noqa: E402
+
+CASES = [
+    ("welcome_najdaigent", "ar", {}),
+    ("language_selected", "en", {}),
+    ("ask_service_interest", "en", {"name": "Ahmed"}),
+    ("onboarding_complete", "ar", {"name": "أحمد"}),
+    ("signature_static", "en", {}),
+]
+
+
+def legacy_get_reply_from_json(replies_file, reply_key, lang="ar", **kwargs):
+    """نفس منطق get_reply_from_json القديم بقراءة الملف في كل مرة."""
+    with open(replies_file, 'r', encoding='utf-8') as f:
+        replies_content = json.loads(f.read())
+    key_obj = replies_content.get(reply_key)
+    if not key_obj:
+        return f"Error: Reply key '{reply_key}' not found."
+    message_template = key_obj.get(lang) or key_obj.get("en", "")
+    try:
+        return message_template.format(**kwargs)
+    except Exception:
+        return message_template
+
+
+def bench(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        key, lang, kwargs = CASES[i % len(CASES)]
+        fn(key, lang, **kwargs)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    store = ConfigStore()
+    replies_file = store.path("replies")
+
+    def cached(key, lang, **kwargs):
+        key_templates = store.get().templates[key]
+        return (key_templates.get(lang) or key_templates["en"]).render(key, lang, **kwargs)
+
+    for key, lang, kwargs in CASES:
+        assert cached(key, lang, **kwargs) == legacy_get_reply_from_json(replies_file, key, lang, **kwargs), key
+
+    legacy_us = bench(lambda k, l, **kw: legacy_get_reply_from_json(replies_file, k, l, **kw), args.iterations)
+    cached_us = bench(cached, args.iterations)
+    print(f"legacy (disk read + json.loads): {legacy_us:8.2f} us/reply")
+    print(f"config store:                    {cached_us:8.2f} us/reply")
+    print(f"speedup:                         {legacy_us / cached_us:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/bench_conversation_context.py
+# تحميل التاريخ كله (get_conversation) مقابل آخر N رسالة بالـ index + token budget لعملاء عندهم 10k رسالة.
+#
+#   python -m benchmarks.bench_conversation_context [--customers 20] [--messages 10000]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_context_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}")
+
+from sqlalchemy import text  # noqa: E402
+
+from utils.db import Base, engine, ConversationHistory  # noqa: E402
+from utils.db_helpers import get_conversation, get_recent_conversation  # noqa: E402
+from utils.conversation_context import build_context, CONTEXT_MAX_TURNS, estimate_tokens  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "What are your working hours?", "كم سعر روبوت المحادثة؟", "I need a custom AI project for my shop",
+    "Our pricing is tailored to the scope of each project and we will contact you shortly. " * 3,
+    "ما هي الخدمات التي تقدمونها للشركات الصغيرة؟", "Can you integrate with WhatsApp and our CRM?",
+]
+
+
+def populate(customers, messages_per_customer):
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for c in range(customers):
+            phone = f"9665{c:08d}"
+            rows = [
+                {"phone": phone, "sender": "user" if i % 2 == 0 else "assistant",
+                 "message": rng.choice(SAMPLE_TEXTS), "timestamp": start + timedelta(seconds=i * 30 + c)}
+                for i in range(messages_per_customer)
+            ]
+            conn.execute(ConversationHistory.__table__.insert(), rows)
+
+
+def bench(fn, phones, repeat):
+    start = time.perf_counter()
+    result = None
+    for _ in range(repeat):
+        for phone in phones:
+            result = fn(phone)
+    return (time.perf_counter() - start) / (repeat * len(phones)) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Populating {args.customers} customers x {args.messages} messages ...")
+    populate(args.customers, args.messages)
+    phones = [f"9665{c:08d}" for c in range(args.customers)]
+    system = [{"role": "system", "content": "You are NajdAIgent."}]
+
+    def legacy(phone):
+        # القديم: كل الصفوف، ومعظمها بيتشال في generate_openai_response لأن المفاتيح sender/message
+        history = get_conversation(phone)
+        return system + [{"role": "user", "content": "hi"}], len(history)
+
+    def bounded(phone):
+        history = get_recent_conversation(phone, CONTEXT_MAX_TURNS)
+        return build_context(system, history, "hi"), len(history)
+
+    legacy_ms, (_, legacy_rows) = bench(legacy, phones, args.repeat)
+    bounded_ms, (messages, bounded_rows) = bench(bounded, phones, args.repeat)
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_conversation_history_phone_timestamp"))
+    no_index_ms, _ = bench(bounded, phones, args.repeat)
+
+    print(f"{'strategy':<40} {'ms/reply':>10} {'rows loaded':>12}")
+    print(f"{'get_conversation (full history)':<40} {legacy_ms:>10.2f} {legacy_rows:>12}")
+    print(f"{'recent + budget, no (phone, ts) index':<40} {no_index_ms:>10.2f} {bounded_rows:>12}")
+    print(f"{'recent + budget, (phone, ts) index':<40} {bounded_ms:>10.2f} {bounded_rows:>12}")
+    print(f"prompt tokens with bounded context: ~{prompt_tokens}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_db_layer.py
+# طبقة قاعدة البيانات على conversation_history فيها 1M+ صف:
+#   1) latency استعلام آخر N رسالة من غير index (phone, timestamp) ومعاه
+#   2) throughput الكتابة: add_message بـ commit لكل رسالة مقابل الـ write-behind buffer (batches)
+#
+#   python -m benchmarks.bench_db_layer [--rows 1000000] [--phones 20000] [--writes 5000] [--threads 8]
+#   DATABASE_URL=postgresql://... python -m benchmarks.bench_db_layer   # على PostgreSQL بدل SQLite مؤقت
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_db_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}")
+os.environ["HISTORY_WRITE_BEHIND"] = "false"  # المسار العادي لـ add_message؛ الـ buffer بنستخدمه مباشرة
+
+from sqlalchemy import insert, func, select  # noqa: E402
+
+from utils.db import engine, SessionLocal, ConversationHistory  # noqa: E402
+from utils.db_helpers import add_message, get_recent_conversation  # noqa: E402
+from utils.migrations import upgrade  # noqa: E402
+from utils.write_buffer import MessageWriteBuffer  # noqa: E402
+
+HISTORY_INDEX = next(ix for ix in ConversationHistory.__table__.indexes if ix.name.endswith("phone_timestamp"))
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] if values else 0.0
+
+
+def seed(rows, phones, rng):
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(ConversationHistory))
+    if existing >= rows:
+        return existing, 0.0
+    start_ts = datetime.utcnow() - timedelta(days=365)
+    batch = 50_000
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for offset in range(existing, rows, batch):
+            conn.execute(insert(ConversationHistory), [
+                {"phone": f"9665{rng.randrange(phones):08d}", "sender": "user" if i % 2 else "assistant",
+                 "message": f"seed message {i} about pricing and delivery", "timestamp": start_ts + timedelta(seconds=i)}
+                for i in range(offset, min(offset + batch, rows))
+            ])
+    return rows, time.perf_counter() - start
+
+
+def history_latency(phones, queries, limit, rng):
+    latencies = []
+    for _ in range(queries):
+        phone = f"9665{rng.randrange(phones):08d}"
+        start = time.perf_counter()
+        get_recent_conversation(phone, limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _percentile(latencies, 0.5), _percentile(latencies, 0.95)
+
+
+def write_throughput(writes, threads, write_one, finish=None):
+    phones = [f"9667{i:08d}" for i in range(writes)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda phone: write_one(phone, "user", "hello, what are your prices?"), phones))
+    if finish:
+        finish()
+    return writes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--phones", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--writes", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(11)
+
+    upgrade()
+    total, seed_s = seed(args.rows, args.phones, rng)
+    print(f"{engine.url.get_backend_name()}: {total} history rows over {args.phones} phones"
+          + (f" (seeded in {seed_s:.1f}s)" if seed_s else ""))
+
+    print(f"\n{'history query (last ' + str(args.limit) + ')':<34} {'p50 ms':>9} {'p95 ms':>9}")
+    HISTORY_INDEX.drop(engine, checkfirst=True)
+    p50, p95 = history_latency(args.phones, max(args.queries // 10, 10), args.limit, rng)
+    print(f"{'without (phone, timestamp) index':<34} {p50:>9.2f} {p95:>9.2f}")
+    HISTORY_INDEX.create(engine, checkfirst=True)
+    p50, p95 = history_latency(args.phones, args.queries, args.limit, rng)
+    print(f"{'with (phone, timestamp) index':<34} {p50:>9.2f} {p95:>9.2f}")
+
+    print(f"\n{'insert path (' + str(args.threads) + ' threads)':<34} {'msgs/s':>9}")
+    rate = write_throughput(args.writes, args.threads, add_message)
+    print(f"{'add_message (commit per message)':<34} {rate:>9.0f}")
+    buffer = MessageWriteBuffer(batch_size=args.batch_size, flush_ms=200)
+    rate = write_throughput(args.writes, args.threads, buffer.append, finish=buffer.flush)
+    print(f"{'write-behind (batch ' + str(args.batch_size) + ')':<34} {rate:>9.0f}")
+    assert buffer.flushed == args.writes, (buffer.flushed, args.writes)
+
+
+if __name__ == "__main__":
+    main()
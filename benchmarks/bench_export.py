@@ -0,0 +1,129 @@
+# benchmarks/bench_export.py
+# export لـ conversation_history من SQLite فيه --rows صف (افتراضياً 10M):
+#   materialize : زي get_conversation — كل الصفوف في list of dicts وبعدين json (على --naive-rows بس، غير كده الذاكرة بتخلص)
+#   stream      : utils/export.py — server-side cursor + yield_per + NDJSON batch ورا batch (عادي و gzip)
+#   incremental : نفس الـ stream من watermark (آخر 1% من الجدول)
+# كل قياس في process جديدة عشان الـ peak RSS يبقى بتاعه لوحده.
+#
+#   python -m benchmarks.bench_export [--rows 10000000] [--naive-rows 1000000] [--keep]
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHILD = r"""
+import os, sys, json, time, resource, itertools
+sys.path.insert(0, os.getcwd())
+from utils.db import SessionLocal, ConversationHistory
+import utils.export as export
+mode, out_path, limit, since_id = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+with open(out_path, "wb") as out:
+    if mode == "materialize":
+        with SessionLocal() as db:
+            rows = db.query(ConversationHistory).filter(ConversationHistory.id <= limit)\
+                .order_by(ConversationHistory.id).all()
+            data = [{"id": m.id, "phone": m.phone, "sender": m.sender, "message": m.message,
+                     "timestamp": m.timestamp.isoformat()} for m in rows]
+        out.write("".join(json.dumps(d, ensure_ascii=False) + "\n" for d in data).encode("utf-8"))
+        count = len(data)
+    else:
+        if limit:
+            rows = itertools.takewhile(lambda r: r["id"] <= limit, export.iter_history(since_id=since_id or None))
+            stats = {}
+            for chunk in export.iter_ndjson(rows, gzip=mode == "gzip", stats=stats):
+                out.write(chunk)
+        else:
+            stats = export.export("history", out, gzip=mode == "gzip", since_id=since_id or None)
+        count = stats["rows"]
+elapsed = time.perf_counter() - start
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("BENCH " + json.dumps({"rows": count, "seconds": elapsed, "base_mb": base_kb / 1024, "peak_mb": peak_kb / 1024,
+                             "bytes": os.path.getsize(out_path)}))
+"""
+
+
+def populate(path, rows, phones=50000, chunk=200000):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    subprocess.run([sys.executable, "-c", "from utils.db import Base, engine; Base.metadata.create_all(bind=engine)"],
+                   cwd=ROOT, env=env, check=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    start_ts = datetime(2025, 1, 1)
+    texts = ["hello", "I need a chatbot for my clinic", "كم سعر الباقة الأساسية؟",
+             "We build custom WhatsApp assistants; pricing depends on scope and integrations."]
+    started = time.perf_counter()
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            ts = start_ts + timedelta(seconds=i)
+            batch.append((f"9665{i % phones:08d}", "user" if i % 2 == 0 else "assistant", texts[i % len(texts)],
+                          ts.strftime("%Y-%m-%d %H:%M:%S.%f")))
+        conn.executemany("INSERT INTO conversation_history (phone, sender, message, timestamp) VALUES (?, ?, ?, ?)",
+                         batch)
+        conn.commit()
+        print(f"\r  populated {min(rows, offset + chunk):,} rows", end="", flush=True)
+    conn.close()
+    print(f" in {time.perf_counter() - started:.0f}s")
+
+
+def measure(db_path, out_path, mode, limit=0, since_id=0):
+    # الصفوف اتعملها INSERT دلوقتي، فالـ settle (inserted_at) كان هيوقف الـ export من أول صف
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", LOG_LEVEL="WARNING", HISTORY_WRITE_BEHIND="false",
+               EXPORT_SETTLE_SECONDS="0")
+    result = subprocess.run([sys.executable, "-c", CHILD, mode, out_path, str(limit), str(since_id)],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    line = next((l for l in result.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if line is None:
+        raise RuntimeError(result.stderr[-2000:])
+    os.remove(out_path)
+    return json.loads(line[6:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--naive-rows", type=int, default=1_000_000)
+    parser.add_argument("--db", help="SQLite موجود بدل ما نعمل واحد جديد")
+    parser.add_argument("--keep", action="store_true", help="متمسحش الـ DB في الآخر")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_export_")
+    db_path = args.db or os.path.join(tmp_dir, "export.db")
+    if not args.db:
+        print(f"populating {args.rows:,} rows into {db_path}")
+        populate(db_path, args.rows)
+    total = sqlite3.connect(db_path).execute("SELECT COUNT(*), MAX(id) FROM conversation_history").fetchone()
+    naive = min(args.naive_rows, total[0])
+    out_path = os.path.join(tmp_dir, "out.ndjson")
+
+    print(f"\n{'method':<36} {'rows':>11} {'seconds':>8} {'rows/s':>9} {'output MB':>10} {'peak RSS MB':>12}")
+    cases = [
+        (f"materialize (first {naive:,})", "materialize", naive, 0),
+        (f"stream (first {naive:,})", "plain", naive, 0),
+        ("stream, full table", "plain", 0, 0),
+        ("stream + gzip, full table", "gzip", 0, 0),
+        ("incremental (since_id, last 1%)", "plain", 0, total[1] - total[0] // 100),
+    ]
+    for label, mode, limit, since_id in cases:
+        r = measure(db_path, out_path, mode, limit, since_id)
+        print(f"{label:<36} {r['rows']:>11,} {r['seconds']:>8.1f} {r['rows'] / r['seconds']:>9,.0f} "
+              f"{r['bytes'] / 1e6:>10.0f} {r['peak_mb']:>12.0f}")
+    if not args.keep and not args.db:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+if __name__ == "__main__":
+    main()
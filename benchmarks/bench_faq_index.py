@@ -0,0 +1,107 @@
+# benchmarks/bench_faq_index.py
+# مقارنة زمن get_static_reply القديم (loop على كل keyword) بـ FaqIndex مع عدد FAQs من 10 لـ 10,000،
+# وبيتأكد إن الاتنين بيرجعوا نفس الإجابة لكل رسالة.
+#
+#   python -m benchmarks.bench_faq_index [--sizes 10,100,1000,10000] [--queries 200]
+import os
+import sys
+import time
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thefuzz import fuzz  # noqa: E402
+
+from utils.faq_index import FaqIndex  # noqa: E402
+
+EN_WORDS = ["price", "hours", "office", "chatbot", "service", "support", "contact", "analytics",
+            "custom", "project", "location", "team", "demo", "training", "data", "api", "cost", "plan"]
+AR_WORDS = ["سعر", "ساعات", "العمل", "مكتب", "خدمات", "دعم", "تواصل", "تحليلات", "مشروع",
+            "موقع", "فريق", "تدريب", "بيانات", "تكلفة", "باقة", "روبوت", "محادثة", "عرض"]
+
+
+def legacy_get_static_reply(faq_content, user_message, lang, threshold=75):
+    """نسخة طبق الأصل من get_static_reply القديمة (من غير قراءة الملف)."""
+    user_message_lower = user_message.lower().strip()
+    best_score = 0
+    best_answer = None
+    for _, faq_item in faq_content.items():
+        keywords_key = f"keywords_{lang}"
+        answer_key = f"answer_{lang}"
+        if keywords_key not in faq_item or answer_key not in faq_item:
+            continue
+        for keyword in faq_item[keywords_key]:
+            score = fuzz.token_set_ratio(user_message_lower, keyword.lower())
+            if score >= threshold and score > best_score:
+                best_score = score
+                best_answer = faq_item[answer_key]
+    return best_answer
+
+
+def make_faq(size, rng):
+    faq = {}
+    for i in range(size):
+        faq[f"faq_{i}"] = {
+            "keywords_en": [" ".join(rng.sample(EN_WORDS, rng.randint(1, 3))) + f" {i}" for _ in range(4)],
+            "keywords_ar": [" ".join(rng.sample(AR_WORDS, rng.randint(1, 3))) for _ in range(4)],
+            "answer_en": f"answer {i}",
+            "answer_ar": f"إجابة {i}",
+        }
+    return faq
+
+
+def make_queries(count, rng):
+    queries = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            words = rng.sample(EN_WORDS, rng.randint(1, 4))
+            # شوية أخطاء إملائية عشان نختبر المسار الـ fuzzy
+            if rng.random() < 0.3:
+                w = words[0]
+                words[0] = w[:-1] if len(w) > 3 else w
+            queries.append(("en", "What is the " + " ".join(words) + "?"))
+        else:
+            queries.append(("ar", " ".join(rng.sample(AR_WORDS, rng.randint(1, 4)))))
+    return queries
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    results = [fn(text, lang) for lang, text in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="أكبر حجم نشغل عليه النسخة القديمة (بطيئة جداً)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    queries = make_queries(args.queries, rng)
+    print(f"{'faq entries':>12} {'legacy ms/msg':>14} {'reload+legacy':>14} {'index ms/msg':>13} {'build ms':>9} {'same':>5}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        faq = make_faq(size, rng)
+        raw = json.dumps(faq, ensure_ascii=False)
+
+        build_start = time.perf_counter()
+        index = FaqIndex(faq, fold_arabic=False)
+        build_ms = (time.perf_counter() - build_start) * 1000
+        index_ms, index_results = timed(lambda text, lang: index.match(text, lang), queries)
+
+        if size <= args.legacy_max:
+            legacy_ms, legacy_results = timed(lambda text, lang: legacy_get_static_reply(faq, text, lang), queries)
+            # القديم كان كمان بيعمل json.loads للملف مع كل رسالة
+            reload_ms, _ = timed(lambda text, lang: json.loads(raw), queries[:20])
+            same = "yes" if legacy_results == index_results else "NO"
+            print(f"{size:>12} {legacy_ms:>14.3f} {legacy_ms + reload_ms:>14.3f} {index_ms:>13.3f} {build_ms:>9.1f} {same:>5}")
+        else:
+            print(f"{size:>12} {'-':>14} {'-':>14} {index_ms:>13.3f} {build_ms:>9.1f} {'-':>5}")
+
+
+if __name__ == "__main__":
+    main()
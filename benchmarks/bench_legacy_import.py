@@ -0,0 +1,167 @@
+# benchmarks/bench_legacy_import.py
+# استيراد أرشيف JSON قديم (customer_data.json + <phone>_history.json) متولّد بـ --customers عميل و
+# --phones ملف تاريخ فيه --messages رسالة:
+#   per-row     : add_or_update_customer / add_message لكل صف (session و commit لكل صف) على --naive-rows بس
+#   bulk        : utils/legacy_import.py بـ worker واحد وبـ --workers
+#   kill+resume : الـ import بيتقتل (SIGKILL) في النص وبيتشغل تاني؛ لازم عدد الصفوف يطلع مظبوط من غير تكرار
+# كل قياس في process جديدة و DB جديدة عشان الـ peak RSS يبقى بتاعه لوحده.
+#
+#   python -m benchmarks.bench_legacy_import [--customers 100000] [--phones 20000] [--messages 50] [--workers 4]
+import os
+import sys
+import json
+import time
+import signal
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+NAIVE_CHILD = r"""
+import os, sys, json, time, resource
+sys.path.insert(0, os.getcwd())
+from utils.migrations import upgrade
+from utils.db_helpers import add_or_update_customer, add_message
+from utils import legacy_import as li
+customers_path, history_dir, limit = sys.argv[1], sys.argv[2], int(sys.argv[3])
+upgrade()
+start = time.perf_counter()
+count = 0
+for key, record in li.iter_json_items(customers_path):
+    row = li.customer_row(key, record)
+    if count >= limit // 2:
+        break
+    add_or_update_customer(row["phone"], row["name"], row["language"], row["onboarding_step"], row["service_interest"])
+    count += 1
+for path in li.history_files(history_dir):
+    if count >= limit:
+        break
+    for phone, entry in li.iter_history_entries(path):
+        add_message(phone, entry["sender"], entry["message"])
+        count += 1
+elapsed = time.perf_counter() - start
+print("BENCH " + json.dumps({"rows": count, "seconds": elapsed,
+                             "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+BULK_CHILD = r"""
+import os, sys, json
+sys.path.insert(0, os.getcwd())
+from utils.legacy_import import run_import
+totals = run_import(sys.argv[1], sys.argv[2], workers=int(sys.argv[3]))
+print("BENCH " + json.dumps({"rows": totals["customers"] + totals["history"], "seconds": totals["seconds"],
+                             "peak_mb": totals["peak_rss_mb"]}))
+"""
+
+
+def generate(directory, customers, phones, messages):
+    """أرشيف بشكل التخزين القديم: object واحد للعملاء، وملف array لكل رقم."""
+    history_dir = os.path.join(directory, "conversation_history")
+    os.makedirs(history_dir)
+    customers_path = os.path.join(directory, "customer_data.json")
+    steps = ["completed", "awaiting_name", "awaiting_service_interest"]
+    with open(customers_path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for i in range(customers):
+            record = {"name": f"Customer {i}", "language": "ar" if i % 3 else "en", "onboarding_step": steps[i % 3],
+                      "service_interest": "chatbot" if i % 2 else None}
+            f.write(f'{"," if i else ""}"+9665{i:08d}": {json.dumps(record, ensure_ascii=False)}\n')
+        f.write("}\n")
+    texts = ["hello", "I need a chatbot for my clinic", "كم سعر الباقة الأساسية؟",
+             "We build custom WhatsApp assistants; pricing depends on scope and integrations."]
+    start = datetime(2024, 1, 1)
+    for p in range(phones):
+        entries = [{"sender": "user" if m % 2 == 0 else "assistant", "message": texts[(p + m) % len(texts)],
+                    "timestamp": (start + timedelta(minutes=p + m)).isoformat()} for m in range(messages)]
+        with open(os.path.join(history_dir, f"+9665{p:08d}_history.json"), "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+    return customers_path, history_dir
+
+
+def _env(db_path):
+    return dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", LOG_LEVEL="WARNING", HISTORY_WRITE_BEHIND="false")
+
+
+def _bench_line(result):
+    line = next((l for l in result.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if line is None:
+        raise RuntimeError(result.stderr[-2000:])
+    return json.loads(line[6:])
+
+
+def _fresh_db(tmp_dir, name):
+    path = os.path.join(tmp_dir, f"{name}.db")
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return path
+
+
+def _counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return (conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0],
+                conn.execute("SELECT COUNT(*) FROM conversation_history").fetchone()[0],
+                conn.execute("SELECT COUNT(*) FROM (SELECT phone, timestamp, message FROM conversation_history "
+                             "GROUP BY phone, timestamp, message HAVING COUNT(*) > 1)").fetchone()[0])
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--phones", type=int, default=20_000)
+    parser.add_argument("--messages", type=int, default=50, help="رسايل لكل ملف تاريخ")
+    parser.add_argument("--naive-rows", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_legacy_import_")
+    started = time.perf_counter()
+    customers_path, history_dir = generate(tmp_dir, args.customers, args.phones, args.messages)
+    expected = (args.customers, args.phones * args.messages)
+    print(f"generated {args.customers:,} customers + {args.phones:,} history files x {args.messages} messages "
+          f"in {time.perf_counter() - started:.0f}s")
+
+    print(f"\n{'method':<28} {'rows':>11} {'seconds':>8} {'rows/s':>9} {'peak RSS MB':>12}")
+    db = _fresh_db(tmp_dir, "naive")
+    r = _bench_line(subprocess.run([sys.executable, "-c", NAIVE_CHILD, customers_path, history_dir,
+                                    str(args.naive_rows)], cwd=ROOT, env=_env(db), capture_output=True, text=True))
+    print(f"{'per-row (first rows)':<28} {r['rows']:>11,} {r['seconds']:>8.1f} {r['rows'] / r['seconds']:>9,.0f} "
+          f"{r['peak_mb']:>12.0f}")
+
+    bulk_seconds = None
+    for workers in sorted({1, args.workers}):
+        db = _fresh_db(tmp_dir, f"bulk{workers}")
+        r = _bench_line(subprocess.run([sys.executable, "-c", BULK_CHILD, customers_path, history_dir, str(workers)],
+                                       cwd=ROOT, env=_env(db), capture_output=True, text=True))
+        bulk_seconds = bulk_seconds or r["seconds"]
+        ok = _counts(db)[:2] == expected
+        print(f"{f'bulk, {workers} worker(s)':<28} {r['rows']:>11,} {r['seconds']:>8.1f} "
+              f"{r['rows'] / r['seconds']:>9,.0f} {r['peak_mb']:>12.0f}" + ("" if ok else f"  MISMATCH {_counts(db)}"))
+
+    # kill في نص الاستيراد وبعدين resume
+    db = _fresh_db(tmp_dir, "resume")
+    process = subprocess.Popen([sys.executable, "-c", BULK_CHILD, customers_path, history_dir, str(args.workers)],
+                               cwd=ROOT, env=_env(db), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    time.sleep(bulk_seconds / 2)
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+    before = _counts(db)
+    r = _bench_line(subprocess.run([sys.executable, "-c", BULK_CHILD, customers_path, history_dir, str(args.workers)],
+                                   cwd=ROOT, env=_env(db), capture_output=True, text=True))
+    customers, history, duplicates = _counts(db)
+    status = "OK" if (customers, history) == expected and not duplicates else f"MISMATCH, {duplicates} duplicated"
+    print(f"{'kill+resume (2nd run)':<28} {r['rows']:>11,} {r['seconds']:>8.1f} {r['rows'] / r['seconds']:>9,.0f} "
+          f"{r['peak_mb']:>12.0f}  killed at {before[0] + before[1]:,} rows, final "
+          f"{customers + history:,}/{sum(expected):,} {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# benchmarks/bench_logging.py
+# overhead اللوج في 3 أوضاع:
+#   off          : اللوج مقفول (الحد الأدنى)
+#   sync full    : زي الأول — handler sync بيكتب على الـ stream + الـ payload كامل (indent=2) مع كل طلب
+#   queue json   : QueueHandler + JSON في thread في الخلفية + redaction + sampling للـ payloads
+# (1) الوقت اللي اللوج بياخده من الـ thread بتاع الطلب (نفس سطور اللوج بتاعة طلب webhook واحد)،
+#     مع sink سريع (ملف) و sink بطيء (stdout pipe وراه log shipper زحمة)
+# (2) POST /webhook كامل (رد FAQ + إرسال لـ Graph API وهمي)
+#
+#   python -m benchmarks.bench_logging [--requests 2000] [--threads 8] [--sink-latency-ms 0.5]
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import FakeGraphAPI  # noqa: E402
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_logging_")
+
+
+def _payload(phone, message_id):
+    return {"object": "whatsapp_business_account", "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550001111", "phone_number_id": "100"},
+        "contacts": [{"profile": {"name": "Bench Customer"}, "wa_id": phone}],
+        "messages": [{"id": message_id, "from": phone, "timestamp": "1700000000", "type": "text",
+                      "text": {"body": "What are your working hours?"}}],
+    }}]}]}
+
+
+def run(client, prefix, requests, threads):
+    def one(i):
+        start = time.perf_counter()
+        response = client.post("/webhook", json=_payload(f"{prefix}{i % 500:08d}", f"wamid.{prefix}.{i}"))
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+class SlowStream:
+    """stream كل write فيه بياخد latency ثابتة (زي pipe مليان)."""
+
+    def __init__(self, target, latency):
+        self.target = target
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+
+def log_one_request(logger, data, legacy):
+    """نفس سطور اللوج اللي طلب webhook واحد (FAQ) بيكتبها."""
+    from utils.logging_setup import log_context, log_payload, body_for_log
+    with log_context(request_id="bench", message_id="wamid.bench"):
+        if legacy:
+            logger.info(f"Received webhook data: {json.dumps(data, indent=2, ensure_ascii=False)}")
+        else:
+            log_payload(logger, "Received webhook data", data)
+        logger.info("Webhook batch: entries=1, received=1, text=1, duplicates=0")
+        logger.info(f"Processing message from 966500000001: '{body_for_log('What are your working hours?')}'")
+        logger.info("Attempting to send WhatsApp message to: 966500000001")
+        logger.info("Message successfully sent to 966500000001. API Response Status: 200")
+        if legacy:
+            logger.info('Response Body: {"messaging_product":"whatsapp","contacts":[{"input":"966500000001",'
+                        '"wa_id":"966500000001"}],"messages":[{"id":"wamid.HBgMOTY2NTAwMDAwMDAxFQIAERgSMEE"}]}')
+        logger.info("Regular reply sent to user 966500000001.")
+        logger.info("Webhook batch done: processed=1, failed=0")
+
+
+def calling_thread_cost(logging_setup, mode, stream, iterations):
+    logger = logging.getLogger("bench.request")
+    data = _payload("966500000001", "wamid.bench")
+    legacy = mode == "sync full payload"
+    root = logging.getLogger()
+    if mode == "off":
+        logging_setup.configure_logging(use_queue=False, stream=stream)
+        root.setLevel(logging.CRITICAL)
+    elif legacy:
+        logging_setup.shutdown_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        logging_setup.LOG_REDACT = True
+        logging_setup.LOG_PAYLOAD_SAMPLE_RATE = 0.01
+        logging_setup.configure_logging(fmt="json", use_queue=True, stream=stream)
+    before = logging_setup.dropped_records()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        log_one_request(logger, data, legacy)
+    elapsed = time.perf_counter() - start
+    dropped = logging_setup.dropped_records() - before
+    logging_setup.shutdown_logging()  # بيستنى الطابور يفضى (مش محسوب في الوقت)
+    return elapsed / iterations * 1e6, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=2000, help="طلبات لقياس (1)")
+    parser.add_argument("--sink-latency-ms", type=float, default=0.5)
+    args = parser.parse_args()
+
+    graph = FakeGraphAPI(latency=0).start()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}",
+        "MESSAGE_QUEUE_PATH": os.path.join(_tmp_dir, "queue.db"),
+        "OPENAI_API_KEY": "sk-bench", "WHATSAPP_API_BASE_URL": graph.base_url,
+        "WHATSAPP_ACCESS_TOKEN": "bench", "WHATSAPP_PHONE_NUMBER_ID": "100",
+        "WHATSAPP_RATE_LIMIT_PER_SEC": "100000", "WEBHOOK_PROCESSING_MODE": "inline",
+        "HISTORY_WRITE_BEHIND": "true",  # عشان الـ DB متغطيش على فرق اللوج
+    })
+    import utils.logging_setup as logging_setup
+    from utils.db import Base, engine, SessionLocal, Customer
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        for prefix in ("1", "2", "3"):
+            db.add_all([Customer(phone=f"{prefix}{i:08d}", name="Bench", language="en", onboarding_step="completed")
+                        for i in range(500)])
+        db.commit()
+    from app import app
+    client = app.test_client()
+    client.post("/webhook", json=_payload("100000000", "wamid.warmup"))
+
+    log_path = os.path.join(_tmp_dir, "app.log")
+
+    def mode_off():
+        logging_setup.configure_logging(use_queue=False, stream=open(os.devnull, "w"))
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def mode_sync_full():
+        logging_setup.shutdown_logging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        logging_setup.LOG_REDACT = False
+        logging_setup.LOG_PAYLOAD_SAMPLE_RATE = 1.0
+
+    def mode_queue_json():
+        logging_setup.LOG_REDACT = True
+        logging_setup.LOG_PAYLOAD_SAMPLE_RATE = 0.01
+        logging_setup.configure_logging(fmt="json", use_queue=True, stream=open(log_path, "a"))
+
+    print(f"(1) logging cost in the request thread, per webhook request ({args.iterations} requests)")
+    print(f"{'logging':<26} {'file sink us':>13} {f'slow sink ({args.sink_latency_ms}ms/write) us':>32} {'dropped':>8}")
+    for mode in ("off", "sync full payload", "queue json"):
+        with open(log_path, "a") as fast:
+            fast_us, _ = calling_thread_cost(logging_setup, mode, fast, args.iterations)
+        with open(log_path, "a") as target:
+            slow_us, dropped = calling_thread_cost(
+                logging_setup, mode, SlowStream(target, args.sink_latency_ms / 1000), args.iterations)
+        print(f"{mode:<26} {fast_us:>13.1f} {slow_us:>32.1f} {dropped:>8}")
+
+    modes = [("off", mode_off, "1"), ("sync full payload", mode_sync_full, "2"), ("queue json (1% payloads)", mode_queue_json, "3")]
+    print(f"\n(2) {args.requests} webhook POSTs end to end, {args.threads} threads")
+    print(f"{'logging':<26} {'req/s':>8} {'p50 us':>9} {'p99 us':>9}")
+    for label, setup, prefix in modes:
+        setup()
+        rps, p50, p99 = run(client, prefix, args.requests, args.threads)
+        print(f"{label:<26} {rps:>8.0f} {p50:>9.0f} {p99:>9.0f}")
+    logging_setup.shutdown_logging()
+    print(f"queue mode dropped {logging_setup.dropped_records()} record(s); log file: {os.path.getsize(log_path) / 1024:.0f} KB")
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# benchmarks/bench_message_burst.py
+# عملاء بيبعتوا رسايل قصيرة ورا بعض ("hello" / "I need" / "a bot for my clinic" / ...)، كل رسالة في webhook
+# لوحده (Meta مش بتستنى رد الـ webhook اللي قبله) وبينهم 100-400ms زي الكتابة الحقيقية. بنقارن من غير burst window ومعاه (utils/message_burst.py) في
+# الوضعين inline (threads) و queue: عدد طلبات OpenAI، عدد الردود اللي اتبعتت، والوقت من آخر رسالة لآخر رد.
+#
+#   python -m benchmarks.bench_message_burst [--customers 40] [--window-ms 1500] [--llm-latency 0.5]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_burst_")
+BURST = ["hello", "I need", "a bot for my clinic", "can it book appointments?"]  # مش في الـ FAQ
+
+
+def _payload(phone, body, message_id):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+        {"id": message_id, "from": phone, "type": "text", "text": {"body": body}}
+    ]}}]}]}
+
+
+def replay(client, phones, graph, expected_replies, gap_ms, timeout=60):
+    """كل رسالة webhook في thread في ميعادها؛ يرجع الوقت من آخر رسالة لآخر رد (median و max) بالـ ms."""
+    last_sent = {}
+    rng = random.Random(7)
+    start = time.perf_counter() + 0.05
+    schedule = []
+    for phone in phones:
+        at = start + rng.uniform(0, 0.5)
+        for n, body in enumerate(BURST):
+            if n:
+                at += rng.uniform(*gap_ms) / 1000
+            schedule.append((at, phone, n, body))
+            last_sent[phone] = at
+
+    def deliver(at, phone, n, body):
+        time.sleep(max(0.0, at - time.perf_counter()))
+        response = client.post("/webhook", json=_payload(phone, body, f"wamid.{phone}.{n}"))
+        assert response.status_code == 200, (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=deliver, args=item) for item in schedule]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with graph.lock:
+            done = sum(1 for m in graph.messages if m["to"] in last_sent) >= expected_replies(len(phones))
+        if done:
+            break
+        time.sleep(0.01)
+    last_reply = {}
+    with graph.lock:
+        for m, received_at in zip(graph.messages, graph.received_at):
+            if m["to"] in last_sent:
+                last_reply[m["to"]] = received_at
+    delays = sorted((last_reply[p] - last_sent[p]) * 1000 for p in phones if p in last_reply)
+    return delays[len(delays) // 2], delays[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=40)
+    parser.add_argument("--window-ms", type=float, default=1500)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--gap-ms", type=float, nargs=2, default=(100, 400), metavar=("MIN", "MAX"))
+    args = parser.parse_args()
+
+    llm = StubOpenAI(reply="We build custom chatbots; pricing depends on scope.", latency=args.llm_latency).start()
+    graph = FakeGraphAPI().start()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}",
+        "MESSAGE_QUEUE_PATH": os.path.join(_tmp_dir, "queue.db"),
+        "OPENAI_BASE_URL": f"{llm.base_url}/v1", "OPENAI_API_KEY": "sk-bench",
+        "WHATSAPP_API_BASE_URL": graph.base_url, "WHATSAPP_ACCESS_TOKEN": "bench",
+        "WHATSAPP_PHONE_NUMBER_ID": "100", "WHATSAPP_RATE_LIMIT_PER_SEC": "100000",
+        "COMPLETION_CACHE_ENABLED": "false", "WARMUP_ON_START": "false", "LOG_LEVEL": "WARNING",
+        "MESSAGE_QUEUE_POLL_INTERVAL": "0.05",
+    })
+    from utils.db import Base, engine, SessionLocal, Customer, ConversationHistory
+    Base.metadata.create_all(bind=engine)
+    from app import app
+    import routes.webhook as webhook
+    import utils.message_processor as processor
+    from utils.message_burst import BurstCollector
+    from utils.metrics import BURST_REPLIES_SAVED
+
+    client = app.test_client()
+    print(f"{args.customers} customers x {len(BURST)} messages ({args.gap_ms[0]:.0f}-{args.gap_ms[1]:.0f}ms apart), "
+          f"OpenAI latency {args.llm_latency * 1000:.0f}ms")
+    print(f"{'mode':<24} {'LLM calls':>10} {'replies':>8} {'user rows':>10} {'saved':>6} "
+          f"{'last reply p50 ms':>18} {'max ms':>8}")
+    for n, (label, processing, window) in enumerate([
+        ("inline, no window", "inline", 0),
+        (f"inline, {args.window_ms:.0f}ms window", "inline", args.window_ms),
+        ("queue, no window", "queue", 0),
+        (f"queue, {args.window_ms:.0f}ms window", "queue", args.window_ms),
+    ]):
+        phones = [f"9665{n}{i:07d}" for i in range(args.customers)]
+        with SessionLocal() as db:
+            db.add_all([Customer(phone=p, name="Bench", language="en", onboarding_step="completed") for p in phones])
+            db.commit()
+        processor.burst_collector = BurstCollector(window_ms=window)
+        webhook.WEBHOOK_PROCESSING_MODE = processing
+        pool = webhook.start_message_workers() if processing == "queue" else None
+        calls_before, saved_before = llm.requests, BURST_REPLIES_SAVED.value("llm")
+        expected = (lambda c: c) if window else (lambda c: c * len(BURST))
+        p50, worst = replay(client, phones, graph, expected, args.gap_ms)
+        if pool is not None:
+            pool.stop()
+            webhook._worker_pool = None
+        with SessionLocal() as db:
+            user_rows = db.query(ConversationHistory).filter(
+                ConversationHistory.phone.in_(phones), ConversationHistory.sender == "user").count()
+        replies = sum(1 for m in graph.messages if m["to"] in set(phones))
+        print(f"{label:<24} {llm.requests - calls_before:>10} {replies:>8} {user_rows:>10} "
+              f"{BURST_REPLIES_SAVED.value('llm') - saved_before:>6.0f} {p50:>18.0f} {worst:>8.0f}")
+    llm.stop()
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# benchmarks/bench_metrics.py
+# overhead الـ instrumentation: دالة فاضية من غير/مع @timed، و Counter.inc، وزمن الـ scrape.
+#
+#   python -m benchmarks.bench_metrics [--calls 200000]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from utils.metrics import timed, registry, REPLY_SOURCE, STAGE_DURATION  # noqa: E402
+
+
+def per_call_ns(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    def plain():
+        return None
+
+    instrumented = timed("bench")(plain)
+    base = per_call_ns(plain, args.calls)
+    wrapped = per_call_ns(instrumented, args.calls)
+    counter = per_call_ns(lambda: REPLY_SOURCE.inc("bench"), args.calls)
+
+    # scrape واقعي: ~20 stage × 15 bucket
+    for i in range(20):
+        STAGE_DURATION.observe(0.01, f"stage{i}")
+    registry.render()  # أول scrape بيعمل import للـ collectors
+    start = time.perf_counter()
+    body = registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    print(f"plain call            {base:8.0f} ns")
+    print(f"@timed call           {wrapped:8.0f} ns  (overhead {wrapped - base:.0f} ns)")
+    print(f"Counter.inc           {counter:8.0f} ns")
+    print(f"/metrics render       {render_ms:8.2f} ms  ({len(body.splitlines())} lines)")
+
+
+if __name__ == "__main__":
+    main()
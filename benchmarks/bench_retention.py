@@ -0,0 +1,161 @@
+# benchmarks/bench_retention.py
+# retention لتاريخ المحادثات (utils/retention.py) على --rows صف (50M للقياس الكامل) لـ --customers عميل على مدى
+# --span-days يوم، والردود فيها التوقيع كامل زي الحقيقة. قبل وبعد أرشفة الأقدم من --retention-days:
+#   - حجم conversation_history (الجدول + الـ indexes، من dbstat) و conversation_archives وحجم الملف بعد VACUUM
+#   - latency الـ hot query (get_recent_conversation، آخر CONTEXT_MAX_TURNS رسالة) p50/p99
+#   - get_conversation للتاريخ كله (بعد الأرشفة بيقرا الأرشيف) ومطابقته لنفس النتيجة قبل الأرشفة
+#
+#   python -m benchmarks.bench_retention [--rows 5000000] [--customers 50000] [--retention-days 90]
+#   python -m benchmarks.bench_retention --rows 50000000 --customers 500000
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_retention_")
+_db_path = os.path.join(_tmp_dir, "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_path}")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from utils.migrations import upgrade  # noqa: E402
+from utils.db_helpers import get_conversation, get_recent_conversation  # noqa: E402
+from utils.conversation_context import CONTEXT_MAX_TURNS  # noqa: E402
+from utils.retention import archive_history  # noqa: E402
+
+USER_TEXTS = [
+    "What are your working hours?", "كم سعر روبوت المحادثة؟", "I need a custom AI project for my shop",
+    "ما هي الخدمات التي تقدمونها للشركات الصغيرة؟", "Can you integrate with WhatsApp and our CRM?",
+]
+ASSISTANT_TEXTS = [
+    "Our pricing is tailored to the scope of each project and we will contact you shortly.",
+    "نعم، نقدر نربط المساعد مع واتساب ونظام إدارة العملاء عندكم.",
+    "Our official working hours are from Sunday to Thursday, 9:00 AM to 6:00 PM (GMT+3).",
+]
+SIGNATURE = "\n\n🤖 Generated by NajdAIgent – AI replies may contain mistakes; our team reviews important requests."
+
+
+def populate(rows, customers, span_days, now):
+    """صفوف بالـ driver على طول (أسرع بكتير من الـ ORM لعشرات الملايين)."""
+    rng = random.Random(1)
+    per_customer = max(2, rows // customers)
+    conn = sqlite3.connect(_db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    span = span_days * 86400
+    batch = []
+    inserted = 0
+    for c in range(customers):
+        phone = f"9665{c:08d}"
+        # كل عميل نشاطه من وقت عشوائي في المدى لحد دلوقتي
+        first = now - timedelta(seconds=rng.uniform(span * 0.05, span))
+        step = (now - first).total_seconds() / per_customer
+        for i in range(per_customer):
+            timestamp = (first + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S.%f")
+            if i % 2 == 0:
+                batch.append(("default", phone, "user", rng.choice(USER_TEXTS), timestamp))
+            else:
+                batch.append(("default", phone, "assistant", rng.choice(ASSISTANT_TEXTS) + SIGNATURE, timestamp))
+        if len(batch) >= 200_000 or c == customers - 1:
+            conn.executemany("INSERT INTO conversation_history (tenant_id, phone, sender, message, timestamp) "
+                             "VALUES (?, ?, ?, ?, ?)", batch)
+            conn.commit()
+            inserted += len(batch)
+            batch = []
+    conn.close()
+    return inserted
+
+
+def sizes():
+    conn = sqlite3.connect(_db_path)
+    try:
+        by_name = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+        counts = (conn.execute("SELECT COUNT(*) FROM conversation_history").fetchone()[0],
+                  conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM conversation_archives").fetchone()[0])
+    finally:
+        conn.close()
+    history = sum(v for k, v in by_name.items() if "conversation_history" in k)
+    archives = sum(v for k, v in by_name.items() if "conversation_archives" in k)
+    return {"history_mb": history / 2**20, "archives_mb": archives / 2**20,
+            "file_mb": os.path.getsize(_db_path) / 2**20, "hot_rows": counts[0], "archived_rows": counts[1]}
+
+
+def vacuum():
+    conn = sqlite3.connect(_db_path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def latency(fn, phones):
+    timings = []
+    for phone in phones:
+        start = time.perf_counter()
+        fn(phone)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--span-days", type=int, default=730, help="مدى التاريخ المتولد")
+    parser.add_argument("--retention-days", type=float, default=90)
+    parser.add_argument("--samples", type=int, default=2000, help="عملاء لقياس الـ hot query")
+    parser.add_argument("--full-samples", type=int, default=100, help="عملاء لقياس ومطابقة get_conversation")
+    args = parser.parse_args()
+
+    upgrade()
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    total = populate(args.rows, args.customers, args.span_days, now)
+    vacuum()
+    print(f"generated {total:,} rows for {args.customers:,} customers over {args.span_days} days "
+          f"in {time.perf_counter() - started:.0f}s ({_db_path})")
+
+    rng = random.Random(2)
+    phones = [f"9665{rng.randrange(args.customers):08d}" for _ in range(args.samples)]
+    full_phones = phones[:args.full_samples]
+    recent = lambda phone: get_recent_conversation(phone, CONTEXT_MAX_TURNS)  # noqa: E731
+    latency(recent, phones[:200])  # warm-up للـ page cache
+    before = sizes()
+    before["hot"] = latency(recent, phones)
+    before["full"] = latency(get_conversation, full_phones)
+    expected = {phone: get_conversation(phone) for phone in full_phones}
+
+    stats = archive_history(args.retention_days)
+    vacuum()
+    latency(recent, phones[:200])
+    after = sizes()
+    after["hot"] = latency(recent, phones)
+    after["full"] = latency(get_conversation, full_phones)
+    mismatched = sum(get_conversation(phone) != messages for phone, messages in expected.items())
+
+    print(f"archived {stats['messages']:,} messages of {stats['customers']:,} customers older than "
+          f"{args.retention_days:g} days in {stats['seconds']:.1f}s ({stats['messages'] / max(stats['seconds'], 1e-9):,.0f} "
+          f"rows/s); message text {stats['bytes_raw'] / 2**20:,.1f} MB -> {stats['bytes_archived'] / 2**20:,.1f} MB "
+          f"compressed")
+    print(f"\n{'':<34} {'before':>12} {'after':>12}")
+    print(f"{'conversation_history rows':<34} {before['hot_rows']:>12,} {after['hot_rows']:>12,}")
+    print(f"{'archived messages':<34} {before['archived_rows']:>12,} {after['archived_rows']:>12,}")
+    print(f"{'conversation_history + idx MB':<34} {before['history_mb']:>12,.1f} {after['history_mb']:>12,.1f}")
+    print(f"{'conversation_archives MB':<34} {before['archives_mb']:>12,.1f} {after['archives_mb']:>12,.1f}")
+    print(f"{'database file MB (after VACUUM)':<34} {before['file_mb']:>12,.1f} {after['file_mb']:>12,.1f}")
+    print(f"{'recent history p50 / p99 ms':<34} {before['hot'][0]:>6.2f}/{before['hot'][1]:<5.2f} "
+          f"{after['hot'][0]:>6.2f}/{after['hot'][1]:<5.2f}")
+    print(f"{'full history p50 / p99 ms':<34} {before['full'][0]:>6.2f}/{before['full'][1]:<5.2f} "
+          f"{after['full'][0]:>6.2f}/{after['full'][1]:<5.2f}")
+    archived_ok = after["archived_rows"] + after["hot_rows"] - stats["customers"] == before["hot_rows"]
+    print(f"\nfull history identical for {len(expected) - mismatched}/{len(expected)} sampled customers; "
+          f"row accounting {'OK' if archived_ok else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
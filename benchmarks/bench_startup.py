@@ -0,0 +1,113 @@
+# benchmarks/bench_startup.py
+# cold start: (1) وقت الـ import لكل موديول (python -X importtime) لـ `import app`،
+# (2) time-to-first-request في process جديدة: من تشغيل الـ interpreter لحد أول رد webhook (سؤال بيروح لـ OpenAI وهمي)،
+#     من غير warm-up (أول طلب بيدفع التحميل كله) ومع انتظار الـ warm-up (/readyz) قبل أول طلب.
+#
+#   python -m benchmarks.bench_startup [--runs 3] [--top 15]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+# بيتشغل في process جديدة لكل قياس
+CHILD = r"""
+import os, sys, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, os.getcwd())
+from app import app
+t_import = time.perf_counter()
+warmup = None
+try:
+    from utils.warmup import warmup
+except ImportError:  # نسخ قديمة من غير warm-up
+    pass
+client = app.test_client()
+if os.environ.get("BENCH_WAIT_READY") == "1" and warmup is not None:
+    while client.get("/readyz").status_code != 200:
+        time.sleep(0.005)
+t_ready = time.perf_counter()
+payload = {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+    {"id": "wamid.first", "from": "966500000001", "type": "text", "text": {"body": "can you design a custom integration zq?"}}
+]}}]}]}
+response = client.post("/webhook", json=payload)
+t_first = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print("BENCH " + json.dumps({"wall": time.time(), "import_ms": (t_import - t0) * 1000,
+                             "ready_ms": (t_ready - t_import) * 1000, "first_ms": (t_first - t_ready) * 1000}))
+"""
+
+
+def import_times(env, top):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative_us), depth, name.strip()))
+    total = next((c for c, _, name in rows if name == "app"), 0)
+    # الموديولات اللي app والـ routes بيعملولها import مباشرة (عمق صغير) مرتبة بالوقت
+    shallow = sorted((r for r in rows if r[1] <= 3 and r[2] != "app"), reverse=True)[:top]
+    return total, shallow
+
+
+def time_to_first_request(env, wait_ready):
+    env = dict(env, BENCH_WAIT_READY="1" if wait_ready else "0")
+    start = time.time()
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True)
+    line = next((l for l in result.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if line is None:
+        raise RuntimeError(result.stderr[-2000:])
+    data = json.loads(line[6:])
+    data["ttfr_ms"] = (data["wall"] - start) * 1000
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    llm = StubOpenAI(reply="Sure, our team can build that integration.").start()
+    graph = FakeGraphAPI().start()
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}",
+               MESSAGE_QUEUE_PATH=os.path.join(tmp_dir, "queue.db"),
+               OPENAI_BASE_URL=f"{llm.base_url}/v1", OPENAI_API_KEY="sk-bench",
+               WHATSAPP_API_BASE_URL=graph.base_url, WHATSAPP_ACCESS_TOKEN="bench", WHATSAPP_PHONE_NUMBER_ID="100",
+               COMPLETION_CACHE_ENABLED="false", WEBHOOK_PROCESSING_MODE="inline", LOG_LEVEL="WARNING")
+    seed = ("from utils.db import Base, engine, SessionLocal, Customer\n"
+            "Base.metadata.create_all(bind=engine)\n"
+            "db = SessionLocal(); db.merge(Customer(phone='966500000001', name='Bench', language='en', "
+            "onboarding_step='completed')); db.commit()")
+    subprocess.run([sys.executable, "-c", seed], cwd=ROOT, env=env, check=True, capture_output=True)
+
+    total, shallow = import_times(env, args.top)
+    print(f"import app: {total / 1000:.0f} ms total; slowest imports (cumulative, incl. children):")
+    for cumulative, depth, name in shallow:
+        print(f"  {'  ' * max(depth - 1, 0)}{name:<40} {cumulative / 1000:>8.1f} ms")
+
+    print(f"\ntime to first request (median of {args.runs} fresh processes, LLM reply via stub):")
+    print(f"{'mode':<30} {'import ms':>10} {'warm-up ms':>11} {'1st req ms':>11} {'TTFR ms':>9}")
+    for label, wait_ready in (("no wait (lazy init on request)", False), ("wait for /readyz", True)):
+        runs = sorted((time_to_first_request(env, wait_ready) for _ in range(args.runs)), key=lambda r: r["ttfr_ms"])
+        r = runs[len(runs) // 2]
+        print(f"{label:<30} {r['import_ms']:>10.0f} {r['ready_ms']:>11.0f} {r['first_ms']:>11.0f} {r['ttfr_ms']:>9.0f}")
+    llm.stop()
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
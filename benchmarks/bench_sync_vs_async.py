@@ -0,0 +1,123 @@
+# benchmarks/bench_sync_vs_async.py
+# كام محادثة in-flight في process واحد: Flask (threads زي gunicorn gthread) مقابل وضع ASGI (asyncio)،
+# و OpenAI + Graph API وهميين بـ latency عشان الوقت يروح في انتظار I/O زي الحقيقة.
+#
+#   python -m benchmarks.bench_sync_vs_async [--conversations 200] [--threads 16] [--llm-latency 2.0]
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import resource
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_async_")
+
+
+def _payload(phone, body, message_id):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+        {"id": message_id, "from": phone, "type": "text", "text": {"body": body}}
+    ]}}]}]}
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] * 1000 if values else 0.0
+
+
+def _report(label, elapsed, latencies, stub):
+    print(f"{label:<28} {len(latencies) / elapsed:>9.1f} {elapsed:>8.1f} {_percentile(latencies, 0.5):>9.0f} "
+          f"{_percentile(latencies, 0.95):>9.0f} {stub.max_in_flight:>10}")
+
+
+def run_sync(app, conversations, threads, stub, prefix):
+    client = app.test_client()
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        response = client.post("/webhook", json=_payload(f"{prefix}{i:06d}", f"plan zq{i} integration details", f"wamid.s{i}"))
+        latencies.append(time.perf_counter() - start)
+        return response.status_code
+
+    stub.max_in_flight = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(one, range(conversations)))
+    elapsed = time.perf_counter() - start
+    assert all(code == 200 for code in statuses), statuses
+    return elapsed, latencies
+
+
+async def run_async(asgi_app, conversations, stub, prefix):
+    import httpx
+    latencies = []
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(i):
+            start = time.perf_counter()
+            response = await client.post("/webhook", json=_payload(
+                f"{prefix}{i:06d}", f"plan zq{i} integration details", f"wamid.a{i}"))
+            latencies.append(time.perf_counter() - start)
+            return response.status_code
+
+        stub.max_in_flight = 0
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(one(i) for i in range(conversations)))
+        elapsed = time.perf_counter() - start
+    assert all(code == 200 for code in statuses), statuses
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16, help="threads لكل worker في الوضع العادي")
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    llm = StubOpenAI(reply="Thanks for asking, our team will share the details.", latency=args.llm_latency).start()
+    graph = FakeGraphAPI(latency=args.send_latency).start()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}",
+        "MESSAGE_QUEUE_PATH": os.path.join(_tmp_dir, "queue.db"),
+        "OPENAI_BASE_URL": f"{llm.base_url}/v1", "OPENAI_API_KEY": "sk-bench",
+        "WHATSAPP_API_BASE_URL": graph.base_url, "WHATSAPP_ACCESS_TOKEN": "bench",
+        "WHATSAPP_PHONE_NUMBER_ID": "100", "WHATSAPP_RATE_LIMIT_PER_SEC": "100000",
+        "COMPLETION_CACHE_ENABLED": "false", "LLM_BREAKER_MIN_CALLS": "1000000",
+        "WEBHOOK_PROCESSING_MODE": "inline",
+    })
+    import logging
+    logging.disable(logging.WARNING)
+
+    from utils.db import Base, engine, SessionLocal, Customer
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        for prefix in ("5", "6"):
+            db.add_all([Customer(phone=f"{prefix}{i:06d}", name="Bench", language="en", onboarding_step="completed")
+                        for i in range(args.conversations)])
+        db.commit()
+
+    import asgi
+    from app import app
+
+    print(f"{args.conversations} conversations, LLM latency {args.llm_latency}s, send latency {args.send_latency}s")
+    # in-flight = أقصى عدد نداءات OpenAI متزامنة خرجت من الـ process (= محادثات شغالة في نفس اللحظة)
+    print(f"{'mode':<28} {'conv/s':>9} {'total s':>8} {'p50 ms':>9} {'p95 ms':>9} {'in-flight':>10}")
+    elapsed, latencies = run_sync(app, args.conversations, args.threads, llm, "5")
+    _report(f"sync Flask ({args.threads} threads)", elapsed, latencies, llm)
+    elapsed, latencies = asyncio.run(run_async(asgi.app, args.conversations, llm, "6"))
+    _report("async ASGI (1 event loop)", elapsed, latencies, llm)
+    print(f"peak RSS of this process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    llm.stop()
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
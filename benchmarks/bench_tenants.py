@@ -0,0 +1,133 @@
+# benchmarks/bench_tenants.py
+# multi-tenant في process واحدة (utils/tenants.py): الذاكرة لكل tenant عند 1 و 50 و 500 tenant.
+# كل tenant ليه فولدر config فيه system_prompt.txt و faq_data.json بتوعه (--faq-entries سؤال) والباقي من
+# config_data، وكل tenant بياخد رسالة webhook على الـ phone_number_id بتاعه (عميل جديد → onboarding) فالـ config
+# بتاعه بيتحمل. كل حجم في process جديدة: RSS بعد أول رسالة للـ default، وبعد رسالة لكل tenant، والفرق / N.
+# كل حجم بيتقاس مرتين: TENANT_CONFIG_CACHE_SIZE أكبر من N (كل الـ configs في الذاكرة) و بـ --cache-size (LRU).
+#
+#   python -m benchmarks.bench_tenants [--sizes 1,50,500] [--cache-size 100] [--faq-entries 40]
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+CHILD = r"""
+import os, sys, gc, json, time
+sys.path.insert(0, os.getcwd())
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        return next(int(l.split()[1]) for l in f if l.startswith("VmRSS:")) / 1024
+
+def payload(i, phone_number_id):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": phone_number_id},
+        "messages": [{"id": f"wamid.t{i}.{time.time_ns()}", "from": "966500000001", "type": "text",
+                      "text": {"body": "hello"}}]}}]}]}
+
+from utils.migrations import upgrade
+upgrade()
+from app import app
+from utils.tenants import tenant_registry, tenant_configs
+client = app.test_client()
+assert client.post("/webhook", json=payload(0, "100")).status_code == 200
+gc.collect()
+base = rss_mb()
+tenants = [t for t in tenant_registry.all() if t.id != "default"]
+start = time.perf_counter()
+for i, tenant in enumerate(tenants, 1):
+    response = client.post("/webhook", json=payload(i, tenant.phone_number_id))
+    assert response.status_code == 200 and response.get_json()["status"] == "onboarding_handled", response.get_json()
+elapsed = time.perf_counter() - start
+gc.collect()
+print("BENCH " + json.dumps({"tenants": len(tenants), "base_mb": base, "rss_mb": rss_mb(),
+                             "ms_per_webhook": elapsed * 1000 / max(len(tenants), 1),
+                             "loaded": len(tenant_configs), "evictions": tenant_configs.evictions}))
+"""
+
+
+def generate(directory, count, faq_entries):
+    """count فولدر tenant (prompt + FAQ خاصين) وملف TENANTS_FILE ليهم."""
+    tenants = []
+    for i in range(count):
+        tenant_id = f"brand{i:04d}"
+        config_dir = os.path.join(directory, tenant_id)
+        os.makedirs(config_dir, exist_ok=True)
+        with open(os.path.join(config_dir, "system_prompt.txt"), "w", encoding="utf-8") as f:
+            f.write(f"You are the assistant of Brand {i}, a clinic chain. Answer briefly and politely. " * 20)
+        faq = {f"topic_{j}": {
+            "keywords_en": [f"brand {i} topic {j}", f"question {j}", f"service {j} price"],
+            "keywords_ar": [f"موضوع {j}", f"سعر خدمة {j}"],
+            "answer_en": f"Brand {i} answer for topic {j}: opening hours, pricing and booking details. " * 3,
+            "answer_ar": f"إجابة البراند {i} للموضوع {j}: المواعيد والأسعار والحجز. " * 3,
+        } for j in range(faq_entries)}
+        with open(os.path.join(config_dir, "faq_data.json"), "w", encoding="utf-8") as f:
+            json.dump(faq, f, ensure_ascii=False)
+        tenants.append({"id": tenant_id, "name": f"Brand {i}", "phone_number_id": str(10_000 + i),
+                        "access_token": f"token-{i}", "config_dir": tenant_id})
+    path = os.path.join(directory, f"tenants_{count}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"tenants": tenants}, f)
+    return path
+
+
+def run(env, tmp_dir, tenants_file, cache_size):
+    db_path = os.path.join(tmp_dir, "bench.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    env = dict(env, TENANTS_FILE=tenants_file, TENANT_CONFIG_CACHE_SIZE=str(cache_size),
+               DATABASE_URL=f"sqlite:///{db_path}")
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True)
+    line = next((l for l in result.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if line is None:
+        raise RuntimeError(result.stderr[-2000:])
+    return json.loads(line[6:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,50,500")
+    parser.add_argument("--cache-size", type=int, default=100, help="TENANT_CONFIG_CACHE_SIZE للقياس بالـ LRU")
+    parser.add_argument("--faq-entries", type=int, default=40, help="أسئلة FAQ لكل tenant")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_tenants_")
+    llm = StubOpenAI(reply="stub").start()
+    graph = FakeGraphAPI().start()
+    env = dict(os.environ,
+               MESSAGE_QUEUE_PATH=os.path.join(tmp_dir, "queue.db"),
+               OPENAI_BASE_URL=f"{llm.base_url}/v1", OPENAI_API_KEY="sk-bench",
+               WHATSAPP_API_BASE_URL=graph.base_url, WHATSAPP_ACCESS_TOKEN="bench", WHATSAPP_PHONE_NUMBER_ID="100",
+               WHATSAPP_RATE_LIMIT_PER_SEC="100000", WEBHOOK_PROCESSING_MODE="inline", WARMUP_ON_START="false",
+               LOG_LEVEL="WARNING")
+
+    print(f"{'tenants':>8} {'config cache':>13} {'loaded':>7} {'evicted':>8} {'base MB':>8} {'RSS MB':>7} "
+          f"{'KB/tenant':>10} {'ms/webhook':>11}")
+    for size in sizes:
+        tenants_file = generate(tmp_dir, size, args.faq_entries)
+        for cache_size in [size + 1] + ([args.cache_size] if args.cache_size < size else []):
+            sent_before = len(graph.messages)
+            r = run(env, tmp_dir, tenants_file, cache_size)
+            per_tenant_kb = (r["rss_mb"] - r["base_mb"]) * 1024 / max(r["tenants"], 1)
+            label = "all" if cache_size > size else f"LRU {cache_size}"
+            # كل tenant لازم يكون رد من الرقم بتاعه
+            senders = set(graph.senders[sent_before:])
+            ok = all(str(10_000 + i) in senders for i in range(size))
+            print(f"{r['tenants']:>8} {label:>13} {r['loaded']:>7} {r['evictions']:>8} {r['base_mb']:>8.1f} "
+                  f"{r['rss_mb']:>7.1f} {per_tenant_kb:>10.1f} {r['ms_per_webhook']:>11.2f}"
+                  + ("" if ok else "  MISSING REPLIES"))
+    llm.stop()
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/eval_reference_retrieval.py
+# تقييم الـ retrieval على reference data من 10KB لحد 50MB: توكنز الـ prompt (الملف كله مقابل top-k)،
+# زمن بناء الـ index، زمن البحث، و recall@k على أسئلة إجابتها معروفة.
+#
+#   python -m benchmarks.eval_reference_retrieval [--sizes 10KB,100KB,1MB,10MB,50MB] [--queries 200] [-k 4]
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.reference_index import ReferenceIndex, tokenize, REFERENCE_TOP_K, REFERENCE_CHUNK_CHARS  # noqa: E402
+from utils.conversation_context import estimate_tokens  # noqa: E402
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_FILE = os.path.join(BASE_DIR, "config_data", "reference_data.txt")
+
+ARABIC_WORDS = ("خدمة تطوير نظام عميل سعر باقة تدريب دعم فني مشروع تحليل بيانات ذكاء اصطناعي تكامل "
+                "منصة تطبيق متجر شركة مدة تنفيذ ضمان صيانة استشارة").split()
+
+
+def _vocabulary():
+    with open(REFERENCE_FILE, encoding="utf-8") as f:
+        words = sorted(set(tokenize(f.read())))
+    return words + ARABIC_WORDS
+
+
+def build_corpus(target_bytes: int, rng: random.Random):
+    """
+    ملف شبه reference_data.txt: أقسام "## ... ##" كل واحد عن منتج ليه كود فريد.
+    يرجع (النص, [(سؤال, الكود)]) عشان نعرف الإجابة الصح لكل سؤال.
+    """
+    vocab = _vocabulary()
+    sections = []
+    facts = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        code = f"prd{i:07d}"
+        arabic = i % 3 == 0
+        lines = [f"## {'منتج' if arabic else 'Product'} {code} ##"]
+        for _ in range(rng.randint(2, 4)):
+            words = rng.choices(vocab, k=rng.randint(15, 30))
+            lines.append("*   " + " ".join(words) + ".")
+        price = rng.randint(1, 90) * 1000
+        lines.append(f"*   {'السعر' if arabic else 'Price'}: {price} SAR for {code}.")
+        section = "\n".join(lines)
+        sections.append(section)
+        facts.append(code)
+        size += len(section.encode("utf-8")) + 2
+        i += 1
+    return "\n\n".join(sections), facts
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    for suffix, factor in (("MB", 1024 * 1024), ("KB", 1024), ("B", 1)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def evaluate(size_label: str, target_bytes: int, queries: int, k: int, rng: random.Random):
+    text, codes = build_corpus(target_bytes, rng)
+    start = time.perf_counter()
+    index = ReferenceIndex(text, max_chars=REFERENCE_CHUNK_CHARS, full_max_chars=0)
+    build_s = time.perf_counter() - start
+
+    # الملف كله بيتبعت في كل prompt (الطريقة القديمة)؛ على 50MB العد التقريبي أسرع من tiktoken
+    full_tokens = estimate_tokens(text) if len(text) < 5_000_000 else len(text) // 3
+
+    latencies = []
+    context_tokens = 0
+    found = 0
+    for _ in range(queries):
+        code = rng.choice(codes)
+        question = rng.choice([f"How much is {code}?", f"كم سعر {code}؟", f"Tell me about product {code} support"])
+        start = time.perf_counter()
+        context = index.context_for(question, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        context_tokens += estimate_tokens(context)
+        found += code in context
+    latencies.sort()
+    avg_context = context_tokens / queries
+    return {
+        "size": size_label,
+        "chunks": len(index.chunks),
+        "build_s": build_s,
+        "full_tokens": full_tokens,
+        "topk_tokens": avg_context,
+        "saved": 1 - avg_context / full_tokens if full_tokens else 0.0,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "recall": found / queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10KB,100KB,1MB,10MB,50MB")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=REFERENCE_TOP_K)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'size':>7} {'chunks':>8} {'build s':>8} {'full tokens':>12} {'top-k tokens':>13} "
+          f"{'saved':>7} {'p50 ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+    for label in args.sizes.split(","):
+        r = evaluate(label, parse_size(label), args.queries, args.k, rng)
+        print(f"{r['size']:>7} {r['chunks']:>8} {r['build_s']:>8.2f} {r['full_tokens']:>12} {r['topk_tokens']:>13.0f} "
+              f"{r['saved']:>7.1%} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['recall']:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+# benchmarks/loadtest.py
+# load test للـ webhook: بيولّد payloads شبه بتاعة WhatsApp Cloud API (أو يعيد تشغيل payloads متسجلة)،
+# ويشغلها على تطبيق Flask جوه نفس الـ process مع OpenAI و Graph API وهميين، ويطلع
+# throughput و p50/p95/p99 و توقيت كل مرحلة وعدد الـ queries لكل رسالة. بيفشل (exit 1) لو عدّى الحدود.
+#
+#   python -m benchmarks.loadtest [--events 500] [--concurrency 8] [--llm-latency 0.3]
+#   python -m benchmarks.loadtest --write-payloads /tmp/payloads.jsonl      # يحفظ الـ payloads المتولدة
+#   python -m benchmarks.loadtest --replay /tmp/payloads.jsonl              # يعيد تشغيل payloads متسجلة
+#   python -m benchmarks.loadtest --thresholds benchmarks/loadtest_thresholds.json --baseline last.json
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_THRESHOLDS = os.path.join(BENCH_DIR, "loadtest_thresholds.json")
+
+QUESTIONS = {
+    "en": ["What are your working hours?", "How much does a chatbot cost?", "Where is your office location?",
+           "Can you integrate with our CRM and WhatsApp?", "I need a demo for my team",
+           "Do you build computer vision systems for retail stores?", "and how long would that take?",
+           "Tell me more about your data analytics services", "thanks!"],
+    "ar": ["ما هي ساعات العمل؟", "بكم سعر روبوت المحادثة؟", "اين انتم؟", "ابغى استشارة لشركتي",
+           "هل تقدمون حلول تحليل البيانات للمتاجر؟", "وكم المدة المتوقعة للتنفيذ؟", "شكرا لكم"],
+}
+ONBOARDING = {
+    "en": ["Hello", "1", "Sara", "Custom chatbot for our clinic"],
+    "ar": ["السلام عليكم", "2", "محمد", "تحليل البيانات"],
+}
+NON_TEXT_TYPES = ("image", "audio", "sticker", "location")
+
+
+# ---------------------- توليد الـ payloads ---------------------- #
+class PayloadGenerator:
+    """
+    بيولّد events (كل event = POST واحد) بخليط: عملاء جداد بيعدّوا على الـ onboarding، وعملاء خلصوه
+    (seed)، عربي وإنجليزي، batches فيها أكتر من رسالة، إعادة إرسال نفس الـ payload، رسايل مش نصية و statuses.
+    """
+
+    def __init__(self, customers=200, completed_ratio=0.7, batch_ratio=0.1, duplicate_ratio=0.05,
+                 non_text_ratio=0.05, status_ratio=0.05, seed=1):
+        self.rng = random.Random(seed)
+        self.batch_ratio = batch_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.non_text_ratio = non_text_ratio
+        self.status_ratio = status_ratio
+        self.customers = []
+        for i in range(customers):
+            lang = "ar" if i % 2 else "en"
+            completed = self.rng.random() < completed_ratio
+            self.customers.append({"phone": f"9665{i:08d}", "lang": lang, "completed": completed, "step": 0})
+        self._ids = 0
+        self._sent = []
+
+    def seed_rows(self):
+        """العملاء اللي المفروض خلصوا الـ onboarding قبل الـ run (بيتكتبوا في الـ DB قبل البداية)."""
+        return [c for c in self.customers if c["completed"]]
+
+    def _next_id(self):
+        self._ids += 1
+        return f"wamid.load{self._ids:09d}"
+
+    def _next_text(self, customer):
+        if not customer["completed"]:
+            script = ONBOARDING[customer["lang"]]
+            text = script[customer["step"]]
+            customer["step"] += 1
+            if customer["step"] == len(script):
+                customer["completed"] = True
+            return text
+        return self.rng.choice(QUESTIONS[customer["lang"]])
+
+    def _message(self, customer):
+        message = {"from": customer["phone"], "id": self._next_id(), "timestamp": str(int(time.time()))}
+        if self.rng.random() < self.non_text_ratio:
+            kind = self.rng.choice(NON_TEXT_TYPES)
+            message.update({"type": kind, kind: {"id": "media-1"}})
+        else:
+            message.update({"type": "text", "text": {"body": self._next_text(customer)}})
+        return message
+
+    def _envelope(self, messages, statuses=None):
+        value = {"messaging_product": "whatsapp",
+                 "metadata": {"display_phone_number": "966500000000", "phone_number_id": "100"}}
+        if messages:
+            value["messages"] = messages
+        if statuses:
+            value["statuses"] = statuses
+        return {"object": "whatsapp_business_account",
+                "entry": [{"id": "WABA", "changes": [{"field": "messages", "value": value}]}]}
+
+    def event(self):
+        if self._sent and self.rng.random() < self.duplicate_ratio:
+            # Meta بتعيد نفس الـ POST لو مردناش بسرعة
+            return self.rng.choice(self._sent)
+        if self.rng.random() < self.status_ratio:
+            status = {"id": self._next_id(), "status": self.rng.choice(["sent", "delivered", "read"]),
+                      "recipient_id": self.rng.choice(self.customers)["phone"]}
+            return self._envelope(None, [status])
+        customer = self.rng.choice(self.customers)
+        messages = [self._message(customer)]
+        if self.rng.random() < self.batch_ratio:
+            for other in self.rng.sample(self.customers, k=min(3, len(self.customers))):
+                if other is not customer:
+                    messages.append(self._message(other))
+        payload = self._envelope(messages)
+        self._sent.append(payload)
+        return payload
+
+    def events(self, count):
+        return [self.event() for _ in range(count)]
+
+
+def load_replay(path):
+    """JSONL: كل سطر body webhook كامل، أو object فيه المفتاح payload/body."""
+    payloads = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and "object" not in record:
+                record = record.get("payload") or record.get("body") or record
+            if isinstance(record, str):
+                record = json.loads(record)
+            if isinstance(record, dict) and record.get("object"):
+                payloads.append(record)
+    return payloads
+
+
+def _primary_phone(payload):
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            for message in (change.get("value") or {}).get("messages") or []:
+                if message.get("from"):
+                    return message["from"]
+    return ""
+
+
+# ---------------------- توقيت المراحل ---------------------- #
+class StageTimer:
+    """بيلف دوال الـ pipeline (في namespace بتاع routes.webhook و utils.message_processor) ويسجل زمن كل نداء باسم المرحلة."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def wrap(self, owner, name, stage=None):
+        original = getattr(owner, name)
+        stage = stage or name
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.samples[stage].append(elapsed)
+
+        setattr(owner, name, timed)
+        self._patched.append((owner, name, original))
+
+    def restore(self):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched.clear()
+
+
+def instrument_pipeline(timer):
+    import routes.webhook as webhook
+    import utils.message_processor as processor
+    from utils.idempotency import message_deduplicator
+    for name, stage in (
+        ("parse_webhook_batch", "parse"),
+        ("add_messages", "db.store_batch"),
+        ("ACTIVE_MESSAGE_SENDER", "whatsapp_send"),
+        ("process_incoming_messages", "process_message"),
+    ):
+        timer.wrap(webhook, name, stage)
+    for name, stage in (
+        ("add_message", "db.store_reply"),
+        ("get_customer", "db.get_customer"),
+        ("add_or_update_customer", "db.upsert_customer"),
+        ("get_static_reply", "faq_match"),
+        ("get_recent_conversation", "db.history"),
+        ("generate_openai_response", "llm"),
+    ):
+        timer.wrap(processor, name, stage)
+    timer.wrap(message_deduplicator, "claim", "dedupe")
+
+
+# ---------------------- التشغيل ---------------------- #
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(payloads, concurrency):
+    from app import app
+    from utils.db import count_queries
+
+    client = app.test_client()
+    latencies = []
+    query_counts = []   # (statements, text messages) لكل request
+    statuses = defaultdict(int)
+    lock = threading.Lock()
+
+    # كل عميل في lane واحد بالترتيب (زي Meta)، والـ lanes بتشتغل بالتوازي
+    lanes = defaultdict(list)
+    for payload in payloads:
+        lanes[zlib.crc32(_primary_phone(payload).encode()) % concurrency].append(payload)
+
+    def drive(lane):
+        for payload in lane:
+            with count_queries() as queries:
+                start = time.perf_counter()
+                response = client.post("/webhook", json=payload)
+                elapsed = time.perf_counter() - start
+            body = response.get_json(silent=True) or {}
+            texts = (body.get("counts") or {}).get("processed", 0)
+            with lock:
+                latencies.append(elapsed)
+                statuses[f"{response.status_code} {body.get('status')}"] += 1
+                if texts:
+                    query_counts.append((queries.count, texts))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(drive, lanes.values()))
+    wall = time.perf_counter() - start
+    return wall, latencies, query_counts, statuses
+
+
+def summarize(wall, latencies, query_counts, statuses, timer, llm_stub, graph_stub):
+    total_messages = sum(texts for _, texts in query_counts)
+    errors = sum(count for key, count in statuses.items() if not key.startswith("200"))
+    return {
+        "requests": len(latencies),
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "error_rate": errors / len(latencies) if latencies else 0.0,
+        "messages_processed": total_messages,
+        "queries_per_message": (sum(q for q, _ in query_counts) / total_messages) if total_messages else 0.0,
+        "max_queries_per_request": max((q for q, _ in query_counts), default=0),
+        "llm_calls": llm_stub.requests,
+        "whatsapp_sends": len(graph_stub.messages),
+        "statuses": dict(statuses),
+        "stages": {
+            stage: {"count": len(samples), "p50_ms": _percentile(samples, 50) * 1000,
+                    "p99_ms": _percentile(samples, 99) * 1000, "total_s": sum(samples)}
+            for stage, samples in sorted(timer.samples.items())
+        },
+    }
+
+
+def print_report(result):
+    print(f"requests={result['requests']} wall={result['wall_s']:.2f}s throughput={result['throughput_rps']:.1f} req/s "
+          f"errors={result['error_rate']:.1%}")
+    print(f"latency p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms p99={result['p99_ms']:.1f}ms")
+    print(f"messages={result['messages_processed']} queries/message={result['queries_per_message']:.2f} "
+          f"max queries/request={result['max_queries_per_request']} llm calls={result['llm_calls']} "
+          f"sends={result['whatsapp_sends']}")
+    print("responses: " + ", ".join(f"{k}={v}" for k, v in sorted(result["statuses"].items())))
+    print(f"{'stage':<20} {'calls':>7} {'p50 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<20} {stats['count']:>7} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['total_s']:>9.2f}")
+
+
+def check_thresholds(result, thresholds, baseline=None):
+    """
+    thresholds: {"max_p99_ms", "max_p95_ms", "min_throughput_rps", "max_error_rate",
+                 "max_queries_per_message", "max_regression"}؛ max_regression نسبة مسموحة مقارنة بالـ baseline.
+    يرجع قائمة المخالفات.
+    """
+    failures = []
+    limits = (
+        ("max_p99_ms", "p99_ms", lambda v, t: v <= t),
+        ("max_p95_ms", "p95_ms", lambda v, t: v <= t),
+        ("max_error_rate", "error_rate", lambda v, t: v <= t),
+        ("max_queries_per_message", "queries_per_message", lambda v, t: v <= t),
+        ("min_throughput_rps", "throughput_rps", lambda v, t: v >= t),
+    )
+    for key, metric, ok in limits:
+        if key in thresholds and not ok(result[metric], thresholds[key]):
+            failures.append(f"{metric}={result[metric]:.2f} violates {key}={thresholds[key]}")
+
+    if baseline and "max_regression" in thresholds:
+        allowed = thresholds["max_regression"]
+        for metric in ("p50_ms", "p99_ms", "queries_per_message"):
+            if baseline.get(metric) and result[metric] > baseline[metric] * (1 + allowed):
+                failures.append(f"{metric} regressed {result[metric]:.2f} vs baseline {baseline[metric]:.2f} "
+                                f"(> {allowed:.0%})")
+        if baseline.get("throughput_rps") and result["throughput_rps"] < baseline["throughput_rps"] * (1 - allowed):
+            failures.append(f"throughput_rps regressed {result['throughput_rps']:.2f} vs baseline "
+                            f"{baseline['throughput_rps']:.2f} (> {allowed:.0%})")
+    return failures
+
+
+def _prepare_environment(args, llm, graph, tmp_dir):
+    os.environ.update({
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'loadtest.db')}",
+        "MESSAGE_QUEUE_PATH": os.path.join(tmp_dir, "queue.db"),
+        "COMPLETION_CACHE_SQLITE_PATH": "",
+        "OPENAI_BASE_URL": f"{llm.base_url}/v1", "OPENAI_API_KEY": "sk-loadtest",
+        "WHATSAPP_API_BASE_URL": graph.base_url, "WHATSAPP_ACCESS_TOKEN": "loadtest",
+        "WHATSAPP_PHONE_NUMBER_ID": "100", "WHATSAPP_RATE_LIMIT_PER_SEC": "100000",
+        "WEBHOOK_PROCESSING_MODE": "inline",
+        # process واحدة: الكاش آمن من غير lock موزع
+        "CUSTOMER_CACHE": "on",
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=500, help="عدد الـ POSTs المتولدة")
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--send-latency", type=float, default=0.02)
+    parser.add_argument("--send-error-rate", type=float, default=0.0)
+    parser.add_argument("--replay", help="JSONL فيه payloads متسجلة بدل التوليد")
+    parser.add_argument("--write-payloads", help="يحفظ الـ payloads المتولدة JSONL عشان تتعاد بعدين")
+    parser.add_argument("--database-url", help="افتراضياً SQLite مؤقت")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--baseline", help="نتيجة run سابقة (JSON) للمقارنة بـ max_regression")
+    parser.add_argument("--output", help="يحفظ النتيجة JSON (تنفع baseline للـ run الجاي)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="loadtest_")
+    llm = StubOpenAI(reply="Thanks for your question! Our team will follow up with the details shortly.",
+                     latency=args.llm_latency, error_rate=args.llm_error_rate).start()
+    graph = FakeGraphAPI(latency=args.send_latency, error_rate=args.send_error_rate).start()
+    _prepare_environment(args, llm, graph, tmp_dir)
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    generator = PayloadGenerator(customers=args.customers, seed=args.seed)
+    if args.replay:
+        payloads = load_replay(args.replay)
+        seeded = []
+    else:
+        seeded = generator.seed_rows()
+        payloads = generator.events(args.events)
+    if args.write_payloads:
+        with open(args.write_payloads, "w", encoding="utf-8") as f:
+            for payload in payloads:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        print(f"Wrote {len(payloads)} payloads to {args.write_payloads}")
+
+    from utils.db import Base, engine, SessionLocal, Customer
+    Base.metadata.create_all(bind=engine)
+    if seeded:
+        with SessionLocal() as db:
+            db.add_all([Customer(phone=c["phone"], name="Load", language=c["lang"], onboarding_step="completed")
+                        for c in seeded])
+            db.commit()
+
+    timer = StageTimer()
+    instrument_pipeline(timer)
+    try:
+        wall, latencies, query_counts, statuses = run(payloads, args.concurrency)
+    finally:
+        timer.restore()
+    result = summarize(wall, latencies, query_counts, statuses, timer, llm, graph)
+    llm.stop()
+    graph.stop()
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    thresholds = {}
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds, encoding="utf-8") as f:
+            thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = check_thresholds(result, thresholds, baseline)
+    if failures:
+        print("FAILED thresholds:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("All thresholds passed.")
+
+
+if __name__ == "__main__":
+    main()
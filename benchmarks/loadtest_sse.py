@@ -0,0 +1,201 @@
+# benchmarks/loadtest_sse.py
+# load test للويب شات: --sessions متصفح فاتحين POST /chat (SSE) في نفس الوقت على OpenAI وهمي بيعمل stream
+# كلمة كلمة (StubOpenAI بـ --llm-latency قبل أول كلمة و --chunk-delay بين الكلمات). السيرفر process لوحده:
+#   flask : Werkzeug threaded (thread لكل stream مفتوح، زي gunicorn gthread)
+#   asgi  : uvicorn asgi:app (كل stream task على event loop واحد)
+# بنقيس الوقت لأول delta (TTFB) والوقت للرد كله، الأخطاء، أقصى streams وصلت OpenAI مع بعض، وأقصى threads/RSS للسيرفر.
+# العميل والـ stub والسيرفر على نفس الجهاز: على core واحد الـ CPU بيخلص قبل الـ concurrency، فاستخدم --ramp عشان
+# تقيس الـ TTFB تحت معدل sessions جديدة ثابت. DB الـ bench هي SQLite (aiosqlite في وضع asgi) مش Postgres.
+#
+#   python -m benchmarks.loadtest_sse [--sessions 500] [--llm-latency 0.3] [--chunk-delay 0.02] [--server both]
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_servers import StubOpenAI, FakeGraphAPI  # noqa: E402
+
+REPLY = ("We build custom WhatsApp and web assistants for clinics, shops and service companies. "
+         "Pricing depends on the scope, the number of integrations and the expected message volume.")
+
+WARMUP_SESSIONS = 30  # قد الـ DB pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) تقريباً
+
+SERVERS = {
+    "flask": [sys.executable, "-c",
+              "import sys, logging; from werkzeug.serving import run_simple; from app import app; "
+              "logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+              "run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--log-level", "warning", "--port"],
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] * 1000 if values else 0.0
+
+
+class ProcessSampler:
+    """أقصى threads و RSS للـ process من /proc كل interval (Linux)."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.max_threads = 0
+        self.max_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with open(f"/proc/{self.pid}/status") as f:
+                    for line in f:
+                        if line.startswith("Threads:"):
+                            self.max_threads = max(self.max_threads, int(line.split()[1]))
+                        elif line.startswith("VmRSS:"):
+                            self.max_rss_mb = max(self.max_rss_mb, int(line.split()[1]) / 1024)
+            except OSError:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def seed(db_url, sessions, prefix):
+    env = dict(os.environ, DATABASE_URL=db_url)
+    code = ("import sys; from utils.db import Base, engine, SessionLocal, Customer; "
+            "Base.metadata.create_all(bind=engine); db = SessionLocal(); "
+            "db.add_all([Customer(phone='web:' + sys.argv[1] + f'{i:08d}', name='Web', language='en', "
+            "onboarding_step='completed') for i in range(int(sys.argv[2]))]); db.commit()")
+    subprocess.run([sys.executable, "-c", code, prefix, str(sessions)], cwd=ROOT, env=env, check=True)
+
+
+def start_server(kind, port, env):
+    process = subprocess.Popen(SERVERS[kind] + [str(port)], cwd=ROOT, env=env)
+    import httpx
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+async def drive(base_url, sessions, prefix, ramp, timeout):
+    """كل session بتفتح stream في ميعادها (موزعين على ramp ثانية) وبتقرا الأحداث لحد done."""
+    import httpx
+    results = []
+    limits = httpx.Limits(max_connections=sessions + 10, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def one(i):
+            await asyncio.sleep(ramp * i / sessions)
+            start = time.perf_counter()
+            first = None
+            outcome = "no_done"
+            try:
+                async with client.stream("POST", "/chat", json={"message": f"tell me about plan zq{i}"},
+                                         headers={"X-Chat-Session": f"{prefix}{i:08d}"}) as response:
+                    if response.status_code != 200:
+                        outcome = f"http_{response.status_code}"
+                        await response.aread()
+                    else:
+                        async for line in response.aiter_lines():
+                            if line == "event: delta" and first is None:
+                                first = time.perf_counter() - start
+                            elif line in ("event: done", "event: error"):
+                                outcome = line[7:]
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            results.append((outcome, first, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(sessions)))
+        return time.perf_counter() - start, results
+
+
+def run(kind, args, llm, graph, tmp_dir):
+    prefix = f"sse{kind}"
+    db_url = f"sqlite:///{os.path.join(tmp_dir, kind + '.db')}"
+    seed(db_url, args.sessions, prefix)
+    seed(db_url, WARMUP_SESSIONS, prefix + "w")
+    port = _free_port()
+    env = dict(os.environ, DATABASE_URL=db_url,
+               OPENAI_BASE_URL=f"{llm.base_url}/v1", OPENAI_API_KEY="sk-bench",
+               WHATSAPP_API_BASE_URL=graph.base_url, WHATSAPP_ACCESS_TOKEN="bench", WHATSAPP_PHONE_NUMBER_ID="100",
+               COMPLETION_CACHE_ENABLED="false", WARMUP_ON_START="false", LOG_LEVEL="WARNING",
+               HISTORY_WRITE_BEHIND=os.getenv("HISTORY_WRITE_BEHIND", "true"),
+               CHAT_MAX_STREAMS=str(args.sessions + 10), LLM_REQUEST_TIMEOUT="60", LLM_DEADLINE_SECONDS="120",
+               MESSAGE_QUEUE_PATH=os.path.join(tmp_dir, kind + "_queue.db"))
+    server = start_server(kind, port, env)
+    try:
+        # جولة تسخين: connections الـ DB و OpenAI بتتفتح هنا مش في أول القياس (زي /readyz في الإنتاج)
+        asyncio.run(drive(f"http://127.0.0.1:{port}", WARMUP_SESSIONS, prefix + "w", 0, args.timeout))
+        llm.max_in_flight = 0
+        with ProcessSampler(server.pid) as sampler:
+            wall, results = asyncio.run(drive(f"http://127.0.0.1:{port}", args.sessions, prefix, args.ramp,
+                                              args.timeout))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    done = [r for r in results if r[0] == "done"]
+    ttfb = [first for _, first, _ in done if first is not None]
+    total = [elapsed for _, _, elapsed in done]
+    errors = {}
+    for outcome, _, _ in results:
+        if outcome != "done":
+            errors[outcome] = errors.get(outcome, 0) + 1
+    print(f"{kind:<7} {len(done):>6}/{len(results):<6} {_percentile(ttfb, 0.5):>9.0f} {_percentile(ttfb, 0.95):>9.0f} "
+          f"{_percentile(ttfb, 0.99):>9.0f} {_percentile(total, 0.5):>10.0f} {_percentile(total, 0.99):>10.0f} "
+          f"{wall:>7.1f} {llm.max_in_flight:>9} {sampler.max_threads:>8} {sampler.max_rss_mb:>7.0f}"
+          + (f"  errors: {errors}" if errors else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=500, help="عدد الـ SSE streams المفتوحة مع بعض")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="ثواني قبل أول كلمة من OpenAI")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="ثواني بين كل كلمة في الـ stream")
+    parser.add_argument("--ramp", type=float, default=0.0, help="توزيع بداية الـ sessions على الثواني دي")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--server", choices=("flask", "asgi", "both"), default="both")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="loadtest_sse_")
+    llm = StubOpenAI(reply=REPLY, latency=args.llm_latency, chunk_delay=args.chunk_delay).start()
+    graph = FakeGraphAPI().start()
+    words = len(REPLY.split())
+    print(f"{args.sessions} concurrent SSE sessions, OpenAI stub {args.llm_latency * 1000:.0f}ms to first token + "
+          f"{words} words x {args.chunk_delay * 1000:.0f}ms")
+    print(f"{'server':<7} {'ok':>13} {'ttfb p50':>9} {'p95':>9} {'p99':>9} {'total p50':>10} {'p99':>10} "
+          f"{'wall s':>7} {'LLM peak':>9} {'threads':>8} {'RSS MB':>7}  (ms)")
+    for kind in (("flask", "asgi") if args.server == "both" else (args.server,)):
+        run(kind, args, llm, graph, tmp_dir)
+    llm.stop()
+    graph.stop()
+
+
+if __name__ == "__main__":
+    main()
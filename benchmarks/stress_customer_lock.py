@@ -0,0 +1,167 @@
+# benchmarks/stress_customer_lock.py
+# stress test لـ utils/customer_lock.py: كذا process (زي gunicorn workers) كل واحدة فيها threads، وكل عميل
+# جديد بيبعت 4 رسايل "1" في نفس اللحظة تقريباً، فبيوصلوا لـ workers مختلفة ومتداخلين مع رسايل عملاء تانيين.
+# لو رسايل العميل اتعالجت واحدة واحدة، الـ 4 رسايل بيعدّوا الـ 4 خطوات بتوع الـ onboarding بالظبط
+# (لغة -> اختيار 1 -> اسم -> الخدمة) مهما كان ترتيبهم، وكل عميل بياخد 4 ردود مختلفة ويوصل completed.
+# لو اتنين اتعالجوا مع بعض بيقروا نفس الخطوة: رد مكرر وعميل مبيوصلش completed.
+#
+#   python -m benchmarks.stress_customer_lock [--phones 200] [--processes 4] [--threads 8]
+#       [--modes none,local,file] [--database-url postgresql://...  (بيضيف advisory)]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing as mp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_servers import FakeGraphAPI  # noqa: E402
+
+MESSAGES_PER_PHONE = 4  # عدد خطوات الـ onboarding في config_data/onboarding.json
+
+
+def _payload(phone, message_id):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+        {"id": message_id, "from": phone, "type": "text", "text": {"body": "1"}}
+    ]}}]}]}
+
+
+def setup_schema(env):
+    os.environ.update(env)
+    from utils.migrations import upgrade
+    upgrade()
+
+
+def worker_process(env, threads, tasks, results, ready, go):
+    os.environ.update(env)
+    import threading
+    from app import app
+    client = app.test_client()
+    ready.put(os.getpid())
+    go.wait()
+
+    status = {"ok": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            phone, message_id = task
+            code = client.post("/webhook", json=_payload(phone, message_id)).status_code
+            with lock:
+                status["ok" if code == 200 else "errors"] += 1
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    from utils.customer_lock import customer_locks
+    results.put((status["ok"], status["errors"], customer_locks.local.stats()))
+
+
+def check(database_url, phones):
+    """يرجع (عملاء موصلوش completed، عملاء خدوا رد مكرر)."""
+    from sqlalchemy import create_engine, text
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        steps = dict(conn.execute(text("SELECT phone, onboarding_step FROM customers")).all())
+        replies = {}
+        for phone, message in conn.execute(
+                text("SELECT phone, message FROM conversation_history WHERE sender = 'assistant'")):
+            replies.setdefault(phone, []).append(message)
+    engine.dispose()
+    not_completed = sum(1 for p in phones if steps.get(p) != "completed")
+    duplicated = sum(1 for p in phones if len(set(replies.get(p, []))) != len(replies.get(p, [])))
+    return not_completed, duplicated
+
+
+def run_mode(mode, args, graph, ctx):
+    tmp_dir = tempfile.mkdtemp(prefix=f"stress_lock_{mode}_")
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'stress.db')}"
+    prefix = f"9{random.randint(10 ** 6, 10 ** 7 - 1)}"
+    phones = [f"{prefix}{i:05d}" for i in range(args.phones)]
+    env = {
+        "DATABASE_URL": database_url, "CUSTOMER_LOCK_BACKEND": mode,
+        "CUSTOMER_LOCK_DIR": os.path.join(tmp_dir, "locks"),
+        "MESSAGE_QUEUE_PATH": os.path.join(tmp_dir, "queue.db"), "WEBHOOK_PROCESSING_MODE": "inline",
+        "WHATSAPP_API_BASE_URL": graph.base_url, "WHATSAPP_ACCESS_TOKEN": "stress",
+        "WHATSAPP_PHONE_NUMBER_ID": "100", "WHATSAPP_RATE_LIMIT_PER_SEC": "100000",
+        "OPENAI_API_KEY": "sk-stress", "WARMUP_ON_START": "false", "LOG_LEVEL": "ERROR",
+    }
+    setup = ctx.Process(target=setup_schema, args=(env,))
+    setup.start()
+    setup.join()
+
+    tasks, results, ready, go = ctx.Queue(), ctx.Queue(), ctx.Queue(), ctx.Event()
+    procs = [ctx.Process(target=worker_process, args=(env, args.threads, tasks, results, ready, go))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.get(timeout=120)
+
+    # رسايل كل مجموعة صغيرة من العملاء متلخبطة مع بعض، والمجموعات ورا بعض
+    window = max(1, args.processes * args.threads // MESSAGES_PER_PHONE)
+    for start in range(0, len(phones), window):
+        batch = [(phone, f"wamid.{phone}.{n}") for phone in phones[start:start + window]
+                 for n in range(MESSAGES_PER_PHONE)]
+        random.shuffle(batch)
+        for task in batch:
+            tasks.put(task)
+    for _ in range(args.processes * args.threads):
+        tasks.put(None)
+
+    started = time.perf_counter()
+    go.set()
+    ok = errors = 0
+    leaked = 0
+    for _ in procs:
+        p_ok, p_errors, (held, waiting) = results.get()
+        ok, errors, leaked = ok + p_ok, errors + p_errors, leaked + held + waiting
+    elapsed = time.perf_counter() - started
+    for p in procs:
+        p.join()
+
+    not_completed, duplicated = check(database_url, phones)
+    print(f"{mode:<10} {ok / elapsed:>8.0f} {errors:>7} {not_completed:>14} {duplicated:>15} {leaked:>7}")
+    return not_completed + duplicated + errors + leaked
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--phones", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--modes", default="none,local,file")
+    parser.add_argument("--database-url", default=None, help="PostgreSQL مشترك (الـ advisory mode بيتضاف)")
+    parser.add_argument("--graph-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    modes = args.modes.split(",")
+    if args.database_url and args.database_url.startswith("postgres") and "advisory" not in modes:
+        modes.append("advisory")
+
+    graph = FakeGraphAPI(latency=args.graph_latency).start()
+    ctx = mp.get_context("spawn")
+    print(f"{args.phones} new customers x {MESSAGES_PER_PHONE} messages, "
+          f"{args.processes} processes x {args.threads} threads")
+    print(f"{'lock':<10} {'msg/s':>8} {'errors':>7} {'not completed':>14} {'duplicate reply':>15} {'leaked':>7}")
+    failures = {}
+    for mode in modes:
+        failures[mode] = run_mode(mode, args, graph, ctx)
+    graph.stop()
+    # بدون lock بين الـ processes (none / local) المشاكل متوقعة؛ الـ distributed لازم يبقى نضيف
+    broken = [m for m in modes if m in ("file", "advisory") and failures[m]]
+    if broken:
+        print(f"FAILED: {', '.join(broken)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/stub_servers.py
+# سيرفرات وهمية محلية للـ benchmarks والتجارب: Graph API بتاع واتساب و API متوافق مع OpenAI.
+#
+#   WHATSAPP_API_BASE_URL=http://127.0.0.1:<port>  عشان send_meta يكلمها بدل graph.facebook.com
+#   OPENAI_BASE_URL=http://127.0.0.1:<port>/v1      عشان مكتبة openai تكلم StubOpenAI
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # الـ backlog الافتراضي 5 بس، ومع مئات الـ connections مع بعض (loadtest_sse) الـ SYNs بتتعاد بعد ثانية
+    request_queue_size = 1024
+
+
+class _StubServer:
+    """أساس مشترك: ThreadingHTTPServer في thread منفصل على port عشوائي."""
+
+    handler_class = None
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        handler = type("Handler", (self.handler_class,), {"stub": self})
+        self.httpd = _HTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive عشان نقيس الـ connection pooling بجد
+    disable_nagle_algorithm = True  # من غيره الـ headers والـ body بيتأخروا ~40ms (Nagle + delayed ACK)
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _GraphHandler(_QuietHandler):
+    def do_POST(self):
+        stub = self.stub
+        payload = self._read_json()
+        if stub.latency:
+            time.sleep(stub.latency)
+        with stub.lock:
+            stub.requests += 1
+            stub.connections.add(self.client_address)
+            fail = stub.fail_next > 0 or random.random() < stub.error_rate
+            if stub.fail_next > 0:
+                stub.fail_next -= 1
+        if fail:
+            self._send_json(stub.error_status, {"error": {"message": "stub failure", "code": 4}},
+                            {"Retry-After": str(stub.retry_after)} if stub.error_status == 429 else None)
+            return
+        with stub.lock:
+            stub.messages.append(payload)
+            stub.senders.append(self.path.strip("/").split("/")[1] if self.path.count("/") >= 3 else None)
+            stub.received_at.append(time.perf_counter())
+            message_id = f"wamid.stub{len(stub.messages)}"
+        self._send_json(200, {"messaging_product": "whatsapp",
+                              "contacts": [{"wa_id": payload.get("to")}],
+                              "messages": [{"id": message_id}]})
+
+
+class FakeGraphAPI(_StubServer):
+    """
+    Graph API وهمي: بيقبل POST /<version>/<phone_number_id>/messages ويسجل الـ payloads.
+
+    latency: تأخير كل request بالثواني، error_rate: نسبة الردود الفاشلة،
+    fail_next: عدد الطلبات الجاية اللي هتفشل بـ error_status (429 بيبعت Retry-After).
+    """
+
+    handler_class = _GraphHandler
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 retry_after: float = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages = []
+        self.received_at = []  # perf_counter وقت استلام كل رسالة في messages
+        self.senders = []      # الـ phone_number_id من الـ URL لكل رسالة في messages
+        self.connections = set()
+
+
+class _OpenAIHandler(_QuietHandler):
+    def do_POST(self):
+        stub = self.stub
+        with stub.lock:
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        try:
+            self._handle()
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+    def _handle(self):
+        stub = self.stub
+        request = self._read_json()
+        with stub.lock:
+            stub.requests += 1
+            stub.payloads.append(request)
+            fail = stub.fail_next > 0 or random.random() < stub.error_rate
+            if stub.fail_next > 0:
+                stub.fail_next -= 1
+        if stub.latency:
+            time.sleep(stub.latency)
+        if fail:
+            headers = {"Retry-After": str(stub.retry_after)} if stub.error_status == 429 else None
+            self._send_json(stub.error_status, {"error": {"message": "stub failure", "type": "server_error"}}, headers)
+            return
+        text = stub.reply_for(request)
+        if request.get("stream"):
+            self._send_stream(text)
+            return
+        self._send_json(200, {
+            "id": f"chatcmpl-stub{stub.requests}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": stub.usage(request, text),
+        })
+
+    def _send_stream(self, text):
+        stub = self.stub
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = text.split(" ")
+        try:
+            for i, word in enumerate(words):
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": "stub",
+                         "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                      "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                if stub.chunk_delay:
+                    time.sleep(stub.chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # الـ gateway قفل الـ stream بدري (العميل قفل الصفحة)
+            with stub.lock:
+                stub.streams_closed_early += 1
+
+
+class StubOpenAI(_StubServer):
+    """
+    POST /v1/chat/completions وهمي (عادي و stream=true بـ SSE) عشان نجرب الـ LLM gateway من غير OpenAI.
+
+    latency: تأخير قبل أول byte، chunk_delay: تأخير بين كل كلمة في الـ stream،
+    error_rate / fail_next / error_status زي FakeGraphAPI (429 بيبعت Retry-After).
+    """
+
+    handler_class = _OpenAIHandler
+
+    def __init__(self, reply: str = "This is a stub reply from the local OpenAI server.", latency: float = 0.0,
+                 chunk_delay: float = 0.0, error_rate: float = 0.0, error_status: int = 500,
+                 retry_after: float = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.payloads = []
+        self.in_flight = 0
+        self.max_in_flight = 0  # أقصى عدد طلبات متزامنة وصلت للسيرفر
+        self.streams_closed_early = 0
+
+    def reply_for(self, request: dict) -> str:
+        return self.reply
+
+    @staticmethod
+    def usage(request: dict, text: str) -> dict:
+        prompt = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        completion = len(text) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
@@ -0,0 +1,144 @@
+from flask import Blueprint, Response, request, jsonify, render_template
+import os
+import re
+import json
+import time
+import uuid
+import threading
+
+from utils.helpers import get_reply_from_json
+from utils.message_processor import stream_message, astream_message
+from utils.metrics import STAGE_DURATION, registry
+from utils.logging_setup import log_context
+
+chat_bp = Blueprint('chat_bp', __name__)
+# الويب شات (templates/index.html): POST /chat بيرجع الرد حتة حتة كـ Server-Sent Events.
+# كل متصفح ليه session (cookie) وبيتعامل كعميل رقمه "web:<session>" في نفس الـ pipeline بتاع واتساب.
+CHAT_SESSION_COOKIE = os.getenv("CHAT_SESSION_COOKIE", "chat_session")
+CHAT_SESSION_MAX_AGE = int(os.getenv("CHAT_SESSION_MAX_AGE", 30 * 24 * 3600))  # ثواني
+CHAT_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_MAX_MESSAGE_CHARS", 2000))
+# أقصى عدد streams مفتوحة في نفس الوقت في الـ process؛ اللي بعد كده بياخد 503 بدل ما يستنى
+CHAT_MAX_STREAMS = int(os.getenv("CHAT_MAX_STREAMS", 1000))
+WEB_USER_PREFIX = "web:"
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # nginx ميعملش buffer للـ stream
+}
+
+
+class StreamSlots:
+    """عداد الـ streams المفتوحة (thread-safe) عشان CHAT_MAX_STREAMS ومتريك chat_open_streams."""
+
+    def __init__(self, limit: int = CHAT_MAX_STREAMS):
+        self.limit = limit
+        self.open = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.open >= self.limit:
+                return False
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+
+chat_streams = StreamSlots()
+
+
+def _chat_streams_collector():
+    return [("chat_open_streams", "gauge", "Web chat SSE streams currently open.", [({}, chat_streams.open)])]
+
+
+registry.register_collector(_chat_streams_collector)
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _event_data(kind, value):
+    return {"text": value} if kind in ("delta", "error") else {"status": value}
+
+
+def parse_chat_request(data, session_id):
+    """
+    الجزء المشترك بين Flask والـ ASGI. يرجع (user_id, message, session_id, None) أو
+    (None, None, None, (body, status)) لو الطلب مرفوض. session جديدة لو مفيش واحدة صالحة.
+    """
+    message = data.get("message") if isinstance(data, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return None, None, None, ({"reply": get_reply_from_json("error_occurred_generic", "ar")}, 400)
+    message = message.strip()[:CHAT_MAX_MESSAGE_CHARS]
+    if not session_id or not _SESSION_ID.match(session_id):
+        session_id = uuid.uuid4().hex
+    return WEB_USER_PREFIX + session_id, message, session_id, None
+
+
+def session_cookie(session_id: str) -> str:
+    return (f"{CHAT_SESSION_COOKIE}={session_id}; Max-Age={CHAT_SESSION_MAX_AGE}; Path=/; HttpOnly; "
+            "SameSite=Lax")
+
+
+def busy_response():
+    return {"reply": get_reply_from_json("ai_unavailable", "ar")}, 503
+
+
+def iter_sse(user_id, message):
+    """أحداث الـ SSE (bytes) لرسالة: delta لكل حتة، وفي الآخر done أو error."""
+    start = time.perf_counter()
+    first = True
+    for kind, value in stream_message(user_id, message):
+        if first:
+            STAGE_DURATION.observe(time.perf_counter() - start, "chat_first_event")
+            first = False
+        yield sse_event(kind, _event_data(kind, value))
+    STAGE_DURATION.observe(time.perf_counter() - start, "chat")
+
+
+async def aiter_sse(user_id, message):
+    """نسخة async من iter_sse (asgi.py): الـ stream مش بيحجز thread وهو مستني OpenAI."""
+    start = time.perf_counter()
+    first = True
+    async for kind, value in astream_message(user_id, message):
+        if first:
+            STAGE_DURATION.observe(time.perf_counter() - start, "chat_first_event")
+            first = False
+        yield sse_event(kind, _event_data(kind, value))
+    STAGE_DURATION.observe(time.perf_counter() - start, "chat")
+
+
+@chat_bp.route('/', methods=['GET'])
+def index():
+    return render_template('index.html')
+
+
+@chat_bp.route('/chat', methods=['POST'])
+def chat_handler():
+    session_id = request.headers.get('X-Chat-Session') or request.cookies.get(CHAT_SESSION_COOKIE)
+    user_id, message, session_id, error = parse_chat_request(request.get_json(silent=True), session_id)
+    if error:
+        return jsonify(error[0]), error[1]
+    if not chat_streams.acquire():
+        body, status = busy_response()
+        return jsonify(body), status
+
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+
+    def events():
+        # الـ generator بيشتغل بعد ما الـ view يرجع، فالـ log context بيتعمل جواه
+        with log_context(request_id=request_id):
+            yield from iter_sse(user_id, message)
+
+    response = Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.headers['Set-Cookie'] = session_cookie(session_id)
+    # release مع قفل الـ response حتى لو العميل قفل قبل ما الـ generator يبدأ
+    response.call_on_close(chat_streams.release)
+    return response
@@ -0,0 +1,33 @@
+from flask import Blueprint, Response, request, stream_with_context
+import os
+import hmac
+from datetime import datetime
+
+from utils.export import EXPORTERS, iter_ndjson
+
+export_bp = Blueprint('export_bp', __name__)
+# الـ export فيه أرقام ورسايل العملاء، فمقفول لحد ما EXPORT_TOKEN يتظبط (Authorization: Bearer <token>)
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+
+@export_bp.route('/export/<table>.ndjson', methods=['GET'])
+def export_handler(table):
+    if not EXPORT_TOKEN or not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {EXPORT_TOKEN}"):
+        return 'Forbidden', 403
+    if table not in EXPORTERS:
+        return 'Not Found', 404
+
+    filters = {"phone": request.args.get('phone'), "tenant": request.args.get('tenant')}
+    try:
+        if table == 'history':
+            since_id = request.args.get('since_id')
+            since = request.args.get('since')
+            filters['since_id'] = int(since_id) if since_id else None
+            filters['since'] = datetime.fromisoformat(since) if since else None
+    except ValueError as e:
+        return f'Bad Request: {e}', 400
+
+    # الصفوف بتتقرا وتتبعت batch ورا batch (chunked)، ومضغوطة لو الـ client بيقبل gzip
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    body = iter_ndjson(EXPORTERS[table](**filters), gzip=use_gzip)
+    headers = {'Content-Encoding': 'gzip'} if use_gzip else {}
+    return Response(stream_with_context(body), mimetype='application/x-ndjson', headers=headers)
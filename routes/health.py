@@ -0,0 +1,16 @@
+from flask import Blueprint, jsonify
+
+from utils.warmup import warmup
+
+health_bp = Blueprint('health_bp', __name__)
+
+# liveness: الـ process شغال (مش بيلمس DB ولا OpenAI)
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'}), 200
+
+# readiness: 503 لحد ما الـ warm-up يخلص (config + DB + clients) أو لو الـ DB مش متاحة
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    ready, details = warmup.readiness()
+    return jsonify(details), 200 if ready else 503
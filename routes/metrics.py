@@ -0,0 +1,14 @@
+from flask import Blueprint, Response, request
+import os
+
+from utils.metrics import registry
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+# لو متظبط، الـ scraper لازم يبعت Authorization: Bearer <token>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics_handler():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return 'Forbidden', 403
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,181 +1,382 @@
-from flask import Blueprint, request, jsonify, current_app
-import os
-import json
-import logging
-
-from utils.db_helpers import (
-    add_or_update_customer,
-    get_customer,
-    add_message,
-    get_conversation,
-)
-from utils.helpers import (
-    detect_language,
-    get_user_language,
-    get_reply_from_json,
-    get_static_reply,
-)
-from utils.openai_logic import generate_openai_response
-
-# ارسال رسالة واتساب
-try:
-    from utils.send_meta import send_whatsapp_message_real
-    ACTIVE_MESSAGE_SENDER = send_whatsapp_message_real
-except ImportError:
-    def mock_send_whatsapp_message(to_phone_number: str, message_text: str):
-        logger = current_app.logger if current_app else logging.getLogger(__name__)
-        logger.info(f"MOCK SEND (Real function not imported) to {to_phone_number}: '{message_text}'")
-    ACTIVE_MESSAGE_SENDER = mock_send_whatsapp_message
-
-webhook_bp = Blueprint('webhook_bp', __name__)
-VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "your_default_verify_token_if_not_set")
-
-# ---------------------- دالة الـ onboarding الكاملة --------------------- #
-def handle_onboarding(phone, msg_body, user_data):
-    onboarding_step = user_data.onboarding_step if user_data and user_data.onboarding_step else "awaiting_language"
-    current_lang = user_data.language if user_data and user_data.language else None
-
-    # ---- (1) أول رسالة - كشف اللغة والترحيب والاختيار ---- #
-    if onboarding_step == "awaiting_language" or not current_lang:
-        detected_lang = detect_language(msg_body)
-        add_or_update_customer(phone, language=detected_lang, onboarding_step="awaiting_language_selection")
-        # كل رسالة من replies.json
-        welcome = get_reply_from_json("welcome_najdaigent", detected_lang)
-        return welcome
-
-    # ---- (2) العميل يختار اللغة ---- #
-    elif onboarding_step == "awaiting_language_selection":
-        if msg_body.strip() == "1" or "english" in msg_body.lower():
-            current_lang = "en"
-            add_or_update_customer(phone, language=current_lang, onboarding_step="awaiting_name")
-            confirm_lang = get_reply_from_json("language_selected", current_lang)
-            ask_name = get_reply_from_json("ask_name", current_lang)
-            return f"{confirm_lang}\n\n{ask_name}"
-        elif msg_body.strip() == "2" or "عربية" in msg_body or "arabic" in msg_body.lower():
-            current_lang = "ar"
-            add_or_update_customer(phone, language=current_lang, onboarding_step="awaiting_name")
-            confirm_lang = get_reply_from_json("language_selected", current_lang)
-            ask_name = get_reply_from_json("ask_name", current_lang)
-            return f"{confirm_lang}\n\n{ask_name}"
-        else:
-            reply = get_reply_from_json("invalid_language_choice", current_lang or "en")
-            welcome_again = get_reply_from_json("welcome_najdaigent", current_lang or "en")
-            return f"{reply}\n\n{welcome_again}"
-
-    # ---- (3) العميل يكتب اسمه ---- #
-    elif onboarding_step == "awaiting_name":
-        user_name = msg_body.strip()
-        add_or_update_customer(phone, name=user_name, onboarding_step="awaiting_service_interest")
-        current_lang = get_user_language(phone)
-        reply = get_reply_from_json("ask_service_interest", current_lang, name=user_name)
-        return reply
-
-    # ---- (4) العميل يختار الخدمة ---- #
-    elif onboarding_step == "awaiting_service_interest":
-        service_interest = msg_body.strip()
-        add_or_update_customer(phone, service_interest=service_interest, onboarding_step="completed")
-        current_lang = get_user_language(phone)
-        user_obj = get_customer(phone)
-        user_name = user_obj.name if user_obj and user_obj.name else get_reply_from_json("default_username", current_lang)
-        reply = get_reply_from_json("onboarding_complete", current_lang, name=user_name)
-        return reply
-
-    else:
-        # خطوة احتياطية لو فيه حاجة مش متوقعة
-        return get_reply_from_json("error_occurred_generic", current_lang or "en")
-
-# -------------------- نقطة الدخول للويب هوك -------------------- #
-@webhook_bp.route('/webhook', methods=['GET', 'POST'])
-def webhook_handler():
-    logger = current_app.logger
-
-    if request.method == 'GET':
-        if request.args.get('hub.mode') == 'subscribe' and request.args.get('hub.verify_token') == VERIFY_TOKEN:
-            logger.info("Webhook GET verification successful.")
-            return request.args.get('hub.challenge'), 200
-        else:
-            logger.warning(f"Webhook GET verification failed. Token received: {request.args.get('hub.verify_token')}")
-            return 'Forbidden', 403
-
-    if request.method == 'POST':
-        data = request.get_json()
-        logger.info(f"Received webhook data: {json.dumps(data, indent=2, ensure_ascii=False)}")
-
-        if data and data.get('object') == 'whatsapp_business_account':
-            try:
-                entry = data.get('entry', [{}])[0]
-                changes = entry.get('changes', [{}])[0]
-                value = changes.get('value', {})
-
-                if 'messages' not in value:
-                    logger.info("No 'messages' field in webhook data. Skipping.")
-                    return jsonify({'status': 'no_message_field'}), 200
-
-                message_object = value.get('messages', [{}])[0]
-                if message_object.get('type') != 'text':
-                    msg_type = message_object.get('type', 'unknown')
-                    logger.info(f"Received non-text message type: {msg_type}")
-                    return jsonify({'status': 'ignored_non_text_message'}), 200
-
-                from_user_id = message_object.get('from')
-                msg_body = message_object.get('text', {}).get('body', '').strip()
-                if not from_user_id or not msg_body:
-                    logger.warning("Missing 'from' or 'msg_body' in message object.")
-                    return jsonify({'status': 'missing_data_in_message'}), 400
-
-                logger.info(f"Processing message from {from_user_id}: '{msg_body}'")
-                add_message(from_user_id, "user", msg_body)
-
-                # --- استرجاع بيانات العميل ---
-                user_data = get_customer(from_user_id)
-                onboarding_step = user_data.onboarding_step if user_data and user_data.onboarding_step else "awaiting_language"
-
-                # --- التعامل مع تغيير اللغة في أي وقت ---
-                if msg_body.strip() in ["تغيير اللغة", "change language"]:
-                    add_or_update_customer(from_user_id, onboarding_step="awaiting_language_selection")
-                    msg = get_reply_from_json("language_change_prompt", get_user_language(from_user_id))
-                    ACTIVE_MESSAGE_SENDER(from_user_id, msg)
-                    add_message(from_user_id, "assistant", msg)
-                    return jsonify({'status': 'language_switch'}), 200
-
-                # --- العميل في خطوات الـ onboarding ---
-                if onboarding_step != "completed":
-                    reply = handle_onboarding(from_user_id, msg_body, user_data)
-                    ACTIVE_MESSAGE_SENDER(from_user_id, reply)
-                    add_message(from_user_id, "assistant", reply)
-                    logger.info(f"Onboarding step '{onboarding_step}' processed for user {from_user_id}.")
-                    return jsonify({'status': 'onboarding_handled'}), 200
-
-                # -------- الردود بعد الانتهاء من الـ onboarding -------- #
-                current_lang = user_data.language if user_data and user_data.language else "en"
-                static_answer = get_static_reply(msg_body, current_lang)
-
-                if static_answer:
-                    reply = static_answer + get_reply_from_json("signature_static", current_lang)
-                else:
-                    conversation_hist = get_conversation(from_user_id)
-                    ai_response = generate_openai_response(from_user_id, msg_body, current_lang, conversation_hist)
-                    reply = ai_response + get_reply_from_json("signature_openai", current_lang)
-
-                ACTIVE_MESSAGE_SENDER(from_user_id, reply)
-                add_message(from_user_id, "assistant", reply)
-                logger.info(f"Regular reply sent to user {from_user_id}.")
-                return jsonify({'status': 'reply_sent'}), 200
-
-            except Exception as e:
-                logger.error(f"Unhandled error processing webhook POST data: {e}", exc_info=True)
-                try:
-                    error_lang = 'en'
-                    if 'from_user_id' in locals() and from_user_id:
-                        user_lang_data = get_customer(from_user_id)
-                        if user_lang_data and user_lang_data.language:
-                            error_lang = user_lang_data.language
-                    error_msg = get_reply_from_json("error_occurred_generic", error_lang)
-                    if 'from_user_id' in locals() and from_user_id and error_msg:
-                        ACTIVE_MESSAGE_SENDER(from_user_id, error_msg)
-                except Exception as e_send:
-                    logger.error(f"Failed to send generic error message to user after an exception: {e_send}", exc_info=True)
-                return jsonify({'status': 'error', 'message': str(e)}), 500
-
-        logger.info("Webhook POST received, but not a recognized WhatsApp business account message or no data.")
-        return jsonify({'status': 'received_ok_not_processed'}), 200
+from flask import Blueprint, request, jsonify, current_app, has_app_context
+import os
+import uuid
+import asyncio
+import logging
+
+from utils.db_helpers import add_messages, aadd_messages
+from utils.llm_gateway import iter_segments, aiter_segments
+from utils.message_queue import PersistentMessageQueue, MessageWorkerPool
+from utils.webhook_parser import parse_webhook_batch
+from utils.idempotency import message_deduplicator
+from utils.metrics import timed, slow_request_profiler
+from utils.logging_setup import log_context, log_payload, body_for_log
+from utils.tenants import DEFAULT_TENANT_ID, tenant_registry, tenant_context
+from utils import message_processor
+from utils.message_processor import Channel
+
+# ارسال رسالة واتساب
+try:
+    from utils.send_meta import send_whatsapp_message_real
+    from utils.send_meta import asend_whatsapp_message_real
+    ACTIVE_MESSAGE_SENDER = send_whatsapp_message_real
+    ACTIVE_ASYNC_MESSAGE_SENDER = asend_whatsapp_message_real
+except ImportError:
+    def mock_send_whatsapp_message(to_phone_number: str, message_text: str):
+        logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+        logger.info(f"MOCK SEND (Real function not imported) to {to_phone_number}: '{body_for_log(message_text)}'")
+    async def amock_send_whatsapp_message(to_phone_number: str, message_text: str):
+        mock_send_whatsapp_message(to_phone_number, message_text)
+    ACTIVE_MESSAGE_SENDER = mock_send_whatsapp_message
+    ACTIVE_ASYNC_MESSAGE_SENDER = amock_send_whatsapp_message
+
+webhook_bp = Blueprint('webhook_bp', __name__)
+VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "your_default_verify_token_if_not_set")
+# inline: نعالج الرسالة جوه الـ request زي الأول | queue: نحطها في الطابور ونرد 200 فوراً
+WEBHOOK_PROCESSING_MODE = os.getenv("WEBHOOK_PROCESSING_MODE", "inline").lower()
+# true: رد OpenAI بيتبعت على أجزاء (جملة/فقرة) أول ما كل جزء يخلص بدل ما نستنى الرد كله
+LLM_STREAM_REPLIES = os.getenv("LLM_STREAM_REPLIES", "false").lower() == "true"
+LLM_STREAM_SEGMENT_CHARS = int(os.getenv("LLM_STREAM_SEGMENT_CHARS", 200))
+
+# -------------------- قناة واتساب -------------------- #
+def _get_logger():
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+class WhatsAppChannel(Channel):
+    """
+    الردود بتتبعت بـ ACTIVE_MESSAGE_SENDER (بيتقرا وقت الإرسال عشان يتبدل في التجارب). مع LLM_STREAM_REPLIES
+    رد OpenAI بيتبعت على أجزاء (جملة/فقرة) أول ما كل جزء يخلص، والرد كله بيتسجل في التاريخ مرة واحدة.
+    """
+
+    name = "whatsapp"
+
+    @property
+    def stream_llm(self):
+        return LLM_STREAM_REPLIES
+
+    def send(self, user_id, text):
+        ACTIVE_MESSAGE_SENDER(user_id, text)
+
+    async def asend(self, user_id, text):
+        await ACTIVE_ASYNC_MESSAGE_SENDER(user_id, text)
+
+    def deliver(self, user_id, reply):
+        if reply.deltas is None:
+            return super().deliver(user_id, reply)
+        # كل جزء بيتبعت لما اللي بعده يبدأ، عشان التوقيع يتلزق في آخر جزء
+        sent = []
+        pending = None
+        for segment in iter_segments(reply.deltas, LLM_STREAM_SEGMENT_CHARS):
+            if pending is not None:
+                self.send(user_id, pending)
+                sent.append(pending)
+            pending = segment
+        last = (pending or "") + reply.suffix
+        self.send(user_id, last)
+        sent.append(last)
+        _get_logger().info(f"Streamed reply sent to user {user_id} in {len(sent)} part(s).")
+        return "\n\n".join(sent)
+
+    async def adeliver(self, user_id, reply):
+        if reply.deltas is None:
+            return await super().adeliver(user_id, reply)
+        sent = []
+        pending = None
+        async for segment in aiter_segments(reply.deltas, LLM_STREAM_SEGMENT_CHARS):
+            if pending is not None:
+                await self.asend(user_id, pending)
+                sent.append(pending)
+            pending = segment
+        last = (pending or "") + reply.suffix
+        await self.asend(user_id, last)
+        sent.append(last)
+        _get_logger().info(f"Streamed reply sent to user {user_id} in {len(sent)} part(s).")
+        return "\n\n".join(sent)
+
+whatsapp_channel = WhatsAppChannel()
+
+# -------------------- معالجة رسالة واحدة (inline أو من الطابور) -------------------- #
+def process_incoming_message(from_user_id, msg_body, store_incoming=True):
+    """يعالج رسالة نصية واحدة من العميل ويرجع الـ status اللي حصل.
+
+    store_incoming=False لو رسالة العميل اتسجلت قبل كده (مع باقي الـ batch).
+    """
+    return process_incoming_messages(from_user_id, [msg_body], store_incoming)[0]
+
+def process_incoming_messages(from_user_id, bodies, store_incoming=True, debounce=True):
+    """رسايل متتالية من نفس الرقم على قناة واتساب (utils/message_processor.process_messages)."""
+    return message_processor.process_messages(whatsapp_channel, from_user_id, bodies, store_incoming, debounce)
+
+def process_queued_message(payload):
+    """الـ handler اللي بيناديه الـ worker لكل رسالة طالعة من الطابور."""
+    return process_queued_burst([payload])[0]
+
+def process_queued_burst(payloads):
+    """الـ handler لما MESSAGE_BURST_WINDOW_MS شغال: رسايل العميل اللي استنت الـ window في الطابور مع بعض."""
+    with tenant_context(tenant_registry.get(payloads[0].get("tenant_id"))), \
+            log_context(message_id=payloads[0].get("id")):
+        # رسايل العميل بتتسجل الأول، و stored بيتحفظ مع الـ payload لو المعالجة فشلت (PersistentMessageQueue.fail)
+        # فالمحاولة الجاية أو إعادة الإرسال من Meta (message_deduplicator.claim) مش بتسجلها تاني
+        unstored = [p for p in payloads if not p.get("stored")]
+        if unstored:
+            add_messages([(p["from"], "user", p["body"]) for p in unstored])
+            for p in unstored:
+                p["stored"] = True
+        return process_incoming_messages(payloads[0]["from"], [p["body"] for p in payloads],
+                                         store_incoming=False, debounce=False)
+
+# -------------------- طابور المعالجة في الخلفية -------------------- #
+_message_queue = None
+_worker_pool = None
+
+def get_message_queue():
+    global _message_queue
+    if _message_queue is None:
+        _message_queue = PersistentMessageQueue()
+    return _message_queue
+
+def start_message_workers():
+    """يشغل الـ workers اللي بتفضّي الطابور (بيتنادى من create_app في وضع queue)."""
+    global _worker_pool
+    if _worker_pool is None:
+        burst = message_processor.burst_collector.queue_policy()
+        _worker_pool = MessageWorkerPool(get_message_queue(), process_queued_burst if burst else process_queued_message,
+                                         burst=burst)
+        _worker_pool.start()
+    return _worker_pool
+
+# -------------------- نقطة الدخول للويب هوك -------------------- #
+@webhook_bp.route('/webhook', methods=['GET', 'POST'])
+@timed("webhook")
+def webhook_handler():
+    profile = slow_request_profiler.start()
+    try:
+        with log_context(request_id=request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]):
+            return _webhook_handler()
+    finally:
+        slow_request_profiler.stop(profile, f"{request.method} /webhook")
+
+def _webhook_handler():
+    logger = current_app.logger
+
+    if request.method == 'GET':
+        return verify_subscription(request.args)
+
+    if request.method == 'POST':
+        data = request.get_json()
+        log_payload(logger, "Received webhook data", data)
+
+        early, messages, counts, new_ids = _prepare_webhook_batch(data)
+        if early:
+            return jsonify(early[0]), early[1]
+
+        try:
+            # رسايل العملاء كلها بتتسجل في round-trip واحد (لكل tenant) قبل المعالجة
+            for tenant_id, tenant_messages in _by_tenant(_unstored(messages)).items():
+                with tenant_context(tenant_registry.get(tenant_id)):
+                    add_messages([(m['from'], "user", m['body']) for m in tenant_messages])
+        except Exception as e:
+            logger.error(f"Unhandled error storing webhook batch: {e}", exc_info=True)
+            # نسيب Meta تعيد الإرسال بدل ما الرسايل تضيع
+            _release_batch(messages, new_ids)
+            return jsonify({'status': 'error', 'message': str(e), 'counts': counts}), 500
+
+        outcomes = []
+        for group in _burst_groups(messages):
+            try:
+                with tenant_context(tenant_registry.get(group[0]['tenant_id'])), \
+                        log_context(message_id=group[0]['id']):
+                    statuses = process_incoming_messages(group[0]['from'], [m['body'] for m in group],
+                                                         store_incoming=False)
+                outcomes.extend((m, status, None) for m, status in zip(group, statuses))
+            except Exception as e:
+                # الـ 500 بيخلي Meta تعيد الإرسال: الرسايل اتسجلت في التاريخ، فإعادة الإرسال بتتعالج من غير تسجيل
+                message_deduplicator.mark_failed(m['id'] for m in group if m['id'])
+                outcomes.extend((m, 'error', str(e)) for m in group)
+
+        body, status_code = _batch_response(messages, outcomes, counts)
+        return jsonify(body), status_code
+
+def verify_subscription(args):
+    """التحقق بتاع Meta (GET /webhook)؛ args أي mapping فيه hub.*. يرجع (body, status)."""
+    logger = _get_logger()
+    if args.get('hub.mode') == 'subscribe' and args.get('hub.verify_token') == VERIFY_TOKEN:
+        logger.info("Webhook GET verification successful.")
+        return args.get('hub.challenge'), 200
+    else:
+        logger.warning(f"Webhook GET verification failed. Token received: {args.get('hub.verify_token')}")
+        return 'Forbidden', 403
+
+def _prepare_webhook_batch(data):
+    """
+    الجزء المشترك بين الـ handler العادي والـ async: parse + dedupe + وضع الطابور.
+    يرجع (early_response, messages, counts, new_ids)؛ early_response = (body, status) لو الرد اتحدد خلاص.
+    """
+    logger = _get_logger()
+    if not (data and data.get('object') == 'whatsapp_business_account'):
+        logger.info("Webhook POST received, but not a recognized WhatsApp business account message or no data.")
+        return ({'status': 'received_ok_not_processed'}, 200), [], {}, set()
+
+    batch = parse_webhook_batch(data)
+    messages, counts = batch['messages'], batch['counts']
+    logger.info(
+        "Webhook batch: " + ", ".join(f"{k}={v}" for k, v in counts.items())
+    )
+
+    # نفس الـ status القديم لو مفيش ولا رسالة نصية صالحة في الـ batch
+    if not messages:
+        if counts['invalid']:
+            logger.warning("Missing 'from' or 'msg_body' in message object.")
+            return ({'status': 'missing_data_in_message', 'counts': counts}, 400), [], counts, set()
+        if counts['non_text']:
+            logger.info("Received only non-text messages in webhook batch.")
+            return ({'status': 'ignored_non_text_message', 'counts': counts}, 200), [], counts, set()
+        logger.info("No 'messages' field in webhook data. Skipping.")
+        return ({'status': 'no_message_field', 'counts': counts}, 200), [], counts, set()
+
+    # --- الـ tenant بتاع كل رسالة من الرقم اللي جت عليه (metadata.phone_number_id) ---
+    messages = _assign_tenants(messages, counts)
+    if not messages:
+        logger.warning(f"Dropped {counts['unknown_tenant']} message(s) sent to unregistered phone_number_id(s).")
+        return ({'status': 'unknown_tenant', 'counts': counts}, 200), [], counts, set()
+
+    # --- رفض الرسايل اللي Meta بتعيد إرسالها قبل أي شغل تاني ---
+    new_ids, retry_ids = message_deduplicator.claim([m['id'] for m in messages if m['id']])
+    fresh_messages = [m for m in messages if not m['id'] or m['id'] in new_ids or m['id'] in retry_ids]
+    for m in fresh_messages:
+        # رسالة معالجتها فشلت قبل كده: متسجلة في التاريخ خلاص، فبتتعالج بس
+        m['stored'] = m['id'] in retry_ids
+    counts['redelivered'] = len(messages) - len(fresh_messages)
+    if not fresh_messages:
+        logger.info(f"Dropped {counts['redelivered']} redelivered message(s). Dedupe stats: {message_deduplicator.get_stats()}")
+        return ({'status': 'duplicate', 'counts': counts}, 200), [], counts, new_ids
+    messages = fresh_messages
+
+    # --- وضع الطابور: نسجل الـ batch كله ونرد على Meta فوراً ---
+    if WEBHOOK_PROCESSING_MODE == 'queue':
+        try:
+            get_message_queue().enqueue_many([(_customer_key(m), m) for m in messages])
+        except Exception as e:
+            logger.error(f"Unhandled error storing webhook batch: {e}", exc_info=True)
+            _release_batch(messages, new_ids)
+            return ({'status': 'error', 'message': str(e), 'counts': counts}, 500), [], counts, new_ids
+        logger.info(f"Queued {len(messages)} message(s) from webhook batch.")
+        return ({'status': 'queued', 'counts': counts}, 200), [], counts, new_ids
+
+    return None, messages, counts, new_ids
+
+def _unstored(messages):
+    return [m for m in messages if not m.get('stored')]
+
+def _release_batch(messages, new_ids):
+    """الـ batch متسجلش: الجديد يتشال من الـ dedupe، واللي كان متسجل قبل كده يفضل failed عشان يتعالج بس."""
+    message_deduplicator.release(new_ids)
+    message_deduplicator.mark_failed(m['id'] for m in messages if m.get('stored') and m['id'])
+
+def _assign_tenants(messages, counts):
+    """
+    يحط tenant_id في كل رسالة (بيتخزن معاها في الطابور). رسايل لرقم مش متسجل في TENANTS_FILE بتترمي:
+    مفيش config ولا token نرد بيهم، و 200 عشان Meta متفضلش تعيدها.
+    """
+    known = []
+    for m in messages:
+        tenant = tenant_registry.resolve(m.get('phone_number_id'))
+        if tenant is None:
+            _get_logger().warning(f"Message {m['id']} sent to unregistered phone_number_id {m.get('phone_number_id')}.")
+            continue
+        m['tenant_id'] = tenant.id
+        known.append(m)
+    counts['unknown_tenant'] = len(messages) - len(known)
+    return known
+
+def _customer_key(m):
+    """مفتاح العميل في الطابور: نفس الرقم على tenant تاني عميل تاني."""
+    tenant_id = m.get('tenant_id') or DEFAULT_TENANT_ID
+    return m['from'] if tenant_id == DEFAULT_TENANT_ID else f"{tenant_id}:{m['from']}"
+
+def _by_tenant(messages):
+    by_tenant = {}
+    for m in messages:
+        by_tenant.setdefault(m['tenant_id'], []).append(m)
+    return by_tenant
+
+def _by_customer(messages):
+    by_customer = {}
+    for m in messages:
+        by_customer.setdefault(_customer_key(m), []).append(m)
+    return list(by_customer.values())
+
+def _burst_groups(messages):
+    """الرسايل اللي بتتعالج مع بعض: كل رسالة لوحدها، أو رسايل كل عميل مع بعض لو الـ burst شغال."""
+    if not message_processor.burst_collector.enabled:
+        return [[m] for m in messages]
+    return _by_customer(messages)
+
+def _batch_response(messages, outcomes, counts):
+    """outcomes: (message, status, error) بأي ترتيب؛ النتايج بترجع بترتيب الرسايل في الـ webhook."""
+    outcome_by_message = {id(m): (status, error) for m, status, error in outcomes}
+    results = []
+    errors = []
+    for m in messages:
+        status, error = outcome_by_message[id(m)]
+        results.append(status)
+        if error is not None:
+            errors.append(error)
+    counts['processed'] = len(results) - len(errors)
+    counts['failed'] = len(errors)
+    _get_logger().info(f"Webhook batch done: processed={counts['processed']}, failed={counts['failed']}")
+    if errors:
+        return {'status': 'error', 'message': errors[0], 'results': results, 'counts': counts}, 500
+    status = results[0] if len(results) == 1 else 'batch_processed'
+    return {'status': status, 'results': results, 'counts': counts}, 200
+
+# -------------------- وضع asyncio (ASGI، شوف asgi.py) -------------------- #
+async def aprocess_incoming_message(from_user_id, msg_body, store_incoming=True):
+    """نسخة async من process_incoming_message: قاعدة البيانات و OpenAI و واتساب من غير ما نحجز thread."""
+    return (await aprocess_incoming_messages(from_user_id, [msg_body], store_incoming))[0]
+
+async def aprocess_incoming_messages(from_user_id, bodies, store_incoming=True):
+    """نسخة async من process_incoming_messages."""
+    return await message_processor.aprocess_messages(whatsapp_channel, from_user_id, bodies, store_incoming)
+
+async def _aprocess_phone_messages(phone_messages):
+    # رسايل نفس العميل بالترتيب، والعملاء المختلفين بالتوازي
+    outcomes = []
+    for group in _burst_groups(phone_messages):
+        try:
+            with tenant_context(tenant_registry.get(group[0]['tenant_id'])), \
+                    log_context(message_id=group[0]['id']):
+                statuses = await aprocess_incoming_messages(group[0]['from'], [m['body'] for m in group],
+                                                            store_incoming=False)
+            outcomes.extend((m, status, None) for m, status in zip(group, statuses))
+        except Exception as e:
+            await asyncio.to_thread(message_deduplicator.mark_failed, [m['id'] for m in group if m['id']])
+            outcomes.extend((m, 'error', str(e)) for m in group)
+    return outcomes
+
+@timed("webhook")
+async def ahandle_webhook_post(data, request_id=None):
+    """الـ POST /webhook في وضع asyncio؛ يرجع (body, status) بنفس ردود الـ handler العادي."""
+    with log_context(request_id=request_id or uuid.uuid4().hex[:16]):
+        return await _ahandle_webhook_post(data)
+
+async def _ahandle_webhook_post(data):
+    logger = _get_logger()
+    log_payload(logger, "Received webhook data", data)
+
+    # الـ dedupe والطابور سريعين ومعظمهم من الذاكرة، فبيشتغلوا في thread
+    early, messages, counts, new_ids = await asyncio.to_thread(_prepare_webhook_batch, data)
+    if early:
+        return early
+
+    try:
+        for tenant_id, tenant_messages in _by_tenant(_unstored(messages)).items():
+            with tenant_context(tenant_registry.get(tenant_id)):
+                await aadd_messages([(m['from'], "user", m['body']) for m in tenant_messages])
+    except Exception as e:
+        logger.error(f"Unhandled error storing webhook batch: {e}", exc_info=True)
+        await asyncio.to_thread(_release_batch, messages, new_ids)
+        return {'status': 'error', 'message': str(e), 'counts': counts}, 500
+
+    groups = await asyncio.gather(*(_aprocess_phone_messages(group) for group in _by_customer(messages)))
+    return _batch_response(messages, [outcome for group in groups for outcome in group], counts)
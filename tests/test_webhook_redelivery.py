@@ -0,0 +1,63 @@
+"""
+لما المعالجة تفشل بعد ما رسالة العميل اتسجلت، Meta بتعيد إرسالها: لازم تتعالج تاني من غير ما تتسجل مرتين.
+
+python -m pytest tests/  (أو python -m unittest discover tests)
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/history.db"
+os.environ["MESSAGE_QUEUE_PATH"] = f"{_tmp}/queue.db"
+os.environ["WEBHOOK_PROCESSING_MODE"] = "inline"
+os.environ["DB_AUTO_MIGRATE"] = "true"
+
+from app import create_app  # noqa: E402
+import routes.webhook as webhook  # noqa: E402
+from utils.db import SessionLocal, ConversationHistory  # noqa: E402
+
+
+def _payload(phone, body, message_id):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+        {"id": message_id, "from": phone, "type": "text", "text": {"body": body}}]}}]}]}
+
+
+class WebhookRedeliveryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+        self.sent = []
+        patcher = mock.patch.object(webhook, "ACTIVE_MESSAGE_SENDER",
+                                    lambda to, text: self.sent.append((to, text)) or True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _user_rows(self, phone):
+        with SessionLocal() as db:
+            return db.query(ConversationHistory)\
+                .filter(ConversationHistory.phone == phone, ConversationHistory.sender == "user").all()
+
+    def test_failed_message_is_reprocessed_without_storing_it_again(self):
+        phone, message_id = "201000000001", f"wamid.{time.time_ns()}"
+
+        with mock.patch.object(webhook, "process_incoming_messages", side_effect=RuntimeError("llm down")):
+            response = self.client.post("/webhook", json=_payload(phone, "hello", message_id))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual([row.message for row in self._user_rows(phone)], ["hello"])
+
+        response = self.client.post("/webhook", json=_payload(phone, "hello", message_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["counts"]["redelivered"], 0)
+        self.assertEqual([row.message for row in self._user_rows(phone)], ["hello"])
+        self.assertTrue(any(to == phone for to, _ in self.sent))
+
+        # بعد ما اتعالجت بنجاح، أي إعادة إرسال تانية تكرار عادي
+        response = self.client.post("/webhook", json=_payload(phone, "hello", message_id))
+        self.assertEqual(response.get_json()["status"], "duplicate")
+        self.assertEqual(len(self._user_rows(phone)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
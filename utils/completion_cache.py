@@ -0,0 +1,272 @@
+# utils/completion_cache.py
+import os
+import re
+import time
+import json
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from utils.ttl_cache import TTLCache
+from utils.faq_index import process_text
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "true").lower() == "true"
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", 5000))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", 24 * 60 * 60))
+# طبقة تانية على القرص (اختيارية) عشان الكاش يعيش بعد الـ restart ويتشارك بين الـ workers
+COMPLETION_CACHE_SQLITE_PATH = os.getenv("COMPLETION_CACHE_SQLITE_PATH")
+
+# كلمات بتدل إن السؤال معتمد على الكلام اللي قبله، فالرد المتكاش مش هينفع
+_FOLLOW_UP_MARKERS = {
+    "en": {"it", "its", "that", "this", "those", "these", "them", "they", "he", "she", "above",
+           "previous", "earlier", "again", "more", "else", "also", "same", "why", "yes", "no", "ok", "okay"},
+    "ar": {"هذا", "هذه", "ذلك", "تلك", "نفس", "كمان", "برضو", "ايضا", "أيضا",
+           "ليه", "لماذا", "نعم", "لا", "اوك", "تمام", "السابق", "قبل"},
+}
+_SHORT_MESSAGE_TOKENS = 1
+
+
+def normalize_question(text: str, lang: str) -> str:
+    """نفس تطبيع الـ FAQ (lowercase + شيل الرموز + طي الحروف العربية) وترتيب المسافات."""
+    return " ".join(process_text(text, lang, fold_arabic=True).split())
+
+
+def is_context_dependent(text: str) -> bool:
+    """
+    تقدير بسيط: رسالة قصيرة جداً أو فيها ضمير/إشارة لكلام سابق
+    معناها إن الرد لازم يتبني على المحادثة ومينفعش ييجي من الكاش.
+    """
+    tokens = set(re.findall(r"\w+", text.lower()))
+    if len(tokens) <= _SHORT_MESSAGE_TOKENS:
+        return True
+    return any(tokens & markers for markers in _FOLLOW_UP_MARKERS.values())
+
+
+class _SqliteTier:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS completion_cache ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, tokens INTEGER NOT NULL, expires_at REAL NOT NULL);"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT response, tokens FROM completion_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key, value, ttl):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO completion_cache (key, response, tokens, expires_at) VALUES (?, ?, ?, ?)",
+            (key, value[0], value[1], time.time() + ttl),
+        )
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """الطلبات المتزامنة لنفس المفتاح بتستنى نداء واحد بس وتاخد نفس النتيجة."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """يرجع (result, shared) و shared=True لو النتيجة جت من نداء تاني شغال."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """نسخة asyncio من SingleFlight: الـ coroutines المتزامنة لنفس المفتاح بتستنى Future واحد من غير ما تقفل الـ loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, afn):
+        """يرجع (result, shared) زي SingleFlight.do؛ afn() بترجع awaitable."""
+        # الـ Future مربوط بالـ loop بتاعه، فكل loop ليه flights لوحده
+        key = (asyncio.get_running_loop(), key)
+        future = self._calls.get(key)
+        if future is not None:
+            # shield: لو الـ waiter اتلغى الـ leader يكمل للباقيين
+            return await asyncio.shield(future), True
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await afn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            # لو مفيش حد مستني، متطلعش "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+
+class CompletionCache:
+    """
+    كاش لردود OpenAI: LRU في الذاكرة + SQLite اختياري، والمفتاح = السؤال بعد التطبيع
+    + اللغة + نسخة الـ prompt/reference data + الموديل + hash الـ context اللي اتبعت فعلاً (تاريخ العميل
+    والملخص). القيمة (response, total_tokens).
+    """
+
+    def __init__(self, maxsize: int = COMPLETION_CACHE_SIZE, ttl: float = COMPLETION_CACHE_TTL,
+                 sqlite_path: str = COMPLETION_CACHE_SQLITE_PATH):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._disk = None
+        if sqlite_path:
+            try:
+                self._disk = _SqliteTier(sqlite_path)
+            except sqlite3.Error as e:
+                logger.error(f"Completion cache disk tier disabled ({sqlite_path}): {e}")
+        self._flight = SingleFlight()
+        self._aflight = AsyncSingleFlight()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "saved_tokens": 0}
+
+    @staticmethod
+    def make_key(question: str, lang: str, prompt_version: str, model: str, context: list = None) -> str:
+        """
+        context: الـ messages اللي قبل سؤال العميل زي ما هتتبعت. رد اتبنى على تاريخ عميل مش بيتشارك إلا مع نفس
+        الـ context بالظبط، فالأسئلة اللي بتتشارك فعلاً بين العملاء هي أول سؤال (من غير تاريخ).
+        """
+        raw = f"{model}|{prompt_version}|{lang}|{normalize_question(question, lang)}"
+        if context:
+            raw += "|" + hashlib.sha256(json.dumps(context, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _lookup(self, key):
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache disk read failed: {e}")
+                value = None
+            if value is not None:
+                self._memory.set(key, value)
+                self._count(disk_hits=1)
+        return value
+
+    def get(self, key):
+        """يرجع (response_text, total_tokens) أو None (للـ streaming اللي مش بيمر بـ get_or_compute)."""
+        value = self._lookup(key)
+        if value is not None:
+            self._count(hits=1, saved_tokens=value[1])
+        else:
+            self._count(misses=1)
+        return value
+
+    def set(self, key, value):
+        self._memory.set(key, value)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, value, self.ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache disk write failed: {e}")
+
+    def get_or_compute(self, key, compute):
+        """
+        compute() لازم ترجع (response_text, total_tokens). لو رمت exception مش بيتكاش حاجة.
+        Returns:
+            tuple: (response_text, cached) و cached=True لو الرد جه من غير نداء جديد لـ OpenAI.
+        """
+        value = self._lookup(key)
+        if value is not None:
+            self._count(hits=1, saved_tokens=value[1])
+            return value[0], True
+
+        def _compute_and_store():
+            # ممكن نداء تاني يكون خلّص وخزّن قبل ما ناخد الـ flight
+            existing = self._lookup(key)
+            if existing is not None:
+                return existing, True
+            result = compute()
+            self.set(key, result)
+            return result, False
+
+        (value, was_cached), shared = self._flight.do(key, _compute_and_store)
+        return self._finish(value, was_cached, shared)
+
+    async def aget_or_compute(self, key, acompute):
+        """نسخة async من get_or_compute: acompute() coroutine function بترجع (response_text, total_tokens)."""
+        value = self._lookup(key)
+        if value is not None:
+            self._count(hits=1, saved_tokens=value[1])
+            return value[0], True
+
+        async def _compute_and_store():
+            existing = self._lookup(key)
+            if existing is not None:
+                return existing, True
+            result = await acompute()
+            self.set(key, result)
+            return result, False
+
+        (value, was_cached), shared = await self._aflight.do(key, _compute_and_store)
+        return self._finish(value, was_cached, shared)
+
+    def _finish(self, value, was_cached, shared):
+        if shared or was_cached:
+            self._count(**({"coalesced": 1} if shared else {"hits": 1}), saved_tokens=value[1])
+            return value[0], True
+        self._count(misses=1)
+        return value[0], False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["coalesced"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0
+        stats["size"] = len(self._memory)
+        return stats
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,251 @@
+# utils/config_store.py
+import os
+import json
+import hashlib
+import signal
+import logging
+import threading
+import time
+from string import Formatter
+
+from utils.faq_index import FaqIndex
+from utils.reference_index import ReferenceIndex, load_embedding_backend
+from utils.onboarding import OnboardingMachine
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DATA_PATH = os.path.join(BASE_DIR, "config_data")
+# كل قد إيه (ثواني) نبص على الـ mtime بتاع ملفات config_data
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", 2))
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."  # برومبت افتراضي بسيط جداً
+
+# backend الـ embeddings (لو متظبط) بيتحمل مرة واحدة ويتستخدم مع كل reload للـ reference data
+_reference_embedder = load_embedding_backend()
+
+
+class ReplyTemplate:
+    """قالب رد متحلل مرة واحدة: لو مفيهوش {placeholders} بيرجع النص جاهز من غير format."""
+
+    __slots__ = ("raw", "literal")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.literal = None
+        try:
+            parts = list(Formatter().parse(raw))
+            if all(field is None for _, field, _, _ in parts):
+                # نفس ناتج raw.format() بالظبط ({{ و }} بيتحولوا لقوس واحد)
+                self.literal = "".join(text for text, _, _, _ in parts)
+        except ValueError:
+            pass  # قالب مكسور: هيتعامل معاه render زي الأول
+
+    def render(self, reply_key: str, lang: str, **kwargs) -> str:
+        if self.literal is not None:
+            return self.literal
+        try:
+            return self.raw.format(**kwargs)
+        except Exception as e:
+            logger.warning(f"Error formatting message for key '{reply_key}' and lang '{lang}': {e}")
+            return self.raw
+
+
+class ConfigSnapshot:
+    """نسخة ثابتة (immutable) من كل ملفات config_data، بتتبدل كلها مرة واحدة عند الـ reload."""
+
+    def __init__(self, replies: dict, faq_content: dict, system_prompt: str, reference_data: str,
+                 faq_index: FaqIndex = None, templates: dict = None, reference_index: ReferenceIndex = None,
+                 onboarding: OnboardingMachine = None):
+        self.replies = replies
+        self.faq_content = faq_content
+        self.system_prompt = system_prompt
+        self.reference_data = reference_data
+        self.faq_index = faq_index if faq_index is not None else FaqIndex(faq_content)
+        self.templates = templates if templates is not None else self._compile_templates(replies)
+        self.reference_index = (reference_index if reference_index is not None
+                                else ReferenceIndex(reference_data, embed=_reference_embedder))
+        self.onboarding = onboarding if onboarding is not None else OnboardingMachine({})
+        # بيتغير مع أي تعديل في الـ prompt أو الـ reference data (بيدخل في مفتاح كاش ردود OpenAI)
+        self.prompt_version = hashlib.sha256(
+            f"{system_prompt}\0{reference_data}".encode("utf-8")
+        ).hexdigest()[:16]
+
+    @staticmethod
+    def _compile_templates(replies: dict) -> dict:
+        templates = {}
+        for key, by_lang in replies.items():
+            if isinstance(by_lang, dict):
+                templates[key] = {
+                    lang: ReplyTemplate(text) for lang, text in by_lang.items()
+                    if isinstance(text, str) and text
+                }
+        return templates
+
+
+class ConfigStore:
+    """
+    بيحمّل replies.json و faq_data.json و onboarding.json و system_prompt.txt و reference_data.txt مرة واحدة،
+    ويعيد تحميل الملف اللي اتغير بس (mtime أو SIGHUP) من غير restart.
+    مع base (config الـ tenants، utils/tenants.py) أي ملف مش موجود في config_dir بيتاخد من الـ base بالـ objects
+    المتحضرة بتاعته (مش نسخة).
+    """
+
+    FILES = {
+        "replies": "replies.json",
+        "faq": "faq_data.json",
+        "onboarding": "onboarding.json",
+        "system_prompt": "system_prompt.txt",
+        "reference_data": "reference_data.txt",
+    }
+
+    def __init__(self, config_dir: str = CONFIG_DATA_PATH, reload_interval: float = CONFIG_RELOAD_INTERVAL,
+                 base: "ConfigStore" = None):
+        self.config_dir = config_dir
+        self.reload_interval = reload_interval
+        self.base = base
+        self._lock = threading.Lock()
+        self._mtimes = {}
+        self._snapshot = None
+        self._base_snapshot = None
+        self._next_check = 0.0
+        self._force_reload = False
+
+    def path(self, name: str) -> str:
+        path = os.path.join(self.config_dir, self.FILES[name])
+        if self.base is not None and not os.path.exists(path):
+            return self.base.path(name)
+        return path
+
+    def get(self) -> ConfigSnapshot:
+        now = time.monotonic()
+        if self._snapshot is None or self._force_reload or now >= self._next_check:
+            self.reload(force=self._force_reload)
+        return self._snapshot
+
+    def request_reload(self, *_args):
+        """بيتنادى من الـ SIGHUP handler: الـ reload الفعلي بيحصل مع أول get بعدها."""
+        self._force_reload = True
+
+    def install_sighup_handler(self) -> bool:
+        if not hasattr(signal, "SIGHUP") or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signal.SIGHUP, self.request_reload)
+        return True
+
+    def _current_mtimes(self) -> dict:
+        mtimes = {}
+        for name in self.FILES:
+            try:
+                # الـ path جوه المفتاح: ملف اتضاف أو اتشال من فولدر الـ tenant = تغيير
+                path = self.path(name)
+                mtimes[name] = (path, os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes[name] = None
+        return mtimes
+
+    def _inherited(self) -> set:
+        if self.base is None:
+            return set()
+        return {name for name in self.FILES if self.path(name) == self.base.path(name)}
+
+    def reload(self, force: bool = False) -> ConfigSnapshot:
+        with self._lock:
+            self._next_check = time.monotonic() + self.reload_interval
+            mtimes = self._current_mtimes()
+            # الـ base بيعمل reload بميعاده هو، فبنقارن الـ snapshot بتاعه كمان مش الـ mtimes بس
+            base = self.base.get() if self.base is not None else None
+            old = self._snapshot
+            if old is not None and not force and mtimes == self._mtimes and base is self._base_snapshot:
+                return old
+            self._force_reload = False
+
+            changed = {name for name in self.FILES if force or old is None or mtimes[name] != self._mtimes.get(name)}
+            inherited = self._inherited()
+            if "replies" in inherited:
+                replies, templates = base.replies, base.templates
+            elif "replies" in changed:
+                replies, templates = self._load_json("replies", old.replies if old else {}), None
+            else:
+                replies, templates = old.replies, old.templates
+            if "faq" in inherited:
+                faq_content, faq_index = base.faq_content, base.faq_index
+            elif "faq" in changed:
+                faq_content, faq_index = self._load_json("faq", old.faq_content if old else {}), None
+            else:
+                faq_content, faq_index = old.faq_content, old.faq_index
+            if "system_prompt" in inherited:
+                system_prompt = base.system_prompt
+            else:
+                system_prompt = (self._load_text("system_prompt", DEFAULT_SYSTEM_PROMPT)
+                                 if "system_prompt" in changed else old.system_prompt)
+            if "reference_data" in inherited:
+                reference_data, reference_index = base.reference_data, base.reference_index
+            elif "reference_data" in changed:
+                reference_data, reference_index = self._load_text("reference_data", ""), None
+            else:
+                reference_data, reference_index = old.reference_data, old.reference_index
+            if {"onboarding", "replies"} <= inherited:
+                onboarding = base.onboarding
+            elif "onboarding" in changed or "replies" in changed:
+                onboarding = self._load_onboarding(old.onboarding if old else None, replies)
+            else:
+                onboarding = old.onboarding
+
+            snapshot = ConfigSnapshot(
+                replies=replies,
+                faq_content=faq_content,
+                system_prompt=system_prompt,
+                reference_data=reference_data,
+                # الأجزاء المتحضرة مسبقاً بنعيد استخدامها لو ملفها متغيرش (أو لو جاية من الـ base)
+                faq_index=faq_index,
+                templates=templates,
+                reference_index=reference_index,
+                onboarding=onboarding,
+            )
+            # تبديل الـ reference مرة واحدة = reload atomic بالنسبة للـ threads اللي بتقرا
+            self._snapshot = snapshot
+            self._mtimes = mtimes
+            self._base_snapshot = base
+            if old is not None and changed:
+                logger.info(f"Reloaded config files in {self.config_dir}: {sorted(changed)}")
+            return snapshot
+
+    def _load_json(self, name: str, fallback: dict) -> dict:
+        file_path = self.path(name)
+        try:
+            if not os.path.exists(file_path):
+                logger.warning(f"File not found: {file_path}")
+                return {}
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if not content.strip():
+                logger.warning(f"File is empty: {file_path}")
+                return {}
+            return json.loads(content)
+        except Exception as e:
+            # ملف اتحفظ نصه أو فيه غلطة: نفضل على آخر نسخة سليمة
+            logger.error(f"Error loading JSON from {file_path}: {e}", exc_info=True)
+            return fallback
+
+    def _load_onboarding(self, old: OnboardingMachine, replies: dict) -> OnboardingMachine:
+        """state machine الـ onboarding؛ لو التعريف الجديد فيه مشاكل بنفضل على النسخة القديمة."""
+        machine = OnboardingMachine(self._load_json("onboarding", old.definition if old else {}))
+        problems = machine.validate(set(replies))
+        if problems:
+            logger.error(f"Invalid {self.FILES['onboarding']}: " + "; ".join(problems))
+            if old is not None and not old.validate(set(replies)):
+                return old
+        return machine
+
+    def _load_text(self, name: str, default: str) -> str:
+        file_path = self.path(name)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            logger.warning(f"{name.replace('_', ' ').capitalize()} file not found: {file_path}")
+            return default
+
+
+config_store = ConfigStore()
@@ -0,0 +1,123 @@
+# utils/conversation_context.py
+import os
+import math
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# عدد الرسائل اللي بنجيبها من قاعدة البيانات، والحد الأقصى لتوكنز الـ prompt كله
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", 20))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# ملخص بسيط (استخراجي) للرسائل القديمة اللي اتشالت عشان الـ budget
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "false").lower() == "true"
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", 200))
+
+# كل رسالة في chat completions ليها overhead تقريباً 4 توكنز (role + فواصل)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+# الـ encoding بيتحمل أول ما يتطلب (أو في الـ warm-up)؛ tiktoken ممكن ينزّل ملف الـ BPE أول مرة
+_ENCODING = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    global _ENCODING, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _ENCODING = tiktoken.get_encoding("cl100k_base")
+                except Exception:  # tiktoken اختياري
+                    _ENCODING = None
+                _encoding_loaded = True
+    return _ENCODING
+
+
+def estimate_tokens(text: str) -> int:
+    """عدد التوكنز بـ tiktoken لو متسطب، وإلا تقدير متحفظ (العربي بياخد توكنز أكتر من الإنجليزي)."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 3)
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content", "")) + _MESSAGE_OVERHEAD_TOKENS
+
+
+# بداية الملخص وفاصل الرسايل فيه (utils/retention.py بيقرا الملخص القديم بيهم عشان يبني عليه)
+SUMMARY_PREFIX = "Earlier in this conversation the customer said: "
+SUMMARY_SEPARATOR = " | "
+
+
+def _summarize(dropped: list, max_tokens: int):
+    questions = [m["content"].strip().replace("\n", " ") for m in dropped if m["role"] == "user"]
+    if not questions:
+        return None
+    summary = SUMMARY_PREFIX
+    parts = []
+    # الأحدث الأول عشان لو الملخص اتقص يفضل أقرب كلام
+    for question in reversed(questions):
+        candidate = summary + SUMMARY_SEPARATOR.join([question] + parts)
+        if estimate_tokens(candidate) + _MESSAGE_OVERHEAD_TOKENS > max_tokens:
+            break
+        parts.insert(0, question)
+    if not parts:
+        return None
+    return {"role": "system", "content": summary + SUMMARY_SEPARATOR.join(parts)}
+
+
+def build_context(system_messages: list, history: list, user_message: str, user_id: str = None,
+                  token_budget: int = CONTEXT_TOKEN_BUDGET, summarize: bool = CONTEXT_SUMMARY_ENABLED) -> list:
+    """
+    يبني قائمة الـ messages لـ OpenAI: رسائل الـ system + أحدث رسائل التاريخ اللي تكفي في الـ budget
+    + رسالة العميل الحالية. الـ system prompt والـ reference data محسوبين من الـ budget.
+    """
+    valid_history = []
+    for entry in history:
+        if isinstance(entry, dict) and "role" in entry and "content" in entry:
+            valid_history.append({"role": entry["role"], "content": entry["content"]})
+        else:
+            logger.warning(f"Skipping invalid history entry for user {user_id}: {entry}")
+
+    # رسالة العميل الحالية بتتسجل قبل ما نطلب الرد، فمنكررهاش مرتين. لو كانت burst مدموج
+    # (utils/message_burst.py) رسايله متسجلة لوحدها في آخر التاريخ فبتتشال كلها.
+    target = user_message.strip()
+    tail = []
+    for entry in reversed(valid_history):
+        if entry["role"] != "user" or len(tail) >= target.count("\n") + 1:
+            break
+        tail.insert(0, entry["content"].strip())
+        if "\n".join(tail) == target:
+            del valid_history[-len(tail):]
+            break
+
+    current = {"role": "user", "content": user_message}
+    used = sum(message_tokens(m) for m in system_messages) + message_tokens(current)
+    summary_reserve = CONTEXT_SUMMARY_MAX_TOKENS if summarize else 0
+
+    kept = []
+    for entry in reversed(valid_history):
+        cost = message_tokens(entry)
+        if used + cost > token_budget - summary_reserve:
+            break
+        kept.append(entry)
+        used += cost
+    kept.reverse()
+
+    dropped = valid_history[:len(valid_history) - len(kept)]
+    messages = list(system_messages)
+    if dropped:
+        logger.info(f"Trimmed {len(dropped)} older history message(s) for user {user_id} to fit {token_budget} tokens.")
+        if summarize:
+            summary = _summarize(dropped, min(summary_reserve, max(token_budget - used, 0)))
+            if summary:
+                messages.append(summary)
+    messages.extend(kept)
+    messages.append(current)
+    return messages
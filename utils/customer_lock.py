@@ -0,0 +1,286 @@
+# utils/customer_lock.py
+# رسايل نفس العميل لازم تتعالج واحدة ورا التانية: الـ onboarding بيقرا onboarding_step وبعدين يكتب الخطوة
+# اللي بعدها، فلو رسالتين لنفس الرقم اتعالجوا في نفس الوقت (threads أو gunicorn workers أو أكتر من سيرفر)
+# الاتنين بيشوفوا نفس الخطوة والحالة بتبوظ.
+#
+#   CUSTOMER_LOCK_BACKEND=local     lock لكل رقم جوه الـ process (FIFO) — كفاية لـ process واحدة
+#   CUSTOMER_LOCK_BACKEND=advisory  local + PostgreSQL advisory lock — بين الـ workers والسيرفرات
+#   CUSTOMER_LOCK_BACKEND=file      local + fcntl.flock على ملفات في CUSTOMER_LOCK_DIR — نفس الفكرة على
+#                                   جهاز واحد (SQLite / التجارب / الـ stress test)
+#   CUSTOMER_LOCK_BACKEND=none      من غير locks
+#
+#   with customer_locks.hold(phone): ...          /   async with customer_locks.ahold(phone): ...
+# phone هو رقم العميل زي ما هو؛ الـ lock نفسه على scoped_key(phone) بتاع الـ tenant الحالي.
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+from sqlalchemy import text
+
+from .metrics import STAGE_DURATION, STAGE_ERRORS, registry
+from .tenants import scoped_key
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CUSTOMER_LOCK_BACKEND = os.getenv("CUSTOMER_LOCK_BACKEND", "local").lower()
+CUSTOMER_LOCK_TIMEOUT = float(os.getenv("CUSTOMER_LOCK_TIMEOUT", 30))  # ثواني
+CUSTOMER_LOCK_DIR = os.getenv("CUSTOMER_LOCK_DIR", os.path.join(BASE_DIR, "customer_locks"))
+CUSTOMER_LOCK_STRIPES = int(os.getenv("CUSTOMER_LOCK_STRIPES", 256))  # عدد ملفات الـ file backend
+
+# الـ polling على الـ lock البعيد بيبدأ سريع ويبطأ لحد الحد ده
+_POLL_MIN = 0.002
+_POLL_MAX = 0.05
+
+
+class CustomerLockTimeout(TimeoutError):
+    pass
+
+
+def _key_hash(key: str) -> int:
+    """رقم 64-bit signed ثابت لكل key (pg advisory locks بتاخد bigint)."""
+    digest = hashlib.blake2b(f"customer:{key}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class KeyedLock:
+    """
+    lock لكل key جوه الـ process. FIFO: اللي مستني من بدري بياخده الأول (release بيسلمه له على طول)،
+    والـ entry بيتمسح أول ما محدش ماسكه ولا مستنيه، فالذاكرة على قد الأرقام اللي شغالة دلوقتي بس.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._entries = {}  # key -> deque بالـ Events بتاعة اللي مستنيين؛ وجود الـ key معناه إن الـ lock محجوز
+
+    def try_acquire(self, key) -> bool:
+        with self._mutex:
+            if key in self._entries:
+                return False
+            self._entries[key] = deque()
+            return True
+
+    def acquire(self, key, timeout: float = None) -> bool:
+        with self._mutex:
+            waiters = self._entries.get(key)
+            if waiters is None:
+                self._entries[key] = deque()
+                return True
+            event = threading.Event()
+            waiters.append(event)
+        if event.wait(timeout):
+            return True
+        with self._mutex:
+            if event.is_set():  # اتسلم لنا في نفس لحظة الـ timeout
+                return True
+            waiters.remove(event)
+            return False
+
+    def release(self, key):
+        with self._mutex:
+            waiters = self._entries[key]
+            if waiters:
+                waiters.popleft().set()
+            else:
+                del self._entries[key]
+
+    def stats(self):
+        with self._mutex:
+            return len(self._entries), sum(len(w) for w in self._entries.values())
+
+
+class FileLockBackend:
+    """
+    flock على ملف من CUSTOMER_LOCK_STRIPES ملف حسب الـ hash بتاع الرقم: بين الـ processes على نفس الجهاز.
+    رقمين في نفس الـ stripe بيستنوا بعض ساعات، وده تمن إن عدد الملفات ثابت.
+    """
+
+    def __init__(self, directory: str = CUSTOMER_LOCK_DIR, stripes: int = CUSTOMER_LOCK_STRIPES):
+        import fcntl  # POSIX بس
+        self._fcntl = fcntl
+        self.directory = directory
+        self.stripes = max(stripes, 1)
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}  # key -> الملف المفتوح (الـ local lock بيضمن إن الـ key ده بتاعنا لوحدنا في الـ process)
+
+    def try_acquire(self, key) -> bool:
+        path = os.path.join(self.directory, f"{_key_hash(key) % self.stripes:04d}.lock")
+        f = open(path, "a+")
+        try:
+            self._fcntl.flock(f, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._files[key] = f
+        return True
+
+    def release(self, key):
+        f = self._files.pop(key)
+        try:
+            self._fcntl.flock(f, self._fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+
+class AdvisoryLockBackend:
+    """
+    pg_try_advisory_lock على connection من الـ pool (AUTOCOMMIT) بيفضل محجوز لحد الـ release.
+    كل رسالة تحت المعالجة بتمسك connection، فالـ pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) لازم يستحمل ده.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._connections = {}  # key -> connection ماسكة الـ lock
+
+    def try_acquire(self, key) -> bool:
+        conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _key_hash(key)}).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if not locked:
+            conn.close()
+            return False
+        self._connections[key] = conn
+        return True
+
+    def release(self, key):
+        conn = self._connections.pop(key)
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _key_hash(key)})
+        except Exception as e:
+            # الـ lock بيتفك لوحده لما الـ session تتقفل، فبنرمي الـ connection بدل ما يرجع الـ pool وهو ماسكه
+            logger.warning(f"Failed to release advisory lock for customer {key}: {e}")
+            conn.invalidate()
+        finally:
+            conn.close()
+
+
+class CustomerLocks:
+    def __init__(self, backend: str = CUSTOMER_LOCK_BACKEND, timeout: float = CUSTOMER_LOCK_TIMEOUT):
+        if backend not in ("local", "advisory", "file", "none"):
+            raise ValueError(f"Unknown CUSTOMER_LOCK_BACKEND: {backend!r}")
+        self.backend = backend
+        self.timeout = timeout
+        self.local = KeyedLock()
+        self._remote = None
+        self._remote_lock = threading.Lock()
+
+    @property
+    def distributed(self) -> bool:
+        return self.backend in ("advisory", "file")
+
+    def _remote_backend(self):
+        if not self.distributed:
+            return None
+        if self._remote is None:
+            with self._remote_lock:
+                if self._remote is None:
+                    if self.backend == "advisory":
+                        from .db import engine
+                        if engine.dialect.name != "postgresql":
+                            raise RuntimeError(f"CUSTOMER_LOCK_BACKEND=advisory needs PostgreSQL, not {engine.dialect.name}")
+                        self._remote = AdvisoryLockBackend(engine)
+                    else:
+                        self._remote = FileLockBackend()
+        return self._remote
+
+    def _timed_out(self, phone, timeout):
+        STAGE_ERRORS.inc("customer_lock")
+        raise CustomerLockTimeout(f"Timed out after {timeout}s waiting for the lock on customer {phone}")
+
+    def _acquired(self, phone, start):
+        STAGE_DURATION.observe(time.perf_counter() - start, "customer_lock.wait")
+        if self.distributed:
+            # عميل اتعدل في process تانية: الكاش المحلي ممكن يكون قديم (الكاش بالرقم الخام جوه الـ tenant الحالي)
+            from .db_helpers import invalidate_customer
+            invalidate_customer(phone)
+
+    @contextmanager
+    def hold(self, phone, timeout: float = None):
+        if self.backend == "none":
+            yield
+            return
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        key = scoped_key(phone)
+        if not self.local.acquire(key, timeout):
+            self._timed_out(phone, timeout)
+        try:
+            remote = self._remote_backend()
+            if remote is not None:
+                delay = _POLL_MIN
+                while not remote.try_acquire(key):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timed_out(phone, timeout)
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, _POLL_MAX)
+            self._acquired(phone, start)
+            try:
+                yield
+            finally:
+                if remote is not None:
+                    remote.release(key)
+        finally:
+            self.local.release(key)
+
+    @asynccontextmanager
+    async def ahold(self, phone, timeout: float = None):
+        """نفس hold من غير ما نوقف الـ event loop: polling بـ asyncio.sleep، والـ lock البعيد في thread."""
+        if self.backend == "none":
+            yield
+            return
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        key = scoped_key(phone)
+
+        async def poll(try_acquire):
+            delay = _POLL_MIN
+            while not await try_acquire():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, _POLL_MAX)
+            return True
+
+        async def try_local():
+            return self.local.try_acquire(key)
+
+        if not await poll(try_local):
+            self._timed_out(phone, timeout)
+        try:
+            remote = await asyncio.to_thread(self._remote_backend)
+            if remote is not None and not await poll(lambda: asyncio.to_thread(remote.try_acquire, key)):
+                self._timed_out(phone, timeout)
+            self._acquired(phone, start)
+            try:
+                yield
+            finally:
+                if remote is not None:
+                    await asyncio.to_thread(remote.release, key)
+        finally:
+            self.local.release(key)
+
+
+customer_locks = CustomerLocks()
+
+
+def _customer_lock_collector():
+    held, waiting = customer_locks.local.stats()
+    return [
+        ("customer_locks", "gauge", "Per-customer locks held and threads waiting for one in this process.",
+         [({"state": "held"}, held), ({"state": "waiting"}, waiting)]),
+    ]
+
+
+registry.register_collector(_customer_lock_collector)
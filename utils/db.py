@@ -1,17 +1,96 @@
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, func, Column, String, Integer, Text, DateTime, Index, LargeBinary
+from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+from .tenants import DEFAULT_TENANT_ID
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=False)
+# --- إعدادات الـ connection pool (الـ defaults بتاعة SQLAlchemy صغيرة ومن غير pre-ping) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))      # ثواني استنى connection فاضية
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))      # ثواني؛ قبل ما السيرفر/الـ proxy يقفل الـ connection
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+def engine_options(url: str = DATABASE_URL) -> dict:
+    """options الـ pool لـ create_engine؛ SQLite in-memory بيستخدم pool تاني مالوش الإعدادات دي."""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url and url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url):
+        return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                   pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE)
+    return options
+
+engine = create_engine(DATABASE_URL, echo=False, **engine_options())
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
+# --- الـ async engine (وضع ASGI) بيتعمل أول ما يتطلب بس، عشان الـ drivers بتاعته اختيارية ---
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+_async_engine = None
+_async_session_factory = None
+_async_lock = threading.Lock()
+
+def async_database_url(url: str = DATABASE_URL) -> str:
+    """نفس DATABASE_URL بالـ driver الـ async المقابل (asyncpg / aiosqlite)."""
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+def get_async_sessionmaker():
+    """async_sessionmaker على engine async واحد للـ process (محتاج asyncpg أو aiosqlite)."""
+    global _async_engine, _async_session_factory
+    if _async_session_factory is None:
+        with _async_lock:
+            if _async_session_factory is None:
+                from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+                _async_engine = create_async_engine(async_database_url(), echo=False, **engine_options())
+                _async_session_factory = async_sessionmaker(_async_engine, expire_on_commit=False)
+    return _async_session_factory
+
+# --- عدّاد الاستعلامات (round trips) عشان نقدر نقيس/نختبر عدد الـ queries لكل رسالة ---
+_query_counters = threading.local()
+
+class QueryCount:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_query_counters, "active", ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+@contextmanager
+def count_queries():
+    """
+    with count_queries() as q:
+        ...
+    q.count = عدد الـ statements اللي اتبعتت لقاعدة البيانات في الـ thread ده.
+    """
+    counter = QueryCount()
+    active = getattr(_query_counters, "active", None)
+    if active is None:
+        active = _query_counters.active = []
+    active.append(counter)
+    try:
+        yield counter
+    finally:
+        active.remove(counter)
+
 class Customer(Base):
+    # نفس الرقم ممكن يكون عميل عند أكتر من tenant (utils/tenants.py)، فالـ primary key هو (tenant_id, phone)
     __tablename__ = "customers"
+    tenant_id = Column(String, primary_key=True, default=DEFAULT_TENANT_ID, server_default=DEFAULT_TENANT_ID)
     phone = Column(String, primary_key=True, index=True)
     name = Column(String)
     language = Column(String)
@@ -21,11 +100,81 @@ class Customer(Base):
 class ConversationHistory(Base):
     __tablename__ = "conversation_history"
     id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(String, nullable=False, default=DEFAULT_TENANT_ID, server_default=DEFAULT_TENANT_ID)
     phone = Column(String)
     sender = Column(String)
     message = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # وقت الـ INSERT من ساعة قاعدة البيانات، مش وقت الرسالة (legacy_import بيكتب timestamps قديمة بـ ids جديدة).
+    # الـ export التدريجي بيستنى عليه قبل ما يعدّي الـ watermark (utils/export.py)
+    inserted_at = Column(DateTime, server_default=func.now())
+
+    # كل استعلامات التاريخ بتفلتر بالـ tenant والـ phone وترتب بالوقت
+    __table_args__ = (
+        Index("ix_conversation_history_tenant_phone_timestamp", "tenant_id", "phone", "timestamp"),
+    )
+
+class ProcessedMessage(Base):
+    # الـ primary key على message_id هو اللي بيمنع معالجة نفس رسالة واتساب مرتين
+    __tablename__ = "processed_messages"
+    message_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # claimed: الرسالة اتسجلت/بتتعالج | failed: اتسجلت في التاريخ والمعالجة فشلت، فإعادة الإرسال بتتعالج تاني
+    # من غير ما تتسجل تاني (utils/idempotency.py)
+    status = Column(String, nullable=False, default="claimed", server_default="claimed")
+
+    __table_args__ = (
+        # الـ purge الدوري بيمسح بالـ created_at (utils/idempotency.py)
+        Index("ix_processed_messages_created_at", "created_at"),
+    )
+
+class OutboundMessage(Base):
+    # outbox: رسايل واتساب اللي فشل إرسالها (429/5xx/timeout) وبتتعاد في الخلفية
+    __tablename__ = "outbound_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(String, nullable=False, default=DEFAULT_TENANT_ID, server_default=DEFAULT_TENANT_ID)  # رقم الإرسال
+    recipient = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | sending | sent | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_outbound_messages_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+class LegacyImport(Base):
+    # تقدم استيراد ملفات الـ JSON القديمة (utils/legacy_import.py): بيتكتب في نفس transaction الصفوف،
+    # فالاستيراد بيكمل من آخر batch اتعملها commit من غير ما يكرر ولا يفوّت حاجة
+    __tablename__ = "legacy_imports"
+    source = Column(String, primary_key=True)          # "customers:customer_data.json" / "history:<phone>_history.json"
+    position = Column(Integer, nullable=False, default=0)  # عدد العناصر اللي اتقرت من الملف (صالحة أو لأ)
+    rows = Column(Integer, nullable=False, default=0)
+    invalid = Column(Integer, nullable=False, default=0)
+    completed_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ConversationArchive(Base):
+    # رسايل conversation_history الأقدم من HISTORY_RETENTION_DAYS (utils/retention.py): blob مضغوط لكل عميل
+    # ولكل دفعة أرشفة، ومكانها في الجدول الأساسي صف summary واحد
+    __tablename__ = "conversation_archives"
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(String, nullable=False, default=DEFAULT_TENANT_ID, server_default=DEFAULT_TENANT_ID)
+    phone = Column(String, nullable=False)
+    first_at = Column(DateTime, nullable=False)
+    last_at = Column(DateTime, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)  # zlib(JSON [[sender, message, timestamp], ...]) من الأقدم للأحدث
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_conversation_archives_tenant_phone_last_at", "tenant_id", "phone", "last_at"),
+    )
 
-# لو بتشتغل محلي شغل الملف ده مرة واحدة:
+# إنشاء/تحديث الـ schema بقى عن طريق الـ migrations: python -m utils.migrations
 if __name__ == "__main__":
-    Base.metadata.create_all(bind=engine)
+    from utils.migrations import upgrade
+    upgrade()
@@ -1,6 +1,18 @@
 # utils/db_helpers.py
 
-from .db import SessionLocal, Customer, ConversationHistory
+import os
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Optional
+
+from .db import SessionLocal, Customer, ConversationHistory, get_async_sessionmaker
+from .ttl_cache import TTLCache
+from .metrics import timed
+from .write_buffer import HISTORY_WRITE_BEHIND, history_buffer
+from .tenants import current_tenant_id
+from .customer_lock import customer_locks
+from .retention import SUMMARY_SENDER, load_archived
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
 # Context manager style for safety
@@ -11,14 +23,73 @@ def get_db_session():
     finally:
         db.close()
 
+# كل الدوال هنا على صفوف الـ tenant الحالي (utils/tenants.py)؛ الـ phone لوحده مش unique بين الـ tenants.
+
+# --- كاش حالة العملاء (write-through): القراءة من الذاكرة وأي كتابة بتحدّث الكاش، بمفتاح (tenant_id, phone) ---
+# الكاش جوه الـ process، فعميل اتعدل في process تانية بيفضل قديم هنا لحد CUSTOMER_CACHE_TTL، وخطوة onboarding
+# قديمة ممكن ترجّع الخطوة اللي process تانية لسه كاتباها. عشان كده:
+#   CUSTOMER_CACHE=auto  (الافتراضي) شغال بس مع CUSTOMER_LOCK_BACKEND=advisory/file: الـ lock بيمسح العميل من
+#                        الكاش أول ما يتاخد (utils/customer_lock.py) فكل رسالة بتبدأ من صف الـ DB
+#   CUSTOMER_CACHE=on    لـ process واحدة بس (gunicorn worker واحد و MESSAGE_WORKER_MODE=thread)
+#   CUSTOMER_CACHE=off
+CUSTOMER_CACHE = os.getenv("CUSTOMER_CACHE", "auto").lower()
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", 10000))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", 60))  # ثواني؛ أقصى مدة لصف قديم في وضع on
+
+def _customer_cache_enabled() -> bool:
+    if CUSTOMER_CACHE not in ("auto", "on", "off"):
+        raise ValueError(f"Unknown CUSTOMER_CACHE: {CUSTOMER_CACHE!r}")
+    if CUSTOMER_CACHE == "auto":
+        return customer_locks.distributed
+    return CUSTOMER_CACHE == "on"
+
+# مقفول = حجم 0: أي set بيتشال على طول فكل get بيروح للـ DB
+_customer_cache = TTLCache(maxsize=CUSTOMER_CACHE_SIZE if _customer_cache_enabled() else 0, ttl=CUSTOMER_CACHE_TTL)
+_NOT_FOUND = object()  # بنكاش كمان إن العميل مش موجود عشان أول رسالة متعملش query زيادة
+
+_CUSTOMER_FIELDS = ("name", "language", "onboarding_step", "service_interest")
+
+@dataclass(frozen=True)
+class CustomerState:
+    """نسخة read-only من صف Customer (آمنة بين الـ threads ومش مربوطة بـ session)."""
+    phone: str
+    name: Optional[str] = None
+    language: Optional[str] = None
+    onboarding_step: Optional[str] = None
+    service_interest: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.phone, row.name, row.language, row.onboarding_step, row.service_interest)
+
+def _cache_key(phone):
+    return current_tenant_id(), phone
+
+def invalidate_customer(phone=None):
+    """يمسح العميل من الكاش (أو الكاش كله لو phone=None)."""
+    if phone is None:
+        _customer_cache.clear()
+    else:
+        _customer_cache.pop(_cache_key(phone))
+
+@timed("db.get_customer")
 def get_customer(phone):
+    key = _cache_key(phone)
+    cached = _customer_cache.get(key)
+    if cached is not None:
+        return None if cached is _NOT_FOUND else cached
     with SessionLocal() as db:
-        return db.query(Customer).filter(Customer.phone == phone).first()
+        row = db.get(Customer, key)
+        state = CustomerState.from_row(row) if row else None
+    _customer_cache.set(key, state if state else _NOT_FOUND)
+    return state
 
+@timed("db.add_customer")
 def add_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
     try:
         with SessionLocal() as db:
             customer = Customer(
+                tenant_id=current_tenant_id(),
                 phone=phone,
                 name=name,
                 language=language,
@@ -27,13 +98,18 @@ def add_customer(phone, name=None, language=None, onboarding_step=None, service_
             )
             db.add(customer)
             db.commit()
+            state = CustomerState.from_row(customer)
+        _customer_cache.set(_cache_key(phone), state)
+        return state
     except SQLAlchemyError as e:
+        invalidate_customer(phone)
         print(f"Error adding customer: {e}")
 
+@timed("db.update_customer")
 def update_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
     try:
         with SessionLocal() as db:
-            customer = db.query(Customer).filter(Customer.phone == phone).first()
+            customer = db.get(Customer, _cache_key(phone))
             if not customer:
                 return None
             if name is not None:
@@ -44,34 +120,236 @@ def update_customer(phone, name=None, language=None, onboarding_step=None, servi
                 customer.onboarding_step = onboarding_step
             if service_interest is not None:
                 customer.service_interest = service_interest
+            state = CustomerState.from_row(customer)
             db.commit()
-            return customer
+        _customer_cache.set(_cache_key(phone), state)
+        return state
     except SQLAlchemyError as e:
+        invalidate_customer(phone)
         print(f"Error updating customer: {e}")
 
-def add_or_update_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
-    customer = get_customer(phone)
-    if customer:
-        return update_customer(phone, name, language, onboarding_step, service_interest)
+def _dialect_insert(dialect_name):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
     else:
-        return add_customer(phone, name, language, onboarding_step, service_interest)
+        return None
+    return insert
+
+def _upsert_statement(insert, phone, values):
+    updates = {k: v for k, v in values.items() if v is not None}
+    stmt = insert(Customer).values(tenant_id=current_tenant_id(), phone=phone, **values)
+    return stmt.on_conflict_do_update(
+        index_elements=[Customer.tenant_id, Customer.phone],
+        # لو مفيش حاجة تتغير بنكتب الـ phone في نفسه عشان RETURNING يرجع الصف
+        set_={k: stmt.excluded[k] for k in updates} or {"phone": stmt.excluded.phone},
+    ).returning(Customer.phone, *[getattr(Customer, f) for f in _CUSTOMER_FIELDS])
+
+@timed("db.upsert_customer")
+def upsert_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
+    """
+    إضافة أو تعديل عميل في round-trip واحد (INSERT ... ON CONFLICT DO UPDATE ... RETURNING)
+    على PostgreSQL و SQLite، والحقول اللي قيمتها None مش بتتغير زي update_customer.
+    """
+    values = {"name": name, "language": language, "onboarding_step": onboarding_step,
+              "service_interest": service_interest}
+    updates = {k: v for k, v in values.items() if v is not None}
+    try:
+        with SessionLocal() as db:
+            dialect = db.get_bind().dialect
+            insert = _dialect_insert(dialect.name)
+            if insert is None or not getattr(dialect, "insert_returning", False):
+                # قواعد بيانات تانية: select + insert/update في نفس الـ session
+                customer = db.get(Customer, _cache_key(phone))
+                if customer is None:
+                    customer = Customer(tenant_id=current_tenant_id(), phone=phone, **values)
+                    db.add(customer)
+                else:
+                    for key, value in updates.items():
+                        setattr(customer, key, value)
+                db.flush()
+                state = CustomerState.from_row(customer)
+            else:
+                state = CustomerState.from_row(db.execute(_upsert_statement(insert, phone, values)).one())
+            db.commit()
+        _customer_cache.set(_cache_key(phone), state)
+        return state
+    except SQLAlchemyError as e:
+        invalidate_customer(phone)
+        print(f"Error upserting customer: {e}")
+
+def add_or_update_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
+    return upsert_customer(phone, name, language, onboarding_step, service_interest)
 
+@timed("db.add_message")
 def add_message(phone, sender, message):
+    if HISTORY_WRITE_BEHIND:
+        history_buffer.append(phone, sender, message)
+        return
     try:
         with SessionLocal() as db:
-            msg = ConversationHistory(phone=phone, sender=sender, message=message)
+            msg = ConversationHistory(tenant_id=current_tenant_id(), phone=phone, sender=sender, message=message)
             db.add(msg)
             db.commit()
     except SQLAlchemyError as e:
         print(f"Error adding message: {e}")
 
-def get_conversation(phone):
+@timed("db.add_messages")
+def add_messages(messages):
+    """
+    إضافة كذا رسالة في session و commit واحد (messages: list of (phone, sender, message)).
+    الخطأ بيترمي للي نادى (الـ webhook بيرجّع 500 ويسيب Meta تعيد الإرسال بدل ما الرسايل تضيع).
+    """
+    if not messages:
+        return
+    if HISTORY_WRITE_BEHIND:
+        history_buffer.append_many(messages)
+        return
+    tenant_id = current_tenant_id()
+    try:
+        with SessionLocal() as db:
+            db.add_all([
+                ConversationHistory(tenant_id=tenant_id, phone=phone, sender=sender, message=message)
+                for phone, sender, message in messages
+            ])
+            db.commit()
+    except SQLAlchemyError as e:
+        print(f"Error adding messages: {e}")
+        raise
+
+def get_conversation(phone, since=None):
+    """
+    التاريخ كله (أو من since) من الأقدم للأحدث. الرسايل اللي اتأرشفت (utils/retention.py) بتتقرا من
+    conversation_archives وبتيجي قبل الباقي، وصف الـ summary اللي مكانها مش بيرجع.
+    """
+    if HISTORY_WRITE_BEHIND:
+        history_buffer.flush()
+    tenant_id = current_tenant_id()
     with SessionLocal() as db:
-        conv = db.query(ConversationHistory)\
-            .filter(ConversationHistory.phone == phone)\
-            .order_by(ConversationHistory.timestamp)\
-            .all()
-        return [
+        query = db.query(ConversationHistory)\
+            .filter(ConversationHistory.tenant_id == tenant_id, ConversationHistory.phone == phone,
+                    ConversationHistory.sender != SUMMARY_SENDER)
+        if since is not None:
+            query = query.filter(ConversationHistory.timestamp >= since)
+        conv = [
             {"sender": m.sender, "message": m.message, "timestamp": m.timestamp.isoformat()}
-            for m in conv
+            for m in query.order_by(ConversationHistory.timestamp).all()
         ]
+        # الأرشيف بعد الجدول: لو job الأرشفة نقل رسايل في النص بتبقى في الاتنين، فبناخد من الأرشيف اللي قبل أول
+        # رسالة لسه في الجدول بس
+        archived = load_archived(db, tenant_id, phone, since)
+    if conv and archived:
+        first = conv[0]["timestamp"]
+        archived = [m for m in archived if datetime.fromisoformat(m["timestamp"]) < datetime.fromisoformat(first)]
+    return archived + conv
+
+def _recent_conversation_query(phone, limit):
+    return select(ConversationHistory.sender, ConversationHistory.message)\
+        .where(ConversationHistory.tenant_id == current_tenant_id(), ConversationHistory.phone == phone)\
+        .order_by(ConversationHistory.timestamp.desc(), ConversationHistory.id.desc())\
+        .limit(limit)
+
+def _with_pending(rows, pending, limit):
+    """rows من الأحدث للأقدم + رسايل الـ write-behind اللي لسه مكتبتش (وهي الأحدث)."""
+    return (list(reversed(pending)) + list(rows))[:limit] if pending else rows
+
+def _as_openai_history(rows):
+    # ملخص الرسايل المتأرشفة (utils/retention.py) بيروح كـ system قبل الرسايل اللي فضلت
+    return [
+        {"role": "system" if sender == SUMMARY_SENDER else sender, "content": message}
+        for sender, message in reversed(rows)
+        if sender in ("user", "assistant", SUMMARY_SENDER) and message
+    ]
+
+@timed("db.recent_conversation")
+def get_recent_conversation(phone, limit=20):
+    """
+    آخر limit رسالة للعميل بصيغة OpenAI (role/content) من الأقدم للأحدث،
+    بـ query واحدة على الـ index (tenant_id, phone, timestamp) بدل تحميل التاريخ كله.
+    """
+    def fetch():
+        with SessionLocal() as db:
+            return db.execute(_recent_conversation_query(phone, limit)).all()
+    if HISTORY_WRITE_BEHIND:
+        rows, pending = history_buffer.read_through(phone, fetch)
+        return _as_openai_history(_with_pending(rows, pending, limit))
+    return _as_openai_history(fetch())
+
+# --- نسخ async (وضع ASGI) بنفس الكاش ونفس الـ statements على الـ async engine ---
+@timed("db.get_customer")
+async def aget_customer(phone):
+    key = _cache_key(phone)
+    cached = _customer_cache.get(key)
+    if cached is not None:
+        return None if cached is _NOT_FOUND else cached
+    async with get_async_sessionmaker()() as db:
+        row = await db.get(Customer, key)
+        state = CustomerState.from_row(row) if row else None
+    _customer_cache.set(key, state if state else _NOT_FOUND)
+    return state
+
+@timed("db.upsert_customer")
+async def aadd_or_update_customer(phone, name=None, language=None, onboarding_step=None, service_interest=None):
+    values = {"name": name, "language": language, "onboarding_step": onboarding_step,
+              "service_interest": service_interest}
+    try:
+        async with get_async_sessionmaker()() as db:
+            dialect = db.get_bind().dialect
+            insert = _dialect_insert(dialect.name)
+            if insert is None or not getattr(dialect, "insert_returning", False):
+                customer = await db.get(Customer, _cache_key(phone))
+                if customer is None:
+                    customer = Customer(tenant_id=current_tenant_id(), phone=phone, **values)
+                    db.add(customer)
+                else:
+                    for key, value in values.items():
+                        if value is not None:
+                            setattr(customer, key, value)
+                await db.flush()
+                state = CustomerState.from_row(customer)
+            else:
+                state = CustomerState.from_row((await db.execute(_upsert_statement(insert, phone, values))).one())
+            await db.commit()
+        _customer_cache.set(_cache_key(phone), state)
+        return state
+    except SQLAlchemyError as e:
+        invalidate_customer(phone)
+        print(f"Error upserting customer: {e}")
+
+async def aadd_message(phone, sender, message):
+    # زي add_message: الرد اتبعت خلاص، فخطأ في تسجيله مش بيوقف المعالجة
+    try:
+        await aadd_messages([(phone, sender, message)])
+    except SQLAlchemyError:
+        pass
+
+@timed("db.add_messages")
+async def aadd_messages(messages):
+    """نسخة async من add_messages (وبترمي الخطأ زيها)."""
+    if not messages:
+        return
+    if HISTORY_WRITE_BEHIND:
+        history_buffer.append_many(messages)
+        return
+    tenant_id = current_tenant_id()
+    try:
+        async with get_async_sessionmaker()() as db:
+            db.add_all([
+                ConversationHistory(tenant_id=tenant_id, phone=phone, sender=sender, message=message)
+                for phone, sender, message in messages
+            ])
+            await db.commit()
+    except SQLAlchemyError as e:
+        print(f"Error adding messages: {e}")
+        raise
+
+@timed("db.recent_conversation")
+async def aget_recent_conversation(phone, limit=20):
+    async def fetch():
+        async with get_async_sessionmaker()() as db:
+            return (await db.execute(_recent_conversation_query(phone, limit))).all()
+    if HISTORY_WRITE_BEHIND:
+        rows, pending = await history_buffer.aread_through(phone, fetch)
+        return _as_openai_history(_with_pending(rows, pending, limit))
+    return _as_openai_history(await fetch())
@@ -0,0 +1,221 @@
+# utils/export.py
+# export لـ conversation_history و customers كـ NDJSON (سطر JSON لكل صف، ومع gzip لو حبيت) للـ analytics.
+# الصفوف بتتقرا بـ server-side cursor (stream_results + yield_per) وبتتكتب batch ورا batch، فالذاكرة
+# ثابتة مهما كان حجم الجدول، بعكس get_conversation اللي بيحمّل كل الصفوف في list.
+# الـ export التدريجي بيبدأ بعد آخر id اتصدّر (watermark) أو من timestamp معين.
+# الـ export الكامل (من غير since_id) بيطلع كمان الرسايل المتأرشفة (utils/retention.py) قبل الصفوف اللي في
+# conversation_history، بـ "id": null. الـ export التدريجي مش بيقرا الأرشيف: الصفوف اتصدّرت وهي لسه في الجدول
+# طول ما الـ export بيشتغل أسرع من HISTORY_RETENTION_DAYS.
+#
+#   python -m utils.export history -o history.ndjson.gz --gzip --watermark export_state.json
+#   python -m utils.export customers -o customers.ndjson
+#   GET /export/history.ndjson?since_id=123   (routes/export.py)
+import os
+import sys
+import json
+import zlib
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from .db import Customer, ConversationHistory, ConversationArchive
+from .write_buffer import HISTORY_WRITE_BEHIND, history_buffer
+from .retention import SUMMARY_SENDER, decode_messages
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))  # صفوف لكل fetch من الـ cursor ولكل chunk مكتوب
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+# الـ ids بتتحجز وقت الـ INSERT بس بتبان وقت الـ COMMIT، فعلى PostgreSQL (webhook، الـ workers، الـ write-behind،
+# legacy_import) id أكبر ممكن يبان قبل id أصغر لسه في transaction مفتوحة، ولو الـ watermark عدّاه مش هيتصدّر أبداً.
+# الـ export بيقف عند أول صف (بترتيب الـ id) اتعمله INSERT (inserted_at، ساعة قاعدة البيانات) من أقل من الثواني
+# دي، فأي id قبل الـ watermark كان اتعمله commit (0 = من غير وقفة). مش بيعتمد على timestamp لأن legacy_import
+# بيكتب رسايل قديمة بـ ids جديدة. الصفوف اللي قبل migration 9 (inserted_at = NULL) بتتحسب settled، وكمان على
+# SQLite اللي اتعمله migrate (مفيش default هناك، والـ ids بتبان بالترتيب أصلاً)
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", 60))
+EXPORT_ARCHIVE_BATCH_SIZE = 20  # blobs لكل fetch (كل blob لحد HISTORY_ARCHIVE_CHUNK_MESSAGES رسالة)
+
+_encoder = json.JSONEncoder(ensure_ascii=False)  # json.dumps بيعمل encoder جديد مع كل صف
+
+
+def _partitions(statement, batch_size, engine=None):
+    """الصفوف (tuples) على batches بحجم batch_size من server-side cursor."""
+    from .db import engine as default_engine
+    with (engine or default_engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+        yield from result.partitions()
+
+
+def iter_archived(since: datetime = None, phone: str = None, tenant: str = None, engine=None):
+    """الرسايل المتأرشفة كـ dicts بنفس شكل iter_history و "id": None، عميل عميل ومن الأقدم للأحدث."""
+    t = ConversationArchive.__table__
+    statement = select(t.c.tenant_id, t.c.phone, t.c.data)\
+        .order_by(t.c.tenant_id, t.c.phone, t.c.first_at, t.c.id)
+    if since is not None:
+        statement = statement.where(t.c.last_at >= since)
+    if phone:
+        statement = statement.where(t.c.phone == phone)
+    if tenant:
+        statement = statement.where(t.c.tenant_id == tenant)
+    for partition in _partitions(statement, EXPORT_ARCHIVE_BATCH_SIZE, engine):
+        for tenant_id, phone_, data in partition:
+            for message in decode_messages(data):
+                if since is not None and datetime.fromisoformat(message["timestamp"]) < since:
+                    continue
+                yield {"id": None, "tenant_id": tenant_id, "phone": phone_, **message}
+
+
+def iter_history(since_id: int = None, since: datetime = None, phone: str = None, tenant: str = None,
+                 batch_size: int = EXPORT_BATCH_SIZE, engine=None, settle_seconds: float = EXPORT_SETTLE_SECONDS):
+    """
+    صفوف conversation_history كـ dicts بترتيب الـ id. since_id بيستخدم الـ primary key فهو الأسرع.
+    من غير since_id الرسايل المتأرشفة بتطلع الأول (iter_archived). صفوف الملخص اللي الأرشفة بتحطها
+    مش رسايل فمش بتتصدّر. الـ export بيقف قبل أول صف اتعمله INSERT من أقل من settle_seconds
+    (EXPORT_SETTLE_SECONDS)، والباقي بيطلع في الـ export الجاي من نفس الـ watermark.
+    """
+    if HISTORY_WRITE_BEHIND:
+        history_buffer.flush()
+    settled_before = _database_now(engine) - timedelta(seconds=settle_seconds) if settle_seconds > 0 else None
+    if since_id is None:
+        yield from iter_archived(since, phone, tenant, engine)
+    t = ConversationHistory.__table__
+    statement = select(t.c.id, t.c.tenant_id, t.c.phone, t.c.sender, t.c.message, t.c.timestamp, t.c.inserted_at)\
+        .where(t.c.sender != SUMMARY_SENDER).order_by(t.c.id)
+    if since_id is not None:
+        statement = statement.where(t.c.id > since_id)
+    if since is not None:
+        statement = statement.where(t.c.timestamp >= since)
+    if phone:
+        statement = statement.where(t.c.phone == phone)
+    if tenant:
+        statement = statement.where(t.c.tenant_id == tenant)
+    for partition in _partitions(statement, batch_size, engine):
+        for id_, tenant_id, phone_, sender, message, timestamp, inserted_at in partition:
+            if settled_before is not None and inserted_at is not None and inserted_at >= settled_before:
+                return
+            yield {"id": id_, "tenant_id": tenant_id, "phone": phone_, "sender": sender, "message": message,
+                   "timestamp": timestamp.isoformat() if timestamp else None}
+
+
+def _database_now(engine=None) -> datetime:
+    """now() بتاع قاعدة البيانات بنفس شكل inserted_at (naive): مقارنة بساعة السيرفر هنا كانت هتتلخبط مع أي فرق."""
+    from .db import engine as default_engine
+    with (engine or default_engine).connect() as conn:
+        now = conn.execute(select(func.now())).scalar()
+    # PostgreSQL بيرجع now() بالـ timezone بتاع الـ session، وده نفس الوقت اللي اتخزن في العمود (timestamp من غير tz)
+    return now.replace(tzinfo=None)
+
+
+def iter_customers(phone: str = None, tenant: str = None, batch_size: int = EXPORT_BATCH_SIZE, engine=None):
+    t = Customer.__table__
+    statement = select(t.c.tenant_id, t.c.phone, t.c.name, t.c.language, t.c.onboarding_step, t.c.service_interest)\
+        .order_by(t.c.tenant_id, t.c.phone)
+    if phone:
+        statement = statement.where(t.c.phone == phone)
+    if tenant:
+        statement = statement.where(t.c.tenant_id == tenant)
+    fields = ("tenant_id", "phone", "name", "language", "onboarding_step", "service_interest")
+    for partition in _partitions(statement, batch_size, engine):
+        for row in partition:
+            yield dict(zip(fields, row))
+
+
+EXPORTERS = {"history": iter_history, "customers": iter_customers}
+
+
+def iter_ndjson(rows, gzip: bool = False, chunk_rows: int = EXPORT_BATCH_SIZE, stats: dict = None):
+    """
+    بيحول الصفوف لـ chunks من الـ bytes (NDJSON، ومضغوطة gzip لو طلبت) بحجم chunk_rows صف تقريباً.
+    stats (لو اتبعت) بيتحدث فيه rows و last_id و last_timestamp عشان الـ watermark.
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None  # 31 = gzip header
+    encode = _encoder.encode
+    lines = []
+    last = None
+    count = 0
+    for row in rows:
+        lines.append(encode(row))
+        count += 1
+        if row.get("id") is not None:  # الرسايل المتأرشفة ملهاش id فمش بتحرك الـ watermark
+            last = row
+        if len(lines) >= chunk_rows:
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            lines.clear()
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+    if stats is not None:
+        stats["rows"] = count
+        if last is not None:
+            stats["last_id"] = last["id"]
+            stats["last_timestamp"] = last["timestamp"]
+
+
+def export(table: str, out, gzip: bool = False, **filters) -> dict:
+    """يكتب الجدول كـ NDJSON في out (ملف binary). يرجع {"rows", "last_id", "last_timestamp"}."""
+    stats = {"rows": 0, "last_id": filters.get("since_id"), "last_timestamp": None}
+    for chunk in iter_ndjson(EXPORTERS[table](**filters), gzip=gzip, stats=stats):
+        out.write(chunk)
+    return stats
+
+
+def _load_watermark(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_watermark(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m utils.export", description="Stream tables as NDJSON.")
+    parser.add_argument("table", choices=sorted(EXPORTERS))
+    parser.add_argument("-o", "--output", default="-", help="ملف الـ output (- = stdout)")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--since-id", type=int, help="history: الصفوف بعد الـ id ده بس")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="history: الصفوف من الوقت ده (UTC، ISO 8601)")
+    parser.add_argument("--phone")
+    parser.add_argument("--tenant", help="صفوف tenant واحد بس (utils/tenants.py)")
+    parser.add_argument("--watermark", help="history: ملف JSON بآخر id اتصدّر؛ بيتقرا كـ --since-id وبيتحدث بعد الـ export")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--settle-seconds", type=float, default=EXPORT_SETTLE_SECONDS,
+                        help="history: الصفوف اللي اتعملها INSERT من أقل من كده (inserted_at، مش timestamp) "
+                             "بتستنى الـ export الجاي (0 = كله). الصفوف قبل migration 9 ملهاش inserted_at "
+                             "فبتتصدّر على طول")
+    args = parser.parse_args(argv)
+
+    filters = {"phone": args.phone, "tenant": args.tenant, "batch_size": args.batch_size}
+    state = _load_watermark(args.watermark)
+    if args.table == "history":
+        since_id = args.since_id if args.since_id is not None else state.get("history", {}).get("last_id")
+        filters.update(since_id=since_id, since=args.since, settle_seconds=args.settle_seconds)
+    elif args.since_id is not None or args.since is not None or args.watermark:
+        parser.error("--since-id, --since and --watermark only apply to history")
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        stats = export(args.table, out, gzip=args.gzip, **filters)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    if args.watermark and stats["rows"] and stats["last_id"] is not None:
+        state["history"] = {"last_id": stats["last_id"], "last_timestamp": stats["last_timestamp"],
+                            "exported_at": datetime.utcnow().isoformat()}
+        _save_watermark(args.watermark, state)
+    print(f"Exported {stats['rows']} {args.table} row(s)"
+          + (f", last id {stats['last_id']}" if stats.get("last_id") is not None else ""), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+# utils/faq_index.py
+import os
+import re
+import logging
+from typing import Optional
+
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+logger = logging.getLogger(__name__)
+
+# طي الحروف العربية (تشكيل/ألف/تاء مربوطة) بيغيّر الـ scores عن النسخة القديمة، فهو اختياري
+FAQ_ARABIC_FOLDING = os.getenv("FAQ_ARABIC_FOLDING", "false").lower() == "true"
+
+# نفس معالجة thefuzz (full_process مع force_ascii=True): شيل حروف 128-255 وبعدين default_process
+_LATIN1_TABLE = {i: None for i in range(128, 256)}
+
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_ARABIC_FOLD_TABLE = str.maketrans({
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627",  # أ إ آ ٱ -> ا
+    "\u0629": "\u0647",  # ة -> ه
+    "\u0649": "\u064A",  # ى -> ي
+})
+
+
+def normalize_arabic(text: str) -> str:
+    """شيل التشكيل والتطويل ووحّد أشكال الألف والتاء المربوطة والألف المقصورة."""
+    return _ARABIC_DIACRITICS.sub("", text).translate(_ARABIC_FOLD_TABLE)
+
+
+def process_text(text: str, lang: str = None, fold_arabic: bool = False) -> str:
+    if fold_arabic and lang == "ar":
+        text = normalize_arabic(text)
+    return default_process(text.lower().translate(_LATIN1_TABLE))
+
+
+class _LanguageIndex:
+    def __init__(self):
+        self.keywords = []      # الكلمات بعد المعالجة بنفس ترتيب faq_data.json
+        self.answers = []
+        self.token_sets = []
+        self.postings = {}      # token -> أرقام الكلمات اللي فيها الـ token (مترتبة)
+
+    def add(self, keyword: str, answer: str):
+        idx = len(self.keywords)
+        tokens = frozenset(keyword.split())
+        self.keywords.append(keyword)
+        self.answers.append(answer)
+        self.token_sets.append(tokens)
+        for token in tokens:
+            self.postings.setdefault(token, []).append(idx)
+
+    def first_full_match(self, query_tokens) -> Optional[int]:
+        """
+        أول keyword الـ token_set_ratio بتاعها 100 بالظبط:
+        فيه تقاطع وواحدة من مجموعتين الـ tokens جوه التانية.
+        """
+        hits = {}
+        for token in query_tokens:
+            for idx in self.postings.get(token, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+        best = None
+        for idx, count in hits.items():
+            # keyword ⊆ message  أو  message ⊆ keyword
+            if count == len(self.token_sets[idx]) or count == len(query_tokens):
+                if best is None or idx < best:
+                    best = idx
+        return best
+
+
+class FaqIndex:
+    """
+    فهرس FAQ بيتبني مرة واحدة: مطابقة tokens سريعة، وبعدها scoring مجمّع (rapidfuzz)
+    على keywords اللغة بس. بيرجع نفس إجابة الـ loop القديم عند نفس الـ threshold.
+    """
+
+    def __init__(self, faq_content: dict, fold_arabic: bool = FAQ_ARABIC_FOLDING):
+        self.fold_arabic = fold_arabic
+        self.languages = {}
+        for _, faq_item in faq_content.items():
+            if not isinstance(faq_item, dict):
+                continue
+            for key in faq_item:
+                if not key.startswith("keywords_"):
+                    continue
+                lang = key[len("keywords_"):]
+                answer = faq_item.get(f"answer_{lang}")
+                if answer is None:
+                    continue
+                index = self.languages.setdefault(lang, _LanguageIndex())
+                for keyword in faq_item[key]:
+                    index.add(process_text(keyword, lang, fold_arabic), answer)
+
+    def match(self, user_message: str, lang: str, threshold: int = 75) -> Optional[str]:
+        index = self.languages.get(lang)
+        if not index or threshold > 100:
+            return None
+        query = process_text(user_message.strip(), lang, self.fold_arabic)
+        query_tokens = frozenset(query.split())
+        if not query_tokens:
+            return None
+
+        # --- المسار السريع: keyword واخدة 100 من الـ inverted index ---
+        full_idx = index.first_full_match(query_tokens)
+        if full_idx is not None:
+            # keyword قبلها ممكن تقرّب لـ 100 من غير تطابق tokens (نصوص طويلة)، والأولى هي اللي بتكسب
+            for _, score, idx in process.extract_iter(
+                query, index.keywords[:full_idx], scorer=fuzz.token_set_ratio,
+                processor=None, score_cutoff=99.5,
+            ):
+                if int(round(score)) == 100:
+                    return index.answers[idx]
+            return index.answers[full_idx]
+
+        # --- scoring مجمّع بـ cutoff، والتعادل بيكسب فيه الأقدم زي الـ loop القديم ---
+        # thefuzz بيقرّب الـ score لأقرب int، فلازم نقرّب زيه عشان نفس الـ threshold يدي نفس النتيجة
+        best_score = 0
+        best_idx = None
+        for _, score, idx in process.extract_iter(
+            query, index.keywords, scorer=fuzz.token_set_ratio,
+            processor=None, score_cutoff=max(threshold - 0.5, 0),
+        ):
+            rounded = int(round(score))
+            if rounded >= threshold and rounded > best_score:
+                best_score = rounded
+                best_idx = idx
+        return index.answers[best_idx] if best_idx is not None else None
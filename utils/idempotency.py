@@ -0,0 +1,214 @@
+# utils/idempotency.py
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from .db import SessionLocal, ProcessedMessage
+from .ttl_cache import TTLCache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Meta بتعيد إرسال الرسالة لحد ما ياخد 200، فبنفتكر الـ ids لفترة كافية
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 100000))
+# جدول processed_messages بيتنضف من الـ ids الأقدم من كده (Meta بتعيد المحاولة لحد 7 أيام) كل
+# IDEMPOTENCY_PURGE_INTERVAL ثانية، في thread في الخلفية بيبدأ من filter_new
+IDEMPOTENCY_RETENTION_DAYS = float(os.getenv("IDEMPOTENCY_RETENTION_DAYS", 7))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 3600))
+
+
+class MessageDeduplicator:
+    """
+    طبقة idempotency على WhatsApp message id:
+    LRU في الذاكرة (O(1)) وقبلها جدول processed_messages عشان يشتغل بين الـ workers والـ restarts.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL_SECONDS,
+                 retention_days: float = IDEMPOTENCY_RETENTION_DAYS, purge_interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+        self._seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "retries": 0, "db_errors": 0, "purged": 0}
+        self.retention_days = retention_days
+        self.purge_interval = purge_interval
+        # أول purge بعد دقيقة من التشغيل مش مع أول رسالة، والـ processes بتتوزع على الـ interval
+        self._next_purge = time.monotonic() + min(60.0, purge_interval)
+        self._purging = False
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def filter_new(self, message_ids):
+        """يرجع set بالـ ids اللي لازم تتعالج (الجديدة + اللي فشلت قبل كده)، ويسجلها كـ processed."""
+        new_ids, retry_ids = self.claim(message_ids)
+        return new_ids | retry_ids
+
+    def claim(self, message_ids):
+        """
+        يرجع (new_ids, retry_ids): new_ids أول مرة تيجي، و retry_ids اتسجلت في التاريخ قبل كده والمعالجة فشلت
+        (mark_failed) فبتتعالج تاني من غير ما تتسجل تاني. الباقي تكرار.
+        """
+        candidates = []
+        for message_id in dict.fromkeys(message_ids):
+            if self._seen.add(message_id):
+                candidates.append(message_id)
+            else:
+                self._count("memory_hits")
+        self._maybe_purge()
+        if not candidates:
+            return set(), set()
+
+        new_ids, retry_ids = self._claim_in_db(candidates)
+        self._count("db_hits", len(candidates) - len(new_ids) - len(retry_ids))
+        self._count("misses", len(new_ids))
+        self._count("retries", len(retry_ids))
+        return new_ids, retry_ids
+
+    def _claim_in_db(self, message_ids):
+        try:
+            with SessionLocal() as db:
+                existing = dict(
+                    db.query(ProcessedMessage.message_id, ProcessedMessage.status)
+                    .filter(ProcessedMessage.message_id.in_(message_ids))
+                )
+                new_ids = [m for m in message_ids if m not in existing]
+                # الـ failed بيرجع claimed بـ UPDATE مشروط، فلو Meta بعتت نفس الرسالة مرتين مع بعض واحدة بس بتتعالج
+                retry_ids = {m for m, status in existing.items() if status == "failed" and
+                             db.query(ProcessedMessage)
+                             .filter(ProcessedMessage.message_id == m, ProcessedMessage.status == "failed")
+                             .update({"status": "claimed"}, synchronize_session=False) == 1}
+                db.add_all([ProcessedMessage(message_id=m) for m in new_ids])
+                try:
+                    db.commit()
+                    return set(new_ids), retry_ids
+                except IntegrityError:
+                    # worker تاني سبقنا على واحد منهم، نرجع للتسجيل واحدة واحدة
+                    db.rollback()
+            return self._claim_in_db_one_by_one(new_ids, retry_ids)
+        except SQLAlchemyError as e:
+            # لو قاعدة البيانات مش متاحة منوقفش الرسايل، الـ LRU لسه بيحمي في نفس الـ process
+            logger.error(f"Idempotency store unavailable, accepting {len(message_ids)} message(s): {e}")
+            self._count("db_errors")
+            return set(message_ids), set()
+
+    def _claim_in_db_one_by_one(self, new_ids, retry_ids):
+        # الـ rollback رجّع الـ UPDATE بتاع الـ retries كمان، فبيتعاد لكل واحدة لوحدها
+        retried = set()
+        for message_id in retry_ids:
+            with SessionLocal() as db:
+                updated = db.query(ProcessedMessage)\
+                    .filter(ProcessedMessage.message_id == message_id, ProcessedMessage.status == "failed")\
+                    .update({"status": "claimed"}, synchronize_session=False)
+                db.commit()
+                if updated == 1:
+                    retried.add(message_id)
+        return {m for m in new_ids if self._claim_one(m)}, retried
+
+    def _claim_one(self, message_id) -> bool:
+        with SessionLocal() as db:
+            db.add(ProcessedMessage(message_id=message_id))
+            try:
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False
+
+    def release(self, message_ids):
+        """يشيل الـ ids لو المعالجة فشلت قبل ما تبدأ، عشان إعادة الإرسال من Meta تتعالج."""
+        message_ids = list(message_ids)
+        for message_id in message_ids:
+            self._seen.pop(message_id)
+        if not message_ids:
+            return
+        try:
+            with SessionLocal() as db:
+                db.query(ProcessedMessage)\
+                    .filter(ProcessedMessage.message_id.in_(message_ids))\
+                    .delete(synchronize_session=False)
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to release message ids {message_ids}: {e}")
+
+    def mark_failed(self, message_ids):
+        """
+        الرسايل اتسجلت في التاريخ بس المعالجة فشلت: إعادة الإرسال من Meta بتتعالج تاني (claim بيرجعها في
+        retry_ids) من غير ما تتسجل مرة تانية.
+        """
+        message_ids = list(message_ids)
+        for message_id in message_ids:
+            self._seen.pop(message_id)
+        if not message_ids:
+            return
+        try:
+            with SessionLocal() as db:
+                db.query(ProcessedMessage)\
+                    .filter(ProcessedMessage.message_id.in_(message_ids))\
+                    .update({"status": "failed"}, synchronize_session=False)
+                db.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to mark message ids {message_ids} as failed: {e}")
+
+    def purge_older_than(self, days: float = IDEMPOTENCY_RETENTION_DAYS) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        with SessionLocal() as db:
+            count = db.query(ProcessedMessage)\
+                .filter(ProcessedMessage.created_at < cutoff)\
+                .delete(synchronize_session=False)
+            db.commit()
+            return count
+
+    def _maybe_purge(self):
+        """purge_older_than في thread لوحده لو عدّى purge_interval (الـ webhook مش بيستناه)."""
+        if self.purge_interval <= 0 or time.monotonic() < self._next_purge:
+            return
+        with self._lock:
+            if self._purging or time.monotonic() < self._next_purge:
+                return
+            self._purging = True
+            self._next_purge = time.monotonic() + self.purge_interval
+        threading.Thread(target=self._purge, name="idempotency-purge", daemon=True).start()
+
+    def _purge(self):
+        try:
+            count = self.purge_older_than(self.retention_days)
+            self._count("purged", count)
+            if count:
+                logger.info(f"Purged {count} processed message id(s) older than {self.retention_days:g} day(s).")
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to purge processed message ids: {e}")
+        finally:
+            with self._lock:
+                self._purging = False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hits"] = stats["memory_hits"] + stats["db_hits"]
+        stats["cache_size"] = len(self._seen)
+        return stats
+
+
+message_deduplicator = MessageDeduplicator()
+
+
+def _dedupe_collector():
+    stats = message_deduplicator.get_stats()
+    return [
+        ("webhook_dedupe_events", "counter", "Webhook message ids checked against the idempotency store.",
+         [({"result": "memory_hit"}, stats["memory_hits"]), ({"result": "db_hit"}, stats["db_hits"]),
+          ({"result": "miss"}, stats["misses"]), ({"result": "retry"}, stats["retries"]),
+          ({"result": "db_error"}, stats["db_errors"])]),
+        ("webhook_dedupe_purged", "counter", "Processed message ids purged from the idempotency table.",
+         [({}, stats["purged"])]),
+        ("webhook_dedupe_cache_size", "gauge", "Message ids held in the in-memory dedupe cache.",
+         [({}, stats["cache_size"])]),
+    ]
+
+
+registry.register_collector(_dedupe_collector)
@@ -0,0 +1,34 @@
+# utils/lazy_imports.py
+# مكتبات تقيلة (openai ~0.9s، requests) بتتحمل أول ما حاجة منها تتطلب بدل وقت import الـ app،
+# عشان الـ process يبدأ يرد على health checks بسرعة والـ warm-up يحملها في الخلفية.
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    openai = LazyModule("openai") — بيتصرف زي الموديول نفسه (openai.OpenAI, except openai.APIError ...)
+    بس الـ import الحقيقي بيحصل مع أول attribute. thread-safe.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
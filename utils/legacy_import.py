@@ -0,0 +1,543 @@
+# utils/legacy_import.py
+# استيراد التخزين القديم (ملفات JSON) لقاعدة البيانات:
+#   customers/customer_data.json                 → customers
+#   conversation_history/<phone>_history.json    → conversation_history
+# الملفات بتتقرا stream (عنصر عنصر، من غير json.load للملف كله) والصفوف بتتكتب batches:
+# COPY على PostgreSQL و executemany على SQLite، بدل add_customer/add_message (session و commit لكل صف).
+# التقدم (عدد العناصر اللي اتقرت من كل ملف) بيتكتب في جدول legacy_imports في نفس transaction الـ batch،
+# فلو الاستيراد وقف في النص تشغيله تاني بيكمل من آخر commit من غير تكرار. ملفات التاريخ بتتوزع على processes.
+#
+#   python -m utils.legacy_import --customers customers/customer_data.json --history-dir conversation_history
+#   python -m utils.legacy_import --history-dir /archive/conversation_history --workers 8 --batch-size 10000
+#   python -m utils.legacy_import --tenant acme --customers /archive/acme/customer_data.json   (utils/tenants.py)
+import io
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import create_engine, insert, select
+
+from .db import DATABASE_URL, Customer, ConversationHistory, LegacyImport, engine_options
+from .db_helpers import _dialect_insert
+from .tenants import DEFAULT_TENANT_ID
+
+logger = logging.getLogger(__name__)
+
+LEGACY_IMPORT_BATCH_SIZE = int(os.getenv("LEGACY_IMPORT_BATCH_SIZE", 5000))  # صفوف لكل transaction
+LEGACY_IMPORT_WORKERS = int(os.getenv("LEGACY_IMPORT_WORKERS", os.cpu_count() or 1))
+LEGACY_IMPORT_FILES_PER_TASK = int(os.getenv("LEGACY_IMPORT_FILES_PER_TASK", 200))
+HISTORY_FILE_SUFFIX = "_history.json"
+READ_CHUNK_CHARS = 1 << 16
+# ملف أصغر من كده (أغلب ملفات التاريخ) بيتقرا مرة واحدة بـ json.load، أسرع من الـ stream والذاكرة محدودة برضه
+WHOLE_FILE_MAX_BYTES = int(os.getenv("LEGACY_IMPORT_WHOLE_FILE_MAX_BYTES", 1 << 20))
+
+SENDER_ALIASES = {"user": "user", "customer": "user", "assistant": "assistant", "bot": "assistant"}
+CUSTOMER_COLUMNS = ("tenant_id", "phone", "name", "language", "onboarding_step", "service_interest")
+HISTORY_COLUMNS = ("tenant_id", "phone", "sender", "message", "timestamp")
+
+
+class LegacyFormatError(ValueError):
+    """الملف نفسه مش JSON صالح (مش عنصر واحد بايظ)."""
+
+
+# --- قراءة JSON stream ---
+
+def iter_json_items(path, chunk_chars: int = READ_CHUNK_CHARS):
+    """
+    عناصر الـ array أو الـ object اللي في أول الملف واحد واحد: (index, value) أو (key, value).
+    الذاكرة على قد أكبر عنصر مش قد الملف. ملف فاضي = ولا عنصر.
+    """
+    if os.path.getsize(path) <= WHOLE_FILE_MAX_BYTES:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        if not content.strip():
+            return
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise LegacyFormatError(f"{path}: {e}") from None
+        if isinstance(data, list):
+            yield from enumerate(data)
+        elif isinstance(data, dict):
+            yield from data.items()
+        else:
+            raise LegacyFormatError(f"{path}: expected a JSON array or object")
+        return
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def more(size):
+            nonlocal buf, pos, eof
+            data = f.read(size)
+            if not data:
+                eof = True
+            buf = buf[pos:] + data
+            pos = 0
+
+        def peek():
+            # أول حرف مش مسافة (ولو الـ buffer خلص بيقرا كمان)، و "" في آخر الملف
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                more(chunk_chars)
+
+        def value():
+            # raw_decode على اللي في الـ buffer؛ لو القيمة ناقصة (أو واصلة لآخر الـ buffer) نقرا ضعف اللي فات ونعيد
+            nonlocal pos
+            size = chunk_chars
+            while True:
+                try:
+                    result, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return result
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise LegacyFormatError(f"{path}: {e}") from None
+                more(size)
+                size *= 2
+
+        first = peek()
+        if not first:
+            return
+        if first not in "[{":
+            raise LegacyFormatError(f"{path}: expected a JSON array or object")
+        closing = "]" if first == "[" else "}"
+        pos += 1
+        index = 0
+        while True:
+            char = peek()
+            if char == closing:
+                return
+            if index:
+                if char != ",":
+                    raise LegacyFormatError(f"{path}: expected ',' or '{closing}' after item {index}")
+                pos += 1
+                peek()
+            if closing == "}":
+                key = value()
+                if peek() != ":":
+                    raise LegacyFormatError(f"{path}: expected ':' after key {key!r}")
+                pos += 1
+                peek()
+                yield key, value()
+            else:
+                yield index, value()
+            index += 1
+
+
+# --- التحويل والتحقق ---
+
+def normalize_phone(phone) -> str:
+    """نفس شكل الـ "from" بتاع واتساب: أرقام من غير + ولا whatsapp: (Twilio)."""
+    if isinstance(phone, int):
+        phone = str(phone)
+    if not isinstance(phone, str):
+        return ""
+    phone = phone.strip()
+    if phone.startswith("whatsapp:"):
+        phone = phone[len("whatsapp:"):]
+    return phone.lstrip("+").replace(" ", "").replace("-", "")
+
+
+def _optional_str(value):
+    return value.strip() or None if isinstance(value, str) else None
+
+
+def customer_row(key, record):
+    """dict لجدول customers أو None لو العنصر مش صالح. key هو الـ phone لو الملف object."""
+    if not isinstance(record, dict):
+        return None
+    phone = normalize_phone(record.get("phone", key if isinstance(key, str) else None))
+    if not phone.isdigit():
+        return None
+    language = _optional_str(record.get("language", record.get("lang")))
+    return {
+        "phone": phone,
+        "name": _optional_str(record.get("name")),
+        "language": language if language in ("ar", "en") else None,
+        "onboarding_step": _optional_str(record.get("onboarding_step")),
+        "service_interest": _optional_str(record.get("service_interest")),
+    }
+
+
+def parse_timestamp(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.utcfromtimestamp(value / 1000 if value > 1e11 else value)
+    if isinstance(value, str) and value:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if ts.tzinfo is not None:
+            ts = (ts - ts.utcoffset()).replace(tzinfo=None)
+        return ts
+    return None
+
+
+def history_row(phone, entry, previous):
+    """
+    dict لجدول conversation_history أو None. بيقبل {sender, message} (شكل get_conversation) و {role, content}
+    (شكل الـ history اللي كان بيتبعت لـ OpenAI). رسالة من غير timestamp بتاخد اللي قبلها + 1 ميكروثانية عشان الترتيب.
+    """
+    if not isinstance(entry, dict):
+        return None
+    sender = entry.get("sender", entry.get("role"))
+    sender = SENDER_ALIASES.get(sender) if isinstance(sender, str) else None
+    message = entry.get("message", entry.get("content"))
+    if sender is None or not isinstance(message, str) or not message.strip():
+        return None
+    try:
+        timestamp = parse_timestamp(entry.get("timestamp"))
+    except (ValueError, OverflowError, OSError):
+        return None
+    return {"phone": phone, "sender": sender, "message": message,
+            "timestamp": timestamp or previous + timedelta(microseconds=1)}
+
+
+def history_phone(path) -> str:
+    name = os.path.basename(path)
+    return normalize_phone(name[:-len(HISTORY_FILE_SUFFIX)] if name.endswith(HISTORY_FILE_SUFFIX) else "")
+
+
+def iter_history_entries(path):
+    """رسايل ملف تاريخ واحد: array على طول، أو object فيه messages/history (وممكن phone)."""
+    phone = history_phone(path)
+    for key, value in iter_json_items(path):
+        if isinstance(key, int):
+            yield phone, value
+        elif key == "phone":
+            phone = normalize_phone(value) or phone
+        elif key in ("messages", "history") and isinstance(value, list):
+            for entry in value:
+                yield phone, entry
+
+
+def source_name(kind: str, path: str, tenant_id: str = DEFAULT_TENANT_ID) -> str:
+    name = os.path.basename(path)
+    return f"{kind}:{name}" if tenant_id == DEFAULT_TENANT_ID else f"{kind}:{tenant_id}/{name}"
+
+
+# --- الكتابة ---
+
+def _copy(conn, table, columns, rows):
+    """COPY ... FROM STDIN بـ psycopg2 (CSV في الذاكرة للـ batch بس)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buf.seek(0)
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+    finally:
+        cursor.close()
+
+
+def _can_copy(conn) -> bool:
+    return conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2"
+
+
+def write_history(conn, rows):
+    if not rows:
+        return
+    if _can_copy(conn):
+        _copy(conn, ConversationHistory.__tablename__, HISTORY_COLUMNS, rows)
+    elif conn.dialect.name == "sqlite":
+        # executemany على الـ driver على طول: الـ bind processing بتاع SQLAlchemy لكل صف كان نص وقت الكتابة.
+        # الـ timestamp بنفس الـ format اللي SQLAlchemy بيخزن بيه DateTime في SQLite
+        conn.exec_driver_sql(
+            f"INSERT INTO {ConversationHistory.__tablename__} ({', '.join(HISTORY_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            [(r["tenant_id"], r["phone"], r["sender"], r["message"], r["timestamp"].strftime("%Y-%m-%d %H:%M:%S.%f")) for r in rows])
+    else:
+        conn.execute(insert(ConversationHistory), rows)
+
+
+def write_customers(conn, rows) -> int:
+    """
+    يرجع عدد العملاء الجداد. عميل موجود في قاعدة البيانات بيفضل زي ما هو (بياناته أحدث من الملفات)،
+    ولو نفس الـ phone متكرر في الملف أول مرة هي اللي بتتحسب.
+    """
+    if not rows:
+        return 0
+    rows = list({row["phone"]: row for row in reversed(rows)}.values())
+    if _can_copy(conn):
+        conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS legacy_customers_stage "
+                             "(LIKE customers INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        _copy(conn, "legacy_customers_stage", CUSTOMER_COLUMNS, rows)
+        columns = ", ".join(CUSTOMER_COLUMNS)
+        return conn.exec_driver_sql(f"INSERT INTO customers ({columns}) SELECT {columns} FROM legacy_customers_stage "
+                                    "ON CONFLICT (tenant_id, phone) DO NOTHING").rowcount
+    dialect_insert = _dialect_insert(conn.dialect.name)
+    if dialect_insert is not None:
+        return conn.execute(dialect_insert(Customer).on_conflict_do_nothing(
+            index_elements=[Customer.tenant_id, Customer.phone]), rows).rowcount
+    existing = set(conn.execute(select(Customer.phone).where(Customer.tenant_id == rows[0]["tenant_id"],
+                                                             Customer.phone.in_([r["phone"] for r in rows])))
+                   .scalars())
+    rows = [row for row in rows if row["phone"] not in existing]
+    if rows:
+        conn.execute(insert(Customer), rows)
+    return len(rows)
+
+
+def save_progress(conn, progress):
+    """بيحدث صفوف legacy_imports للملفات اللي اتلمست في الـ batch (في نفس الـ transaction)."""
+    if not progress:
+        return
+    table = LegacyImport.__table__
+    now = datetime.utcnow()
+    dialect_insert = _dialect_insert(conn.dialect.name)
+    if dialect_insert is not None:
+        # upsert واحد executemany لكل الملفات بدل update/insert لكل ملف
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=[table.c.source],
+                                          set_={c: stmt.excluded[c] for c in (
+                                              "position", "rows", "invalid", "completed_at", "updated_at")})
+        conn.execute(stmt, [dict(state, source=source, updated_at=now) for source, state in progress.items()])
+        return
+    for source, state in progress.items():
+        values = dict(state, updated_at=now)
+        updated = conn.execute(table.update().where(table.c.source == source).values(**values)).rowcount
+        if not updated:
+            conn.execute(table.insert().values(source=source, **values))
+
+
+def load_progress(engine, sources=None) -> dict:
+    """{source: {position, rows, invalid, completed}} من legacy_imports."""
+    table = LegacyImport.__table__
+    statement = select(table.c.source, table.c.position, table.c.rows, table.c.invalid, table.c.completed_at)
+    with engine.connect() as conn:
+        return {source: {"position": position, "rows": rows, "invalid": invalid, "completed": completed is not None}
+                for source, position, rows, invalid, completed in conn.execute(statement)
+                if sources is None or source in sources}
+
+
+class _Batch:
+    """صفوف batch واحدة + تقدم كل ملف فيها؛ commit() بيكتبهم مع بعض في transaction واحدة."""
+
+    def __init__(self, engine, kind, batch_size):
+        self.engine = engine
+        self.kind = kind
+        self.batch_size = batch_size
+        self.rows = []
+        self.progress = {}
+        self.stats = {"rows": 0, "invalid": 0, "files": 0}
+
+    def full(self) -> bool:
+        return len(self.rows) >= self.batch_size
+
+    def commit(self):
+        if not self.rows and not self.progress:
+            return
+        with self.engine.begin() as conn:
+            if self.kind == "customers":
+                inserted = write_customers(conn, self.rows)
+            else:
+                write_history(conn, self.rows)
+                inserted = len(self.rows)
+            save_progress(conn, self.progress)
+        self.stats["rows"] += inserted
+        self.rows = []
+        self.progress = {source: state for source, state in self.progress.items() if not state["completed_at"]}
+
+
+def _import_file(batch, source, items, done):
+    """
+    items: iterator بيرجع dict صالح أو None لكل عنصر في الملف. العناصر اللي قبل done["position"]
+    اتكتبت قبل كده فبتتقرا وتتساب. الـ batch بيتعمل لها commit كل ما تتملي حتى لو الملف لسه مخلصش.
+    """
+    state = {"position": done.get("position", 0), "rows": done.get("rows", 0),
+             "invalid": done.get("invalid", 0), "completed_at": None}
+    batch.progress[source] = state
+    skip = state["position"]
+    for position, row in enumerate(items, 1):
+        if position <= skip:
+            continue
+        state["position"] = position
+        if row is None:
+            state["invalid"] += 1
+            batch.stats["invalid"] += 1
+            if state["invalid"] <= 3:
+                logger.warning(f"Skipping invalid item #{position} in {source}")
+        else:
+            state["rows"] += 1
+            batch.rows.append(row)
+        if batch.full():
+            batch.commit()
+    state["completed_at"] = datetime.utcnow()
+    batch.stats["files"] += 1
+
+
+def _history_items(path, tenant_id):
+    previous = datetime.utcfromtimestamp(os.path.getmtime(path))
+    for phone, entry in iter_history_entries(path):
+        row = history_row(phone, entry, previous) if phone.isdigit() else None
+        if row is not None:
+            previous = row["timestamp"]
+            row["tenant_id"] = tenant_id
+        yield row
+
+
+def _customer_items(path, tenant_id):
+    for key, record in iter_json_items(path):
+        row = customer_row(key, record)
+        if row is not None:
+            row["tenant_id"] = tenant_id
+        yield row
+
+
+def _peak_rss_mb() -> float:
+    # resource موجودة على POSIX بس؛ على Windows الرقم بيطلع 0
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB على Linux
+
+
+_worker_engine = None
+
+
+def _get_engine():
+    # كل process ليها engine بتاعها (الـ connections مينفعش تتشارك بعد fork)؛ SQLite بيستنى الـ lock بدل "database is locked"
+    global _worker_engine
+    if _worker_engine is None:
+        connect_args = {"timeout": 60} if DATABASE_URL.startswith("sqlite") else {}
+        _worker_engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_options())
+    return _worker_engine
+
+
+def import_files(kind, paths, progress, batch_size=LEGACY_IMPORT_BATCH_SIZE, engine=None,
+                 tenant_id=DEFAULT_TENANT_ID) -> dict:
+    """يستورد ملفات من نوع واحد (customers أو history) لـ tenant واحد في الـ process دي. يرجع stats."""
+    start = time.perf_counter()
+    batch = _Batch(engine or _get_engine(), kind, batch_size)
+    items = _customer_items if kind == "customers" else _history_items
+    failed = []
+    for path in paths:
+        source = source_name(kind, path, tenant_id)
+        done = progress.get(source, {})
+        if done.get("completed"):
+            continue
+        try:
+            _import_file(batch, source, items(path, tenant_id), done)
+        except (OSError, LegacyFormatError) as e:
+            # الملف نفسه بايظ: اللي اتقرا منه قبل الغلط بيتكتب بتقدمه، والملف بيفضل مش مكتمل لحد ما يتصلح
+            logger.error(f"Failed to import {path}: {e}")
+            failed.append(path)
+    batch.commit()
+    return dict(batch.stats, failed=failed, seconds=time.perf_counter() - start, peak_rss_mb=_peak_rss_mb())
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def history_files(directory):
+    with os.scandir(directory) as entries:
+        return sorted(e.path for e in entries if e.is_file() and e.name.endswith(HISTORY_FILE_SUFFIX))
+
+
+def run_import(customers_path=None, history_dir=None, workers=LEGACY_IMPORT_WORKERS,
+               batch_size=LEGACY_IMPORT_BATCH_SIZE, files_per_task=LEGACY_IMPORT_FILES_PER_TASK,
+               tenant_id=DEFAULT_TENANT_ID) -> dict:
+    """
+    الصفوف كلها بتتكتب للـ tenant_id (الأرشيف القديم كان رقم واتساب واحد). العملاء الأول (ملف واحد، في الـ process دي) وبعدين ملفات التاريخ موزعة على workers process.
+    الملفات اللي خلصت في تشغيل قبل كده بتتساب، واللي وقفت في النص بتكمل من آخر batch.
+    """
+    from .migrations import upgrade
+    engine = _get_engine()
+    upgrade(engine)
+    start = time.perf_counter()
+    totals = {"customers": 0, "history": 0, "invalid": 0, "files": 0, "skipped_files": 0, "failed": []}
+    progress = load_progress(engine)
+
+    if customers_path:
+        stats = import_files("customers", [customers_path], progress, batch_size, engine, tenant_id)
+        totals["customers"] += stats["rows"]
+        totals["invalid"] += stats["invalid"]
+        totals["failed"] += stats["failed"]
+        logger.info(f"Imported {stats['rows']} customer(s) from {customers_path} in {stats['seconds']:.1f}s")
+
+    if history_dir:
+        paths = history_files(history_dir)
+        pending = [p for p in paths if not progress.get(source_name("history", p, tenant_id), {}).get("completed")]
+        totals["skipped_files"] = len(paths) - len(pending)
+        tasks = list(_chunks(pending, max(1, files_per_task)))
+        progress = {s: v for s, v in progress.items() if s.startswith("history:") and not v["completed"]}
+
+        def record(stats):
+            totals["history"] += stats["rows"]
+            totals["invalid"] += stats["invalid"]
+            totals["files"] += stats["files"]
+            totals["failed"] += stats["failed"]
+            totals["worker_peak_rss_mb"] = max(totals.get("worker_peak_rss_mb", 0), stats["peak_rss_mb"])
+            logger.info(f"History: {totals['files']}/{len(pending)} file(s), {totals['history']} row(s)")
+
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                record(import_files("history", task, progress, batch_size, engine, tenant_id))
+        else:
+            engine.dispose()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(import_files, "history", task, progress, batch_size, None, tenant_id)
+                           for task in tasks]
+                for future in as_completed(futures):
+                    record(future.result())
+
+    totals["seconds"] = time.perf_counter() - start
+    rows = totals["customers"] + totals["history"]
+    totals["rows_per_second"] = rows / totals["seconds"] if totals["seconds"] else 0.0
+    totals["peak_rss_mb"] = max(_peak_rss_mb(), totals.get("worker_peak_rss_mb", 0))
+    return totals
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m utils.legacy_import",
+                                     description="Bulk import the legacy JSON customer and history files.")
+    parser.add_argument("--customers", help="ملف customer_data.json")
+    parser.add_argument("--history-dir", help="فولدر ملفات <phone>_history.json")
+    parser.add_argument("--workers", type=int, default=LEGACY_IMPORT_WORKERS, help="processes لملفات التاريخ")
+    parser.add_argument("--batch-size", type=int, default=LEGACY_IMPORT_BATCH_SIZE, help="صفوف لكل transaction")
+    parser.add_argument("--files-per-task", type=int, default=LEGACY_IMPORT_FILES_PER_TASK)
+    parser.add_argument("--tenant", default=DEFAULT_TENANT_ID, help="الـ tenant اللي الأرشيف ده بتاعه (TENANTS_FILE)")
+    parser.add_argument("--status", action="store_true", help="اعرض التقدم المتسجل بس")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.status:
+        from .migrations import upgrade
+        upgrade(_get_engine())
+        progress = load_progress(_get_engine())
+        completed = sum(1 for state in progress.values() if state["completed"])
+        print(f"{completed}/{len(progress)} source(s) completed, "
+              f"{sum(s['rows'] for s in progress.values())} row(s), {sum(s['invalid'] for s in progress.values())} invalid")
+        for source, state in sorted(progress.items()):
+            if not state["completed"]:
+                print(f"  in progress: {source} at item {state['position']}")
+        return 0
+    if not args.customers and not args.history_dir:
+        parser.error("nothing to import: pass --customers and/or --history-dir")
+
+    totals = run_import(args.customers, args.history_dir, args.workers, args.batch_size, args.files_per_task,
+                        args.tenant)
+    print(f"Imported {totals['customers']} customer(s) and {totals['history']} history row(s) "
+          f"from {totals['files']} file(s) ({totals['skipped_files']} already done) in {totals['seconds']:.1f}s: "
+          f"{totals['rows_per_second']:,.0f} rows/s, peak RSS {totals['peak_rss_mb']:.0f} MB, "
+          f"{totals['invalid']} invalid item(s) skipped", file=sys.stderr)
+    for path in totals["failed"]:
+        print(f"  failed: {path}", file=sys.stderr)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,362 @@
+# utils/llm_gateway.py
+import os
+import re
+import json
+import time
+import asyncio
+import random
+import logging
+import threading
+from collections import deque
+
+from utils.metrics import record_llm_usage
+from utils.lazy_imports import LazyModule
+
+openai = LazyModule("openai")
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات الـ gateway ---
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 20))       # أقصى وقت للنداء كله بالـ retries
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 10))         # أقصى وقت لمحاولة واحدة
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 8))
+# الـ circuit breaker بيفتح لو نسبة الأخطاء في آخر LLM_BREAKER_WINDOW ثانية عدّت الحد
+LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", 60))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", 10))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+
+# أخطاء مؤقتة تستاهل retry وبتتحسب على الـ circuit breaker (دالة عشان openai يفضل lazy لحد أول نداء)
+def _transient_errors():
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+_SEGMENT_BOUNDARY = re.compile(r"(\n\n|(?<=[.!?؟])\s)")
+
+
+class CircuitOpenError(Exception):
+    """الـ circuit مفتوح: مفيش نداء هيروح لـ OpenAI لحد ما الـ cooldown يخلص."""
+
+
+class DeadlineExceeded(Exception):
+    """الوقت المسموح للنداء خلص قبل ما نوصل لرد."""
+
+
+class CircuitBreaker:
+    """closed -> open (نسبة أخطاء عالية) -> half_open (محاولة تجريبية واحدة) -> closed/open."""
+
+    def __init__(self, window: float = LLM_BREAKER_WINDOW, min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 error_rate: float = LLM_BREAKER_ERROR_RATE, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._events = deque()  # (timestamp, ok)
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._events and self._events[0][0] < now - self.window:
+            self._events.popleft()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "half_open":
+                self._trial_in_flight = False
+                if ok:
+                    self.state = "closed"
+                    self._events.clear()
+                    logger.info("LLM circuit breaker closed again after a successful trial call.")
+                else:
+                    self._open(now)
+                return
+            self._events.append((now, ok))
+            self._trim(now)
+            failures = sum(1 for _, success in self._events if not success)
+            if (self.state == "closed" and len(self._events) >= self.min_calls
+                    and failures / len(self._events) >= self.error_rate):
+                self._open(now)
+
+    def _open(self, now):
+        self.state = "open"
+        self._opened_at = now
+        logger.error(f"LLM circuit breaker opened; short-circuiting calls for {self.cooldown:.0f}s.")
+
+
+def _retry_after_seconds(error) -> float:
+    """يقرا Retry-After (أو retry-after-ms) من رد OpenAI لو موجود."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _completion_result(response):
+    usage = getattr(response, "usage", None)
+    record_llm_usage(usage)
+    return response.choices[0].message.content.strip(), getattr(usage, "total_tokens", 0) or 0
+
+
+_STREAM_DONE = object()
+
+
+def _stream_line_delta(line: str, request):
+    """
+    نص الـ delta من سطر SSE واحد في stream بتاع chat.completions (أو _STREAM_DONE في الآخر). بنقرا الـ JSON
+    بنفسنا بدل ما الـ SDK يبني pydantic models لكل chunk: ده كان أغلى جزء في الـ CPU مع streams كتير مع بعض.
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return _STREAM_DONE
+    chunk = json.loads(data)
+    error = chunk.get("error")
+    if error:
+        raise openai.APIError(error.get("message") or "OpenAI stream error", request, body=error)
+    choices = chunk.get("choices")
+    return (choices[0].get("delta") or {}).get("content") if choices else None
+
+
+def _cut_segment(buffer: str, min_chars: int):
+    """يرجع (segment, باقي الـ buffer) عند آخر حد جملة/فقرة بعد min_chars، أو (None, buffer) لو لسه."""
+    if len(buffer) < min_chars:
+        return None, buffer
+    cut = None
+    for match in _SEGMENT_BOUNDARY.finditer(buffer):
+        if match.end() >= min_chars:
+            cut = match.end()
+    if not cut:
+        return None, buffer
+    return buffer[:cut].strip(), buffer[cut:]
+
+
+def iter_segments(deltas, min_chars: int = 80):
+    """
+    بيجمع الـ deltas اللي جاية من الـ stream لأجزاء كاملة (جملة/فقرة) عشان أول جزء
+    يتبعت أول ما يخلص بدل ما نستنى الرد كله.
+    """
+    buffer = ""
+    for delta in deltas:
+        segment, buffer = _cut_segment(buffer + delta, min_chars)
+        if segment:
+            yield segment
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def aiter_segments(deltas, min_chars: int = 80):
+    """نفس iter_segments على async iterator (astream)."""
+    buffer = ""
+    async for delta in deltas:
+        segment, buffer = _cut_segment(buffer + delta, min_chars)
+        if segment:
+            yield segment
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class LLMGateway:
+    """
+    غلاف حوالين OpenAI: deadline لكل نداء، retries محدودة بـ backoff بتحترم Retry-After،
+    circuit breaker، ووضع streaming.
+    """
+
+    def __init__(self, client_getter, breaker: CircuitBreaker = None,
+                 deadline: float = LLM_DEADLINE_SECONDS, request_timeout: float = LLM_REQUEST_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self._client_getter = client_getter
+        self.breaker = breaker or CircuitBreaker()
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+
+    def _client(self, timeout: float):
+        # الـ retries بتاعتنا بدل retries الـ SDK عشان نتحكم في الـ deadline
+        return self._client_getter().with_options(timeout=timeout, max_retries=0)
+
+    def _backoff(self, attempt: int, error) -> float:
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+        retry_after = _retry_after_seconds(error)
+        return max(delay, retry_after) if retry_after else delay
+
+    def complete(self, **params):
+        """chat.completions.create مع الـ deadline/retries/breaker؛ يرجع (text, total_tokens)."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record(False)
+                raise DeadlineExceeded(f"LLM call exceeded {self.deadline:.1f}s deadline")
+            try:
+                response = self._client(min(self.request_timeout, remaining)).chat.completions.create(**params)
+            except _transient_errors() as e:
+                delay = self._backoff(attempt, e)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.breaker.record(False)
+                    raise
+                logger.warning(f"Transient OpenAI error ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s.")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except openai.APIStatusError:
+                # 4xx: OpenAI شغال بس الطلب نفسه فيه مشكلة (key/parameters)، مش عطل يفتح الـ circuit
+                self.breaker.record(True)
+                raise
+            except Exception:
+                self.breaker.record(False)
+                raise
+            self.breaker.record(True)
+            return _completion_result(response)
+
+    async def acomplete(self, **params):
+        """نسخة async من complete؛ client_getter لازم يرجع openai.AsyncOpenAI."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record(False)
+                raise DeadlineExceeded(f"LLM call exceeded {self.deadline:.1f}s deadline")
+            try:
+                response = await self._client(min(self.request_timeout, remaining)).chat.completions.create(**params)
+            except _transient_errors() as e:
+                delay = self._backoff(attempt, e)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.breaker.record(False)
+                    raise
+                logger.warning(f"Transient OpenAI error ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except openai.APIStatusError:
+                self.breaker.record(True)
+                raise
+            except Exception:
+                self.breaker.record(False)
+                raise
+            self.breaker.record(True)
+            return _completion_result(response)
+
+    def stream(self, **params):
+        """
+        Generator بيطلع نص الرد حتة حتة. الـ retry بيحصل بس قبل أول chunk
+        (بعد كده جزء من الرد يكون اتبعت خلاص).
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record(False)
+                raise DeadlineExceeded(f"LLM call exceeded {self.deadline:.1f}s deadline")
+            started = False
+            try:
+                client = self._client(min(self.request_timeout, remaining))
+                with client.chat.completions.with_streaming_response.create(stream=True, **params) as response:
+                    for line in response.iter_lines():
+                        if time.monotonic() > deadline:
+                            raise DeadlineExceeded(f"LLM stream exceeded {self.deadline:.1f}s deadline")
+                        delta = _stream_line_delta(line, response.http_request)
+                        if delta is _STREAM_DONE:
+                            break
+                        if delta:
+                            started = True
+                            yield delta
+                self.breaker.record(True)
+                return
+            except _transient_errors() as e:
+                delay = self._backoff(attempt, e)
+                if started or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.breaker.record(False)
+                    raise
+                logger.warning(f"Transient OpenAI stream error ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s.")
+                time.sleep(delay)
+                attempt += 1
+            except openai.APIStatusError:
+                self.breaker.record(True)
+                raise
+            except GeneratorExit:
+                # اللي بيقرا الـ stream قفله بدري، ده مش خطأ من OpenAI
+                self.breaker.record(True)
+                raise
+            except Exception:
+                self.breaker.record(False)
+                raise
+
+    async def astream(self, **params):
+        """
+        نسخة async من stream (async generator). لو اللي بيقرا قفل بدري (العميل قفل الـ SSE) الـ response
+        بتاع OpenAI بيتقفل مع خروجنا من الـ async with بدل ما يفضل شاغل connection لحد آخر الرد.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record(False)
+                raise DeadlineExceeded(f"LLM call exceeded {self.deadline:.1f}s deadline")
+            started = False
+            try:
+                client = self._client(min(self.request_timeout, remaining))
+                async with client.chat.completions.with_streaming_response.create(stream=True, **params) as response:
+                    async for line in response.iter_lines():
+                        if time.monotonic() > deadline:
+                            raise DeadlineExceeded(f"LLM stream exceeded {self.deadline:.1f}s deadline")
+                        delta = _stream_line_delta(line, response.http_request)
+                        if delta is _STREAM_DONE:
+                            break
+                        if delta:
+                            started = True
+                            yield delta
+                self.breaker.record(True)
+                return
+            except _transient_errors() as e:
+                delay = self._backoff(attempt, e)
+                if started or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.breaker.record(False)
+                    raise
+                logger.warning(f"Transient OpenAI stream error ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+            except openai.APIStatusError:
+                self.breaker.record(True)
+                raise
+            except GeneratorExit:
+                self.breaker.record(True)
+                raise
+            except Exception:
+                self.breaker.record(False)
+                raise
@@ -0,0 +1,211 @@
+# utils/logging_setup.py
+# اللوج كله بيعدي على QueueHandler: الـ thread اللي بيعالج الطلب بيحط الـ record في طابور وبس،
+# و thread في الخلفية (QueueListener) هو اللي بيعمل format (JSON) + redaction + الكتابة على الـ stream.
+# request_id / message_id بيتاخدوا من contextvars فبيشتغلوا مع الـ threads والـ asyncio tasks.
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # لو اتملى الـ records الزيادة بتترمي بدل ما الطلب يستنى
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() == "true"
+# نسبة الـ payloads (webhook body / ردود Graph API) اللي بتتكتب كاملة في اللوج (بعد الـ redaction)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+_log_context = contextvars.ContextVar("log_context", default={})
+
+# أرقام تليفونات (8-15 رقم) مش جزء من كلمة أو id أطول
+_PHONE_RE = re.compile(r"(?<![\w.])\+?\d{8,15}(?!\w|\.\d)")
+# مفاتيح الـ payload اللي قيمتها بيانات عميل (Graph API / webhook)
+_REDACTED_KEYS = {"body", "text", "caption", "name", "formatted_name"}
+_PHONE_KEYS = {"from", "wa_id", "to", "input", "recipient_id", "display_phone_number"}
+
+
+def mask_phone(value) -> str:
+    value = str(value)
+    return f"***{value[-4:]}" if len(value) > 4 else "***"
+
+
+def redact_text(text: str) -> str:
+    """يخفي أرقام التليفونات في أي نص (بيتنادى على الرسالة النهائية في الـ formatter)."""
+    return _PHONE_RE.sub(lambda m: mask_phone(m.group()), text) if LOG_REDACT and text else text
+
+
+def body_for_log(text) -> str:
+    """نص رسالة عميل/رد بوت للّوج: طوله بس، أو النص نفسه لو LOG_REDACT مقفول."""
+    if not LOG_REDACT:
+        return text
+    return f"<{len(text or '')} chars>"
+
+
+def redact_payload(value):
+    """نسخة من الـ payload (dict/list) من غير نصوص الرسايل وأرقام التليفونات."""
+    if not LOG_REDACT:
+        return value
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            if key in _REDACTED_KEYS and isinstance(item, str):
+                redacted[key] = body_for_log(item)
+            elif key in _PHONE_KEYS and isinstance(item, (str, int)):
+                redacted[key] = mask_phone(item)
+            else:
+                redacted[key] = redact_payload(item)
+        return redacted
+    if isinstance(value, list):
+        return [redact_payload(item) for item in value]
+    return value
+
+
+def log_payload(logger, label: str, payload, level: int = logging.INFO, sample_rate: float = None):
+    """يكتب payload كامل (redacted) لنسبة sample_rate من النداءات بس؛ الباقي مفيش فيه أي json.dumps."""
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or not logger.isEnabledFor(level) or (rate < 1 and random.random() >= rate):
+        return
+    if isinstance(payload, (dict, list)):
+        payload = json.dumps(redact_payload(payload), ensure_ascii=False)
+    logger.log(level, f"{label}: {payload}")
+
+
+@contextmanager
+def log_context(**fields):
+    """with log_context(request_id=...): كل اللوج جوه البلوك ده (في نفس الـ thread/task) بيتكتب معاه الحقول دي."""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def current_log_context() -> dict:
+    return _log_context.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """سطر JSON لكل record: ts, level, logger, message + حقول الـ context + exception لو فيه."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact_text(record.getMessage()),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        if record.exc_info:
+            entry["exception"] = redact_text(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry["exception"] = redact_text(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context_text)s: %(message)s")
+
+    def format(self, record):
+        context = getattr(record, "context", None) or {}
+        record.context_text = "".join(f" {key}={value}" for key, value in context.items())
+        return redact_text(super().format(record))
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    QueueHandler أخف من الأصلي: بيثبّت الرسالة و الـ context بس (الـ format في الـ listener)،
+    ولو الطابور مليان بيرمي الـ record ويعدّه بدل ما يوقف الطلب.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        record.context = _log_context.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _ContextFilter(logging.Filter):
+    """لما اللوج sync (من غير queue) بنزود الـ context على الـ record مباشرة."""
+
+    def filter(self, record):
+        record.context = _log_context.get()
+        return True
+
+
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(level: str = None, fmt: str = None, use_queue: bool = None, stream=None):
+    """
+    يظبط الـ root logger مرة واحدة للـ process (بيتنادى من create_app). لو اتنادى تاني بيبدّل الإعداد القديم.
+    """
+    global _listener, _queue_handler
+    level = level or LOG_LEVEL
+    fmt = fmt or LOG_FORMAT
+    use_queue = LOG_ASYNC if use_queue is None else use_queue
+
+    with _configure_lock:
+        shutdown_logging()
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        if use_queue:
+            _queue_handler = ContextQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+            _listener.start()
+            root.addHandler(_queue_handler)
+        else:
+            output.addFilter(_ContextFilter())
+            root.addHandler(output)
+        root.setLevel(level)
+    return root
+
+
+def shutdown_logging():
+    """يفضّي الطابور ويوقف الـ listener (بيتنادى من atexit ومن configure_logging)."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def _logging_collector():
+    return [("log_records_dropped", "gauge", "Log records dropped because the log queue was full.",
+             [({}, dropped_records())])]
+
+
+registry.register_collector(_logging_collector)
+atexit.register(shutdown_logging)
@@ -0,0 +1,111 @@
+# utils/message_burst.py
+# عملاء واتساب بيبعتوا كذا رسالة قصيرة ورا بعض ("hi" / "I want" / "a chatbot" / "price?")، وكل رسالة كانت
+# بتاخد FAQ lookup وتاريخ و OpenAI completion ورد لوحدها. هنا بنجمع رسايل نفس الرقم اللي بتوصل في
+# MESSAGE_BURST_WINDOW_MS من بعض ونرد عليهم مرة واحدة (كل رسالة بتتسجل في التاريخ لوحدها برضه).
+#
+#   inline / asyncio: أول رسالة في الـ burst بتستنى لحد ما العميل يهدى الـ window (أو MESSAGE_BURST_MAX_WAIT_MS)
+#                     وبتعالج الكل، والرسايل اللي بتيجي وراها بترجع 'merged' على طول. ده جوه الـ process بس.
+#   queue:            الرسايل بتستنى في الطابور، والـ worker بياخد رسايل العميل كلها مرة واحدة (queue_policy).
+import os
+import time
+import asyncio
+import threading
+
+from .message_queue import BurstPolicy
+
+MESSAGE_BURST_WINDOW_MS = float(os.getenv("MESSAGE_BURST_WINDOW_MS", 0))  # 0 = مقفول (كل رسالة ليها رد زي الأول)
+MESSAGE_BURST_MAX_WAIT_MS = float(os.getenv("MESSAGE_BURST_MAX_WAIT_MS", 5000))  # عميل مبيبطلش كتابة
+MESSAGE_BURST_MAX_MESSAGES = int(os.getenv("MESSAGE_BURST_MAX_MESSAGES", 10))
+
+
+def merge_burst(bodies) -> str:
+    """الـ turn المدموج اللي بيتبعت للـ FAQ و OpenAI: الرسايل بالترتيب سطر تحت سطر."""
+    return "\n".join(body.strip() for body in bodies)
+
+
+class _Burst:
+    __slots__ = ("bodies", "started", "last", "wakeup")
+
+    def __init__(self, bodies, now, wakeup):
+        self.bodies = list(bodies)
+        self.started = now
+        self.last = now
+        self.wakeup = wakeup
+
+    def deadline(self, window, max_wait):
+        return min(self.last + window, self.started + max_wait)
+
+
+class BurstCollector:
+    def __init__(self, window_ms: float = MESSAGE_BURST_WINDOW_MS, max_wait_ms: float = MESSAGE_BURST_MAX_WAIT_MS,
+                 max_messages: int = MESSAGE_BURST_MAX_MESSAGES):
+        self.window = max(window_ms, 0) / 1000
+        self.max_wait = max(max_wait_ms / 1000, self.window)
+        self.max_messages = max(max_messages, 1)
+        self._lock = threading.Lock()
+        self._bursts = {}  # phone -> _Burst مفتوح (اللي بيستنى عليه أول رسالة)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def queue_policy(self):
+        return BurstPolicy(self.window, self.max_wait, self.max_messages) if self.enabled else None
+
+    def _join(self, phone, bodies, wakeup):
+        """يرجع (burst, leader). لو فيه burst مفتوح للرقم الرسايل بتتضاف له (لو لسه فيه مكان)."""
+        now = time.monotonic()
+        with self._lock:
+            burst = self._bursts.get(phone)
+            if burst is not None and len(burst.bodies) + len(bodies) <= self.max_messages:
+                burst.bodies.extend(bodies)
+                burst.last = now
+                burst.wakeup()
+                return burst, False
+            burst = _Burst(bodies, now, wakeup)
+            self._bursts[phone] = burst  # burst مليان بيتقفل للي جاي ويفضل لصاحبه
+            return burst, True
+
+    def _remaining(self, phone, burst):
+        """الوقت الباقي للـ leader؛ لما يخلص الـ burst بيتشال عشان الرسايل الجاية تبدأ burst جديد."""
+        with self._lock:
+            remaining = burst.deadline(self.window, self.max_wait) - time.monotonic()
+            if remaining > 0 and len(burst.bodies) < self.max_messages:
+                return remaining
+            if self._bursts.get(phone) is burst:
+                del self._bursts[phone]
+            return 0
+
+    def collect(self, phone, bodies):
+        """
+        bodies: رسايل وصلت مع بعض من نفس الرقم. يرجع كل رسايل الـ burst (بالترتيب، bodies في الأول) لو
+        الـ caller ده هو اللي هيرد، أو None لو اتضافوا لـ burst تاني مستني.
+        """
+        if not self.enabled:
+            return list(bodies)
+        event = threading.Event()
+        burst, leader = self._join(phone, bodies, event.set)
+        if not leader:
+            return None
+        while True:
+            remaining = self._remaining(phone, burst)
+            if remaining <= 0:
+                return burst.bodies
+            event.wait(remaining)
+            event.clear()
+
+    async def acollect(self, phone, bodies):
+        """نفس collect للـ event loop: الـ leader بيعمل asyncio.sleep لحد الـ deadline بدل ما يحجز thread."""
+        if not self.enabled:
+            return list(bodies)
+        burst, leader = self._join(phone, bodies, lambda: None)
+        if not leader:
+            return None
+        while True:
+            remaining = self._remaining(phone, burst)
+            if remaining <= 0:
+                return burst.bodies
+            await asyncio.sleep(remaining)
+
+
+burst_collector = BurstCollector()
@@ -0,0 +1,344 @@
+# utils/message_processor.py
+# معالجة رسالة العميل من غير ما يفرق معاها جت منين: أمر تغيير اللغة، خطوات الـ onboarding، الـ FAQ و OpenAI،
+# والتاريخ والـ burst والـ lock بتاع العميل. القناة بتحدد بس إزاي الرد بيوصل:
+#   واتساب (routes/webhook.py): process_messages(channel, ...) والـ Channel بيبعت الرد كله أو على أجزاء
+#   الويب (routes/chat.py):     stream_message(...) generator بيطلع الرد حتة حتة والـ route بيكتبه SSE
+# ولكل دالة نسخة async (a...) لوضع asyncio (asgi.py). كل ده جوه tenant_context الـ caller (utils/tenants.py):
+# الـ config والتاريخ بتوع الـ tenant، والـ lock والـ burst بمفتاح scoped_key(user_id).
+import asyncio
+import logging
+
+from .db_helpers import (
+    add_or_update_customer,
+    get_customer,
+    add_message,
+    add_messages,
+    get_recent_conversation,
+    aadd_message,
+    aadd_messages,
+    aadd_or_update_customer,
+    aget_customer,
+    aget_recent_conversation,
+)
+from .helpers import get_reply_from_json, get_static_reply, render_onboarding_reply
+from .tenants import current_config, scoped_key
+from .openai_logic import (
+    generate_openai_response,
+    stream_openai_response,
+    agenerate_openai_response,
+    astream_openai_response,
+)
+from .conversation_context import CONTEXT_MAX_TURNS
+from .completion_cache import is_context_dependent
+from .metrics import timed, REPLY_SOURCE, BURST_REPLIES_SAVED
+from .logging_setup import body_for_log
+from .customer_lock import customer_locks
+from .message_burst import burst_collector, merge_burst
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE_CHANGE_COMMANDS = ("تغيير اللغة", "change language")
+
+
+class Reply:
+    """
+    الرد اللي اتحدد لرسالة العميل قبل ما يتسلم. text رد جاهز، أو deltas (رد OpenAI وهو بيتولد: generator
+    أو async generator) وبعده suffix (التوقيع). status هو اللي بيرجع في رد الـ webhook.
+    """
+
+    __slots__ = ("status", "text", "deltas", "suffix")
+
+    def __init__(self, status, text=None, deltas=None, suffix=""):
+        self.status = status
+        self.text = text
+        self.deltas = deltas
+        self.suffix = suffix
+
+    def pieces(self):
+        if self.deltas is None:
+            yield self.text
+            return
+        try:
+            yield from self.deltas
+        finally:
+            # لو اللي بيقرا وقف في النص (العميل قفل الصفحة) الـ stream بتاع OpenAI بيتقفل معاه
+            self.deltas.close()
+        if self.suffix:
+            yield self.suffix
+
+    async def apieces(self):
+        if self.deltas is None:
+            yield self.text
+            return
+        try:
+            async for delta in self.deltas:
+                yield delta
+        finally:
+            await self.deltas.aclose()
+        if self.suffix:
+            yield self.suffix
+
+
+class Channel:
+    """
+    القناة اللي الردود بتتبعت عليها (لازم send). stream_llm=True يعني رد OpenAI بيتطلب stream والقناة
+    بتسلمه أول بأول في deliver. deliver/adeliver بيرجعوا النص اللي بيتسجل في التاريخ.
+    """
+
+    name = "channel"
+    stream_llm = False
+
+    def send(self, user_id, text):
+        raise NotImplementedError
+
+    async def asend(self, user_id, text):
+        await asyncio.to_thread(self.send, user_id, text)
+
+    def deliver(self, user_id, reply) -> str:
+        text = "".join(reply.pieces())
+        self.send(user_id, text)
+        return text
+
+    async def adeliver(self, user_id, reply) -> str:
+        text = "".join([piece async for piece in reply.apieces()])
+        await self.asend(user_id, text)
+        return text
+
+
+# ---------------------- تحديد الرد --------------------- #
+def plan_onboarding(msg_body, user_data):
+    """
+    يحدد رد خطوة الـ onboarding والتعديلات المطلوبة على العميل من غير ما يكتب في قاعدة البيانات،
+    عشان نفس المنطق يشتغل مع الـ db_helpers العادية والـ async. يرجع (reply, updates).
+    الخطوات نفسها متعرفة في config_data/onboarding.json (utils/onboarding.py).
+    """
+    step = current_config().onboarding.step(user_data, msg_body)
+    return render_onboarding_reply(step, user_data), step.updates
+
+@timed("onboarding")
+def handle_onboarding(phone, msg_body, user_data):
+    reply, updates = plan_onboarding(msg_body, user_data)
+    if updates:
+        add_or_update_customer(phone, **updates)
+    return reply
+
+def _is_language_change(msg_body):
+    return msg_body.strip() in LANGUAGE_CHANGE_COMMANDS
+
+def _count_reply(static_answer, merged):
+    REPLY_SOURCE.inc("faq" if static_answer else "llm")
+    if merged > 1:
+        BURST_REPLIES_SAVED.inc("faq" if static_answer else "llm", amount=merged - 1)
+
+def prepare_reply(user_id, msg_body, merged=1, stream=False):
+    """
+    بيحدد رد الرسالة ويكتب تعديلات العميل (اللغة/خطوة الـ onboarding) من غير ما يبعت حاجة. يرجع Reply؛
+    stream=True يعني رد OpenAI بيرجع deltas بدل النص كله.
+    """
+    user_data = get_customer(user_id)
+    onboarding_step = user_data.onboarding_step if user_data and user_data.onboarding_step else "awaiting_language"
+
+    # --- التعامل مع تغيير اللغة في أي وقت ---
+    if _is_language_change(msg_body):
+        state = add_or_update_customer(user_id, onboarding_step="awaiting_language_selection")
+        REPLY_SOURCE.inc("language_switch")
+        return Reply('language_switch', get_reply_from_json(
+            "language_change_prompt", state.language if state and state.language else "en"))
+
+    # --- العميل في خطوات الـ onboarding ---
+    if onboarding_step != "completed":
+        reply = handle_onboarding(user_id, msg_body, user_data)
+        logger.info(f"Onboarding step '{onboarding_step}' processed for user {user_id}.")
+        REPLY_SOURCE.inc("onboarding")
+        return Reply('onboarding_handled', reply)
+
+    # -------- الردود بعد الانتهاء من الـ onboarding -------- #
+    current_lang = user_data.language if user_data and user_data.language else "en"
+    static_answer = get_static_reply(msg_body, current_lang)
+    _count_reply(static_answer, merged)
+    if static_answer:
+        return Reply('reply_sent', static_answer + get_reply_from_json("signature_static", current_lang))
+
+    conversation_hist = get_recent_conversation(user_id, CONTEXT_MAX_TURNS)
+    use_cache = not is_context_dependent(msg_body)
+    signature = get_reply_from_json("signature_openai", current_lang)
+    if stream:
+        deltas = stream_openai_response(user_id, msg_body, current_lang, conversation_hist, use_cache=use_cache)
+        return Reply('reply_sent', deltas=deltas, suffix=signature)
+    ai_response = generate_openai_response(user_id, msg_body, current_lang, conversation_hist, use_cache=use_cache)
+    return Reply('reply_sent', ai_response + signature)
+
+async def aprepare_reply(user_id, msg_body, merged=1, stream=False):
+    """نسخة async من prepare_reply؛ مع stream=True الـ deltas بتبقى async generator."""
+    user_data = await aget_customer(user_id)
+    onboarding_step = user_data.onboarding_step if user_data and user_data.onboarding_step else "awaiting_language"
+
+    if _is_language_change(msg_body):
+        state = await aadd_or_update_customer(user_id, onboarding_step="awaiting_language_selection")
+        REPLY_SOURCE.inc("language_switch")
+        return Reply('language_switch', get_reply_from_json(
+            "language_change_prompt", state.language if state and state.language else "en"))
+
+    if onboarding_step != "completed":
+        reply, updates = plan_onboarding(msg_body, user_data)
+        if updates:
+            await aadd_or_update_customer(user_id, **updates)
+        logger.info(f"Onboarding step '{onboarding_step}' processed for user {user_id}.")
+        REPLY_SOURCE.inc("onboarding")
+        return Reply('onboarding_handled', reply)
+
+    current_lang = user_data.language if user_data and user_data.language else "en"
+    static_answer = get_static_reply(msg_body, current_lang)
+    _count_reply(static_answer, merged)
+    if static_answer:
+        return Reply('reply_sent', static_answer + get_reply_from_json("signature_static", current_lang))
+
+    conversation_hist = await aget_recent_conversation(user_id, CONTEXT_MAX_TURNS)
+    use_cache = not is_context_dependent(msg_body)
+    signature = get_reply_from_json("signature_openai", current_lang)
+    if stream:
+        deltas = astream_openai_response(user_id, msg_body, current_lang, conversation_hist, use_cache=use_cache)
+        return Reply('reply_sent', deltas=deltas, suffix=signature)
+    ai_response = await agenerate_openai_response(user_id, msg_body, current_lang, conversation_hist,
+                                                  use_cache=use_cache)
+    return Reply('reply_sent', ai_response + signature)
+
+def _error_text(user_data):
+    lang = user_data.language if user_data and user_data.language else 'en'
+    return get_reply_from_json("error_occurred_generic", lang)
+
+def _log_processing(user_id, msg_body, merged):
+    logger.info(f"Processing message from {user_id}: '{body_for_log(msg_body)}'"
+                + (f" ({merged} messages merged)" if merged > 1 else ""))
+
+# -------------------- القنوات اللي بتبعت الرد (push) -------------------- #
+def process_messages(channel, user_id, bodies, store_incoming=True, debounce=True):
+    """
+    رسايل متتالية من نفس العميل؛ يرجع status لكل رسالة. كل رسالة بتتسجل في التاريخ لوحدها، ومع
+    MESSAGE_BURST_WINDOW_MS الرسايل اللي بتوصل ورا بعض بتاخد رد واحد ('merged' للي اترد عليها مع غيرها).
+    debounce=False لو الرسايل اتجمعت خلاص (الطابور). رسايل نفس العميل بتتعالج واحدة واحدة حتى بين
+    الـ workers (utils/customer_lock.py).
+    """
+    if store_incoming:
+        add_messages([(user_id, "user", body) for body in bodies])
+    burst = burst_collector.collect(scoped_key(user_id), bodies) if debounce else list(bodies)
+    if burst is None:
+        logger.info(f"Merged {len(bodies)} message(s) from {user_id} into a pending burst.")
+        return ['merged'] * len(bodies)
+    with customer_locks.hold(user_id):
+        return _process_burst(channel, user_id, burst)[:len(bodies)]
+
+def _can_merge(user_data, bodies):
+    # خطوات الـ onboarding وأمر تغيير اللغة بيتعاملوا رسالة رسالة (كل رسالة بتحرك خطوة)
+    if not user_data or user_data.onboarding_step != "completed":
+        return False
+    return not any(_is_language_change(body) for body in bodies)
+
+def _process_burst(channel, user_id, bodies):
+    if len(bodies) == 1 or not _can_merge(get_customer(user_id), bodies):
+        return [process_message(channel, user_id, body) for body in bodies]
+    status = process_message(channel, user_id, merge_burst(bodies), merged=len(bodies))
+    return [status] + ['merged'] * (len(bodies) - 1)
+
+def process_message(channel, user_id, msg_body, merged=1):
+    """يرد على رسالة واحدة (أو burst مدموج) على القناة ويسجل الرد؛ يرجع الـ status."""
+    try:
+        _log_processing(user_id, msg_body, merged)
+        reply = prepare_reply(user_id, msg_body, merged, stream=channel.stream_llm)
+        text = channel.deliver(user_id, reply)
+        add_message(user_id, "assistant", text)
+        if reply.status == 'reply_sent':
+            logger.info(f"Regular reply sent to user {user_id}.")
+        return reply.status
+
+    except Exception as e:
+        logger.error(f"Unhandled error processing message from {user_id}: {e}", exc_info=True)
+        try:
+            error_msg = _error_text(get_customer(user_id))
+            if error_msg:
+                channel.send(user_id, error_msg)
+        except Exception as e_send:
+            logger.error(f"Failed to send generic error message to user after an exception: {e_send}", exc_info=True)
+        raise
+
+async def aprocess_messages(channel, user_id, bodies, store_incoming=True):
+    """نسخة async من process_messages."""
+    if store_incoming:
+        await aadd_messages([(user_id, "user", body) for body in bodies])
+    burst = await burst_collector.acollect(scoped_key(user_id), bodies)
+    if burst is None:
+        logger.info(f"Merged {len(bodies)} message(s) from {user_id} into a pending burst.")
+        return ['merged'] * len(bodies)
+    async with customer_locks.ahold(user_id):
+        return (await _aprocess_burst(channel, user_id, burst))[:len(bodies)]
+
+async def _aprocess_burst(channel, user_id, bodies):
+    if len(bodies) == 1 or not _can_merge(await aget_customer(user_id), bodies):
+        return [await aprocess_message(channel, user_id, body) for body in bodies]
+    status = await aprocess_message(channel, user_id, merge_burst(bodies), merged=len(bodies))
+    return [status] + ['merged'] * (len(bodies) - 1)
+
+async def aprocess_message(channel, user_id, msg_body, merged=1):
+    try:
+        _log_processing(user_id, msg_body, merged)
+        reply = await aprepare_reply(user_id, msg_body, merged, stream=channel.stream_llm)
+        text = await channel.adeliver(user_id, reply)
+        await aadd_message(user_id, "assistant", text)
+        if reply.status == 'reply_sent':
+            logger.info(f"Regular reply sent to user {user_id}.")
+        return reply.status
+
+    except Exception as e:
+        logger.error(f"Unhandled error processing message from {user_id}: {e}", exc_info=True)
+        try:
+            error_msg = _error_text(await aget_customer(user_id))
+            if error_msg:
+                await channel.asend(user_id, error_msg)
+        except Exception as e_send:
+            logger.error(f"Failed to send generic error message to user after an exception: {e_send}", exc_info=True)
+        raise
+
+# -------------------- القنوات اللي بتقرا الرد بنفسها (pull، SSE) -------------------- #
+def stream_message(user_id, msg_body):
+    """
+    Generator بيطلع ("delta", text) لكل حتة من الرد أول ما تتولد، وفي الآخر ("done", status)، أو
+    ("error", رسالة error_occurred_generic) لو حصل خطأ. رسالة العميل والرد بيتسجلوا في التاريخ،
+    و lock العميل فاضل محجوز لحد ما الرد يخلص. لو اللي بيقرا قفل في النص اللي اتبعت بس هو اللي بيتسجل.
+    """
+    try:
+        add_message(user_id, "user", msg_body)
+        with customer_locks.hold(user_id):
+            _log_processing(user_id, msg_body, 1)
+            reply = prepare_reply(user_id, msg_body, stream=True)
+            parts = []
+            try:
+                for piece in reply.pieces():
+                    parts.append(piece)
+                    yield "delta", piece
+            finally:
+                if parts:
+                    add_message(user_id, "assistant", "".join(parts))
+        yield "done", reply.status
+    except Exception as e:
+        logger.error(f"Unhandled error processing message from {user_id}: {e}", exc_info=True)
+        yield "error", _error_text(get_customer(user_id))
+
+async def astream_message(user_id, msg_body):
+    """نسخة async من stream_message (async generator)."""
+    try:
+        await aadd_message(user_id, "user", msg_body)
+        async with customer_locks.ahold(user_id):
+            _log_processing(user_id, msg_body, 1)
+            reply = await aprepare_reply(user_id, msg_body, stream=True)
+            parts = []
+            try:
+                async for piece in reply.apieces():
+                    parts.append(piece)
+                    yield "delta", piece
+            finally:
+                if parts:
+                    await aadd_message(user_id, "assistant", "".join(parts))
+        yield "done", reply.status
+    except Exception as e:
+        logger.error(f"Unhandled error processing message from {user_id}: {e}", exc_info=True)
+        yield "error", _error_text(await aget_customer(user_id))
@@ -0,0 +1,375 @@
+# utils/message_queue.py
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات الطابور (كلها من متغيرات البيئة) ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGE_QUEUE_PATH = os.getenv("MESSAGE_QUEUE_PATH", os.path.join(BASE_DIR, "message_queue.sqlite3"))
+MESSAGE_WORKERS = int(os.getenv("MESSAGE_WORKERS", 4))
+MESSAGE_WORKER_MODE = os.getenv("MESSAGE_WORKER_MODE", "thread").lower()  # thread | process
+MESSAGE_QUEUE_POLL_INTERVAL = float(os.getenv("MESSAGE_QUEUE_POLL_INTERVAL", 0.5))
+# أي رسالة فضلت "processing" أكتر من كده (مثلاً السيرفر وقع) بترجع للطابور تاني
+MESSAGE_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("MESSAGE_QUEUE_VISIBILITY_TIMEOUT", 300))
+# الـ workers بيرجّعوا الرسايل دي كل كام ثانية (مش بس وقت الـ start)، وإلا worker مات أو restart حصل قبل الـ
+# timeout يسيب الرسالة "processing" على طول و _CLAIM_SQL يوقف رسايل العميل ده كلها
+MESSAGE_QUEUE_REAP_INTERVAL = float(os.getenv("MESSAGE_QUEUE_REAP_INTERVAL", 30))
+# الرسالة اللي فشلت بتتعاد بعد backoff (BASE * 2^(attempts-1) بحد أقصى MAX ثانية) لحد MAX_ATTEMPTS محاولة،
+# وبعدها بس بتبقى 'failed'. نفس الحد على الرسايل اللي بتموّت الـ worker (requeue_stale) عشان متتعادش على طول
+MESSAGE_QUEUE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_QUEUE_MAX_ATTEMPTS", 5))
+MESSAGE_QUEUE_RETRY_BACKOFF = float(os.getenv("MESSAGE_QUEUE_RETRY_BACKOFF", 5))
+MESSAGE_QUEUE_RETRY_BACKOFF_MAX = float(os.getenv("MESSAGE_QUEUE_RETRY_BACKOFF_MAX", 300))
+
+QueuedJob = namedtuple("QueuedJob", ["id", "phone", "payload", "attempts"])
+# رسايل العميل المتتالية بتتاخد مع بعض: لما آخر رسالة تعدي عليها window ثانية من غير جديد،
+# أو أول رسالة تستنى max_wait، بحد أقصى max_messages رسالة في المرة
+BurstPolicy = namedtuple("BurstPolicy", ["window", "max_wait", "max_messages"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    available_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_message_queue_status_id ON message_queue (status, id);
+CREATE INDEX IF NOT EXISTS ix_message_queue_phone_status_id ON message_queue (phone, status, id);
+"""
+
+# أقدم رسالة pending (وعدّى الـ backoff بتاعها) لعميل مفيش له رسالة تانية تحت المعالجة ولا رسالة أقدم منتظرة،
+# وده اللي بيضمن إن رسايل نفس الرقم تتعالج بالترتيب حتى مع أكتر من worker/process.
+_CLAIM_SQL = """
+SELECT id, phone, payload, attempts FROM message_queue AS q
+WHERE q.status = 'pending'
+  AND (q.available_at IS NULL OR q.available_at <= ?)
+  AND NOT EXISTS (
+      SELECT 1 FROM message_queue AS o
+      WHERE o.phone = q.phone
+        AND (o.status = 'processing' OR (o.status = 'pending' AND o.id < q.id))
+  )
+ORDER BY q.id
+LIMIT 1
+"""
+
+
+# العميل (أقدم واحد) اللي رسايله الـ pending هديت أو استنت كفاية ومفيش له رسالة تحت المعالجة أو مستنية backoff
+_CLAIM_BURST_PHONE_SQL = """
+SELECT q.phone FROM message_queue AS q
+WHERE q.status = 'pending'
+  AND NOT EXISTS (
+      SELECT 1 FROM message_queue AS o
+      WHERE o.phone = q.phone
+        AND (o.status = 'processing' OR (o.status = 'pending' AND o.available_at > ?))
+  )
+GROUP BY q.phone
+HAVING MAX(q.created_at) <= ? OR MIN(q.created_at) <= ?
+ORDER BY MIN(q.id)
+LIMIT 1
+"""
+
+
+class PersistentMessageQueue:
+    """طابور رسائل على SQLite عشان الرسايل متضيعش لو السيرفر اتعمله restart."""
+
+    def __init__(self, path: str = MESSAGE_QUEUE_PATH, visibility_timeout: float = MESSAGE_QUEUE_VISIBILITY_TIMEOUT,
+                 reap_interval: float = MESSAGE_QUEUE_REAP_INTERVAL, max_attempts: int = MESSAGE_QUEUE_MAX_ATTEMPTS,
+                 retry_backoff: float = MESSAGE_QUEUE_RETRY_BACKOFF,
+                 retry_backoff_max: float = MESSAGE_QUEUE_RETRY_BACKOFF_MAX):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.reap_interval = reap_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self._next_reap = time.monotonic() + reap_interval
+        self._reap_lock = threading.Lock()
+        self._local = threading.local()
+        self._new_job = threading.Event()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        # طوابير اتعملت قبل الـ retry مفيهاش available_at
+        if "available_at" not in {row[1] for row in conn.execute("PRAGMA table_info(message_queue)")}:
+            conn.execute("ALTER TABLE message_queue ADD COLUMN available_at REAL")
+
+    # كل thread ليه connection خاص بيه (sqlite3 مش thread-safe على نفس الـ connection)
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        # IMMEDIATE بياخد write lock من الأول فمفيش اتنين workers ياخدوا نفس الرسالة
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, phone: str, payload: dict) -> int:
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT INTO message_queue (phone, payload, created_at) VALUES (?, ?, ?)",
+                (phone, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            job_id = cur.lastrowid
+        self._new_job.set()
+        return job_id
+
+    def enqueue_many(self, items) -> int:
+        """items: list of (phone, payload) — كلهم في transaction واحدة."""
+        if not items:
+            return 0
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO message_queue (phone, payload, created_at) VALUES (?, ?, ?)",
+                [(phone, json.dumps(payload, ensure_ascii=False), now) for phone, payload in items],
+            )
+        self._new_job.set()
+        return len(items)
+
+    def claim(self):
+        """يرجع QueuedJob أو None لو مفيش رسالة جاهزة."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(_CLAIM_SQL, (now,)).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE message_queue SET status = 'processing', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (now, row[0]),
+            )
+        return QueuedJob(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def claim_burst(self, policy: BurstPolicy) -> list:
+        """زي claim بس بيرجع كل رسايل العميل الـ pending (بالترتيب) مرة واحدة، أو [] لو مفيش عميل جاهز."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(_CLAIM_BURST_PHONE_SQL, (now, now - policy.window, now - policy.max_wait)).fetchone()
+            if not row:
+                return []
+            rows = conn.execute(
+                "SELECT id, phone, payload, attempts FROM message_queue "
+                "WHERE phone = ? AND status = 'pending' ORDER BY id LIMIT ?",
+                (row[0], max(policy.max_messages, 1)),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE message_queue SET status = 'processing', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now, r[0]) for r in rows],
+            )
+        return [QueuedJob(r[0], r[1], json.loads(r[2]), r[3] + 1) for r in rows]
+
+    def complete(self, job_id: int):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM message_queue WHERE id = ?", (job_id,))
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.retry_backoff * 2 ** max(attempts - 1, 0), self.retry_backoff_max)
+
+    def fail(self, job_id: int, error: str, payload: dict = None) -> str:
+        """
+        الرسالة بترجع pending بعد retry_delay لحد max_attempts محاولة، وبعدها بتفضل 'failed' في الجدول للمراجعة
+        (ومش بتوقف باقي رسايل العميل). payload لو اتغير في الـ handler (مثلاً stored) بيتحفظ للمحاولة الجاية.
+        يرجع الـ status الجديد.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts FROM message_queue WHERE id = ?", (job_id,)).fetchone()
+            attempts = row[0] if row else self.max_attempts
+            status = "pending" if attempts < self.max_attempts else "failed"
+            conn.execute(
+                "UPDATE message_queue SET status = ?, claimed_at = NULL, available_at = ?, last_error = ?, "
+                "payload = COALESCE(?, payload) WHERE id = ?",
+                (status, time.time() + self.retry_delay(attempts) if status == "pending" else None, error[:2000],
+                 json.dumps(payload, ensure_ascii=False) if payload is not None else None, job_id),
+            )
+        if status == "pending":
+            logger.warning(f"Queued message {job_id} will be retried in {self.retry_delay(attempts):.1f}s "
+                           f"(attempt {attempts}/{self.max_attempts}).")
+        return status
+
+    def requeue_stale(self) -> int:
+        """الرسايل اللي فضلت processing أكتر من visibility_timeout بترجع pending، إلا لو خلصت max_attempts."""
+        cutoff = time.time() - self.visibility_timeout
+        with self._transaction() as conn:
+            failed = conn.execute(
+                "UPDATE message_queue SET status = 'failed', claimed_at = NULL, "
+                "last_error = 'visibility timeout exceeded after max attempts' "
+                "WHERE status = 'processing' AND claimed_at < ? AND attempts >= ?",
+                (cutoff, self.max_attempts),
+            ).rowcount
+            count = conn.execute(
+                "UPDATE message_queue SET status = 'pending', claimed_at = NULL, available_at = NULL "
+                "WHERE status = 'processing' AND claimed_at < ?",
+                (cutoff,),
+            ).rowcount
+        if failed:
+            logger.error(f"Marked {failed} stale message(s) failed after {self.max_attempts} attempt(s).")
+        if count:
+            logger.warning(f"Requeued {count} stale message(s) left in 'processing'.")
+            self._new_job.set()
+        return count
+
+    def requeue_stale_if_due(self) -> int:
+        """requeue_stale مرة كل reap_interval (بين كل الـ threads اللي على نفس الـ queue)؛ الـ workers بينادوها في الـ loop."""
+        with self._reap_lock:
+            if time.monotonic() < self._next_reap:
+                return 0
+            self._next_reap = time.monotonic() + self.reap_interval
+        try:
+            return self.requeue_stale()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to requeue stale messages: {e}", exc_info=True)
+            return 0
+
+    def options(self) -> dict:
+        """الإعدادات اللي الـ worker processes بتفتح بيها نفس الطابور."""
+        return {"path": self.path, "visibility_timeout": self.visibility_timeout, "reap_interval": self.reap_interval,
+                "max_attempts": self.max_attempts, "retry_backoff": self.retry_backoff,
+                "retry_backoff_max": self.retry_backoff_max}
+
+    def stats(self) -> dict:
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) FROM message_queue GROUP BY status"
+        ).fetchall()
+        return dict(rows)
+
+    def wait_for_job(self, timeout: float):
+        # الـ Event بيصحّي الـ threads في نفس الـ process، والـ processes التانية بتعتمد على الـ polling
+        self._new_job.wait(timeout)
+        self._new_job.clear()
+
+
+def _burst_worker_loop(queue: PersistentMessageQueue, handler, stop_event, poll_interval: float, burst: BurstPolicy):
+    # الرسايل بتستنى الـ window في الطابور، فالـ polling لازم يبقى أسرع منها
+    poll_interval = min(poll_interval, max(burst.window / 2, 0.01))
+    while not stop_event.is_set():
+        queue.requeue_stale_if_due()
+        try:
+            jobs = queue.claim_burst(burst)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to claim jobs from message queue: {e}", exc_info=True)
+            time.sleep(poll_interval)
+            continue
+        if not jobs:
+            queue.wait_for_job(poll_interval)
+            continue
+        try:
+            handler([job.payload for job in jobs])
+            for job in jobs:
+                queue.complete(job.id)
+        except Exception as e:
+            logger.error(f"Queued burst {[job.id for job in jobs]} for {jobs[0].phone} failed: {e}", exc_info=True)
+            for job in jobs:
+                queue.fail(job.id, repr(e), job.payload)
+
+
+def _worker_loop(queue: PersistentMessageQueue, handler, stop_event, poll_interval: float, burst: BurstPolicy = None):
+    if burst is not None:
+        return _burst_worker_loop(queue, handler, stop_event, poll_interval, burst)
+    while not stop_event.is_set():
+        queue.requeue_stale_if_due()
+        try:
+            job = queue.claim()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to claim job from message queue: {e}", exc_info=True)
+            time.sleep(poll_interval)
+            continue
+        if job is None:
+            queue.wait_for_job(poll_interval)
+            continue
+        try:
+            handler(job.payload)
+            queue.complete(job.id)
+        except Exception as e:
+            logger.error(f"Queued message {job.id} for {job.phone} failed: {e}", exc_info=True)
+            queue.fail(job.id, repr(e), job.payload)
+
+
+def _process_entry(queue_options, handler, stop_event, poll_interval, burst=None):
+    # الـ engine بتاع SQLAlchemy اتورث من الـ parent بعد الـ fork، لازم كل process تفتح connections جديدة
+    try:
+        from utils.db import engine
+        engine.dispose(close=False)
+    except Exception:
+        pass
+    queue = PersistentMessageQueue(**queue_options)
+    _worker_loop(queue, handler, stop_event, poll_interval, burst)
+
+
+class MessageWorkerPool:
+    """
+    مجموعة workers (threads أو processes) بتفضّي الطابور وتنادي الـ handler لكل رسالة.
+    مع burst (BurstPolicy) الـ handler بياخد list بالـ payloads بتاعة رسايل العميل المتجمعة.
+    """
+
+    def __init__(self, queue: PersistentMessageQueue, handler, size: int = MESSAGE_WORKERS,
+                 mode: str = MESSAGE_WORKER_MODE, poll_interval: float = MESSAGE_QUEUE_POLL_INTERVAL,
+                 burst: BurstPolicy = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown worker mode '{mode}', expected 'thread' or 'process'.")
+        self.queue = queue
+        self.handler = handler
+        self.size = max(1, size)
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self._workers = []
+        self._stop_event = None
+
+    def start(self):
+        if self._workers:
+            return
+        self.queue.requeue_stale()
+        if self.mode == "process":
+            self._stop_event = multiprocessing.Event()
+            for i in range(self.size):
+                worker = multiprocessing.Process(
+                    target=_process_entry,
+                    args=(self.queue.options(), self.handler, self._stop_event, self.poll_interval, self.burst),
+                    name=f"message-worker-{i}",
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+        else:
+            self._stop_event = threading.Event()
+            for i in range(self.size):
+                worker = threading.Thread(
+                    target=_worker_loop,
+                    args=(self.queue, self.handler, self._stop_event, self.poll_interval, self.burst),
+                    name=f"message-worker-{i}",
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"Started {self.size} message {self.mode} worker(s) on queue {self.queue.path}.")
+
+    def stop(self, timeout: float = 10):
+        if not self._workers:
+            return
+        self._stop_event.set()
+        self.queue._new_job.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
@@ -0,0 +1,316 @@
+# utils/metrics.py
+# metrics خفيفة بصيغة Prometheus text (من غير dependency): histograms لكل مرحلة، counters،
+# و gauges بتتحسب وقت الـ scrape. كل process ليه أرقامه (مع gunicorn كل worker بيتعمله scrape لوحده).
+import os
+import sys
+import time
+import random
+import logging
+import inspect
+import threading
+import functools
+from bisect import bisect_left
+from collections import Counter as _TallyCounter
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "najdaigent")
+# profiler بالـ sampling للطلبات البطيئة: 0 = مقفول
+METRICS_PROFILE_SLOW_MS = float(os.getenv("METRICS_PROFILE_SLOW_MS", 0))
+METRICS_PROFILE_SAMPLE_RATE = float(os.getenv("METRICS_PROFILE_SAMPLE_RATE", 1.0))  # نسبة الطلبات اللي بتتراقب
+METRICS_PROFILE_INTERVAL_MS = float(os.getenv("METRICS_PROFILE_INTERVAL_MS", 5))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = f"{METRICS_PREFIX}_{name}" if METRICS_PREFIX else name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(tuple(str(v) for v in labelvalues), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}_total{_labels_text(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [counts per bucket..., +Inf count, sum]
+
+    def observe(self, value: float, *labelvalues):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(v) for v in labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labelvalues):
+        series = self._series.get(tuple(str(v) for v in labelvalues))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []  # دوال بترجع [(name, kind, help, [(labels dict, value)])] وقت الـ scrape
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                full_name = f"{METRICS_PREFIX}_{name}" if METRICS_PREFIX else name
+                lines.append(f"# HELP {full_name} {documentation}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{full_name}{_labels_text(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- الـ metrics نفسها ---
+STAGE_DURATION = registry.register(Histogram(
+    "stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"]))
+STAGE_ERRORS = registry.register(Counter(
+    "stage_errors", "Exceptions raised by each pipeline stage.", ["stage"]))
+REPLY_SOURCE = registry.register(Counter(
+    "replies", "Replies sent by source (faq, llm, onboarding, language_switch).", ["source"]))
+LLM_TOKENS = registry.register(Counter(
+    "openai_tokens", "OpenAI token usage reported in response.usage.", ["type"]))
+LLM_OUTCOMES = registry.register(Counter(
+    "openai_requests", "OpenAI calls by outcome (ok, cached, or the fallback/error kind).", ["outcome"]))
+BURST_REPLIES_SAVED = registry.register(Counter(
+    "burst_replies_saved", "Replies avoided by answering a burst of customer messages as one turn "
+    "(source=llm: OpenAI completions saved).", ["source"]))
+WHATSAPP_SENDS = registry.register(Counter(
+    "whatsapp_sends", "Graph API send attempts by HTTP status or transport error.", ["status"]))
+
+
+def record_llm_usage(usage):
+    """يسجل prompt/completion tokens من response.usage (أي object فيه الحقول دي)."""
+    if usage is None:
+        return
+    LLM_TOKENS.inc("prompt", amount=getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.inc("completion", amount=getattr(usage, "completion_tokens", 0) or 0)
+
+
+def timed(stage: str):
+    """Decorator بيسجل زمن الدالة (sync أو async) في stage_duration_seconds{stage=...}."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    STAGE_ERRORS.inc(stage)
+                    raise
+                finally:
+                    STAGE_DURATION.observe(time.perf_counter() - start, stage)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage)
+                raise
+            finally:
+                STAGE_DURATION.observe(time.perf_counter() - start, stage)
+        return wrapper
+    return decorator
+
+
+def _db_pool_collector():
+    """حالة الـ connection pool بتاع الـ engine (QueuePool بس عنده الأرقام دي)."""
+    from utils.db import engine
+    pool = engine.pool
+    samples = []
+    for field in ("size", "checkedin", "checkedout", "overflow"):
+        getter = getattr(pool, field, None)
+        if callable(getter):
+            samples.append(({"state": field}, getter()))
+    return [("db_pool_connections", "gauge", "SQLAlchemy connection pool state.", samples)] if samples else []
+
+
+def _completion_cache_collector():
+    from utils.completion_cache import completion_cache
+    stats = completion_cache.get_stats()
+    return [
+        ("completion_cache_events", "counter", "Completion cache lookups by result since start.",
+         [({"event": key}, stats[key]) for key in ("hits", "disk_hits", "coalesced", "misses")]),
+        ("completion_cache_saved_tokens", "counter", "Tokens not sent to OpenAI thanks to the completion cache.",
+         [({}, stats["saved_tokens"])]),
+        ("completion_cache_size", "gauge", "Completions held in the in-memory cache.", [({}, stats["size"])]),
+        ("completion_cache_hit_rate", "gauge", "Share of completion lookups served without a new OpenAI call.",
+         [({}, stats["hit_rate"])]),
+    ]
+
+
+registry.register_collector(_db_pool_collector)
+registry.register_collector(_completion_cache_collector)
+
+
+# ---------------------- profiler للطلبات البطيئة ---------------------- #
+class SlowRequestProfiler:
+    """
+    Sampling profiler: thread واحد بيبص على stack الـ threads اللي شغالة على request كل interval،
+    ولو الـ request طلع أبطأ من threshold بيكتب أكتر الـ stacks تكراراً في اللوج. لو مقفول مفيش أي overhead.
+    """
+
+    def __init__(self, threshold_ms: float = METRICS_PROFILE_SLOW_MS, interval_ms: float = METRICS_PROFILE_INTERVAL_MS,
+                 sample_rate: float = METRICS_PROFILE_SAMPLE_RATE, top: int = 5):
+        self.threshold = threshold_ms / 1000
+        self.interval = max(interval_ms, 1) / 1000
+        self.sample_rate = sample_rate
+        self.top = top
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _ensure_sampler(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._active.items())
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for thread_id, tally in watched:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 40:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                tally[";".join(reversed(stack))] += 1
+
+    def start(self):
+        """يرجع token (أو None لو الطلب ده مش متراقب)."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        self._ensure_sampler()
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = _TallyCounter()
+        return thread_id, time.perf_counter()
+
+    def stop(self, token, label: str = ""):
+        if token is None:
+            return
+        thread_id, started = token
+        with self._lock:
+            tally = self._active.pop(thread_id, None)
+        elapsed = time.perf_counter() - started
+        if tally is None or elapsed < self.threshold:
+            return
+        total = sum(tally.values()) or 1
+        lines = [f"Slow request {label} took {elapsed * 1000:.0f}ms; top sampled stacks ({total} samples):"]
+        for stack, count in tally.most_common(self.top):
+            lines.append(f"  {count / total:6.1%}  {stack}")
+        logger.warning("\n".join(lines))
+
+
+slow_request_profiler = SlowRequestProfiler()
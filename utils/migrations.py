@@ -0,0 +1,185 @@
+# utils/migrations.py
+# migrations بسيطة بأرقام versions: كل migration دالة بتاخد connection وبتتنفذ مرة واحدة بس،
+# والـ version الحالي متسجل في جدول schema_migrations. أي تغيير في الـ schema = migration جديدة في آخر الليستة.
+#
+#   python -m utils.migrations            # upgrade لآخر version
+#   python -m utils.migrations current    # الـ version الحالي
+#   python -m utils.migrations history    # كل الـ migrations وحالتها
+import os
+import sys
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select
+
+logger = logging.getLogger(__name__)
+
+# لو true، create_app بيعمل upgrade وهو بيقوم (مفيد لـ instance واحدة؛ مع أكتر من worker شغّلها في الـ deploy)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true"
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+def _create_index_if_missing(conn, index):
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(conn)
+
+
+def _initial_schema(conn):
+    from .db import Base
+    Base.metadata.create_all(bind=conn)
+
+
+def _history_phone_timestamp_index(conn):
+    # الجداول اللي اتعملت قبل ما الـ index يتضاف للموديل مفيهاش. الـ DDL مكتوب هنا مش من الموديل لأن الموديل
+    # دلوقتي فيه الـ index اللي بـ tenant_id (migration 5)
+    existing = {ix["name"] for ix in inspect(conn).get_indexes("conversation_history")}
+    if not existing & {"ix_conversation_history_phone_timestamp", "ix_conversation_history_tenant_phone_timestamp"}:
+        conn.exec_driver_sql("CREATE INDEX ix_conversation_history_phone_timestamp "
+                             "ON conversation_history (phone, timestamp)")
+
+
+def _outbox_status_index(conn):
+    from .db import OutboundMessage
+    for index in OutboundMessage.__table__.indexes:
+        _create_index_if_missing(conn, index)
+
+
+def _legacy_imports_table(conn):
+    from .db import LegacyImport
+    LegacyImport.__table__.create(conn, checkfirst=True)
+
+
+def _columns(conn, table_name) -> set:
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def _tenant_columns(conn):
+    # customers: الـ primary key بقى (tenant_id, phone) فالجدول بيتبني من جديد والصفوف القديمة للـ default tenant؛
+    # conversation_history و outbound_messages عمود بـ default بس
+    from .db import Customer, ConversationHistory, OutboundMessage, DEFAULT_TENANT_ID
+    if "tenant_id" not in _columns(conn, "customers"):
+        inspector = inspect(conn)
+        primary_key = inspector.get_pk_constraint("customers").get("name")
+        for index in inspector.get_indexes("customers"):
+            conn.exec_driver_sql(f"DROP INDEX {index['name']}")
+        conn.exec_driver_sql("ALTER TABLE customers RENAME TO customers_pre_tenant")
+        if primary_key and conn.dialect.name == "postgresql":
+            # اسم الـ constraint (والـ index بتاعه) لازم يفضى للجدول الجديد
+            conn.exec_driver_sql(f"ALTER TABLE customers_pre_tenant RENAME CONSTRAINT {primary_key} "
+                                 "TO customers_pre_tenant_pkey")
+        Customer.__table__.create(conn)
+        columns = ", ".join(c.name for c in Customer.__table__.columns if c.name != "tenant_id")
+        conn.exec_driver_sql(f"INSERT INTO customers (tenant_id, {columns}) "
+                             f"SELECT '{DEFAULT_TENANT_ID}', {columns} FROM customers_pre_tenant")
+        conn.exec_driver_sql("DROP TABLE customers_pre_tenant")
+    for table in (ConversationHistory.__table__, OutboundMessage.__table__):
+        if "tenant_id" not in _columns(conn, table.name):
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} "
+                                 f"ADD COLUMN tenant_id VARCHAR NOT NULL DEFAULT '{DEFAULT_TENANT_ID}'")
+    for index in ConversationHistory.__table__.indexes:
+        _create_index_if_missing(conn, index)
+    old_index = "ix_conversation_history_phone_timestamp"
+    if old_index in {ix["name"] for ix in inspect(conn).get_indexes("conversation_history")}:
+        conn.exec_driver_sql(f"DROP INDEX {old_index}")
+
+
+def _conversation_archives_table(conn):
+    from .db import ConversationArchive
+    ConversationArchive.__table__.create(conn, checkfirst=True)
+
+
+def _processed_messages_created_at_index(conn):
+    from .db import ProcessedMessage
+    for index in ProcessedMessage.__table__.indexes:
+        _create_index_if_missing(conn, index)
+
+
+def _processed_messages_status(conn):
+    if "status" not in _columns(conn, "processed_messages"):
+        conn.exec_driver_sql("ALTER TABLE processed_messages ADD COLUMN status VARCHAR NOT NULL DEFAULT 'claimed'")
+
+
+def _history_inserted_at(conn):
+    # الصفوف القديمة بتفضل NULL (اتعملها commit خلاص). SQLite مش بيقبل DEFAULT CURRENT_TIMESTAMP في ADD COLUMN،
+    # والـ writers عليه بيتعملهم serialize فالـ ids بتبان بالترتيب ومش محتاجة settle
+    if "inserted_at" in _columns(conn, "conversation_history"):
+        return
+    conn.exec_driver_sql("ALTER TABLE conversation_history ADD COLUMN inserted_at TIMESTAMP")
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("ALTER TABLE conversation_history ALTER COLUMN inserted_at SET DEFAULT now()")
+
+
+# (version, description, function) — متغيرش ترتيب أو رقم migration اتنفذت قبل كده
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "conversation_history (phone, timestamp) index", _history_phone_timestamp_index),
+    (3, "outbound_messages (status, next_attempt_at) index", _outbox_status_index),
+    (4, "legacy_imports progress table", _legacy_imports_table),
+    (5, "tenant_id on customers (primary key), conversation_history and outbound_messages", _tenant_columns),
+    (6, "conversation_archives table (history retention)", _conversation_archives_table),
+    (7, "processed_messages (created_at) index", _processed_messages_created_at_index),
+    (8, "processed_messages.status (retry failed messages without storing them twice)", _processed_messages_status),
+    (9, "conversation_history.inserted_at (server-side insert time for the export settle cutoff)",
+     _history_inserted_at),
+]
+
+
+def applied_versions(conn) -> set:
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def current_version(engine=None) -> int:
+    from .db import engine as default_engine
+    with (engine or default_engine).begin() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def upgrade(engine=None, target: int = None) -> list:
+    """ينفذ الـ migrations اللي لسه متنفذتش بالترتيب، كل واحدة في transaction لوحدها. يرجع الـ versions اللي اتنفذت."""
+    from .db import engine as default_engine
+    engine = engine or default_engine
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    ran = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(version=version, description=description))
+        logger.info(f"Applied migration {version}: {description}")
+        ran.append(version)
+    return ran
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO)
+    command = argv[0] if argv else "upgrade"
+    if command == "upgrade":
+        ran = upgrade()
+        print(f"Applied {len(ran)} migration(s); schema is at version {current_version()}.")
+    elif command == "current":
+        print(current_version())
+    elif command == "history":
+        from .db import engine
+        with engine.begin() as conn:
+            done = applied_versions(conn)
+        for version, description, _ in MIGRATIONS:
+            print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {description}")
+    else:
+        print(f"Unknown command: {command} (use upgrade, current or history)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+# utils/onboarding.py
+# الـ onboarding كـ state machine متعرفة في config_data/onboarding.json: لكل state ليستة transitions
+# (matcher على نص الرسالة، الحقول اللي بتتحدث، الـ state الجاية، ومفاتيح الرد من replies.json).
+# step() دالة pure على snapshot العميل: مفيش قاعدة بيانات ولا رندر، فالـ caller بيعمل write واحدة بالـ updates.
+#
+#   python -m utils.onboarding [path/to/onboarding.json]   # validation للملف من غير تشغيل البوت
+import re
+import sys
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_FIELDS = ("name", "language", "onboarding_step", "service_interest")
+MATCHER_KEYS = ("any", "exact", "contains", "regex")
+
+
+def _detected_language(message: str) -> str:
+    from utils.helpers import detect_language  # helpers بيعمل import لـ config_store اللي بيعمل import لينا
+    return detect_language(message)
+
+
+# القيم اللي تبدأ بـ $ في "set" بتتحسب من الرسالة
+VALUE_RESOLVERS = {
+    "$message": lambda message: message.strip(),
+    "$detected_language": _detected_language,
+}
+
+
+@dataclass(frozen=True)
+class OnboardingStep:
+    """نتيجة رسالة واحدة: الـ state قبل وبعد، التعديلات على العميل (write واحدة)، ومفاتيح الرد."""
+    state: str
+    next_state: str
+    updates: dict = field(default_factory=dict)
+    reply_keys: tuple = ()
+    matched: Optional[int] = None  # رقم الـ transition اللي اتطبقت (None = fallback)
+
+
+class _Transition:
+    __slots__ = ("index", "any", "exact", "contains", "regex", "set", "next", "reply")
+
+    def __init__(self, index: int, spec: dict):
+        match = spec.get("match") or {}
+        self.index = index
+        self.any = bool(match.get("any"))
+        self.exact = frozenset(match.get("exact", ()))
+        self.contains = tuple(needle.lower() for needle in match.get("contains", ()))
+        self.regex = re.compile(match["regex"], re.IGNORECASE) if match.get("regex") else None
+        self.set = dict(spec.get("set") or {})
+        self.next = spec.get("next")
+        reply = spec.get("reply") or ()
+        self.reply = (reply,) if isinstance(reply, str) else tuple(reply)
+
+    def matches(self, stripped: str, lowered: str) -> bool:
+        return (self.any or stripped in self.exact
+                or any(needle in lowered for needle in self.contains)
+                or (self.regex is not None and self.regex.search(stripped) is not None))
+
+
+class OnboardingMachine:
+    """نسخة متحضرة (compiled) من onboarding.json؛ immutable وآمنة بين الـ threads."""
+
+    def __init__(self, definition: dict):
+        self.definition = definition or {}
+        self.initial_state = self.definition.get("initial_state", "awaiting_language")
+        self.final_state = self.definition.get("final_state", "completed")
+        self.fallback_reply = self.definition.get("fallback_reply", "error_occurred_generic")
+        self.required_fields = dict(self.definition.get("required_fields") or {})
+        self.states = {}
+        for name, state in (self.definition.get("states") or {}).items():
+            self.states[name] = [_Transition(i, spec) for i, spec in enumerate((state or {}).get("transitions", ()))]
+
+    def current_state(self, customer) -> str:
+        state = getattr(customer, "onboarding_step", None) or self.initial_state
+        if state == self.final_state:
+            return state
+        # عميل ناقصه حقل أساسي (اللغة مثلاً) بيرجع للـ state اللي بتملاه
+        for field_name, state_for_field in self.required_fields.items():
+            if not getattr(customer, field_name, None):
+                return state_for_field
+        return state
+
+    def step(self, customer, message: str) -> OnboardingStep:
+        state = self.current_state(customer)
+        stripped = message.strip()
+        lowered = message.lower()
+        for transition in self.states.get(state, ()):
+            if transition.matches(stripped, lowered):
+                updates = {key: VALUE_RESOLVERS[value](message) if isinstance(value, str) and value in VALUE_RESOLVERS
+                           else value for key, value in transition.set.items()}
+                if transition.next:
+                    updates["onboarding_step"] = transition.next
+                return OnboardingStep(state, transition.next or state, updates, transition.reply, transition.index)
+        return OnboardingStep(state, state, {}, (self.fallback_reply,), None)
+
+    def validate(self, reply_keys=None) -> list:
+        """ليستة بالمشاكل في التعريف (فاضية = سليم). reply_keys = مفاتيح replies.json لو عايز تتأكد منها كمان."""
+        problems = []
+        known = set(self.states) | {self.final_state}
+        if self.initial_state not in self.states:
+            problems.append(f"initial_state '{self.initial_state}' is not defined in states")
+        for field_name, state in self.required_fields.items():
+            if field_name not in CUSTOMER_FIELDS:
+                problems.append(f"required_fields: unknown customer field '{field_name}'")
+            if state not in self.states:
+                problems.append(f"required_fields: state '{state}' for '{field_name}' is not defined")
+        if reply_keys is not None and self.fallback_reply not in reply_keys:
+            problems.append(f"fallback_reply '{self.fallback_reply}' is missing from replies.json")
+
+        reachable = {self.initial_state, *self.required_fields.values()}
+        for name, raw_state in (self.definition.get("states") or {}).items():
+            specs = (raw_state or {}).get("transitions", ())
+            if not specs:
+                problems.append(f"state '{name}' has no transitions")
+            for i, spec in enumerate(specs):
+                where = f"state '{name}' transition {i}"
+                match = spec.get("match") or {}
+                unknown = set(match) - set(MATCHER_KEYS)
+                if unknown or not match:
+                    problems.append(f"{where}: match needs one of {MATCHER_KEYS}" +
+                                    (f" (unknown: {sorted(unknown)})" if unknown else ""))
+                if match.get("regex"):
+                    try:
+                        re.compile(match["regex"])
+                    except re.error as e:
+                        problems.append(f"{where}: invalid regex: {e}")
+                if match.get("any") and i != len(specs) - 1:
+                    problems.append(f"{where}: catch-all match makes the following transitions unreachable")
+                for key, value in (spec.get("set") or {}).items():
+                    if key not in CUSTOMER_FIELDS or key == "onboarding_step":
+                        problems.append(f"{where}: cannot set '{key}' (use next for the step)")
+                    if isinstance(value, str) and value.startswith("$") and value not in VALUE_RESOLVERS:
+                        problems.append(f"{where}: unknown value '{value}'")
+                next_state = spec.get("next")
+                if next_state is not None:
+                    reachable.add(next_state)
+                    if next_state not in known:
+                        problems.append(f"{where}: next state '{next_state}' is not defined")
+                reply = spec.get("reply") or ()
+                if not reply:
+                    problems.append(f"{where}: no reply keys")
+                for key in (reply,) if isinstance(reply, str) else reply:
+                    if reply_keys is not None and key not in reply_keys:
+                        problems.append(f"{where}: reply key '{key}' is missing from replies.json")
+        for name in self.states:
+            if name not in reachable:
+                problems.append(f"state '{name}' is unreachable")
+        if self.final_state not in reachable:
+            problems.append(f"final_state '{self.final_state}' is never reached")
+        return problems
+
+
+def main(argv):
+    from utils.config_store import config_store
+    path = argv[0] if argv else config_store.path("onboarding")
+    with open(path, encoding="utf-8") as f:
+        machine = OnboardingMachine(json.load(f))
+    problems = machine.validate(set(config_store.get().replies))
+    for problem in problems:
+        print(f"- {problem}")
+    transitions = sum(len(t) for t in machine.states.values())
+    print(f"{path}: {len(machine.states)} states, {transitions} transitions, "
+          f"{'OK' if not problems else f'{len(problems)} problem(s)'}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
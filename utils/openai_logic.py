@@ -1,121 +1,315 @@
-import openai
-import os
-import logging
-
-# --- تهيئة الـ client الجديد لمكتبة OpenAI ---
-# سيفترض أن متغير البيئة OPENAI_API_KEY موجود وسيتم استخدامه تلقائيًا.
-# إذا لم يكن موجودًا، ستحدث مشكلة عند محاولة استدعاء الـ API.
-# يمكنك إضافة check لوجود الـ key هنا أو تركه للدالة.
-try:
-    client = openai.OpenAI()
-    # يمكنك اختبار الاتصال هنا إذا أردت، مثلاً بمحاولة list models
-    # client.models.list()
-except Exception as e:
-    logging.error(f"Failed to initialize OpenAI client: {e}. Ensure OPENAI_API_KEY is set.", exc_info=True)
-    client = None # أو ارفع exception لوجود مشكلة حرجة
-
-# --- تعريف المسارات للملفات ---
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # يفترض أن utils هو مجلد ابن لـ src
-CONFIG_DATA_PATH = os.path.join(BASE_DIR, "config_data")
-
-SYSTEM_PROMPT_FILE = os.path.join(CONFIG_DATA_PATH, "system_prompt.txt")
-REFERENCE_DATA_FILE = os.path.join(CONFIG_DATA_PATH, "reference_data.txt")
-
-
-def get_system_prompt_content() -> str:
-    try:
-        with open(SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
-            base_prompt = f.read().strip()
-            # يمكنك تعديل البرومبت هنا مباشرة أو إبقائه كما هو
-            return f"{base_prompt}" # مثال: "You are NajdAIgent, a helpful AI for Najd Company."
-    except FileNotFoundError:
-        logging.warning(f"System prompt file not found: {SYSTEM_PROMPT_FILE}")
-        return "You are a helpful AI assistant." # برومبت افتراضي بسيط جداً
-
-def get_reference_data_content() -> str:
-    try:
-        with open(REFERENCE_DATA_FILE, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        logging.warning(f"Reference data file not found: {REFERENCE_DATA_FILE}")
-        return ""
-
-def generate_openai_response(user_id: str, user_message: str, lang: str, conversation_history: list) -> str:
-    if not client:
-        logging.error("OpenAI client not initialized. OPENAI_API_KEY might be missing or invalid.")
-        return "I am currently unable to process this request due to a configuration issue." if lang == "en" else "أنا غير قادر حاليًا على معالجة هذا الطلب بسبب مشكلة في الإعدادات."
-
-    # التحقق من OPENAI_API_KEY (ممكن يكون الـ client اتعمله initialize بس الـ key فاضي أو غلط)
-    # المكتبة الجديدة قد لا تحتاج لـ openai.api_key = ... إذا كان OPENAI_API_KEY مضبوط في البيئة
-    # لكن لو عايز تتأكد أو لو الـ client بيقبل api_key كباراميتر عند الإنشاء:
-    openai_api_key_env = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key_env:
-        logging.error("OPENAI_API_KEY environment variable not found.")
-        return "I am currently unable to process this request due to a configuration issue." if lang == "en" else "أنا غير قادر حاليًا على معالجة هذا الطلب بسبب مشكلة في الإعدادات."
-    # client.api_key = openai_api_key_env # ليس ضروريًا لو OPENAI_API_KEY مضبوط في البيئة عند إنشاء الـ client
-
-    system_prompt_base = get_system_prompt_content()
-    # تعديل البرومبت بناءً على اللغة هنا
-    if lang == "ar":
-        system_prompt = f"{system_prompt_base} Please ensure all your responses are in Arabic."
-    else:
-        system_prompt = f"{system_prompt_base} Please ensure all your responses are in English."
-
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    reference_text = get_reference_data_content()
-    if reference_text:
-        # إضافة البيانات المرجعية كجزء من رسالة الـ system أو رسالة system منفصلة
-        messages.append({"role": "system", "content": f"Use the following reference information if relevant to the user's query:\n{reference_text}"})
-
-    # إضافة تاريخ المحادثة
-    for entry in conversation_history:
-        if isinstance(entry, dict) and "role" in entry and "content" in entry:
-             messages.append({"role": entry["role"], "content": entry["content"]})
-        else:
-            logging.warning(f"Skipping invalid history entry for user {user_id}: {entry}")
-    
-    # إضافة رسالة المستخدم الحالية
-    messages.append({"role": "user", "content": user_message})
-
-    try:
-        logging.info(f"Sending request to OpenAI for user {user_id} with {len(messages)} messages.")
-        # استدعاء الـ API بالطريقة الجديدة
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"), # تأكد أن هذا الموديل متاح لحسابك
-            messages=messages,
-            temperature=float(os.getenv("OPENAI_TEMPERATURE", 0.7)), # تحويل لـ float
-            max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", 300)) # تحويل لـ int
-        )
-        # الوصول للرد بالطريقة الجديدة
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"Received response from OpenAI for user {user_id}.")
-
-    # التعامل مع الأخطاء بالطريقة الجديدة
-    except openai.APIConnectionError as e:
-        logging.error(f"OpenAI API Connection Error for user {user_id}: {e}", exc_info=True)
-        ai_response = "I'm having trouble connecting to my brain right now. Please try again in a moment."
-        if lang == "ar":
-            ai_response = "أواجه مشكلة في الاتصال بالشبكة حاليًا. يرجى المحاولة مرة أخرى بعد لحظات."
-    except openai.RateLimitError as e:
-        logging.error(f"OpenAI API Rate Limit Error for user {user_id}: {e}", exc_info=True)
-        ai_response = "I'm experiencing high demand right now. Please try again in a little while."
-        if lang == "ar":
-            ai_response = "أواجه ضغطًا كبيرًا في الطلبات حاليًا. يرجى المحاولة مرة أخرى بعد قليل."
-    except openai.AuthenticationError as e:
-        logging.error(f"OpenAI API Authentication Error for user {user_id}: {e}. Check your API key.", exc_info=True)
-        ai_response = "There's an issue with my configuration. Please contact support if this persists."
-        if lang == "ar":
-            ai_response = "هناك مشكلة في إعداداتي. يرجى التواصل مع الدعم إذا استمرت المشكلة."
-    except openai.APIError as e: # يمسك أي خطأ آخر من الـ API
-        logging.error(f"OpenAI API Error for user {user_id}: {e}", exc_info=True)
-        ai_response = "I encountered an issue while trying to generate a response. Please try again."
-        if lang == "ar":
-            ai_response = "واجهت مشكلة أثناء محاولة إنشاء رد. يرجى المحاولة مرة أخرى."
-    except Exception as e: # يمسك أي أخطاء غير متوقعة أخرى
-        logging.error(f"An unexpected error occurred in generate_openai_response for user {user_id}: {e}", exc_info=True)
-        ai_response = "An unexpected error occurred. Our team has been notified."
-        if lang == "ar":
-            ai_response = "حدث خطأ غير متوقع. تم إخطار فريقنا."
-            
-    return ai_response
+import os
+import logging
+import threading
+
+from utils.config_store import config_store
+from utils.tenants import current_config
+from utils.conversation_context import build_context, estimate_tokens
+from utils.completion_cache import CompletionCache, completion_cache, COMPLETION_CACHE_ENABLED, is_context_dependent
+from utils.reference_index import REFERENCE_RETRIEVAL_ENABLED, REFERENCE_TOP_K
+from utils.llm_gateway import LLMGateway, CircuitOpenError, DeadlineExceeded
+from utils.metrics import timed, LLM_OUTCOMES
+from utils.lazy_imports import LazyModule
+
+# مكتبة openai لوحدها ~0.9 ثانية import: بتتحمل مع أول نداء أو في الـ warm-up (utils/warmup.py)
+openai = LazyModule("openai")
+
+# --- تهيئة الـ client الجديد لمكتبة OpenAI ---
+# سيفترض أن متغير البيئة OPENAI_API_KEY موجود وسيتم استخدامه تلقائيًا.
+# الـ client بيتعمل مرة واحدة أول ما يتطلب (مش وقت الـ import)؛ لو فشل بنفضل نرجع None زي الأول.
+client = None
+_client_initialized = False
+_client_lock = threading.Lock()
+
+def get_client():
+    global client, _client_initialized
+    if not _client_initialized:
+        with _client_lock:
+            if not _client_initialized:
+                try:
+                    client = openai.OpenAI()
+                except Exception as e:
+                    logging.error(f"Failed to initialize OpenAI client: {e}. Ensure OPENAI_API_KEY is set.", exc_info=True)
+                    client = None
+                _client_initialized = True
+    return client
+
+# client الـ async (وضع ASGI) بيتعمل أول ما يتطلب بس
+_async_client = None
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI()
+    return _async_client
+
+# كل نداءات OpenAI بتعدي على الـ gateway (deadline + retries + circuit breaker)
+gateway = LLMGateway(get_client)
+# الـ async بيشارك نفس الـ circuit breaker: لو OpenAI واقع فهو واقع للاتنين
+async_gateway = LLMGateway(get_async_client, breaker=gateway.breaker)
+# لما OpenAI يقع: أقرب سؤال في الـ FAQ بحد أقل شوية من العادي، وإلا رد ثابت من replies.json
+LLM_FALLBACK_FAQ_THRESHOLD = int(os.getenv("LLM_FALLBACK_FAQ_THRESHOLD", 60))
+
+# --- المسارات للملفات (المحتوى نفسه بيتقري مرة واحدة من الـ config store) ---
+SYSTEM_PROMPT_FILE = config_store.path("system_prompt")
+REFERENCE_DATA_FILE = config_store.path("reference_data")
+
+
+def get_system_prompt_content() -> str:
+    # لو الملف مش موجود الـ store بيرجع برومبت افتراضي بسيط
+    return current_config().system_prompt
+
+def get_reference_data_content() -> str:
+    return current_config().reference_data
+
+def get_relevant_reference_content(user_message: str, conversation_history: list = None) -> str:
+    """أنسب أجزاء الـ reference data للسؤال بدل الملف كله (الملف كله لو صغير أو الـ retrieval مقفول)."""
+    if not REFERENCE_RETRIEVAL_ENABLED:
+        return get_reference_data_content()
+    query = user_message
+    if conversation_history and is_context_dependent(user_message):
+        # "وبكام؟" لوحدها ملهاش كلمات يتدور بيها: نضيف آخر سؤال للعميل قبلها
+        previous = [m.get("content", "") for m in conversation_history
+                    if isinstance(m, dict) and m.get("role") == "user" and m.get("content", "").strip() != user_message.strip()]
+        if previous:
+            query = f"{previous[-1]} {user_message}"
+    return current_config().reference_index.context_for(query, REFERENCE_TOP_K)
+
+def _model_name() -> str:
+    return os.getenv("OPENAI_MODEL", "gpt-3.5-turbo") # تأكد أن هذا الموديل متاح لحسابك
+
+def _completion_params(messages: list) -> dict:
+    return dict(
+        model=_model_name(),
+        messages=messages,
+        temperature=float(os.getenv("OPENAI_TEMPERATURE", 0.7)), # تحويل لـ float
+        max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", 300)) # تحويل لـ int
+    )
+
+def _create_completion(messages: list):
+    """نداء واحد لـ OpenAI؛ يرجع (نص الرد, total_tokens) عشان الكاش يحسب التوكنز اللي وفرها."""
+    return gateway.complete(**_completion_params(messages))
+
+def _fallback_reply(user_message: str, lang: str, default_text: str = None) -> str:
+    """رد من غير OpenAI: إجابة FAQ قريبة لو فيه، وإلا ai_unavailable من replies.json، وإلا default_text."""
+    snapshot = current_config()
+    faq_answer = snapshot.faq_index.match(user_message, lang, LLM_FALLBACK_FAQ_THRESHOLD)
+    if faq_answer:
+        return faq_answer
+    by_lang = snapshot.templates.get("ai_unavailable", {})
+    template = by_lang.get(lang) or by_lang.get("en")
+    if template:
+        return template.render("ai_unavailable", lang)
+    return default_text or "Our assistant is unavailable right now. Please try again later."
+
+def _config_error_reply(lang: str):
+    """None لو الـ client والـ key تمام، وإلا رسالة مشكلة الإعدادات."""
+    if not get_client():
+        logging.error("OpenAI client not initialized. OPENAI_API_KEY might be missing or invalid.")
+        return "I am currently unable to process this request due to a configuration issue." if lang == "en" else "أنا غير قادر حاليًا على معالجة هذا الطلب بسبب مشكلة في الإعدادات."
+
+    # التحقق من OPENAI_API_KEY (ممكن يكون الـ client اتعمله initialize بس الـ key فاضي أو غلط)
+    # المكتبة الجديدة قد لا تحتاج لـ openai.api_key = ... إذا كان OPENAI_API_KEY مضبوط في البيئة
+    openai_api_key_env = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key_env:
+        logging.error("OPENAI_API_KEY environment variable not found.")
+        return "I am currently unable to process this request due to a configuration issue." if lang == "en" else "أنا غير قادر حاليًا على معالجة هذا الطلب بسبب مشكلة في الإعدادات."
+    return None
+
+def _build_messages(user_id: str, user_message: str, lang: str, conversation_history: list) -> list:
+    system_prompt_base = get_system_prompt_content()
+    # تعديل البرومبت بناءً على اللغة هنا
+    if lang == "ar":
+        system_prompt = f"{system_prompt_base} Please ensure all your responses are in Arabic."
+    else:
+        system_prompt = f"{system_prompt_base} Please ensure all your responses are in English."
+
+    messages = [{"role": "system", "content": system_prompt}]
+
+    reference_text = get_relevant_reference_content(user_message, conversation_history)
+    if reference_text:
+        # إضافة البيانات المرجعية كجزء من رسالة الـ system أو رسالة system منفصلة
+        messages.append({"role": "system", "content": f"Use the following reference information if relevant to the user's query:\n{reference_text}"})
+
+    # إضافة تاريخ المحادثة (أحدث الرسائل اللي تكفي في الـ token budget) + رسالة المستخدم الحالية
+    return build_context(messages, conversation_history, user_message, user_id=user_id)
+
+def _cache_key(user_message: str, lang: str, messages: list) -> str:
+    # الـ context اللي اتبعت (prompt + reference + التاريخ/الملخص) جزء من المفتاح: رد فيه اسم العميل أو كلامه
+    # مايتسربش لعميل تاني، والتاريخ بيفضل يتبعت مع الكاش شغال
+    return CompletionCache.make_key(user_message, lang, current_config().prompt_version, _model_name(),
+                                    context=messages[:-1])
+
+def _error_reply(error: Exception, user_id: str, user_message: str, lang: str) -> str:
+    """الرد المناسب لكل نوع خطأ من OpenAI (مشتركة بين النسخة العادية والـ async)."""
+    LLM_OUTCOMES.inc(type(error).__name__)
+    # الترتيب مهم: الأنواع الأخص قبل الأعم (APITimeoutError بيورث من APIConnectionError، وكلهم من APIError)
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        logging.warning(f"OpenAI unavailable for user {user_id} ({type(error).__name__}: {error}); using fallback reply.")
+        ai_response = _fallback_reply(user_message, lang)
+    elif isinstance(error, openai.APIConnectionError):
+        logging.error(f"OpenAI API Connection Error for user {user_id}: {error}", exc_info=error)
+        ai_response = "I'm having trouble connecting to my brain right now. Please try again in a moment."
+        if lang == "ar":
+            ai_response = "أواجه مشكلة في الاتصال بالشبكة حاليًا. يرجى المحاولة مرة أخرى بعد لحظات."
+        ai_response = _fallback_reply(user_message, lang, ai_response)
+    elif isinstance(error, openai.RateLimitError):
+        logging.error(f"OpenAI API Rate Limit Error for user {user_id}: {error}", exc_info=error)
+        ai_response = "I'm experiencing high demand right now. Please try again in a little while."
+        if lang == "ar":
+            ai_response = "أواجه ضغطًا كبيرًا في الطلبات حاليًا. يرجى المحاولة مرة أخرى بعد قليل."
+        ai_response = _fallback_reply(user_message, lang, ai_response)
+    elif isinstance(error, openai.InternalServerError):
+        # 5xx من OpenAI بعد ما الـ retries خلصت
+        logging.error(f"OpenAI API Server Error for user {user_id}: {error}", exc_info=error)
+        ai_response = _fallback_reply(user_message, lang)
+    elif isinstance(error, openai.AuthenticationError):
+        logging.error(f"OpenAI API Authentication Error for user {user_id}: {error}. Check your API key.",
+                      exc_info=error)
+        ai_response = "There's an issue with my configuration. Please contact support if this persists."
+        if lang == "ar":
+            ai_response = "هناك مشكلة في إعداداتي. يرجى التواصل مع الدعم إذا استمرت المشكلة."
+    elif isinstance(error, openai.APIError): # أي خطأ آخر من الـ API
+        logging.error(f"OpenAI API Error for user {user_id}: {error}", exc_info=error)
+        ai_response = "I encountered an issue while trying to generate a response. Please try again."
+        if lang == "ar":
+            ai_response = "واجهت مشكلة أثناء محاولة إنشاء رد. يرجى المحاولة مرة أخرى."
+    else: # أي أخطاء غير متوقعة أخرى
+        logging.error(f"An unexpected error occurred in the OpenAI call for user {user_id}: {error}", exc_info=error)
+        ai_response = "An unexpected error occurred. Our team has been notified."
+        if lang == "ar":
+            ai_response = "حدث خطأ غير متوقع. تم إخطار فريقنا."
+    return ai_response
+
+@timed("llm")
+def generate_openai_response(user_id: str, user_message: str, lang: str, conversation_history: list,
+                             use_cache: bool = True) -> str:
+    """
+    use_cache=False للأسئلة اللي ردها معتمد على سياق المحادثة. تاريخ العميل بيتبعت دايماً وبيدخل في مفتاح
+    الكاش، فالرد المتكاش بيتشارك بس مع نفس الـ context بالظبط.
+    """
+    config_error = _config_error_reply(lang)
+    if config_error:
+        return config_error
+
+    messages = _build_messages(user_id, user_message, lang, conversation_history)
+
+    try:
+        logging.info(f"Sending request to OpenAI for user {user_id} with {len(messages)} messages.")
+        if use_cache and COMPLETION_CACHE_ENABLED:
+            # نفس السؤال (بعد التطبيع) بنفس اللغة ونفس الـ prompt ونفس الـ context بياخد الرد المتكاش،
+            # والطلبات المتزامنة لنفس السؤال بتستنى نداء واحد بس
+            cache_key = _cache_key(user_message, lang, messages)
+            ai_response, cached = completion_cache.get_or_compute(cache_key, lambda: _create_completion(messages))
+        else:
+            ai_response, _ = _create_completion(messages)
+            cached = False
+        LLM_OUTCOMES.inc("cached" if cached else "ok")
+        logging.info(f"Received response from OpenAI for user {user_id}{' (cached)' if cached else ''}.")
+
+    except Exception as e:
+        ai_response = _error_reply(e, user_id, user_message, lang)
+
+    return ai_response
+
+@timed("llm")
+async def agenerate_openai_response(user_id: str, user_message: str, lang: str, conversation_history: list,
+                                    use_cache: bool = True) -> str:
+    """نسخة async من generate_openai_response (AsyncOpenAI على نفس الكاش ونفس الـ fallbacks)."""
+    config_error = _config_error_reply(lang)
+    if config_error:
+        return config_error
+
+    messages = _build_messages(user_id, user_message, lang, conversation_history)
+
+    try:
+        logging.info(f"Sending async request to OpenAI for user {user_id} with {len(messages)} messages.")
+        if use_cache and COMPLETION_CACHE_ENABLED:
+            # زي النسخة العادية: الـ coroutines المتزامنة لنفس السؤال بتستنى نداء واحد بس
+            cache_key = _cache_key(user_message, lang, messages)
+            ai_response, cached = await completion_cache.aget_or_compute(
+                cache_key, lambda: async_gateway.acomplete(**_completion_params(messages)))
+        else:
+            ai_response, _ = await async_gateway.acomplete(**_completion_params(messages))
+            cached = False
+        LLM_OUTCOMES.inc("cached" if cached else "ok")
+        logging.info(f"Received response from OpenAI for user {user_id}{' (cached)' if cached else ''}.")
+    except Exception as e:
+        ai_response = _error_reply(e, user_id, user_message, lang)
+
+    return ai_response
+
+def stream_openai_response(user_id: str, user_message: str, lang: str, conversation_history: list,
+                           use_cache: bool = True):
+    """
+    زي generate_openai_response بس generator بيطلع الرد حتة حتة أول ما يوصل من OpenAI.
+    الرد المتكاش بيطلع مرة واحدة، ولو OpenAI وقع قبل أول حتة بيطلع الـ fallback بداله.
+    """
+    config_error = _config_error_reply(lang)
+    if config_error:
+        yield config_error
+        return
+
+    messages = _build_messages(user_id, user_message, lang, conversation_history)
+    cache_key = _cache_key(user_message, lang, messages) if use_cache and COMPLETION_CACHE_ENABLED else None
+    if cache_key:
+        cached = completion_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Serving cached OpenAI response for user {user_id}.")
+            yield cached[0]
+            return
+    logging.info(f"Streaming request to OpenAI for user {user_id} with {len(messages)} messages.")
+    parts = []
+    try:
+        for delta in gateway.stream(**_completion_params(messages)):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        if parts:
+            # جزء من الرد اتبعت خلاص: نقفل بالكلام اللي وصل ومنخلطوش برد تاني
+            logging.error(f"OpenAI stream for user {user_id} broke after {len(parts)} chunk(s): {e}", exc_info=True)
+            return
+        logging.error(f"OpenAI stream failed for user {user_id} ({type(e).__name__}: {e}); using fallback reply.")
+        yield _fallback_reply(user_message, lang)
+        return
+
+    full_text = "".join(parts).strip()
+    if cache_key and full_text:
+        # الـ stream مش بيرجع usage، فالتوفير بيتحسب بتقدير توكنز الرد نفسه (أقل من total_tokens الحقيقي)
+        completion_cache.set(cache_key, (full_text, estimate_tokens(full_text)))
+    logging.info(f"Finished streaming OpenAI response for user {user_id}.")
+
+async def astream_openai_response(user_id: str, user_message: str, lang: str, conversation_history: list,
+                                  use_cache: bool = True):
+    """نسخة async من stream_openai_response (async generator على AsyncOpenAI) لقناة الويب في وضع asyncio."""
+    config_error = _config_error_reply(lang)
+    if config_error:
+        yield config_error
+        return
+
+    messages = _build_messages(user_id, user_message, lang, conversation_history)
+    cache_key = _cache_key(user_message, lang, messages) if use_cache and COMPLETION_CACHE_ENABLED else None
+    if cache_key:
+        cached = completion_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Serving cached OpenAI response for user {user_id}.")
+            yield cached[0]
+            return
+    logging.info(f"Streaming async request to OpenAI for user {user_id} with {len(messages)} messages.")
+    parts = []
+    try:
+        async for delta in async_gateway.astream(**_completion_params(messages)):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        if parts:
+            logging.error(f"OpenAI stream for user {user_id} broke after {len(parts)} chunk(s): {e}", exc_info=True)
+            return
+        logging.error(f"OpenAI stream failed for user {user_id} ({type(e).__name__}: {e}); using fallback reply.")
+        yield _fallback_reply(user_message, lang)
+        return
+
+    full_text = "".join(parts).strip()
+    if cache_key and full_text:
+        completion_cache.set(cache_key, (full_text, estimate_tokens(full_text)))
+    logging.info(f"Finished streaming OpenAI response for user {user_id}.")
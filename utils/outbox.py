@@ -0,0 +1,205 @@
+# utils/outbox.py
+import os
+import json
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from .db import SessionLocal, OutboundMessage
+from .tenants import current_tenant_id, tenant_context, tenant_registry, UnknownTenantError
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 2))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 2))      # ثواني
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 15 * 60))  # ثواني
+# رسالة فضلت "sending" أكتر من كده (الـ process وقع مثلاً) بترجع pending
+OUTBOX_SENDING_TIMEOUT = float(os.getenv("OUTBOX_SENDING_TIMEOUT", 120))
+# الرسايل اللي خلصت بتتمسح بعد المدة دي (الـ failed بتفضل أطول عشان المراجعة)، والـ dispatcher بيشيّك كل
+# OUTBOX_PURGE_INTERVAL ثانية
+OUTBOX_SENT_RETENTION_DAYS = float(os.getenv("OUTBOX_SENT_RETENTION_DAYS", 7))
+OUTBOX_FAILED_RETENTION_DAYS = float(os.getenv("OUTBOX_FAILED_RETENTION_DAYS", 30))
+OUTBOX_PURGE_INTERVAL = float(os.getenv("OUTBOX_PURGE_INTERVAL", 3600))
+
+
+def backoff_delay(attempts: int, retry_after: float = None) -> float:
+    """Exponential backoff مع full jitter، ولو Meta بعتت Retry-After بنحترمه كحد أدنى."""
+    delay = random.uniform(0, min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0))))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def enqueue_outbound(recipient: str, payload: dict, attempts: int = 0, error: str = None, retry_after: float = None):
+    """يحفظ رسالة في الـ outbox؛ لو attempts > 0 معناها إن محاولة فشلت فبنأجلها بالـ backoff."""
+    delay = backoff_delay(attempts, retry_after) if attempts else 0
+    try:
+        with SessionLocal() as db:
+            msg = OutboundMessage(
+                tenant_id=current_tenant_id(),
+                recipient=recipient,
+                payload=json.dumps(payload, ensure_ascii=False),
+                attempts=attempts,
+                last_error=error,
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            db.add(msg)
+            db.commit()
+            msg_id = msg.id
+        logger.info(f"Outbound message to {recipient} stored in outbox (id={msg_id}, retry in {delay:.1f}s).")
+        _wake_dispatcher()
+        return msg_id
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to store outbound message to {recipient} in outbox: {e}")
+        return None
+
+
+def _claim_due(limit: int):
+    """
+    ياخد الرسايل المستحقة ويعلّمها sending. كل رسالة بتتاخد بـ UPDATE ... WHERE status = 'pending' والرسالة
+    بتتبعت بس لو الـ rowcount = 1، فـ dispatcher في process تانية قرا نفس الصفوف مش هيبعتها تاني (SQLite مفيهوش
+    SKIP LOCKED؛ على PostgreSQL الـ SKIP LOCKED بيخلي الـ processes ياخدوا صفوف مختلفة من الأول).
+    """
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        # رجّع اللي علقت في sending
+        db.query(OutboundMessage)\
+            .filter(OutboundMessage.status == "sending",
+                    OutboundMessage.updated_at < now - timedelta(seconds=OUTBOX_SENDING_TIMEOUT))\
+            .update({"status": "pending"}, synchronize_session=False)
+        rows = db.query(OutboundMessage.id, OutboundMessage.tenant_id, OutboundMessage.recipient,
+                        OutboundMessage.payload, OutboundMessage.attempts)\
+            .filter(OutboundMessage.status == "pending", OutboundMessage.next_attempt_at <= now)\
+            .order_by(OutboundMessage.next_attempt_at)\
+            .limit(limit)\
+            .with_for_update(skip_locked=True)\
+            .all()
+        claimed = []
+        for msg_id, tenant_id, recipient, payload, attempts in rows:
+            updated = db.query(OutboundMessage)\
+                .filter(OutboundMessage.id == msg_id, OutboundMessage.status == "pending")\
+                .update({"status": "sending", "updated_at": now}, synchronize_session=False)
+            if updated == 1:
+                claimed.append((msg_id, tenant_id, recipient, json.loads(payload), attempts))
+        db.commit()
+    return claimed
+
+
+def purge_finished(sent_days: float = OUTBOX_SENT_RETENTION_DAYS,
+                   failed_days: float = OUTBOX_FAILED_RETENTION_DAYS) -> int:
+    """يمسح الـ sent الأقدم من sent_days والـ failed الأقدم من failed_days (بآخر تحديث)؛ يرجع العدد."""
+    now = datetime.utcnow()
+    count = 0
+    with SessionLocal() as db:
+        for status, days in (("sent", sent_days), ("failed", failed_days)):
+            count += db.query(OutboundMessage)\
+                .filter(OutboundMessage.status == status,
+                        OutboundMessage.updated_at < now - timedelta(days=days))\
+                .delete(synchronize_session=False)
+        db.commit()
+    return count
+
+
+def _record_result(msg_id: int, attempts: int, result):
+    with SessionLocal() as db:
+        msg = db.get(OutboundMessage, msg_id)
+        if msg is None:
+            return
+        msg.attempts = attempts
+        if result.ok:
+            msg.status = "sent"
+            msg.last_error = None
+        elif result.retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+            msg.status = "pending"
+            msg.last_error = result.error
+            msg.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(attempts, result.retry_after))
+        else:
+            msg.status = "failed"
+            msg.last_error = result.error
+            logger.error(f"Giving up on outbound message {msg_id} to {msg.recipient} after {attempts} attempt(s).")
+        db.commit()
+
+
+def dispatch_due(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """يبعت كل الرسايل المستحقة مرة واحدة؛ يرجع عدد اللي اتبعتت بنجاح."""
+    from .send_meta import deliver_payload, SendResult
+
+    sent = 0
+    for msg_id, tenant_id, recipient, payload, attempts in _claim_due(limit):
+        try:
+            tenant = tenant_registry.get(tenant_id)
+        except UnknownTenantError:
+            # الـ tenant اتشال من TENANTS_FILE: مفيش credentials نبعت بيها
+            _record_result(msg_id, OUTBOX_MAX_ATTEMPTS, SendResult(False, None, False, None, "unknown_tenant"))
+            continue
+        with tenant_context(tenant):
+            result = deliver_payload(recipient, payload)
+        _record_result(msg_id, attempts + 1, result)
+        sent += int(result.ok)
+    return sent
+
+
+class OutboxDispatcher:
+    """Thread في الخلفية بيعيد إرسال رسايل الـ outbox."""
+
+    def __init__(self, poll_interval: float = OUTBOX_POLL_INTERVAL, purge_interval: float = OUTBOX_PURGE_INTERVAL):
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + min(60.0, purge_interval)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                dispatch_due()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}", exc_info=True)
+            if self.purge_interval > 0 and time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + self.purge_interval
+                try:
+                    purged = purge_finished()
+                    if purged:
+                        logger.info(f"Purged {purged} finished outbound message(s) from the outbox.")
+                except SQLAlchemyError as e:
+                    logger.error(f"Outbox purge failed: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+_dispatcher = None
+
+
+def _wake_dispatcher():
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def start_outbox_dispatcher() -> OutboxDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher()
+        _dispatcher.start()
+    return _dispatcher
@@ -0,0 +1,201 @@
+# utils/reference_index.py
+import os
+import re
+import math
+import heapq
+import logging
+import importlib
+from array import array
+from collections import Counter
+
+from utils.faq_index import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات الـ retrieval ---
+REFERENCE_RETRIEVAL_ENABLED = os.getenv("REFERENCE_RETRIEVAL_ENABLED", "true").lower() == "true"
+REFERENCE_TOP_K = int(os.getenv("REFERENCE_TOP_K", 4))
+REFERENCE_CHUNK_CHARS = int(os.getenv("REFERENCE_CHUNK_CHARS", 800))
+# لو الملف كله أصغر من كده بنبعته كامل زي الأول (مفيش توفير يستاهل، والسؤال العربي
+# على ملف إنجليزي مفيش بينهم كلمات مشتركة)
+REFERENCE_FULL_MAX_CHARS = int(os.getenv("REFERENCE_FULL_MAX_CHARS", 6000))
+# backend اختياري للـ embeddings بصيغة "module:callable"، الـ callable بياخد list[str] ويرجع list[list[float]]
+REFERENCE_EMBEDDING_BACKEND = os.getenv("REFERENCE_EMBEDDING_BACKEND", "")
+
+# BM25
+_K1 = 1.5
+_B = 0.75
+# Reciprocal Rank Fusion لدمج ترتيب BM25 مع ترتيب الـ embeddings
+_RRF_K = 60
+
+_HEADING = re.compile(r"^\s*##\s*(.+?)\s*##\s*$")
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+# السوابق اللي بتتلزق في الكلمة العربية (و/ف/ب/ك/ل + ال)
+_AR_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+_STOPWORDS = frozenset(normalize_arabic(word) for word in """
+a an the and or of to in on for with at by from is are was were be been it this that these those
+what which who how do does can could i you we our your my me us they them he she as if about
+في من على إلى الى عن مع هل ما ماذا كيف هذا هذه ذلك التي الذي هو هي انا أنا نحن انت أنت لكم عندكم او أو و
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """tokens للـ BM25: lowercase + طي العربي + شيل ال التعريف والحروف الملزوقة + stopwords."""
+    tokens = []
+    for token in _TOKEN.findall(normalize_arabic(text.lower())):
+        if token in _STOPWORDS or token.isdigit() and len(token) < 2:
+            continue
+        for prefix in _AR_PREFIXES:
+            if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+                token = token[len(prefix):]
+                break
+        if token and token not in _STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def chunk_text(text: str, max_chars: int = REFERENCE_CHUNK_CHARS) -> list:
+    """
+    يقسم الملف لأجزاء على حدود الفقرات (بدون ما يكسر بند في النص) في حدود max_chars،
+    وكل جزء بيبدأ بعنوان القسم (## ... ##) بتاعه عشان الموديل يفهم هو بيتكلم عن إيه.
+    """
+    chunks = []
+    heading = ""
+    current = []
+    size = 0
+
+    def flush():
+        nonlocal current, size
+        body = "\n".join(current).strip()
+        if body:
+            chunks.append(f"{heading}\n{body}" if heading else body)
+        current, size = [], 0
+
+    for block in re.split(r"\n\s*\n", text):
+        lines = block.strip("\n").splitlines()
+        if not lines:
+            continue
+        match = _HEADING.match(lines[0])
+        if match:
+            flush()
+            heading = lines[0].strip()
+            lines = lines[1:]
+        block = "\n".join(lines).strip()
+        if not block:
+            continue
+        # فقرة أطول من الحد لوحدها: نقسمها على السطور
+        pieces = [block] if len(block) <= max_chars else [line for line in lines if line.strip()]
+        for piece in pieces:
+            if size and size + len(piece) > max_chars:
+                flush()
+            current.append(piece)
+            size += len(piece) + 1
+    flush()
+    return chunks
+
+
+def load_embedding_backend(spec: str = REFERENCE_EMBEDDING_BACKEND):
+    """يرجع الـ callable بتاع الـ embeddings من "module:callable"، أو None لو مش متظبط أو فشل."""
+    if not spec:
+        return None
+    try:
+        module_name, _, attr = spec.partition(":")
+        return getattr(importlib.import_module(module_name), attr or "embed")
+    except Exception as e:
+        logger.error(f"Could not load reference embedding backend '{spec}': {e}", exc_info=True)
+        return None
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ReferenceIndex:
+    """
+    index محلي لـ reference_data.txt: أجزاء + inverted index بـ BM25، ومعاه embeddings اختيارية
+    (hybrid بـ RRF). بيتبني مرة واحدة مع الـ config snapshot.
+    """
+
+    def __init__(self, text: str, max_chars: int = REFERENCE_CHUNK_CHARS, embed=None,
+                 full_max_chars: int = REFERENCE_FULL_MAX_CHARS):
+        self.text = text or ""
+        # ملف صغير: بنبعته كامل ومش محتاجين index
+        self.use_full_text = len(self.text) <= full_max_chars
+        self.chunks = [] if self.use_full_text else chunk_text(self.text, max_chars)
+        # token -> (chunk ids, tfs) في arrays عشان index لـ عشرات الـ MB ميبقاش ملايين tuples
+        self._postings = {}
+        self._lengths = []
+        self._idf = {}
+        self._embed = embed
+        self._vectors = None
+        self._build()
+
+    def _build(self):
+        for idx, chunk in enumerate(self.chunks):
+            counts = Counter(tokenize(chunk))
+            self._lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = (array("I"), array("I"))
+                postings[0].append(idx)
+                postings[1].append(tf)
+        n = len(self.chunks)
+        self._avg_length = (sum(self._lengths) / n) if n else 0.0
+        self._idf = {
+            token: math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            for token, (ids, _) in self._postings.items()
+        }
+        if self._embed and self.chunks:
+            try:
+                self._vectors = self._embed(self.chunks)
+            except Exception as e:
+                logger.error(f"Reference embedding backend failed; using BM25 only: {e}", exc_info=True)
+                self._vectors = None
+
+    def _bm25(self, query: str) -> dict:
+        scores = {}
+        avg = self._avg_length or 1.0
+        for token in set(tokenize(query)):
+            idf = self._idf.get(token)
+            if idf is None:
+                continue
+            ids, tfs = self._postings[token]
+            for idx, tf in zip(ids, tfs):
+                norm = tf + _K1 * (1 - _B + _B * self._lengths[idx] / avg)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (_K1 + 1) / norm
+        return scores
+
+    def search(self, query: str, k: int = REFERENCE_TOP_K) -> list:
+        """يرجع [(score, chunk_idx)] لأحسن k أجزاء مرتبين تنازلياً."""
+        if not self.chunks or k <= 0:
+            return []
+        lexical = self._bm25(query)
+        if self._vectors is None:
+            return heapq.nlargest(k, ((score, idx) for idx, score in lexical.items()))
+
+        try:
+            query_vector = self._embed([query])[0]
+        except Exception as e:
+            logger.warning(f"Reference embedding of query failed; using BM25 only: {e}")
+            return heapq.nlargest(k, ((score, idx) for idx, score in lexical.items()))
+        dense = sorted(range(len(self.chunks)), key=lambda i: _cosine(query_vector, self._vectors[i]), reverse=True)
+        fused = {}
+        for rank, idx in enumerate(sorted(lexical, key=lexical.get, reverse=True)):
+            fused[idx] = fused.get(idx, 0.0) + 1 / (_RRF_K + rank + 1)
+        for rank, idx in enumerate(dense[:max(k * 4, 20)]):
+            fused[idx] = fused.get(idx, 0.0) + 1 / (_RRF_K + rank + 1)
+        return heapq.nlargest(k, ((score, idx) for idx, score in fused.items()))
+
+    def context_for(self, query: str, k: int = REFERENCE_TOP_K) -> str:
+        """النص اللي هيتحط في رسالة الـ reference: الملف كله لو صغير، وإلا أنسب k أجزاء بترتيبها في الملف."""
+        if self.use_full_text:
+            return self.text
+        hits = self.search(query, k)
+        if not hits:
+            # مفيش ولا كلمة مشتركة (مثلاً سؤال عربي والملف إنجليزي): أول الأجزاء (التعريف بالشركة)
+            return "\n\n".join(self.chunks[:k])
+        return "\n\n".join(self.chunks[idx] for idx in sorted(idx for _, idx in hits))
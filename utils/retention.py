@@ -0,0 +1,336 @@
+# utils/retention.py
+# retention لتاريخ المحادثات: conversation_history بيكبر على طول (كل رسالة عميل وكل رد، وكل رد فيه التوقيع كامل)،
+# فالجدول والـ indexes والـ backups بيكبروا من غير حد. الـ job ده بياخد رسايل كل عميل الأقدم من
+# HISTORY_RETENTION_DAYS ويكتبها blob مضغوط (zlib على JSON؛ التوقيع المتكرر بيتضغط لحاجة تقريباً ببلاش) في
+# conversation_archives ويمسحها من الجدول الأساسي، ويسيب مكانها صف summary واحد (ملخص استخراجي لكلام العميل)
+# عشان الـ context بتاع OpenAI ميفقدش اللي فات. get_conversation (utils/db_helpers.py) بيرجّع الأرشيف مع الباقي
+# لما التاريخ القديم يتطلب، و get_recent_conversation بيفضل query واحدة على جدول أصغر.
+#
+#   python -m utils.retention                    # أرشفة مرة واحدة بـ HISTORY_RETENTION_DAYS
+#   python -m utils.retention --days 90 --dry-run
+# ومع HISTORY_RETENTION_DAYS > 0، create_app بيشغل الـ job في الخلفية كل HISTORY_RETENTION_INTERVAL ثانية.
+import os
+import sys
+import json
+import zlib
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, insert, func, text, tuple_, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+from .db import ConversationHistory, ConversationArchive
+from .metrics import registry
+from .conversation_context import _summarize, SUMMARY_PREFIX, SUMMARY_SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 0))  # 0 = الأرشفة مقفولة
+HISTORY_RETENTION_INTERVAL = float(os.getenv("HISTORY_RETENTION_INTERVAL", 6 * 3600))  # ثواني بين كل run
+HISTORY_RETENTION_BATCH_CUSTOMERS = int(os.getenv("HISTORY_RETENTION_BATCH_CUSTOMERS", 200))  # عملاء لكل transaction
+HISTORY_ARCHIVE_CHUNK_MESSAGES = int(os.getenv("HISTORY_ARCHIVE_CHUNK_MESSAGES", 5000))  # أقصى رسايل في blob واحد
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", 150))
+HISTORY_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("HISTORY_ARCHIVE_COMPRESSION_LEVEL", 6))
+
+# sender صف الملخص اللي بيفضل مكان الرسايل المتأرشفة؛ get_recent_conversation بيبعته لـ OpenAI كـ system
+SUMMARY_SENDER = "summary"
+# رقم ثابت لـ pg_try_advisory_lock عشان run واحدة بس في نفس الوقت بين كل الـ workers والسيرفرات
+_ADVISORY_LOCK_KEY = 0x6869_7374_6172_6368  # "histarch"
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+class ArchiveConflict(RuntimeError):
+    """صفوف العميل اتغيرت في نص الـ batch (run تانية أرشفتها مثلاً)؛ الـ batch بيترجع وبيتعاد الـ run الجاية."""
+
+
+# --- الـ blob: [[sender, message, timestamp], ...] ---
+
+def encode_messages(rows) -> bytes:
+    """rows: (sender, message, timestamp) من الأقدم للأحدث."""
+    payload = [[sender, message, timestamp.isoformat()] for sender, message, timestamp in rows]
+    return zlib.compress(_encoder.encode(payload).encode("utf-8"), HISTORY_ARCHIVE_COMPRESSION_LEVEL)
+
+
+def decode_messages(data: bytes) -> list:
+    """نفس شكل get_conversation: dicts فيها sender / message / timestamp (ISO)."""
+    return [{"sender": sender, "message": message, "timestamp": timestamp}
+            for sender, message, timestamp in json.loads(zlib.decompress(data))]
+
+
+def load_archived(conn, tenant_id: str, phone: str, since: datetime = None) -> list:
+    """
+    الرسايل المتأرشفة للعميل (من الأقدم للأحدث)، ومن since بس لو متحدد. conn أي connection أو session؛
+    الـ blobs اللي آخر رسالة فيها قبل since مش بتتقرا أصلاً (index على last_at).
+    """
+    t = ConversationArchive.__table__
+    statement = select(t.c.data).where(t.c.tenant_id == tenant_id, t.c.phone == phone)\
+        .order_by(t.c.first_at, t.c.id)
+    if since is not None:
+        statement = statement.where(t.c.last_at >= since)
+    messages = []
+    for (data,) in conn.execute(statement):
+        messages.extend(decode_messages(data))
+    if since is not None:
+        messages = [m for m in messages if datetime.fromisoformat(m["timestamp"]) >= since]
+    return messages
+
+
+def _previous_statements(previous_summary: str) -> list:
+    """كلام العميل اللي في ملخص run قبل كده (من الأقدم للأحدث)، عشان الملخص الجديد يبني عليه ومايضيعش."""
+    if not previous_summary or SUMMARY_PREFIX not in previous_summary:
+        return []
+    return [part for part in previous_summary.split(SUMMARY_PREFIX, 1)[1].split(SUMMARY_SEPARATOR) if part.strip()]
+
+
+def summary_text(user_messages: list, archived_total: int, first_at: datetime, last_at: datetime,
+                 previous_summary: str = None, max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS) -> str:
+    """
+    ملخص استخراجي (نفس اللي build_context بيعمله للرسايل اللي بتتشال عشان الـ budget) + عدد الرسايل ومداها.
+    previous_summary: الملخص اللي الصف ده هيحل محله؛ كلامه بيتحط قبل الرسايل الجديدة فلو الـ budget مكفاش
+    الأقدم بس هو اللي بيقع.
+    """
+    header = (f"{archived_total} earlier message(s) of this conversation, from {first_at:%Y-%m-%d} "
+              f"to {last_at:%Y-%m-%d}, were archived.")
+    statements = _previous_statements(previous_summary) + list(user_messages)
+    summary = _summarize([{"role": "user", "content": m} for m in statements], max_tokens)
+    return header + (" " + summary["content"] if summary else "")
+
+
+# --- الأرشفة ---
+
+def _customers_batch(conn, cutoff, after, limit):
+    """عملاء عندهم صفوف أقدم من cutoff، بالترتيب بعد after (keyset)؛ index-only على (tenant_id, phone, timestamp)."""
+    t = ConversationHistory.__table__
+    statement = select(t.c.tenant_id, t.c.phone).where(t.c.timestamp < cutoff)\
+        .group_by(t.c.tenant_id, t.c.phone).order_by(t.c.tenant_id, t.c.phone).limit(limit)
+    if after is not None:
+        statement = statement.where(tuple_(t.c.tenant_id, t.c.phone) > tuple_(*after))
+    return [tuple(row) for row in conn.execute(statement)]
+
+
+# الـ statements بتتبني مرة واحدة وبتتنفذ لكل عميل بـ parameters (بناء الـ expression لكل عميل كان تلت وقت الـ run)
+_history = ConversationHistory.__table__
+_archives = ConversationArchive.__table__
+_customer_old_rows = (_history.c.tenant_id == bindparam("tenant_id"), _history.c.phone == bindparam("phone"),
+                      _history.c.timestamp < bindparam("cutoff"))
+_SELECT_OLD_ROWS = select(_history.c.id, _history.c.sender, _history.c.message, _history.c.timestamp)\
+    .where(*_customer_old_rows).order_by(_history.c.timestamp, _history.c.id)
+_SELECT_OLD_ROWS_LOCKED = _SELECT_OLD_ROWS.with_for_update(skip_locked=True)
+_DELETE_OLD_ROWS = delete(_history).where(*_customer_old_rows, _history.c.id <= bindparam("max_id"))
+_ARCHIVED_SO_FAR = select(func.coalesce(func.sum(_archives.c.message_count), 0), func.min(_archives.c.first_at))\
+    .where(_archives.c.tenant_id == bindparam("tenant_id"), _archives.c.phone == bindparam("phone"))
+
+
+def _archive_customer(conn, tenant_id, phone, cutoff, stats):
+    """بيرجع (archives, summary) للعميل ده أو (None, None) لو مفيش رسايل قديمة غير الملخص."""
+    params = {"tenant_id": tenant_id, "phone": phone, "cutoff": cutoff}
+    statement = _SELECT_OLD_ROWS_LOCKED if conn.dialect.name == "postgresql" else _SELECT_OLD_ROWS
+    rows = conn.execute(statement, params).all()
+    messages = [(sender, message, timestamp) for _id, sender, message, timestamp in rows
+                if sender != SUMMARY_SENDER and message is not None]
+    if not messages:
+        return None, None
+
+    deleted = conn.execute(_DELETE_OLD_ROWS, dict(params, max_id=max(row[0] for row in rows))).rowcount
+    if deleted != len(rows):
+        raise ArchiveConflict(f"{tenant_id}:{phone}: expected to archive {len(rows)} row(s), deleted {deleted}")
+
+    # الملخص القديم (لو العميل اتأرشف قبل كده) بيتمسح مع الصفوف، فكلامه بيدخل في الملخص الجديد
+    previous_summary = next((message for _id, sender, message, _t in reversed(rows) if sender == SUMMARY_SENDER),
+                            None)
+    previous_total, first_at = conn.execute(_ARCHIVED_SO_FAR, params).one()
+    archives = []
+    for start in range(0, len(messages), max(1, HISTORY_ARCHIVE_CHUNK_MESSAGES)):
+        chunk = messages[start:start + HISTORY_ARCHIVE_CHUNK_MESSAGES]
+        data = encode_messages(chunk)
+        archives.append({"tenant_id": tenant_id, "phone": phone, "first_at": chunk[0][2], "last_at": chunk[-1][2],
+                         "message_count": len(chunk), "data": data, "created_at": datetime.utcnow()})
+        stats["bytes_raw"] += sum(len(m.encode("utf-8")) for _s, m, _t in chunk)
+        stats["bytes_archived"] += len(data)
+    summary = {
+        "tenant_id": tenant_id, "phone": phone, "sender": SUMMARY_SENDER,
+        # وقت آخر رسالة متأرشفة، فالملخص بيقع قبل الرسايل اللي فضلت
+        "timestamp": messages[-1][2],
+        "message": summary_text([m for s, m, _t in messages if s == "user"], previous_total + len(messages),
+                                first_at or messages[0][2], messages[-1][2], previous_summary),
+    }
+    stats["customers"] += 1
+    stats["messages"] += len(messages)
+    return archives, summary
+
+
+def archive_history(days: float = HISTORY_RETENTION_DAYS, cutoff: datetime = None, engine=None,
+                    batch_customers: int = HISTORY_RETENTION_BATCH_CUSTOMERS) -> dict:
+    """
+    يأرشف كل الرسايل الأقدم من cutoff (أو من days يوم). كل batch عملاء في transaction واحدة، فلو الـ run وقفت
+    في النص اللي اتأرشف اتأرشف واللي لسه هيتعمل في الـ run الجاية. يرجع stats.
+    """
+    from .db import engine as default_engine
+    engine = engine or default_engine
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=days)
+    stats = {"customers": 0, "messages": 0, "archives": 0, "bytes_raw": 0, "bytes_archived": 0, "conflicts": 0}
+    start = time.perf_counter()
+    after = None
+    while True:
+        with engine.connect() as conn:
+            customers = _customers_batch(conn, cutoff, after, batch_customers)
+        if not customers:
+            break
+        after = customers[-1]
+        try:
+            with engine.begin() as conn:
+                archives, summaries = [], []
+                for tenant_id, phone in customers:
+                    customer_archives, summary = _archive_customer(conn, tenant_id, phone, cutoff, stats)
+                    if summary is not None:
+                        archives.extend(customer_archives)
+                        summaries.append(summary)
+                if archives:
+                    conn.execute(insert(ConversationArchive), archives)
+                    conn.execute(insert(ConversationHistory), summaries)
+            stats["archives"] += len(archives)
+        except ArchiveConflict as e:
+            logger.warning(f"History archive batch rolled back, will retry on the next run: {e}")
+            stats["conflicts"] += 1
+    stats["seconds"] = time.perf_counter() - start
+    stats["cutoff"] = cutoff.isoformat()
+    return stats
+
+
+def count_archivable(days: float = HISTORY_RETENTION_DAYS, cutoff: datetime = None, engine=None) -> dict:
+    """للـ --dry-run: كام صف وكام عميل أقدم من cutoff (من غير ما نغير حاجة)."""
+    from .db import engine as default_engine
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=days)
+    t = ConversationHistory.__table__
+    with (engine or default_engine).connect() as conn:
+        rows = conn.execute(select(func.count()).where(t.c.timestamp < cutoff, t.c.sender != SUMMARY_SENDER))\
+            .scalar()
+        customers = conn.execute(select(func.count()).select_from(
+            select(t.c.tenant_id, t.c.phone).where(t.c.timestamp < cutoff).distinct().subquery())).scalar()
+    return {"messages": rows, "customers": customers, "cutoff": cutoff.isoformat()}
+
+
+# --- الـ job في الخلفية ---
+
+class RetentionJob:
+    """Thread بيشغل archive_history كل interval ثانية (run واحدة بس في نفس الوقت على PostgreSQL)."""
+
+    def __init__(self, days: float = HISTORY_RETENTION_DAYS, interval: float = HISTORY_RETENTION_INTERVAL):
+        self.days = days
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = {"ok": 0, "error": 0, "skipped": 0}
+        self.archived_messages = 0
+        self.last_run_seconds = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # أول run بعد وقت عشوائي صغير عشان كل الـ workers اللي قامت مع بعض متبدأش في نفس اللحظة
+        if self._stop.wait(random.uniform(30, min(300, max(self.interval, 30)))):
+            return
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def run_once(self):
+        from .db import engine
+        lock_conn = None
+        try:
+            if engine.dialect.name == "postgresql":
+                lock_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+                if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _ADVISORY_LOCK_KEY}).scalar():
+                    self.runs["skipped"] += 1
+                    return None
+            stats = archive_history(self.days, engine=engine)
+            self.runs["ok"] += 1
+            self.archived_messages += stats["messages"]
+            self.last_run_seconds = stats["seconds"]
+            if stats["messages"]:
+                logger.info(f"Archived {stats['messages']} history message(s) of {stats['customers']} customer(s) "
+                            f"older than {stats['cutoff']} in {stats['seconds']:.1f}s "
+                            f"({stats['bytes_raw']} -> {stats['bytes_archived']} bytes)")
+            return stats
+        except SQLAlchemyError as e:
+            self.runs["error"] += 1
+            logger.error(f"History retention run failed: {e}")
+            return None
+        finally:
+            if lock_conn is not None:
+                try:
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _ADVISORY_LOCK_KEY})
+                finally:
+                    lock_conn.close()
+
+
+_job = None
+
+
+def start_retention_job() -> RetentionJob:
+    global _job
+    if _job is None:
+        _job = RetentionJob()
+        _job.start()
+    return _job
+
+
+def _retention_collector():
+    if _job is None:
+        return []
+    return [
+        ("history_retention_runs", "counter", "History retention (archive) runs by result.",
+         [({"result": result}, count) for result, count in _job.runs.items()]),
+        ("history_archived_messages", "counter", "Conversation history messages moved to conversation_archives.",
+         [({}, _job.archived_messages)]),
+        ("history_retention_last_run_seconds", "gauge", "Duration of the last history retention run.",
+         [({}, _job.last_run_seconds)]),
+    ]
+
+
+registry.register_collector(_retention_collector)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m utils.retention",
+                                     description="Move old conversation history into compressed archives.")
+    parser.add_argument("--days", type=float, default=HISTORY_RETENTION_DAYS or None,
+                        help="أرشف الرسايل الأقدم من كده (افتراضياً HISTORY_RETENTION_DAYS)")
+    parser.add_argument("--before", type=datetime.fromisoformat, help="أو: أرشف الرسايل قبل الوقت ده (UTC، ISO 8601)")
+    parser.add_argument("--batch-customers", type=int, default=HISTORY_RETENTION_BATCH_CUSTOMERS)
+    parser.add_argument("--dry-run", action="store_true", help="اعرض اللي هيتأرشف بس")
+    args = parser.parse_args(argv)
+    if not args.days and not args.before:
+        parser.error("pass --days or --before (or set HISTORY_RETENTION_DAYS)")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.dry_run:
+        counts = count_archivable(args.days, args.before)
+        print(f"{counts['messages']} message(s) of {counts['customers']} customer(s) older than {counts['cutoff']} "
+              "would be archived")
+        return 0
+    stats = archive_history(args.days, args.before, batch_customers=args.batch_customers)
+    print(f"Archived {stats['messages']} message(s) of {stats['customers']} customer(s) older than {stats['cutoff']} "
+          f"into {stats['archives']} blob(s) in {stats['seconds']:.1f}s ({stats['bytes_raw']:,} bytes of text -> "
+          f"{stats['bytes_archived']:,} compressed)" + (f", {stats['conflicts']} batch(es) to retry"
+                                                          if stats["conflicts"] else ""), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,112 +1,328 @@
-# utils/send_meta.py
-import requests
-import os
-import json
-import logging
-
-# --- إعداد الـ Logger ---
-# الأفضل إن الـ logger يتجاب من الـ app الرئيسي لو أمكن (عشان يكون مركزي)
-# بس لو هنعرفه هنا بشكل مستقل:
-logger = logging.getLogger(__name__) # اسم الموديول الحالي كاسم للوجر
-# مستوى اللوجينج المفروض يتحدد في app.py بشكل عام
-# لو مفيش إعدادات لوجينج عامة، ممكن نضيف هنا:
-if not logger.hasHandlers(): # عشان نتجنب إضافة handlers كذا مرة لو الموديول اتعمله import كذا مرة
-    handler = logging.StreamHandler() # يطبع على الـ console
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO) # أو DEBUG لو عايز تفاصيل أكتر
-
-# --- تحميل متغيرات البيئة المطلوبة ---
-WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
-WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
-
-# --- التحقق من وجود متغيرات البيئة عند تحميل الموديول ---
-if not WHATSAPP_ACCESS_TOKEN:
-    logger.critical("CRITICAL ERROR in send_meta: WHATSAPP_ACCESS_TOKEN is not set in environment variables!")
-if not WHATSAPP_PHONE_NUMBER_ID:
-    logger.critical("CRITICAL ERROR in send_meta: WHATSAPP_PHONE_NUMBER_ID is not set in environment variables!")
-
-def send_whatsapp_message_real(recipient_wa_id: str, message_text: str) -> bool:
-    """
-    Sends a text message to a WhatsApp user via the WhatsApp Cloud API (Meta Graph API).
-
-    Args:
-        recipient_wa_id (str): The WhatsApp ID of the recipient (e.g., "201001234567").
-        message_text (str): The text content of the message to send.
-
-    Returns:
-        bool: True if the message was likely sent successfully (API returned 2xx), False otherwise.
-    """
-    if not WHATSAPP_ACCESS_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-        logger.error(
-            f"Cannot send message to {recipient_wa_id}: WHATSAPP_ACCESS_TOKEN or WHATSAPP_PHONE_NUMBER_ID is missing."
-        )
-        return False
-
-    api_version = os.getenv("WHATSAPP_API_VERSION", "v19.0") # ممكن تخلي نسخة الـ API في .env
-    url = f"https://graph.facebook.com/{api_version}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": recipient_wa_id,
-        "type": "text",
-        "text": {"body": message_text},
-    }
-
-    logger.info(f"Attempting to send WhatsApp message to: {recipient_wa_id}")
-    logger.debug(f"Payload for {recipient_wa_id}: {json.dumps(payload, ensure_ascii=False)}") # debug level للتفاصيل
-
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15) # زودت الـ timeout شوية
-        
-        # التحقق من الـ status code
-        if 200 <= response.status_code < 300:
-            logger.info(
-                f"Message successfully sent to {recipient_wa_id}. "
-                f"API Response Status: {response.status_code}, "
-                f"Response Body: {response.text}" # ممكن يكون فيه message_id مفيد
-            )
-            return True
-        else:
-            logger.error(
-                f"Failed to send message to {recipient_wa_id}. "
-                f"API Response Status: {response.status_code}, "
-                f"Response Body: {response.text}"
-            )
-            # تحليل إضافي لبعض الأخطاء الشائعة
-            if response.status_code == 401:
-                logger.critical(
-                    "Authorization error (401) sending WhatsApp message. "
-                    "The WHATSAPP_ACCESS_TOKEN may be invalid, expired, or missing required permissions."
-                )
-            elif response.status_code == 400:
-                try:
-                    error_data = response.json().get("error", {})
-                    error_message = error_data.get("message", "No error message provided.")
-                    error_code = error_data.get("code")
-                    error_subcode = error_data.get("error_subcode")
-                    logger.warning(
-                        f"Bad Request (400) details: Code={error_code}, Subcode={error_subcode}, Message='{error_message}'"
-                    )
-                except ValueError: # لو الـ response مش JSON
-                    logger.warning("Bad Request (400) but response body was not valid JSON.")
-            return False
-
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout error while trying to send message to {recipient_wa_id}.")
-        return False
-    except requests.exceptions.ConnectionError:
-        logger.error(f"Connection error while trying to send message to {recipient_wa_id}.")
-        return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"An unexpected requests library error occurred for {recipient_wa_id}: {e}", exc_info=True)
-        return False
-    except Exception as e:
-        logger.error(f"A general unexpected error occurred in send_whatsapp_message_real for {recipient_wa_id}: {e}", exc_info=True)
-        return False
+# utils/send_meta.py
+import os
+import logging
+import asyncio
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.rate_limit import TokenBucket
+from utils.outbox import enqueue_outbound
+from utils.metrics import timed, WHATSAPP_SENDS
+from utils.logging_setup import log_payload
+from utils.lazy_imports import LazyModule
+from utils.tenants import DEFAULT_TENANT_ID, current_tenant
+
+# requests بيتحمل مع أول إرسال (أو في الـ warm-up) مش وقت الـ import
+requests = LazyModule("requests")
+
+# --- إعداد الـ Logger ---
+# الـ handlers والـ format بيتظبطوا مرة واحدة للـ process كله في utils/logging_setup.py (من create_app)؛
+# handler خاص هنا كان بيكتب كل سطر مرتين وبشكل sync على مسار الإرسال
+logger = logging.getLogger(__name__) # اسم الموديول الحالي كاسم للوجر
+
+# --- تحميل متغيرات البيئة المطلوبة ---
+WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+
+# --- التحقق من وجود متغيرات البيئة عند تحميل الموديول ---
+if not WHATSAPP_ACCESS_TOKEN:
+    logger.critical("CRITICAL ERROR in send_meta: WHATSAPP_ACCESS_TOKEN is not set in environment variables!")
+if not WHATSAPP_PHONE_NUMBER_ID:
+    logger.critical("CRITICAL ERROR in send_meta: WHATSAPP_PHONE_NUMBER_ID is not set in environment variables!")
+
+# --- إعدادات الإرسال ---
+# base URL قابل للتغيير عشان نقدر نجرب على Graph API وهمي محلي
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com").rstrip("/")
+WHATSAPP_HTTP_POOL_SIZE = int(os.getenv("WHATSAPP_HTTP_POOL_SIZE", 20))
+WHATSAPP_CONNECT_TIMEOUT = float(os.getenv("WHATSAPP_CONNECT_TIMEOUT", 3.05))
+WHATSAPP_READ_TIMEOUT = float(os.getenv("WHATSAPP_READ_TIMEOUT", 10))
+# Meta بتسمح بحوالي 80 رسالة/ثانية لكل رقم افتراضياً (ممكن تزيد حسب الـ tier)
+WHATSAPP_RATE_LIMIT_PER_SEC = float(os.getenv("WHATSAPP_RATE_LIMIT_PER_SEC", 80))
+WHATSAPP_OUTBOX_ENABLED = os.getenv("WHATSAPP_OUTBOX_ENABLED", "true").lower() == "true"
+WHATSAPP_BROADCAST_WORKERS = int(os.getenv("WHATSAPP_BROADCAST_WORKERS", 16))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+SendResult = namedtuple("SendResult", ["ok", "status_code", "retryable", "retry_after", "error"])
+
+# الـ limit بتاع Meta لكل رقم، فكل tenant ليه bucket؛ rate_limiter هو بتاع الـ default
+rate_limiter = TokenBucket(WHATSAPP_RATE_LIMIT_PER_SEC)
+_tenant_rate_limiters = {DEFAULT_TENANT_ID: rate_limiter}
+_rate_limiters_lock = threading.Lock()
+
+def _rate_limiter() -> TokenBucket:
+    tenant_id = current_tenant().id
+    limiter = _tenant_rate_limiters.get(tenant_id)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _tenant_rate_limiters.setdefault(tenant_id, TokenBucket(WHATSAPP_RATE_LIMIT_PER_SEC))
+    return limiter
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_http_session():
+    """Session واحدة بـ connection pool (keep-alive) لكل الـ process بدل connection جديدة مع كل رسالة."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=WHATSAPP_HTTP_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def build_text_payload(recipient_wa_id: str, message_text: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "to": recipient_wa_id,
+        "type": "text",
+        "text": {"body": message_text},
+    }
+
+def build_template_payload(recipient_wa_id: str, template_name: str, language_code: str = "en_US",
+                           components: list = None) -> dict:
+    template = {"name": template_name, "language": {"code": language_code}}
+    if components:
+        template["components"] = components
+    return {
+        "messaging_product": "whatsapp",
+        "to": recipient_wa_id,
+        "type": "template",
+        "template": template,
+    }
+
+def _parse_retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _credentials():
+    """(phone_number_id, access_token) بتوع الـ tenant الحالي؛ الـ default من متغيرات البيئة زي الأول."""
+    tenant = current_tenant()
+    if tenant.id == DEFAULT_TENANT_ID:
+        return WHATSAPP_PHONE_NUMBER_ID, WHATSAPP_ACCESS_TOKEN
+    return tenant.phone_number_id, tenant.access_token
+
+def _messages_url() -> str:
+    api_version = os.getenv("WHATSAPP_API_VERSION", "v19.0") # ممكن تخلي نسخة الـ API في .env
+    return f"{WHATSAPP_API_BASE_URL}/{api_version}/{_credentials()[0]}/messages"
+
+def _auth_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {_credentials()[1]}",
+        "Content-Type": "application/json",
+    }
+
+def _missing_credentials(recipient_wa_id: str) -> bool:
+    phone_number_id, access_token = _credentials()
+    if not access_token or not phone_number_id:
+        logger.error(
+            f"Cannot send message to {recipient_wa_id} (tenant {current_tenant().id}): "
+            f"access token or phone_number_id is missing."
+        )
+        return True
+    return False
+
+def _result_from_response(recipient_wa_id: str, response) -> SendResult:
+    """تحليل رد الـ Graph API (requests أو httpx، الاتنين ليهم status_code/text/json/headers)."""
+    WHATSAPP_SENDS.inc(response.status_code)
+    # التحقق من الـ status code
+    if 200 <= response.status_code < 300:
+        logger.info(f"Message successfully sent to {recipient_wa_id}. API Response Status: {response.status_code}")
+        # الـ body (فيه message_id) بيتكتب لعينة بس من الردود عشان منكتبش لوج كبير مع كل رسالة
+        log_payload(logger, f"API Response Body for {recipient_wa_id}", response.text)
+        return SendResult(True, response.status_code, False, None, None)
+
+    logger.error(
+        f"Failed to send message to {recipient_wa_id}. "
+        f"API Response Status: {response.status_code}, "
+        f"Response Body: {response.text[:1000]}"
+    )
+    # تحليل إضافي لبعض الأخطاء الشائعة
+    if response.status_code == 401:
+        logger.critical(
+            "Authorization error (401) sending WhatsApp message. "
+            "The WHATSAPP_ACCESS_TOKEN may be invalid, expired, or missing required permissions."
+        )
+    elif response.status_code == 400:
+        try:
+            error_data = response.json().get("error", {})
+            error_message = error_data.get("message", "No error message provided.")
+            error_code = error_data.get("code")
+            error_subcode = error_data.get("error_subcode")
+            logger.warning(
+                f"Bad Request (400) details: Code={error_code}, Subcode={error_subcode}, Message='{error_message}'"
+            )
+        except ValueError: # لو الـ response مش JSON
+            logger.warning("Bad Request (400) but response body was not valid JSON.")
+    return SendResult(
+        False, response.status_code, response.status_code in RETRYABLE_STATUS_CODES,
+        _parse_retry_after(response), response.text[:2000],
+    )
+
+@timed("whatsapp_send")
+def deliver_payload(recipient_wa_id: str, payload: dict, rate_limit_timeout: float = 30) -> SendResult:
+    """
+    محاولة إرسال واحدة لأي payload على /messages (بدون retry، الـ outbox هو اللي بيعيد).
+
+    Returns:
+        SendResult: ok + status_code + هل الخطأ يستاهل نعيد المحاولة (429/5xx/timeout/connection).
+    """
+    if _missing_credentials(recipient_wa_id):
+        WHATSAPP_SENDS.inc("missing_credentials")
+        return SendResult(False, None, False, None, "missing_credentials")
+
+    if not _rate_limiter().acquire(timeout=rate_limit_timeout):
+        logger.warning(f"Local rate limit reached while sending to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("local_rate_limit")
+        return SendResult(False, None, True, None, "local_rate_limit")
+
+    logger.info(f"Attempting to send WhatsApp message to: {recipient_wa_id}")
+    log_payload(logger, f"Payload for {recipient_wa_id}", payload, level=logging.DEBUG)
+
+    try:
+        response = get_http_session().post(
+            _messages_url(), headers=_auth_headers(), json=payload,
+            timeout=(WHATSAPP_CONNECT_TIMEOUT, WHATSAPP_READ_TIMEOUT),
+        )
+        return _result_from_response(recipient_wa_id, response)
+
+    except requests.exceptions.Timeout:
+        logger.error(f"Timeout error while trying to send message to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("timeout")
+        return SendResult(False, None, True, None, "timeout")
+    except requests.exceptions.ConnectionError:
+        logger.error(f"Connection error while trying to send message to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("connection_error")
+        return SendResult(False, None, True, None, "connection_error")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"An unexpected requests library error occurred for {recipient_wa_id}: {e}", exc_info=True)
+        WHATSAPP_SENDS.inc("error")
+        return SendResult(False, None, False, None, repr(e))
+    except Exception as e:
+        logger.error(f"A general unexpected error occurred while sending to {recipient_wa_id}: {e}", exc_info=True)
+        WHATSAPP_SENDS.inc("error")
+        return SendResult(False, None, False, None, repr(e))
+
+def _deliver_or_defer(recipient_wa_id: str, payload: dict) -> SendResult:
+    result = deliver_payload(recipient_wa_id, payload)
+    if not result.ok and result.retryable and WHATSAPP_OUTBOX_ENABLED:
+        enqueue_outbound(recipient_wa_id, payload, attempts=1, error=result.error, retry_after=result.retry_after)
+    return result
+
+def send_whatsapp_message_real(recipient_wa_id: str, message_text: str) -> bool:
+    """
+    Sends a text message to a WhatsApp user via the WhatsApp Cloud API (Meta Graph API).
+
+    Failures that are worth retrying (429, 5xx, timeouts) are handed to the outbox,
+    which retries them in the background with exponential backoff.
+
+    Args:
+        recipient_wa_id (str): The WhatsApp ID of the recipient (e.g., "201001234567").
+        message_text (str): The text content of the message to send.
+
+    Returns:
+        bool: True if the message was sent successfully on the first attempt (API returned 2xx), False otherwise.
+    """
+    return _deliver_or_defer(recipient_wa_id, build_text_payload(recipient_wa_id, message_text)).ok
+
+def send_whatsapp_message_async(recipient_wa_id: str, message_text: str) -> bool:
+    """يحط الرسالة في الـ outbox ويرجع فوراً؛ الـ dispatcher هو اللي بيبعتها."""
+    return enqueue_outbound(recipient_wa_id, build_text_payload(recipient_wa_id, message_text)) is not None
+
+def broadcast_template(recipients, template_name: str, language_code: str = "en_US",
+                       components: list = None, max_workers: int = WHATSAPP_BROADCAST_WORKERS) -> dict:
+    """
+    يبعت نفس الـ template لعملاء كتير بالتوازي (محكوم بالـ rate limiter)،
+    واللي يفشل بخطأ مؤقت بيروح الـ outbox.
+
+    Returns:
+        dict: عدد sent / deferred / failed.
+    """
+    counts = {"sent": 0, "deferred": 0, "failed": 0}
+    recipients = list(dict.fromkeys(recipients))
+
+    def _send(recipient):
+        payload = build_template_payload(recipient, template_name, language_code, components)
+        return _deliver_or_defer(recipient, payload)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(recipients) or 1))) as pool:
+        for result in pool.map(_send, recipients):
+            if result.ok:
+                counts["sent"] += 1
+            elif result.retryable and WHATSAPP_OUTBOX_ENABLED:
+                counts["deferred"] += 1
+            else:
+                counts["failed"] += 1
+    logger.info(f"Broadcast of template '{template_name}' to {len(recipients)} recipient(s): {counts}")
+    return counts
+
+
+# --- وضع ASGI: نفس الإرسال بـ httpx.AsyncClient (client واحد بـ connection pool لكل event loop) ---
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_http_client():
+    import httpx  # اختياري: مطلوب بس في وضع ASGI
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WHATSAPP_READ_TIMEOUT, connect=WHATSAPP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=WHATSAPP_HTTP_POOL_SIZE,
+                                max_keepalive_connections=WHATSAPP_HTTP_POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+@timed("whatsapp_send")
+async def adeliver_payload(recipient_wa_id: str, payload: dict, rate_limit_timeout: float = 30) -> SendResult:
+    """نسخة async من deliver_payload."""
+    import httpx
+    if _missing_credentials(recipient_wa_id):
+        WHATSAPP_SENDS.inc("missing_credentials")
+        return SendResult(False, None, False, None, "missing_credentials")
+
+    if not await _rate_limiter().aacquire(timeout=rate_limit_timeout):
+        logger.warning(f"Local rate limit reached while sending to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("local_rate_limit")
+        return SendResult(False, None, True, None, "local_rate_limit")
+
+    logger.info(f"Attempting to send WhatsApp message to: {recipient_wa_id}")
+    try:
+        response = await get_async_http_client().post(_messages_url(), headers=_auth_headers(), json=payload)
+        return _result_from_response(recipient_wa_id, response)
+    except httpx.TimeoutException:
+        logger.error(f"Timeout error while trying to send message to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("timeout")
+        return SendResult(False, None, True, None, "timeout")
+    except httpx.TransportError:
+        logger.error(f"Connection error while trying to send message to {recipient_wa_id}.")
+        WHATSAPP_SENDS.inc("connection_error")
+        return SendResult(False, None, True, None, "connection_error")
+    except Exception as e:
+        logger.error(f"A general unexpected error occurred while sending to {recipient_wa_id}: {e}", exc_info=True)
+        WHATSAPP_SENDS.inc("error")
+        return SendResult(False, None, False, None, repr(e))
+
+async def asend_whatsapp_message_real(recipient_wa_id: str, message_text: str) -> bool:
+    """نسخة async من send_whatsapp_message_real (الفشل المؤقت بيروح الـ outbox برضه)."""
+    payload = build_text_payload(recipient_wa_id, message_text)
+    result = await adeliver_payload(recipient_wa_id, payload)
+    if not result.ok and result.retryable and WHATSAPP_OUTBOX_ENABLED:
+        # الـ outbox على الـ engine العادي: نكتب فيه من thread عشان منوقفش الـ loop
+        await asyncio.to_thread(enqueue_outbound, recipient_wa_id, payload, 1, result.error, result.retry_after)
+    return result.ok
+
+async def close_async_http_clients():
+    """بيتنادى عند إيقاف الـ ASGI server عشان الـ connections تتقفل بنظافة."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
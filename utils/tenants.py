@@ -0,0 +1,252 @@
+# utils/tenants.py
+# أكتر من رقم واتساب (براند / عميل بيزنس) في نفس الـ process بدل deployment كامل لكل واحد.
+# كل tenant ليه phone_number_id و token وفولدر config (replies / faq / onboarding / prompt / reference؛ أي ملف
+# مش موجود فيه بيتاخد من config_data ومتحمل مرة واحدة للكل). الـ webhook بيحدد الـ tenant من
+# metadata.phone_number_id وبيعالج جوه tenant_context(...)، واللي تحت (الـ config، صفوف قاعدة البيانات، الكاش،
+# الـ locks، الإرسال) بيقرا current_tenant() — نفس فكرة log_context. الـ DB pool و HTTP session واتساب وعميل
+# OpenAI مشتركين بين كل الـ tenants، والـ configs بتتحمل أول ما تتطلب والأقدم استخدام بيتشال بعد
+# TENANT_CONFIG_CACHE_SIZE.
+#
+# TENANTS_FILE (JSON)، و config_dir نسبي لفولدر الملف:
+#   {"tenants": [{"id": "acme", "name": "Acme Dental", "phone_number_id": "1098...",
+#                 "access_token_env": "ACME_WHATSAPP_TOKEN", "config_dir": "acme"}]}
+# من غير TENANTS_FILE فيه tenant واحد "default" بـ WHATSAPP_PHONE_NUMBER_ID / WHATSAPP_ACCESS_TOKEN زي الأول.
+import os
+import re
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from .logging_setup import log_context
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT_ID = "default"
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+TENANT_CONFIG_CACHE_SIZE = int(os.getenv("TENANT_CONFIG_CACHE_SIZE", 100))  # configs tenants في الذاكرة مع بعض
+TENANTS_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", 2))
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DATA_PATH = os.path.join(BASE_DIR, "config_data")
+
+_TENANT_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class UnknownTenantError(KeyError):
+    """رسالة (من الطابور أو الـ outbox) لـ tenant اتشال من TENANTS_FILE."""
+
+
+@dataclass(frozen=True)
+class Tenant:
+    id: str
+    phone_number_id: Optional[str] = None
+    access_token: Optional[str] = None
+    config_dir: str = CONFIG_DATA_PATH
+    name: str = ""
+
+
+def _default_tenant() -> Tenant:
+    return Tenant(DEFAULT_TENANT_ID, os.getenv("WHATSAPP_PHONE_NUMBER_ID"), os.getenv("WHATSAPP_ACCESS_TOKEN"),
+                  CONFIG_DATA_PATH, "default")
+
+
+class TenantRegistry:
+    """الـ tenants من TENANTS_FILE (بيتعاد تحميله لو الـ mtime اتغير)، بالـ id وبالـ phone_number_id."""
+
+    def __init__(self, path: str = TENANTS_FILE, reload_interval: float = TENANTS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.default = _default_tenant()
+        self._by_id = {DEFAULT_TENANT_ID: self.default}
+        self._by_phone_number_id = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def multi_tenant(self) -> bool:
+        return bool(self.path)
+
+    def _refresh(self):
+        if not self.path or time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.reload_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                logger.error(f"Tenants file not found: {self.path}")
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                by_id, by_phone_number_id = self._load()
+            except (OSError, ValueError) as e:
+                # ملف اتحفظ نصه أو فيه غلطة: نفضل على آخر نسخة سليمة
+                logger.error(f"Error loading tenants from {self.path}: {e}")
+                return
+            self.default = by_id[DEFAULT_TENANT_ID]
+            self._by_id, self._by_phone_number_id = by_id, by_phone_number_id
+            if self._mtime is not None:
+                logger.info(f"Reloaded {len(by_id)} tenant(s) from {self.path}")
+            self._mtime = mtime
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(self.path))
+        by_id = {DEFAULT_TENANT_ID: _default_tenant()}
+        by_phone_number_id = {}
+        for entry in data.get("tenants") or []:
+            tenant_id = str(entry.get("id") or "")
+            if not _TENANT_ID.match(tenant_id):
+                raise ValueError(f"invalid tenant id {tenant_id!r}")
+            default = by_id[DEFAULT_TENANT_ID] if tenant_id == DEFAULT_TENANT_ID else None
+            token = entry.get("access_token")
+            if entry.get("access_token_env"):
+                token = os.getenv(entry["access_token_env"])
+            config_dir = entry.get("config_dir")
+            tenant = Tenant(
+                id=tenant_id,
+                phone_number_id=str(entry["phone_number_id"]) if entry.get("phone_number_id") else
+                (default.phone_number_id if default else None),
+                access_token=token or (default.access_token if default else None),
+                config_dir=os.path.join(base_dir, config_dir) if config_dir else CONFIG_DATA_PATH,
+                name=entry.get("name") or tenant_id,
+            )
+            by_id[tenant_id] = tenant
+        for tenant in by_id.values():
+            if tenant.phone_number_id:
+                if tenant.phone_number_id in by_phone_number_id:
+                    raise ValueError(f"phone_number_id {tenant.phone_number_id} is used by more than one tenant")
+                by_phone_number_id[tenant.phone_number_id] = tenant
+        return by_id, by_phone_number_id
+
+    def get(self, tenant_id: str = None) -> Tenant:
+        """الـ tenant بالـ id (None = default)؛ UnknownTenantError لو مش موجود."""
+        self._refresh()
+        if not tenant_id or tenant_id == DEFAULT_TENANT_ID:
+            return self.default
+        try:
+            return self._by_id[tenant_id]
+        except KeyError:
+            raise UnknownTenantError(tenant_id) from None
+
+    def resolve(self, phone_number_id: str = None) -> Optional[Tenant]:
+        """
+        الـ tenant بتاع رقم واتساب اللي الرسالة جت عليه (metadata.phone_number_id). من غير TENANTS_FILE
+        أو من غير phone_number_id بيرجع الـ default، ولرقم مش متسجل بيرجع None.
+        """
+        if not self.multi_tenant or not phone_number_id:
+            return self.default
+        self._refresh()
+        return self._by_phone_number_id.get(str(phone_number_id))
+
+    def all(self) -> list:
+        self._refresh()
+        return list(self._by_id.values())
+
+
+tenant_registry = TenantRegistry()
+
+# --- الـ tenant الحالي (contextvar: بيمشي مع الـ thread والـ asyncio task وبيتنقل مع asyncio.to_thread) ---
+_current_tenant = contextvars.ContextVar("tenant", default=None)
+
+
+def current_tenant() -> Tenant:
+    tenant = _current_tenant.get()
+    return tenant if tenant is not None else tenant_registry.default
+
+
+def current_tenant_id() -> str:
+    tenant = _current_tenant.get()
+    return tenant.id if tenant is not None else DEFAULT_TENANT_ID
+
+
+@contextmanager
+def tenant_context(tenant: Tenant):
+    """with tenant_context(tenant): كل المعالجة جوه البلوك (config، DB، إرسال) بتاعة الـ tenant ده."""
+    token = _current_tenant.set(tenant)
+    try:
+        if tenant.id == DEFAULT_TENANT_ID:
+            yield tenant
+        else:
+            with log_context(tenant=tenant.id):
+                yield tenant
+    finally:
+        _current_tenant.reset(token)
+
+
+def scoped_key(key: str) -> str:
+    """مفتاح (رقم عميل) للـ locks والـ bursts والطابور: نفس الرقم عند tenant تاني عميل تاني."""
+    tenant_id = current_tenant_id()
+    return key if tenant_id == DEFAULT_TENANT_ID else f"{tenant_id}:{key}"
+
+
+# --- configs الـ tenants: ConfigStore لكل tenant بيتحمل أول ما يتطلب، LRU ---
+class TenantConfigs:
+    """
+    ConfigStore لكل tenant (الـ default هو config_store نفسه). ملفات الـ tenant اللي مش موجودة بتتاخد من
+    config_store (نفس الـ objects المتحضرة مش نسخة)، فـ tenant بيغيّر الـ prompt والـ FAQ بس بيكلف قدهم بس.
+    """
+
+    def __init__(self, maxsize: int = TENANT_CONFIG_CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def store(self, tenant: Tenant = None):
+        from .config_store import ConfigStore, config_store
+        tenant = tenant or current_tenant()
+        if tenant.id == DEFAULT_TENANT_ID:
+            return config_store
+        with self._lock:
+            store = self._stores.get(tenant.id)
+            if store is not None and store.config_dir == tenant.config_dir:
+                self._stores.move_to_end(tenant.id)
+                return store
+            store = ConfigStore(tenant.config_dir, base=config_store)
+            self._stores[tenant.id] = store
+            self.loads += 1
+            while len(self._stores) > self.maxsize:
+                self._stores.popitem(last=False)
+                self.evictions += 1
+        return store
+
+    def get(self, tenant: Tenant = None):
+        """الـ ConfigSnapshot بتاع الـ tenant (الحالي لو مش محدد)."""
+        return self.store(tenant).get()
+
+    def __len__(self):
+        return len(self._stores)
+
+
+tenant_configs = TenantConfigs()
+
+
+def current_config():
+    """الـ ConfigSnapshot بتاع الـ tenant الحالي (replies / FAQ / onboarding / prompt / reference)."""
+    return tenant_configs.get()
+
+
+def _tenant_configs_collector():
+    return [
+        ("tenant_configs_loaded", "gauge", "Tenant config stores currently cached in memory.",
+         [({}, len(tenant_configs))]),
+        ("tenant_config_loads", "counter", "Tenant config stores loaded or evicted (LRU).",
+         [({"event": "load"}, tenant_configs.loads), ({"event": "evict"}, tenant_configs.evictions)]),
+    ]
+
+
+registry.register_collector(_tenant_configs_collector)
@@ -0,0 +1,130 @@
+# utils/warmup.py
+# warm-up في الخلفية بعد ما الـ app يقوم: تحميل config_data والـ indexes، فتح connections للـ DB،
+# import مكتبة openai وعمل الـ client، الـ HTTP session بتاعة واتساب والـ tokenizer.
+# /readyz بيرجع 503 لحد ما يخلص، فالـ load balancer/الـ autoscaler مش بيبعت traffic لـ instance لسه باردة.
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", 2))  # connections بتتفتح وترجع للـ pool
+
+
+def _warm_config():
+    from utils.config_store import config_store
+    config_store.get()  # replies/FAQ/onboarding/prompt/reference + الـ FAQ index والـ reference index
+
+
+def _warm_db():
+    from utils.db import engine
+    size = engine.pool.size() if callable(getattr(engine.pool, "size", None)) else 1
+    connections = []
+    try:
+        for _ in range(max(1, min(WARMUP_DB_CONNECTIONS, size))):
+            conn = engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def _warm_openai():
+    from utils.openai_logic import get_client
+    get_client()
+
+
+def _warm_whatsapp_http():
+    from utils.send_meta import get_http_session
+    get_http_session()
+
+
+def _warm_tokenizer():
+    from utils.conversation_context import get_encoding
+    get_encoding()
+
+
+# (name, function, critical) — الـ instance مش ready لو خطوة critical فشلت
+WARMUP_STEPS = [
+    ("config", _warm_config, True),
+    ("db", _warm_db, True),
+    ("openai", _warm_openai, False),
+    ("whatsapp_http", _warm_whatsapp_http, False),
+    ("tokenizer", _warm_tokenizer, False),
+]
+
+
+class Warmup:
+    def __init__(self, steps=WARMUP_STEPS):
+        self.steps = steps
+        self.started = False
+        self.finished = False
+        self.timings = {}  # name -> ms
+        self.errors = {}   # name -> error
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _run_step(self, name, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+            self.errors.pop(name, None)
+        except Exception as e:
+            self.errors[name] = f"{type(e).__name__}: {e}"
+            logger.error(f"Warm-up step '{name}' failed: {e}")
+        self.timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def run(self):
+        start = time.perf_counter()
+        for name, fn, _ in self.steps:
+            self._run_step(name, fn)
+        self.finished = True
+        self._done.set()
+        logger.info(f"Warm-up finished in {(time.perf_counter() - start) * 1000:.0f}ms: {self.timings}"
+                    + (f", errors: {self.errors}" if self.errors else ""))
+
+    def start(self, background: bool = True):
+        with self._lock:
+            if self.started:
+                return self
+            self.started = True
+        if background:
+            threading.Thread(target=self.run, name="warmup", daemon=True).start()
+        else:
+            self.run()
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def readiness(self):
+        """(ready, details) لـ /readyz؛ الخطوات الـ critical اللي فشلت بتتجرب تاني مع كل probe."""
+        if not self.finished:
+            return False, {"status": "warming_up", "steps": dict(self.timings)}
+        for name, fn, critical in self.steps:
+            if critical and name in self.errors:
+                self._run_step(name, fn)
+        failed = sorted(name for name, _, critical in self.steps if critical and name in self.errors)
+        details = {"status": "ready" if not failed else "not_ready", "steps": dict(self.timings)}
+        if self.errors:
+            details["errors"] = dict(self.errors)
+        return not failed, details
+
+    def _after_fork(self):
+        # gunicorn --preload: الـ thread مش بيتنسخ مع الـ fork، والـ connections بتاعة الـ master متتشاركش
+        from utils.db import engine
+        engine.dispose(close=False)
+        if self.started and not self.finished:
+            self.started = False
+            self._done = threading.Event()
+            self.start()
+
+
+warmup = Warmup()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=warmup._after_fork)
@@ -0,0 +1,60 @@
+# utils/webhook_parser.py
+# Meta ممكن تبعت أكتر من entry/change/message (ومعاهم statuses) في نفس الـ POST،
+# فبنمشي على كل المستويات بدل ما ناخد [0] بس.
+
+
+def parse_webhook_batch(data: dict) -> dict:
+    """
+    يحوّل body الـ webhook لقائمة رسائل نصية جاهزة للمعالجة مع عدادات الـ batch.
+
+    Returns:
+        dict: {"messages": [...], "counts": {...}} وكل رسالة فيها id/from/body/timestamp.
+    """
+    messages = []
+    seen_ids = set()
+    counts = {
+        "entries": 0,
+        "received": 0,
+        "text": 0,
+        "duplicates": 0,
+        "non_text": 0,
+        "invalid": 0,
+        "statuses": 0,
+    }
+
+    for entry in data.get("entry") or []:
+        counts["entries"] += 1
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            counts["statuses"] += len(value.get("statuses") or [])
+            metadata = value.get("metadata") or {}
+
+            for message_object in value.get("messages") or []:
+                counts["received"] += 1
+                message_id = message_object.get("id")
+                if message_id:
+                    if message_id in seen_ids:
+                        counts["duplicates"] += 1
+                        continue
+                    seen_ids.add(message_id)
+
+                if message_object.get("type") != "text":
+                    counts["non_text"] += 1
+                    continue
+
+                from_user_id = message_object.get("from")
+                msg_body = (message_object.get("text") or {}).get("body", "").strip()
+                if not from_user_id or not msg_body:
+                    counts["invalid"] += 1
+                    continue
+
+                counts["text"] += 1
+                messages.append({
+                    "id": message_id,
+                    "from": from_user_id,
+                    "body": msg_body,
+                    "timestamp": message_object.get("timestamp"),
+                    "phone_number_id": metadata.get("phone_number_id"),
+                })
+
+    return {"messages": messages, "counts": counts}
@@ -0,0 +1,179 @@
+# utils/write_buffer.py
+# write-behind لتاريخ المحادثات: add_message بيحط الرسالة في الذاكرة ويرجع فوراً، و thread في الخلفية
+# بيكتبها batches (لما توصل HISTORY_WRITE_BATCH_SIZE أو كل HISTORY_WRITE_FLUSH_MS) في transaction واحدة.
+# الثمن: لو الـ process وقع فجأة ممكن آخر batch متتكتبش، عشان كده مقفول افتراضياً.
+import os
+import time
+import atexit
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from .db import SessionLocal, ConversationHistory
+from .metrics import timed, registry
+from .tenants import current_tenant_id
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", 200))
+HISTORY_WRITE_FLUSH_MS = float(os.getenv("HISTORY_WRITE_FLUSH_MS", 200))
+# لو قاعدة البيانات واقعة الرسايل بتفضل مستنية لحد الحد ده وبعدين الأقدم بيترمي
+HISTORY_WRITE_MAX_PENDING = int(os.getenv("HISTORY_WRITE_MAX_PENDING", 50000))
+
+
+class MessageWriteBuffer:
+    """
+    buffer thread-safe لصفوف conversation_history. الـ timestamp بيتحدد وقت append مش وقت الكتابة،
+    والرسايل اللي لسه مكتبتش بتبان في pending_for() عشان قراءة التاريخ متفوتهاش.
+    """
+
+    def __init__(self, batch_size: int = HISTORY_WRITE_BATCH_SIZE, flush_ms: float = HISTORY_WRITE_FLUSH_MS,
+                 max_pending: int = HISTORY_WRITE_MAX_PENDING, session_factory=SessionLocal):
+        self.batch_size = max(batch_size, 1)
+        self.interval = max(flush_ms, 1) / 1000
+        self.max_pending = max_pending
+        self.session_factory = session_factory
+        self._pending = []
+        self._flushing = []  # الـ batch اللي بيتكتب دلوقتي
+        self._epoch = 0      # بيزيد في أول وآخر كل flush: رقم فردي = فيه batch بتتكتب دلوقتي
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.dropped = 0
+
+    def _ensure_flusher(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="history-write-buffer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def append_many(self, messages):
+        """messages: list of (phone, sender, message) للـ tenant الحالي."""
+        now = datetime.utcnow()
+        tenant_id = current_tenant_id()
+        rows = [{"tenant_id": tenant_id, "phone": phone, "sender": sender, "message": message, "timestamp": now}
+                for phone, sender, message in messages]
+        if not rows:
+            return
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def append(self, phone, sender, message):
+        self.append_many([(phone, sender, message)])
+
+    def pending_for(self, phone) -> list:
+        """(sender, message) للرسايل اللي لسه مكتبتش للعميل ده (في الـ tenant الحالي)، من الأقدم للأحدث."""
+        tenant_id = current_tenant_id()
+        with self._lock:
+            return [(row["sender"], row["message"]) for row in self._flushing + self._pending
+                    if row["phone"] == phone and row["tenant_id"] == tenant_id]
+
+    def _snapshot(self, phone):
+        tenant_id = current_tenant_id()
+        with self._lock:
+            return self._epoch, [(row["sender"], row["message"]) for row in self._pending
+                                 if row["phone"] == phone and row["tenant_id"] == tenant_id]
+
+    def read_through(self, phone, fetch, attempts: int = 5):
+        """
+        ينفذ fetch() (قراءة من قاعدة البيانات) ويرجع (rows, pending) متسقين: لو flush بدأ أو خلص في النص
+        بنعيد، عشان رسالة متطلعش مرتين (في الـ DB وفي الـ buffer) أو متطلعش خالص.
+        """
+        for _ in range(attempts):
+            epoch = self._epoch
+            if epoch % 2:
+                time.sleep(0.002)
+                continue
+            rows = fetch()
+            after, pending = self._snapshot(phone)
+            if after == epoch:
+                return rows, pending
+        return fetch(), self.pending_for(phone)
+
+    async def aread_through(self, phone, fetch, attempts: int = 5):
+        """زي read_through بس fetch بترجع awaitable."""
+        for _ in range(attempts):
+            epoch = self._epoch
+            if epoch % 2:
+                await asyncio.sleep(0.002)
+                continue
+            rows = await fetch()
+            after, pending = self._snapshot(phone)
+            if after == epoch:
+                return rows, pending
+        return await fetch(), self.pending_for(phone)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._flushing)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    @timed("db.flush_history")
+    def _write(self, rows):
+        with self.session_factory() as db:
+            db.execute(insert(ConversationHistory), rows)
+            db.commit()
+
+    def flush(self) -> int:
+        """يكتب كل اللي في الـ buffer (batches بحجم batch_size). يرجع عدد الصفوف اللي اتكتبت."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return written
+                    self._flushing = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+                    self._epoch += 1
+                try:
+                    self._write(self._flushing)
+                except SQLAlchemyError as e:
+                    logger.error(f"History write-behind flush of {len(self._flushing)} rows failed: {e}")
+                    with self._lock:
+                        self._pending[:0] = self._flushing
+                        self._flushing = []
+                        self._epoch += 1
+                        overflow = len(self._pending) - self.max_pending
+                        if overflow > 0:
+                            del self._pending[:overflow]
+                            self.dropped += overflow
+                            logger.error(f"History write-behind buffer full; dropped {overflow} oldest rows.")
+                    return written
+                with self._lock:
+                    written += len(self._flushing)
+                    self.flushed += len(self._flushing)
+                    self._flushing = []
+                    self._epoch += 1
+
+
+history_buffer = MessageWriteBuffer()
+
+
+def _write_buffer_collector():
+    return [
+        ("history_buffer_pending", "gauge", "Conversation messages waiting in the write-behind buffer.",
+         [({}, history_buffer.pending_count())]),
+        ("history_buffer_rows", "counter", "Conversation messages written or dropped by the write-behind buffer.",
+         [({"result": "flushed"}, history_buffer.flushed), ({"result": "dropped"}, history_buffer.dropped)]),
+    ]
+
+
+registry.register_collector(_write_buffer_collector)